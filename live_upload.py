@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+'''Send the samples written by the acquisition software to a running server
+
+The text file is read as it grows (like "tail -f"), and every new block of
+complete lines is appended to the test through the API endpoint
+"/unittests/api/tests/NN/live/". When no new line has been written for
+TIMEOUT seconds, the acquisition is marked as complete.
+'''
+
+from argparse import ArgumentParser
+from base64 import b64encode
+import getpass
+import json
+import sys
+import time
+from urllib.request import Request, urlopen
+
+
+class LineBuffer:
+    '''Accumulate text read from a growing file and return complete lines
+
+    The first line of the file (the header) is skipped.'''
+
+    def __init__(self, skip_header=True):
+        self.pending = b''
+        self.skip_header = skip_header
+
+    def feed(self, data):
+        'Add "data" to the buffer and return the complete lines in it'
+
+        self.pending += data
+        last_newline = self.pending.rfind(b'\n')
+        if last_newline < 0:
+            return b''
+
+        lines = self.pending[:last_newline + 1]
+        self.pending = self.pending[last_newline + 1:]
+
+        if self.skip_header:
+            self.skip_header = False
+            lines = lines[lines.find(b'\n') + 1:]
+
+        return lines
+
+
+def post_samples(url, auth_header, data, final=False):
+    'Send a block of lines to the server and return the decoded answer'
+
+    request = Request(url + ('?final=true' if final else ''), data=data,
+                      headers={'Authorization': auth_header,
+                               'Content-Type': 'text/plain',
+                               'Accept': 'application/json'})
+    with urlopen(request) as answer:
+        return json.loads(answer.read().decode('utf-8'))
+
+
+def main(argv):
+    parser = ArgumentParser(description='Upload the samples of a test while they are being acquired',
+                            epilog='Report bugs through the page https://github.com/lspestrip/stdb2/issues')
+    parser.add_argument('server',
+                        help='URL of the server (e.g., http://localhost:8000)')
+    parser.add_argument('test_id', type=int,
+                        help='ID of the test receiving the samples')
+    parser.add_argument('input_file_path',
+                        help='Name of the text file being written by the acquisition software')
+    parser.add_argument('--user', required=True,
+                        help='Name of the user on the server')
+    parser.add_argument('--password',
+                        help='Password of the user (if not provided, it will be asked)')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='Number of seconds between two reads of the file (default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help='Mark the acquisition as complete when the file does not '
+                        'change for this number of seconds (default: %(default)s)')
+    arguments = parser.parse_args(argv[1:])
+
+    password = arguments.password or getpass.getpass()
+    auth_header = 'Basic ' + b64encode('{0}:{1}'.format(arguments.user, password)
+                                       .encode('utf-8')).decode('ascii')
+    url = '{0}/unittests/api/tests/{1}/live/'.format(arguments.server.rstrip('/'),
+                                                     arguments.test_id)
+
+    buffer = LineBuffer()
+    last_change = time.time()
+    with open(arguments.input_file_path, 'rb') as input_file:
+        while time.time() - last_change < arguments.timeout:
+            lines = buffer.feed(input_file.read())
+            if lines:
+                answer = post_samples(url, auth_header, lines)
+                print('{0} samples in test {1}'.format(answer['num_of_samples'],
+                                                       arguments.test_id))
+                last_change = time.time()
+            else:
+                time.sleep(arguments.interval)
+
+    answer = post_samples(url, auth_header, buffer.pending, final=True)
+    print('acquisition of test {0} complete, {1} samples and {2} glitches'
+          .format(arguments.test_id, answer['num_of_samples'], answer['num_of_glitches']))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
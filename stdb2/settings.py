@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/1.11/ref/settings/
 """
 
 import os
-from decouple import config
+from decouple import Csv, config
 
 from django.core.urlresolvers import reverse_lazy
 
@@ -30,7 +30,9 @@ SECRET_KEY = config('SECRET_KEY')
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = config('DEBUG', default=False, cast=bool)
 
-ALLOWED_HOSTS = config('ALLOWED_HOSTS', default=[])
+# Comma-separated list of the host names served by the site, e.g.
+# "localhost,127.0.0.1,[::1]"
+ALLOWED_HOSTS = config('ALLOWED_HOSTS', default='', cast=Csv())
 
 HTTP_HOST = config('HTTP_HOST', default='localhost')
 
@@ -54,6 +56,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'unittests.timing.RequestTimingMiddleware',
+    'unittests.metrics.MetricsMiddleware',
+    'unittests.dbrouting.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -68,7 +73,9 @@ ROOT_URLCONF = 'stdb2.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Same as "django.template.backends.django.DjangoTemplates", but
+        # it measures the rendering time (see "unittests/timing.py")
+        'BACKEND': 'unittests.timing.TimedDjangoTemplates',
         'DIRS': [
             os.path.join(BASE_DIR, 'templates'),
         ],
@@ -91,6 +98,58 @@ MEDIA_ROOT = config('MEDIA_ROOT', default=os.path.join(BASE_DIR, 'data_files'))
 STATIC_ROOT = config('STATIC_ROOT', default=os.path.join(
     BASE_DIR, 'deployed_static'))
 
+# Lists of numbers in the results of an analysis which are at least this long
+# are saved in a separate file instead of the database
+ANALYSIS_ARRAY_MIN_LENGTH = config('ANALYSIS_ARRAY_MIN_LENGTH', default=256, cast=int)
+
+# Results of the analyses run by the server are cached here, indexed by the
+# hash of the data file and by the parameters of the analysis
+ANALYSIS_CACHE_DIR = config('ANALYSIS_CACHE_DIR', default=os.path.join(BASE_DIR, 'analysis_cache'))
+
+# Number of HDF5 files kept open by each process to serve data to the views,
+# and size (in bytes) of the chunk cache of each of them
+H5_POOL_SIZE = config('H5_POOL_SIZE', default=16, cast=int)
+H5_POOL_RDCC_NBYTES = config('H5_POOL_RDCC_NBYTES', default=16 * 1024 * 1024, cast=int)
+
+# Size (in bytes) of the cache of decompressed time series shared by the worker
+# processes through shared memory (0 disables it), and prefix of the names of
+# the shared memory segments
+SHM_CACHE_BYTES = config('SHM_CACHE_BYTES', default=0, cast=int)
+SHM_CACHE_PREFIX = config('SHM_CACHE_PREFIX', default='stdb2')
+
+# Storage of the data files and of the plots; set it to a storage reading
+# ranges of files (see "unittests/h5storage.py") to share an object store
+# among several nodes
+DEFAULT_FILE_STORAGE = config('DEFAULT_FILE_STORAGE',
+                              default='django.core.files.storage.FileSystemStorage')
+
+# Size (in bytes) of the blocks read from HDF5 files which are not in the
+# local filesystem, and of the cache of these blocks kept by each process
+HDF5_STORAGE_BLOCK_SIZE = config('HDF5_STORAGE_BLOCK_SIZE', default=1024 * 1024, cast=int)
+HDF5_STORAGE_CACHE_BYTES = config('HDF5_STORAGE_CACHE_BYTES', default=256 * 1024 * 1024, cast=int)
+
+# Interval (in seconds) between two reads of the HDF5 file of a test being
+# streamed to the browsers, and maximum duration of each stream (browsers
+# reconnect automatically). Each stream keeps a synchronous worker busy
+# for its whole duration
+LIVE_STREAM_POLL_SECONDS = config('LIVE_STREAM_POLL_SECONDS', default=1.0, cast=float)
+LIVE_STREAM_MAX_SECONDS = config('LIVE_STREAM_MAX_SECONDS', default=60.0, cast=float)
+
+# Fraction of the requests (between 0 and 1) whose SQL queries, HDF5 I/O and
+# rendering time are measured, reported in the "Server-Timing" header and
+# logged (see "unittests/timing.py")
+REQUEST_TIMING_SAMPLE_RATE = config('REQUEST_TIMING_SAMPLE_RATE', default=0.0, cast=float)
+
+# If true, the memory allocated while converting uploaded files is traced
+# using "tracemalloc" (this slows down the conversion noticeably, so enable it
+# only while investigating; see "unittests/tracing.py")
+INGEST_TRACE_MEMORY = config('INGEST_TRACE_MEMORY', default=False, cast=bool)
+
+# Directory where each process saves its metrics, which are exposed in the
+# Prometheus format at the address /metrics (an empty string disables them;
+# see "unittests/metrics.py")
+METRICS_DIR = config('METRICS_DIR', default='')
+
 # Database
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
 
@@ -104,6 +163,36 @@ DATABASES = {
     }
 }
 
+# Hosts of read-only replicas of the default database, separated by
+# commas. Each of them gets an alias ("replica1", "replica2"...) with the
+# same engine, name, user and password as the default database. The views
+# in REPLICA_VIEWS read from them (see "unittests/dbrouting.py")
+for replica_idx, replica_host in enumerate(config('DATABASE_REPLICA_HOSTS',
+                                                  default='', cast=Csv())):
+    DATABASES['replica{0}'.format(replica_idx + 1)] = dict(
+        DATABASES['default'], HOST=replica_host, TEST={'MIRROR': 'default'})
+
+REPLICA_DATABASES = [x for x in DATABASES.keys() if x != 'default']
+DATABASE_ROUTERS = ['unittests.dbrouting.ReplicaRouter']
+
+# Names of the views which only read from the database, and can therefore
+# use a replica for GET requests (shell-style wildcards are allowed)
+REPLICA_VIEWS = [
+    'unittests:api-*',
+    'unittests:test_list',
+    'unittests:test_details_json',
+    'unittests:polarimeter_details',
+]
+
+# After a POST (or any other request that can modify the database), the
+# same browser reads from the default database for this number of seconds,
+# so that users see their changes even if the replicas lag behind
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=10, cast=int)
+
+# Number of seconds during which a replica which could not be reached is
+# not used
+REPLICA_RETRY_SECONDS = config('REPLICA_RETRY_SECONDS', default=30, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
@@ -15,10 +15,12 @@ Including another URLconf
 """
 from django.conf.urls import include, url
 from django.contrib import admin
+from unittests.metrics import metrics_view
 from user import urls as user_urls
 
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
+    url(r'^metrics$', metrics_view, name='metrics'),
     url(r'^unittests/', include('unittests.urls', namespace='unittests')),
     url(r'^user/', include(user_urls, app_name='user', namespace='user-auth'))
 ]
@@ -0,0 +1,156 @@
+# -*- encoding: utf-8 -*-
+
+'''Estimation of bandpasses from frequency sweeps
+
+During a bandpass test, the frequency of the RF source ("freq_Hz") is changed
+in steps, and its power ("rfpower_dB") is recorded together with the outputs
+of the detectors. This module averages the PWR outputs over each frequency
+step, normalizes them by the RF power, and computes the central frequency and
+the bandwidth of each detector.
+
+The functions in this module do not access the database, so that they can
+be run in a pool of processes (see "batch.py").
+'''
+
+from datetime import date
+import logging
+
+import h5py
+import numpy as np
+
+from .file_conversions import PWR_COLUMNS
+
+# Increase this whenever a change in the code changes the results
+ALGORITHM_VERSION = '1.0'
+
+# Number of samples to discard at the beginning of each frequency step, while
+# the source settles to the new frequency
+DEFAULT_SETTLING_SAMPLES = 2
+
+# Get an instance of a logger
+LOGGER = logging.getLogger(__name__)
+
+# NumPy 2 renamed "trapz" to "trapezoid"
+trapezoid = getattr(np, 'trapezoid', None) or np.trapz
+
+
+def find_runs(values):
+    '''Split an array into runs of consecutive equal values
+
+    Return a tuple (starts, lengths) containing the index of the first element
+    of each run and the number of elements in it.'''
+
+    if len(values) == 0:
+        return np.array([], dtype=int), np.array([], dtype=int)
+
+    starts = np.concatenate([[0], np.flatnonzero(values[1:] != values[:-1]) + 1])
+    lengths = np.diff(np.concatenate([starts, [len(values)]]))
+    return starts, lengths
+
+
+def average_by_frequency(freq, channels, settling_samples=DEFAULT_SETTLING_SAMPLES):
+    '''Average a set of channels over each step of a frequency sweep
+
+    The parameter "channels" is a 2D array with one row per channel. The
+    first "settling_samples" samples of every step are ignored. Steps with
+    the same frequency (e.g. if the sweep was repeated) are merged. Samples
+    where the frequency is not positive are ignored. Return a tuple
+    containing the frequencies (sorted) and a 2D array with the averages.
+    '''
+
+    starts, lengths = find_runs(freq)
+    position_in_run = np.arange(len(freq)) - np.repeat(starts, lengths)
+    mask = (position_in_run >= settling_samples) & (freq > 0)
+
+    unique_freq, step_idx = np.unique(freq[mask], return_inverse=True)
+    counts = np.bincount(step_idx, minlength=len(unique_freq))
+    sums = np.vstack([np.bincount(step_idx, weights=x[mask], minlength=len(unique_freq))
+                      for x in channels])
+
+    return unique_freq, sums / counts
+
+
+def band_parameters(freq, response):
+    '''Compute the central frequency and the bandwidth of many bandpasses
+
+    The parameter "response" is a 2D array with one bandpass per row. The
+    central frequency and bandwidth are computed using the usual definitions:
+
+        nu_c = int(nu g(nu) dnu) / int(g(nu) dnu)
+        B = (int(g(nu) dnu))^2 / int(g(nu)^2 dnu)
+
+    Return a tuple (normalized response, central frequencies, bandwidths).
+    The normalized response has its maximum equal to one.
+    '''
+
+    peak = response.max(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        response = response / peak
+
+        integral = trapezoid(response, freq, axis=1)
+        central_nu = trapezoid(response * freq, freq, axis=1) / integral
+        bandwidth = integral ** 2 / trapezoid(response ** 2, freq, axis=1)
+
+    return response, central_nu, bandwidth
+
+
+def compute_bandpass_analysis(h5_file_name,
+                              settling_samples=DEFAULT_SETTLING_SAMPLES):
+    '''Estimate the bandpass of the four detectors from a frequency sweep
+
+    Return a JSON record suitable for the "analysis_results" field of a
+    "BandpassAnalysis" object, or None if the file does not contain a sweep.
+    Frequencies are in GHz. The central frequency and the bandwidth are the
+    average of the values for the four detectors, and their errors are the
+    standard deviation.
+    '''
+
+    with h5py.File(h5_file_name, 'r') as h5_file:
+        if 'time_series' not in h5_file:
+            return None
+
+        dataset = h5_file['time_series']
+        columns = ('freq_Hz', 'rfpower_dB') + PWR_COLUMNS
+        if not set(columns).issubset(dataset.dtype.names or ()):
+            return None
+
+        data = dataset[columns]
+
+    freq = data['freq_Hz'].astype(np.float64)
+    rf_power = 10.0 ** (data['rfpower_dB'].astype(np.float64) / 10.0)
+    channels = np.vstack([rf_power] + [data[x].astype(np.float64)
+                                       for x in PWR_COLUMNS])
+
+    step_freq, averages = average_by_frequency(freq, channels, settling_samples)
+    if len(step_freq) < 3:
+        LOGGER.debug('"%s" does not contain a frequency sweep', h5_file_name)
+        return None
+
+    # The offset of each PWR output is its level outside the band, and it
+    # must be removed before normalizing by the power of the source
+    pwr = averages[1:] - averages[1:].min(axis=1, keepdims=True)
+
+    freq_ghz = step_freq * 1e-9
+    response, central_nu, bandwidth = band_parameters(freq_ghz, pwr / averages[0])
+    if not np.all(np.isfinite(central_nu)):
+        return None
+
+    result = {
+        'estimation_method': 'average of PWR outputs over frequency steps',
+        'code_version': ALGORITHM_VERSION,
+        'analysis_date': date.today().strftime('%Y-%m-%d'),
+        'central_nu_ghz': float(np.mean(central_nu)),
+        'central_nu_err': float(np.std(central_nu)),
+        'bandwidth_ghz': float(np.mean(bandwidth)),
+        'bandwidth_err': float(np.std(bandwidth)),
+        'frequency_ghz': freq_ghz.tolist(),
+        'rf_power_dB': (10.0 * np.log10(averages[0])).tolist(),
+    }
+    for idx, name in enumerate(PWR_COLUMNS):
+        result[name] = {
+            'central_nu_ghz': float(central_nu[idx]),
+            'bandwidth_ghz': float(bandwidth[idx]),
+            'response': response[idx].tolist(),
+        }
+
+    return result
@@ -0,0 +1,415 @@
+# -*- encoding: utf-8 -*-
+
+'''Run analyses on many tests in parallel
+
+The analysis engines (see e.g. "spectra.py") only read HDF5 files and return
+JSON records, so they can run in a pool of processes. The parent process is
+the only one accessing the database.
+'''
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+import hashlib
+import json
+import logging
+import os
+import sys
+from tempfile import NamedTemporaryFile
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from .file_conversions import read_samples_hash
+from .h5storage import StoredFile, file_stat, local_copy, local_path, open_h5_file
+from .metrics import PENDING_JOBS
+
+# Get an instance of a logger
+LOGGER = logging.getLogger(__name__)
+
+# Management commands whose analyses can be recomputed by "recompute"
+ANALYSIS_COMMANDS = (
+    'compute_spectra',
+    'compute_bandpasses',
+    'compute_tnoise',
+    'compute_iv_curves',
+)
+
+
+def run_in_parallel(function, arguments, num_of_workers=None, job_name=None):
+    '''Call "function" on every tuple in "arguments" using a pool of processes
+
+    Each element of "arguments" is a tuple of positional arguments. This is a
+    generator which yields tuples (index, result, error), in the order in
+    which the calls complete; "index" is the position of the arguments in the
+    list. If the call raised an exception, "result" is None and "error" is
+    the exception. If "num_of_workers" is 1, no process is spawned. The
+    number of calls not completed yet is exposed by the metric PENDING_JOBS,
+    labelled with "job_name" (default: the name of the function).
+    '''
+
+    arguments = list(arguments)
+    job_name = job_name or getattr(function, '__name__', 'unknown')
+    PENDING_JOBS.set(len(arguments), job=job_name)
+    try:
+        if num_of_workers == 1:
+            for index, cur_args in enumerate(arguments):
+                try:
+                    yield index, function(*cur_args), None
+                except Exception as exc:
+                    yield index, None, exc
+                finally:
+                    PENDING_JOBS.dec(job=job_name)
+            return
+
+        # Connections to the database cannot be shared with the child processes
+        connections.close_all()
+
+        with ProcessPoolExecutor(max_workers=num_of_workers) as executor:
+            futures = {executor.submit(function, *cur_args): index
+                       for index, cur_args in enumerate(arguments)}
+            for cur_future in as_completed(futures):
+                PENDING_JOBS.dec(job=job_name)
+                try:
+                    yield futures[cur_future], cur_future.result(), None
+                except Exception as exc:
+                    yield futures[cur_future], None, exc
+    finally:
+        PENDING_JOBS.set(0, job=job_name)
+
+
+def file_sha256(file_name, block_size=2 ** 20):
+    'Return the SHA-256 hash of the contents of a file, as a hex string'
+
+    result = hashlib.sha256()
+    with open(file_name, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(block_size), b''):
+            result.update(block)
+
+    return result.hexdigest()
+
+
+def samples_hash(data_file):
+    '''Return the SHA-256 hash of the samples in a HDF5 file
+
+    The parameter "data_file" is a path or a file in a storage (see
+    "h5storage.py"). Unlike the hash of the whole file, this does not change
+    when derived streams, indexes or attributes are written again, and it is
+    usually read from the attributes of the file (see
+    "file_conversions.write_samples_hash"). Files which are not HDF5 files
+    are hashed whole.'''
+
+    import h5py
+
+    path = local_path(data_file)
+    try:
+        # Files opened through the pool of handles could not be written later
+        if path is not None:
+            with h5py.File(path, 'r') as h5_file:
+                return read_samples_hash(h5_file)
+
+        with open_h5_file(data_file) as h5_file:
+            return read_samples_hash(h5_file)
+    except OSError:
+        with local_copy(data_file) as file_name:
+            return file_sha256(file_name)
+
+
+def hashed_call(function, data_file, *args):
+    '''Call function(file_name, *args) and describe the file it has read
+
+    The parameter "data_file" is a path or a file in a storage (see
+    "h5storage.py"); files in remote storages are downloaded, and "file_name"
+    is the path of the local copy. Return a tuple (result, file_info), where
+    "file_info" is a dictionary containing the hash of the samples (see
+    "samples_hash"), the size and the modification time of the file. This is
+    used to track the inputs of the analyses.'''
+
+    size, mtime = file_stat(data_file)
+    with local_copy(data_file) as file_name:
+        file_info = {
+            'hash': samples_hash(file_name),
+            'size': size,
+            'mtime': mtime,
+        }
+
+        # Avoid reading the file once more to compute the key of the cache
+        if isinstance(function, CachedFunction):
+            return function(file_name, *args, file_hash=file_info['hash']), file_info
+
+        return function(file_name, *args), file_info
+
+
+def json_sha256(value):
+    'Return the SHA-256 hash of the JSON representation of "value"'
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def cached_call(cache_dir, function, file_name, *args, file_hash=None, **kwargs):
+    '''Call function(file_name, *args, **kwargs), caching the result on disk
+
+    The cache key depends on the samples in the file (see "samples_hash"),
+    not on its name, on the name of the function, on the value of
+    ALGORITHM_VERSION in its module, and on the other arguments, which must
+    be serializable in JSON. The result must be serializable in JSON too. If
+    the caller already knows the hash of the samples, it can pass it in
+    "file_hash".
+    '''
+
+    key_source = json.dumps([
+        function.__module__,
+        function.__name__,
+        getattr(sys.modules[function.__module__], 'ALGORITHM_VERSION', None),
+        file_hash or samples_hash(file_name),
+        args,
+        kwargs,
+    ], sort_keys=True)
+    key = hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+    cache_file_name = os.path.join(cache_dir, key[:2], key + '.json')
+
+    if os.path.isfile(cache_file_name):
+        LOGGER.debug('result for "%s" found in cache file "%s"',
+                     file_name, cache_file_name)
+        with open(cache_file_name, 'rt') as cache_file:
+            return json.load(cache_file)
+
+    result = function(file_name, *args, **kwargs)
+
+    # Write the file atomically, as other processes might be reading it
+    os.makedirs(os.path.dirname(cache_file_name), exist_ok=True)
+    with NamedTemporaryFile('wt', dir=os.path.dirname(cache_file_name),
+                            suffix='.tmp', delete=False) as cache_file:
+        json.dump(result, cache_file)
+    os.replace(cache_file.name, cache_file_name)
+
+    return result
+
+
+class CachedFunction:
+    '''Picklable wrapper calling a function through "cached_call"
+
+    When used as the worker of a "BatchAnalysisCommand", it receives the hash
+    of the file computed by "hashed_call".'''
+
+    def __init__(self, cache_dir, function, **kwargs):
+        self.cache_dir = cache_dir
+        self.function = function
+        self.kwargs = kwargs
+
+    def __call__(self, file_name, *args, file_hash=None):
+        return cached_call(self.cache_dir, self.function, file_name, *args,
+                           file_hash=file_hash, **self.kwargs)
+
+
+class BatchAnalysisCommand(BaseCommand):
+    '''Base class for management commands running an analysis on many tests
+
+    Derived classes must set "analysis_model" and "algorithm_version", and
+    implement "get_worker" (which returns a picklable function accepting the
+    path of a HDF5 file and returning the JSON record to save in the
+    "analysis_results" field, or None if the test cannot be analysed). They
+    can redefine "get_tests" to restrict the set of tests to analyse,
+    "get_worker_arguments" to pass more arguments to the worker, and
+    "get_housekeeping" to list the database rows used by the analysis.
+
+    Every run is recorded in an "AnalysisRun" object, which is used by the
+    command "recompute" to find stale analyses. The names of the options
+    which change the results must be listed in "parameter_names".
+    '''
+
+    analysis_model = None
+    algorithm_version = None
+    parameter_names = ()
+
+    @property
+    def engine_name(self):
+        # The name of the command, e.g. "compute_spectra"
+        return self.__module__.split('.')[-1]
+
+    def add_arguments(self, parser):
+        parser.add_argument('test_ids', nargs='*', type=int,
+                            help='IDs of the tests to analyse (default: all of them)')
+        parser.add_argument('--author', required=True,
+                            help='User name of the author of the new analyses')
+        parser.add_argument('--jobs', type=int, default=None,
+                            help='Number of processes to use (default: one per CPU)')
+        parser.add_argument('--skip-existing', action='store_true',
+                            help='Skip tests which already have an analysis of this kind')
+
+    def get_tests(self, options):
+        from unittests.models import PolarimeterTest
+
+        tests = PolarimeterTest.objects.exclude(data_file='')
+        if options['test_ids']:
+            tests = tests.filter(pk__in=options['test_ids'])
+
+        return tests
+
+    def get_worker(self, options):
+        raise NotImplementedError()
+
+    def get_worker_arguments(self, test):
+        'Return the tuple of arguments to pass to the worker for a test'
+        return (StoredFile(test.data_file.name),)
+
+    def get_housekeeping(self, test):
+        '''Return a JSON-serializable value with the database rows used for "test"
+
+        By default, these are the ADC offsets, which define the derived
+        streams in the data file.'''
+        return {'adc_offsets': test.get_pwr_offsets()}
+
+    def get_parameters(self, options):
+        return {x: options[x] for x in self.parameter_names}
+
+    def save_analysis(self, test, results, author):
+        'Save the results of the analysis of a test, returning the new objects'
+
+        analysis = self.analysis_model(
+            test=test, analysis_results=results, author=author)
+        analysis.save()
+        return [analysis]
+
+    def record_run(self, test, results, file_info, options, author):
+        '''Save the results of the analysis, replacing those of the last run
+
+        Return the list of new analysis objects.'''
+
+        from unittests.models import AnalysisRun
+
+        with transaction.atomic():
+            last_run = AnalysisRun.objects.filter(
+                test=test, engine=self.engine_name).first()
+            if last_run:
+                self.analysis_model.objects.filter(
+                    pk__in=last_run.analysis_ids).delete()
+            else:
+                last_run = AnalysisRun(test=test, engine=self.engine_name)
+
+            analyses = self.save_analysis(test, results, author) if results else []
+
+            last_run.algorithm_version = self.algorithm_version
+            last_run.parameters = self.get_parameters(options)
+            last_run.data_file_hash = file_info['hash']
+            last_run.data_file_size = file_info['size']
+            last_run.data_file_mtime = file_info['mtime']
+            last_run.housekeeping_hash = json_sha256(self.get_housekeeping(test))
+            last_run.analysis_ids = [x.pk for x in analyses]
+            last_run.save()
+
+        return analyses
+
+    def run_analysis(self, tests, options, author):
+        '''Run the analysis on a list of tests, saving the results
+
+        Return the number of analysis objects saved in the database.'''
+
+        LOGGER.info('running %s on %d test(s)',
+                    self.analysis_model._meta.verbose_name, len(tests))
+
+        num_of_analyses = 0
+        for index, output, error in run_in_parallel(
+                partial(hashed_call, self.get_worker(options)),
+                [self.get_worker_arguments(x) for x in tests],
+                options['jobs'],
+                job_name=self.analysis_model.__name__):
+            test = tests[index]
+            if error:
+                self.stderr.write('unable to analyse test {0} ({1}): {2}'
+                                  .format(test.pk, test, error))
+                continue
+
+            results, file_info = output
+
+            # Tests which cannot be analysed are recorded as well, so that
+            # they are not considered stale
+            analyses = self.record_run(test, results, file_info, options, author)
+            if not analyses:
+                LOGGER.debug('test %d cannot be analysed, skipping it', test.pk)
+                continue
+
+            num_of_analyses += len(analyses)
+            self.stdout.write('test {0} ({1}): {2} saved'
+                              .format(test.pk, test,
+                                      ', '.join('analysis {0}'.format(x.pk)
+                                                for x in analyses)))
+
+        return num_of_analyses
+
+    def handle(self, *args, **options):
+        author = get_author(options['author'])
+
+        tests = self.get_tests(options)
+        if options['skip_existing']:
+            tests = tests.exclude(pk__in=self.analysis_model.objects.values('test'))
+
+        num_of_analyses = self.run_analysis(list(tests), options, author)
+        self.stdout.write('{0} analyses saved'.format(num_of_analyses))
+
+
+def get_author(user_name):
+    try:
+        return get_user_model().objects.get(username=user_name)
+    except get_user_model().DoesNotExist:
+        raise CommandError('unknown user "{0}"'.format(user_name))
+
+
+def find_stale_tests(command, options, include_missing=False, parameters=None):
+    '''Return the tests whose analyses computed by "command" are stale
+
+    The result is a list of tuples (test, reasons, run_parameters), where
+    "reasons" is a list of strings and "run_parameters" is the dictionary of
+    parameters to use when analysing the test again: those of its last run
+    (the defaults in "options" for tests never analysed), updated with
+    "parameters". Only the parameters listed in "parameters" make a test
+    stale if they differ from those of its last run. If "include_missing"
+    is true, tests that were never processed by the command are returned
+    too. The hash of the samples in a data file is read only if its size or
+    modification time has changed.
+    '''
+
+    from unittests.models import AnalysisRun
+
+    last_runs = {x.test_id: x for x in
+                 AnalysisRun.objects.filter(engine=command.engine_name)}
+    default_parameters = command.get_parameters(options)
+    parameters = parameters or {}
+
+    result = []
+    for test in command.get_tests(options):
+        run_parameters = dict(default_parameters)
+        last_run = last_runs.get(test.pk)
+        if not last_run:
+            if include_missing:
+                run_parameters.update(parameters)
+                result.append((test, ['never analysed'], run_parameters))
+            continue
+
+        last_parameters = last_run.parameters or {}
+        run_parameters.update(last_parameters)
+        run_parameters.update(parameters)
+
+        reasons = []
+        if last_run.algorithm_version != command.algorithm_version:
+            reasons.append('algorithm changed from version {0} to {1}'.format(
+                last_run.algorithm_version, command.algorithm_version))
+        if any(last_parameters.get(key) != value
+               for key, value in parameters.items()):
+            reasons.append('parameters changed')
+        if last_run.housekeeping_hash != json_sha256(command.get_housekeeping(test)):
+            reasons.append('housekeeping data changed')
+
+        try:
+            size, mtime = file_stat(test.data_file)
+        except OSError:
+            LOGGER.warning('data file for test %d is missing', test.pk)
+            continue
+
+        if size != last_run.data_file_size or mtime != last_run.data_file_mtime:
+            if samples_hash(test.data_file) != last_run.data_file_hash:
+                reasons.append('data file changed')
+
+        if reasons:
+            result.append((test, reasons, run_parameters))
+
+    return result
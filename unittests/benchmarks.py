@@ -0,0 +1,361 @@
+# -*- encoding: utf-8 -*-
+
+'''Repeatable benchmarks of the converters, of the readers and of the views
+
+Each benchmark is a function decorated with "benchmark": it receives a
+"BenchmarkContext" and prepares whatever it needs (files, database rows),
+then returns a function without arguments, which is the code to be timed.
+Benchmarks run either at several data scales (number of samples in the
+time series), at several database sizes (number of tests) or once on a
+fixed input file; the kind is set by the "scale" argument of the decorator.
+
+Every case is run once to warm caches up, then "repeat" times measuring
+wall-clock and CPU time, and once more with "tracemalloc" active to measure
+the peak of the memory allocated by Python and NumPy. The results are
+collected in a JSON-serializable dictionary (see "run_benchmarks"), which
+also describes the commit and the environment, so that the files produced
+by the command "run_benchmarks" can be compared with "compare_results".
+'''
+
+from collections import OrderedDict
+from datetime import datetime
+from io import BytesIO
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import h5py
+import numpy as np
+
+from django.contrib.auth import get_user_model
+from django.test import Client
+
+from . import h5pool
+from .file_conversions import (SAMPLING_FREQUENCY, convert_text_file_to_h5,
+                               convert_zip_file_to_h5, read_derived_streams)
+from .models import Operator, PolarimeterTest, TestType, create_pwr_plot
+from .synthetic import SYNTHETIC_USER_NAME, SyntheticTest, populate_database
+
+# Get an instance of a logger
+LOGGER = logging.getLogger(__name__)
+
+# Kinds of scale a benchmark can be run at
+DATA_SCALE = 'samples'
+DATABASE_SCALE = 'tests'
+FIXED_SCALE = 'files'
+
+# Default scales used by the command "run_benchmarks"
+DEFAULT_DATA_SCALES = (10000, 100000)
+DEFAULT_DATABASE_SCALES = (100, 1000)
+
+TESTDATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'testdata')
+
+# All the benchmarks, in the order they are defined
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(scale):
+    'Decorator which registers a benchmark running at a scale of kind "scale"'
+
+    def decorator(function):
+        BENCHMARKS[function.__name__] = (scale, function)
+        return function
+
+    return decorator
+
+
+class BenchmarkContext:
+    '''Information passed to the benchmarks
+
+    "work_dir" is a directory where benchmarks can write their files,
+    "scale" is the number of samples or of tests to use, and "client" is a
+    Django test client.'''
+
+    def __init__(self, work_dir, scale, client):
+        self.work_dir = work_dir
+        self.scale = scale
+        self.client = client
+
+    def path(self, file_name):
+        return os.path.join(self.work_dir, file_name)
+
+
+def write_text_file(file_name, num_of_samples, seed=1):
+    'Write a synthetic text file with "num_of_samples" samples'
+
+    SyntheticTest(num_of_samples / SAMPLING_FREQUENCY, seed=seed).write_text_file(file_name)
+
+
+def converted_file(context):
+    'Return the name of a HDF5 file with "context.scale" samples, creating it if needed'
+
+    h5_file_name = context.path('samples_{0}.h5'.format(context.scale))
+    if not os.path.isfile(h5_file_name):
+        text_file_name = context.path('samples_{0}.txt'.format(context.scale))
+        write_text_file(text_file_name, context.scale)
+        with open(text_file_name, 'rb') as input_file:
+            convert_text_file_to_h5(input_file, h5_file_name)
+
+    return h5_file_name
+
+
+################################################################################
+# Benchmarks of the converters and of the readers
+
+
+@benchmark(DATA_SCALE)
+def convert_text(context):
+    text_file_name = context.path('convert_{0}.txt'.format(context.scale))
+    write_text_file(text_file_name, context.scale)
+    with open(text_file_name, 'rb') as input_file:
+        data = input_file.read()
+
+    h5_file_name = context.path('convert_{0}.h5'.format(context.scale))
+
+    def run():
+        convert_text_file_to_h5(BytesIO(data), h5_file_name)
+
+    return run
+
+
+@benchmark(FIXED_SCALE)
+def convert_zip(context):
+    'Convert the Excel files in "testdata/datafile.zip"'
+
+    zip_file_name = os.path.join(TESTDATA_DIR, 'datafile.zip')
+    h5_file_name = context.path('convert_zip.h5')
+
+    def run():
+        with open(zip_file_name, 'rb') as input_file:
+            convert_zip_file_to_h5(input_file, h5_file_name)
+
+    return run
+
+
+@benchmark(DATA_SCALE)
+def pwr_plot(context):
+    h5_file_name = converted_file(context)
+
+    def run():
+        create_pwr_plot(h5_file_name)
+
+    return run
+
+
+@benchmark(DATA_SCALE)
+def read_time_series(context):
+    h5_file_name = converted_file(context)
+
+    def run():
+        with h5py.File(h5_file_name, 'r') as h5_file:
+            h5_file['time_series'][:]
+
+    return run
+
+
+@benchmark(DATA_SCALE)
+def read_derived_streams_decimated(context):
+    h5_file_name = converted_file(context)
+
+    def run():
+        with h5py.File(h5_file_name, 'r') as h5_file:
+            read_derived_streams(h5_file, 100)
+
+    return run
+
+
+################################################################################
+# Benchmarks of the views
+
+
+def view_benchmark(url_function):
+    '''Return a benchmark which gets the URL returned by url_function(test_ids)
+
+    "run_benchmarks" fills the database with "context.scale" tests before
+    running it; "test_ids" is the list of their IDs.'''
+
+    def setup(context):
+        if PolarimeterTest.objects.count() != context.scale:
+            raise ValueError('the database must contain {0} tests'
+                             .format(context.scale))
+
+        url = url_function(list(PolarimeterTest.objects.values_list('id', flat=True)))
+
+        def run():
+            response = context.client.get(url)
+            if response.status_code != 200:
+                raise ValueError('GET "{0}" returned status {1}'
+                                 .format(url, response.status_code))
+            h5pool.invalidate()
+
+        return run
+
+    return setup
+
+
+for name, url_function in (
+        ('view_test_list', lambda ids: '/unittests/'),
+        ('view_test_details_json', lambda ids: '/unittests/tests/{0}/json/'.format(ids[len(ids) // 2])),
+        ('view_api_tnoise', lambda ids: '/unittests/api/tnoise/'),
+        ('view_api_bandpass', lambda ids: '/unittests/api/bandpass/'),
+        ('view_api_spectrum', lambda ids: '/unittests/api/spectrum/')):
+    BENCHMARKS[name] = (DATABASE_SCALE, view_benchmark(url_function))
+
+
+################################################################################
+# Running the benchmarks
+
+
+def summarize_times(times):
+    return OrderedDict([
+        ('min', min(times)),
+        ('median', statistics.median(times)),
+        ('mean', statistics.mean(times)),
+        ('stdev', statistics.stdev(times) if len(times) > 1 else 0.0),
+    ])
+
+
+def measure(function, repeat):
+    '''Time "function" and measure its memory peak
+
+    Return a dictionary containing the statistics of wall-clock and CPU times
+    over "repeat" runs and the peak of the traced memory in bytes.'''
+
+    # Warm up caches (imports, HDF5 metadata, database pages)
+    function()
+
+    wall_times = []
+    cpu_times = []
+    for _ in range(repeat):
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        function()
+        cpu_times.append(time.process_time() - start_cpu)
+        wall_times.append(time.perf_counter() - start_wall)
+
+    # Memory is measured in a separate run, as "tracemalloc" slows down allocations
+    tracemalloc.start()
+    try:
+        function()
+        peak_traced_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return OrderedDict([
+        ('repeat', repeat),
+        ('wall_time_s', summarize_times(wall_times)),
+        ('cpu_time_s', summarize_times(cpu_times)),
+        ('peak_traced_bytes', peak_traced_bytes),
+    ])
+
+
+def git_commit():
+    'Return the hash of the commit checked out in the repository, or None'
+
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(__file__),
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment_info():
+    return OrderedDict([
+        ('git_commit', git_commit()),
+        ('date', datetime.utcnow().isoformat() + 'Z'),
+        ('python', sys.version.split()[0]),
+        ('platform', platform.platform()),
+        ('numpy', np.__version__),
+        ('h5py', h5py.__version__),
+    ])
+
+
+def run_benchmarks(work_dir, data_scales=DEFAULT_DATA_SCALES,
+                   database_scales=DEFAULT_DATABASE_SCALES,
+                   names=None, repeat=5, populate=populate_database):
+    '''Run the benchmarks and return their results as a dictionary
+
+    "names" is a list of names of benchmarks to run (default: all). The
+    benchmarks of the views fill the database using "populate", called with
+    the number of tests, and delete the tests afterwards: the database should
+    be a test database. The result contains the key "environment" and the key
+    "results", which is a list of dictionaries, one per benchmark and scale.
+    '''
+
+    selected = [(name, kind, function) for name, (kind, function) in BENCHMARKS.items()
+                if not names or name in names]
+    client = Client()
+
+    results = []
+    for kind, scales in ((DATA_SCALE, data_scales),
+                         (DATABASE_SCALE, database_scales),
+                         (FIXED_SCALE, (1,))):
+        cases = [(name, function) for name, cur_kind, function in selected
+                 if cur_kind == kind]
+        if not cases:
+            continue
+
+        for cur_scale in scales:
+            if kind == DATABASE_SCALE:
+                populate(cur_scale)
+
+            context = BenchmarkContext(work_dir, cur_scale, client)
+            for name, function in cases:
+                LOGGER.info('running benchmark %s with %d %s', name, cur_scale, kind)
+                measurements = measure(function(context), repeat)
+
+                cur_result = OrderedDict([
+                    ('name', name),
+                    ('scale', cur_scale),
+                    ('scale_unit', kind),
+                ])
+                cur_result.update(measurements)
+                results.append(cur_result)
+
+            if kind == DATABASE_SCALE:
+                get_user_model().objects.filter(username=SYNTHETIC_USER_NAME).delete()
+                for model in (PolarimeterTest, TestType, Operator):
+                    model.objects.all().delete()
+
+    return OrderedDict([
+        ('environment', environment_info()),
+        ('results', results),
+    ])
+
+
+def compare_results(baseline, current, threshold=0.1):
+    '''Compare the median wall-clock times of two results of "run_benchmarks"
+
+    Return a list of tuples (name, scale, baseline_s, current_s, ratio, flag),
+    one for each benchmark and scale present in both. The flag is "slower" or
+    "faster" if the ratio differs from 1 by more than "threshold", otherwise
+    it is an empty string.'''
+
+    baseline_times = {(x['name'], x['scale']): x['wall_time_s']['median']
+                      for x in baseline['results']}
+
+    comparison = []
+    for cur_result in current['results']:
+        key = (cur_result['name'], cur_result['scale'])
+        if key not in baseline_times:
+            continue
+
+        old_time = baseline_times[key]
+        new_time = cur_result['wall_time_s']['median']
+        ratio = new_time / old_time if old_time > 0 else float('inf')
+        if ratio > 1 + threshold:
+            flag = 'slower'
+        elif ratio < 1 - threshold:
+            flag = 'faster'
+        else:
+            flag = ''
+
+        comparison.append((key[0], key[1], old_time, new_time, ratio, flag))
+
+    return comparison
@@ -0,0 +1,159 @@
+# -*- encoding: utf-8 -*-
+
+'''Send the queries of read-only views to replicas of the database
+
+The aliases in REPLICA_DATABASES name read-only copies of the "default"
+database (e.g., PostgreSQL streaming replicas). "ReplicaMiddleware" picks
+one of them for each GET/HEAD/OPTIONS request whose view name matches one
+of the patterns in REPLICA_VIEWS, and "ReplicaRouter" sends the queries
+made while the request is processed to it. Everything else, including all
+the writes, goes to "default".
+
+Replicas lag behind the primary database. To let users see what they have
+just saved, every request with any other method (POST, PUT, DELETE...)
+sets the cookie PRIMARY_COOKIE_NAME, and requests carrying it keep reading
+from "default" for REPLICA_STICKY_SECONDS seconds.
+
+A replica which cannot be reached, or which fails a query, is not used for
+REPLICA_RETRY_SECONDS seconds; in the meantime requests are answered using
+the next replica or "default". Since the views using replicas only read
+from the database, a view which failed on a replica (even while its
+template was being rendered) is run again.
+'''
+
+from fnmatch import fnmatchcase
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+# Get an instance of a logger
+LOGGER = logging.getLogger(__name__)
+
+PRIMARY_COOKIE_NAME = 'stdb2_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Replica used by the request being processed by the current thread
+_LOCAL = threading.local()
+
+# Time (as returned by "time.monotonic") until which a replica is not used
+_DOWN_UNTIL = {}
+
+
+def current_replica():
+    'Return the alias of the replica used by the current thread, or None'
+    return getattr(_LOCAL, 'alias', None)
+
+
+def mark_replica_down(alias):
+    'Stop using the replica "alias" for REPLICA_RETRY_SECONDS seconds'
+
+    _DOWN_UNTIL[alias] = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+    try:
+        connections[alias].close()
+    except DatabaseError:
+        pass
+
+
+def choose_replica():
+    '''Return the alias of a reachable replica, or None
+
+    Replicas are tried in random order, to spread the load among them.'''
+
+    now = time.monotonic()
+    aliases = [x for x in settings.REPLICA_DATABASES
+               if _DOWN_UNTIL.get(x, 0.0) <= now]
+    random.shuffle(aliases)
+
+    for alias in aliases:
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError as exc:
+            LOGGER.warning('replica "%s" is not available: %s', alias, exc)
+            mark_replica_down(alias)
+            continue
+
+        return alias
+
+    return None
+
+
+def is_replica_view(view_name):
+    'Return True if the view named "view_name" can read from a replica'
+    return any(fnmatchcase(view_name, x) for x in settings.REPLICA_VIEWS)
+
+
+class ReplicaRouter:
+    'Database router sending reads to the replica chosen by "ReplicaMiddleware"'
+
+    def db_for_read(self, model, **hints):
+        return current_replica()
+
+    def db_for_write(self, model, **hints):
+        # Objects read from a replica must be saved in the primary database
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas contain the same rows as the primary database
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.REPLICA_DATABASES:
+            return False
+
+        return None
+
+
+class ReplicaMiddleware:
+    'Choose the database used by each request (see the module documentation)'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            response = self.get_response(request)
+        finally:
+            _LOCAL.alias = None
+
+        if request.method not in SAFE_METHODS and settings.REPLICA_DATABASES:
+            response.set_cookie(PRIMARY_COOKIE_NAME, '1',
+                                max_age=settings.REPLICA_STICKY_SECONDS,
+                                httponly=True)
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        _LOCAL.alias = None
+        if (request.method not in SAFE_METHODS or
+                not settings.REPLICA_DATABASES or
+                PRIMARY_COOKIE_NAME in request.COOKIES or
+                not is_replica_view(request.resolver_match.view_name)):
+            return None
+
+        _LOCAL.alias = choose_replica()
+        request.replica_view = (view_func, view_args, view_kwargs)
+        return None
+
+    def process_exception(self, request, exception):
+        alias = current_replica()
+        if alias is None or not isinstance(exception, DatabaseError):
+            return None
+
+        LOGGER.warning('query on replica "%s" failed, using "%s": %s',
+                       alias, DEFAULT_DB_ALIAS, exception)
+        mark_replica_down(alias)
+        _LOCAL.alias = None
+
+        view_func, view_args, view_kwargs = request.replica_view
+        response = view_func(request, *view_args, **view_kwargs)
+
+        # If the query failed while a template response was being rendered,
+        # Django does not render the response returned here
+        if hasattr(response, 'render') and callable(response.render):
+            response = response.render()
+
+        return response
@@ -1,6 +1,7 @@
 # -*- encoding: utf-8 -*-
 
 from collections import OrderedDict
+import hashlib
 from io import BytesIO
 import logging
 import os.path
@@ -8,16 +9,392 @@ import re
 from shutil import copyfileobj
 from zipfile import ZipFile
 
-import h5py
 import numpy as np
-import pandas
-import xlrd
+
+from .glitches import EVENT_DATASET, write_event_index
+from .tracing import span
 
 SAMPLING_FREQUENCY = 25.0
 
+# Names of the columns in the "time_series" dataset containing the outputs
+# of the four detectors
+DEM_COLUMNS = ('dem_Q1_ADU', 'dem_U1_ADU', 'dem_U2_ADU', 'dem_Q2_ADU')
+PWR_COLUMNS = ('pwr_Q1_ADU', 'pwr_U1_ADU', 'pwr_U2_ADU', 'pwr_Q2_ADU')
+
+# Linear combinations of the detector outputs which estimate the Stokes
+# parameters. The two Q (U) detectors measure the Q (U) parameter with
+# opposite signs, while every PWR output is proportional to I.
+STOKES_COMBINATIONS = OrderedDict([
+    ('I', OrderedDict([('pwr_Q1_ADU', 0.25), ('pwr_U1_ADU', 0.25),
+                       ('pwr_U2_ADU', 0.25), ('pwr_Q2_ADU', 0.25)])),
+    ('Q', OrderedDict([('dem_Q1_ADU', 0.5), ('dem_Q2_ADU', -0.5)])),
+    ('U', OrderedDict([('dem_U1_ADU', 0.5), ('dem_U2_ADU', -0.5)])),
+])
+
+
+def stokes_weight_matrix(columns):
+    '''Return the matrix which turns the detector outputs into I, Q, U
+
+    The matrix has one row for each parameter in STOKES_COMBINATIONS and one
+    column for each name in "columns", so that the Stokes parameters can be
+    computed with one matrix product.'''
+
+    result = np.zeros((len(STOKES_COMBINATIONS), len(columns)))
+    for row_idx, weights in enumerate(STOKES_COMBINATIONS.values()):
+        for col_name, weight in weights.items():
+            result[row_idx, columns.index(col_name)] = weight
+
+    return result
+
+
+# Name of the group in HDF5 files containing the streams derived from
+# "time_series", and decimation factors of the streams saved there
+DERIVED_GROUP = 'derived'
+DERIVED_DECIMATIONS = (1, 10, 100, 1000)
+DERIVED_CHUNK_SAMPLES = 100000
+DERIVED_DATA_TYPE = np.dtype([('time_s', np.float64)] +
+                             [(x, np.float32) for x in STOKES_COMBINATIONS.keys()])
+
 # Get an instance of a logger
 LOGGER = logging.getLogger(__name__)
 
+# Attribute of HDF5 files containing the SHA-256 hash of the samples (see
+# "write_samples_hash"), and number of samples hashed at a time
+SAMPLES_HASH_ATTR = 'samples_sha256'
+HASH_CHUNK_SAMPLES = 100000
+
+
+def compute_samples_hash(h5_file):
+    '''Return the SHA-256 hash of the samples in a HDF5 file, as a hex string
+
+    If the file contains "time_series", only that dataset is hashed;
+    otherwise (e.g., in files containing I/V curves) every dataset is. Derived
+    streams, indexes and attributes are not included, so that they can be
+    written again without changing the hash.'''
+
+    import h5py
+
+    if 'time_series' in h5_file:
+        names = ['time_series']
+    else:
+        names = []
+        h5_file.visititems(lambda name, obj: names.append(name)
+                           if isinstance(obj, h5py.Dataset) else None)
+        names.sort()
+
+    result = hashlib.sha256()
+    for cur_name in names:
+        dataset = h5_file[cur_name]
+        result.update('{0}{1}{2}'.format(cur_name, dataset.shape, dataset.dtype)
+                      .encode('utf-8'))
+        if not dataset.shape:
+            result.update(np.ascontiguousarray(dataset[()]).tobytes())
+            continue
+
+        for start in range(0, dataset.shape[0], HASH_CHUNK_SAMPLES):
+            chunk = dataset[start:start + HASH_CHUNK_SAMPLES]
+            result.update(np.ascontiguousarray(chunk).tobytes())
+
+    return result.hexdigest()
+
+
+def write_samples_hash(h5_file):
+    'Save the hash of the samples in the attribute SAMPLES_HASH_ATTR'
+    h5_file.attrs[SAMPLES_HASH_ATTR] = compute_samples_hash(h5_file)
+
+
+def read_samples_hash(h5_file):
+    '''Return the hash of the samples in a HDF5 file
+
+    The value saved by "write_samples_hash" is used, if present.'''
+
+    value = h5_file.attrs.get(SAMPLES_HASH_ATTR)
+    if value is None:
+        return compute_samples_hash(h5_file)
+
+    return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+
+
+def derived_dataset_name(decimation):
+    'Return the name of the dataset containing I, Q, U decimated by "decimation"'
+    return '{0}/stokes_{1}'.format(DERIVED_GROUP, decimation)
+
+
+def write_derived_streams(h5_file, pwr_offsets=None,
+                          chunk_samples=DERIVED_CHUNK_SAMPLES):
+    '''Compute the I, Q, U streams from "time_series" and save them
+
+    The streams are saved in the group DERIVED_GROUP, replacing any previous
+    version, once for each decimation factor in DERIVED_DECIMATIONS
+    (decimated samples are the average of consecutive samples). If
+    "pwr_offsets" is not None, it must contain the four ADC offsets (in the
+    order of PWR_COLUMNS), which are subtracted from the PWR outputs.
+    Datasets are resizable, so that "extend_derived_streams" can extend them.
+    '''
+
+    if DERIVED_GROUP in h5_file:
+        del h5_file[DERIVED_GROUP]
+
+    num_of_samples = h5_file['time_series'].shape[0]
+    for decimation in DERIVED_DECIMATIONS:
+        dataset = h5_file.create_dataset(
+            derived_dataset_name(decimation),
+            (-(-num_of_samples // decimation),), maxshape=(None,),
+            dtype=DERIVED_DATA_TYPE, compression='gzip', shuffle=True)
+        dataset.attrs['decimation'] = decimation
+
+    offsets = np.zeros(len(PWR_COLUMNS))
+    if pwr_offsets is not None:
+        offsets[:] = pwr_offsets
+    h5_file[DERIVED_GROUP].attrs['pwr_offsets_adu'] = offsets
+
+    extend_derived_streams(h5_file, 0, chunk_samples)
+
+
+def extend_derived_streams(h5_file, start, chunk_samples=DERIVED_CHUNK_SAMPLES):
+    '''Compute the I, Q, U streams for the samples of "time_series" after "start"
+
+    The datasets in DERIVED_GROUP are resized to match the length of
+    "time_series". The value of "start" is rounded down to a multiple of the
+    largest decimation factor, so that incomplete blocks at the end of the
+    streams are computed again. The time series is processed in chunks of
+    "chunk_samples" samples, which is rounded to a multiple of the largest
+    decimation factor as well.
+    '''
+
+    time_series = h5_file['time_series']
+    num_of_samples = time_series.shape[0]
+    columns = list(DEM_COLUMNS + PWR_COLUMNS)
+    weights = stokes_weight_matrix(columns)
+
+    offsets = np.zeros((len(columns), 1))
+    offsets[len(DEM_COLUMNS):, 0] = h5_file[DERIVED_GROUP].attrs['pwr_offsets_adu']
+
+    datasets = {}
+    for decimation in DERIVED_DECIMATIONS:
+        datasets[decimation] = h5_file[derived_dataset_name(decimation)]
+        datasets[decimation].resize((-(-num_of_samples // decimation),))
+
+    largest_decimation = max(DERIVED_DECIMATIONS)
+    start -= start % largest_decimation
+    chunk_samples = max(largest_decimation,
+                        chunk_samples - chunk_samples % largest_decimation)
+    for chunk_start in range(start, num_of_samples, chunk_samples):
+        stop = min(chunk_start + chunk_samples, num_of_samples)
+        chunk = time_series[(slice(chunk_start, stop), 'time_s') + tuple(columns)]
+        channels = np.stack([chunk[x].astype(np.float64) for x in columns])
+        stokes = weights @ (channels - offsets)
+        times = chunk['time_s'].astype(np.float64)
+
+        for decimation, dataset in datasets.items():
+            # All the chunks but the last one contain a whole number of
+            # blocks, so the average over each block can be done using
+            # "np.add.reduceat"
+            block_starts = np.arange(0, stop - chunk_start, decimation)
+            block_lengths = np.diff(np.append(block_starts, stop - chunk_start))
+            values = np.empty(len(block_starts), dtype=DERIVED_DATA_TYPE)
+            values['time_s'] = np.add.reduceat(times, block_starts) / block_lengths
+            for idx, name in enumerate(STOKES_COMBINATIONS.keys()):
+                values[name] = np.add.reduceat(stokes[idx], block_starts) / block_lengths
+
+            dataset_start = chunk_start // decimation
+            dataset[dataset_start:dataset_start + len(values)] = values
+
+
+def read_derived_streams(h5_file, decimation, start=None, stop=None):
+    '''Read the I, Q, U streams saved by "write_derived_streams"
+
+    Return a NumPy structured array, or None if the file has no such stream.
+    The indexes "start" and "stop" refer to the decimated samples.
+    '''
+
+    name = derived_dataset_name(decimation)
+    if name not in h5_file:
+        return None
+
+    return h5_file[name][start:stop]
+
+
+# Name of the dataset containing the run-length index of the phase switch
+# ("phb") and recording ("record") states
+SEGMENT_DATASET = 'segments'
+SEGMENT_DATA_TYPE = np.dtype([
+    ('start', np.int64),
+    ('stop', np.int64),
+    ('phb', np.int8),
+    ('record', np.int8),
+])
+
+
+def compute_state_segments(phb, record):
+    '''Split the time series in segments where "phb" and "record" are constant
+
+    Return a NumPy array of type SEGMENT_DATA_TYPE, with one row per segment;
+    "stop" is the index of the first sample after the segment.'''
+
+    num_of_samples = len(phb)
+    if num_of_samples == 0:
+        return np.zeros(0, dtype=SEGMENT_DATA_TYPE)
+
+    changes = np.flatnonzero((phb[1:] != phb[:-1]) | (record[1:] != record[:-1])) + 1
+    starts = np.concatenate([[0], changes])
+
+    result = np.empty(len(starts), dtype=SEGMENT_DATA_TYPE)
+    result['start'] = starts
+    result['stop'] = np.append(changes, num_of_samples)
+    result['phb'] = phb[starts]
+    result['record'] = record[starts]
+    return result
+
+
+def write_segment_index(h5_file):
+    '''Save the segments of constant "phb" and "record" in the file
+
+    The index is saved in the dataset SEGMENT_DATASET, replacing any previous
+    version. Nothing is done if "time_series" has no "phb"/"record" columns.
+    Return the number of segments, or None.'''
+
+    time_series = h5_file['time_series']
+    if not {'phb', 'record'}.issubset(time_series.dtype.names or ()):
+        return None
+
+    if SEGMENT_DATASET in h5_file:
+        del h5_file[SEGMENT_DATASET]
+
+    segments = compute_state_segments(time_series['phb'], time_series['record'])
+    h5_file.create_dataset(SEGMENT_DATASET, data=segments, maxshape=(None,),
+                           chunks=True, compression='gzip')
+    return len(segments)
+
+
+def extend_segment_index(h5_file, start):
+    '''Update the index of segments after new samples were appended
+
+    The parameter "start" is the number of samples in "time_series" before
+    the append. The last segment in the index is extended if the first new
+    samples have the same states. Return the number of segments.'''
+
+    time_series = h5_file['time_series']
+    dataset = h5_file[SEGMENT_DATASET]
+    new_segments = compute_state_segments(time_series['phb', start:],
+                                          time_series['record', start:])
+    new_segments['start'] += start
+    new_segments['stop'] += start
+
+    num_of_segments = dataset.shape[0]
+    if num_of_segments and len(new_segments):
+        last_segment = dataset[num_of_segments - 1]
+        if (last_segment['stop'] == new_segments[0]['start'] and
+                last_segment['phb'] == new_segments[0]['phb'] and
+                last_segment['record'] == new_segments[0]['record']):
+            last_segment['stop'] = new_segments[0]['stop']
+            dataset[num_of_segments - 1] = last_segment
+            new_segments = new_segments[1:]
+
+    dataset.resize((num_of_segments + len(new_segments),))
+    dataset[num_of_segments:] = new_segments
+    return dataset.shape[0]
+
+
+def read_segment_index(h5_file, phb=None, record=None):
+    '''Return the segments saved by "write_segment_index"
+
+    If "phb" or "record" are not None, only the segments with those states are
+    returned. Return None if the file has no index.'''
+
+    if SEGMENT_DATASET not in h5_file:
+        return None
+
+    segments = h5_file[SEGMENT_DATASET][...]
+    if phb is not None:
+        segments = segments[segments['phb'] == phb]
+    if record is not None:
+        segments = segments[segments['record'] == record]
+
+    return segments
+
+
+def iterate_segments(h5_file, phb=None, record=None, columns=None):
+    '''Yield the samples of "time_series" in each segment with the given states
+
+    Each element is a tuple (segment, samples), where "segment" is a row of
+    the index. Only the columns listed in "columns" are read (default: all of
+    them); like h5py, a plain array is returned if there is only one column.
+    Samples are read by slicing the dataset, so the cost depends on the
+    number of segments and on their length, not on the length of the test.'''
+
+    segments = read_segment_index(h5_file, phb=phb, record=record)
+    if segments is None:
+        raise ValueError('file "{0}" has no index of segments'.format(h5_file.filename))
+
+    time_series = h5_file['time_series']
+    for cur_segment in segments:
+        selection = (slice(cur_segment['start'], cur_segment['stop']),)
+        if columns:
+            selection += tuple(columns)
+
+        yield cur_segment, time_series[selection]
+
+
+# Columns in the text files saved by the acquisition software
+TEXT_FILE_COLUMNS = ('pctime', 'phb', 'record',
+                     'dem_Q1_ADU', 'dem_U1_ADU', 'dem_U2_ADU', 'dem_Q2_ADU',
+                     'pwr_Q1_ADU', 'pwr_U1_ADU', 'pwr_U2_ADU', 'pwr_Q2_ADU',
+                     'rfpower_dB', 'freq_Hz')
+
+TIME_SERIES_DATA_TYPE = np.dtype([
+    ('time_s', np.float32),
+    ('pctime', np.float32),
+    ('phb', np.int8),
+    ('record', np.int8),
+    ('dem_Q1_ADU', np.float32),
+    ('dem_U1_ADU', np.float32),
+    ('dem_U2_ADU', np.float32),
+    ('dem_Q2_ADU', np.float32),
+    ('pwr_Q1_ADU', np.float32),
+    ('pwr_U1_ADU', np.float32),
+    ('pwr_U2_ADU', np.float32),
+    ('pwr_Q2_ADU', np.float32),
+    ('rfpower_dB', np.float32),
+    ('freq_Hz', np.float32)
+])
+
+
+def read_text_samples(input_file, skiprows=1, strict=False):
+    '''Read the samples in a text file saved by the acquisition software
+
+    Return a NumPy array of type TIME_SERIES_DATA_TYPE. The column "time_s"
+    is not filled, as it depends on the position of the samples in the test.
+    Raise ValueError if a line has missing values; unless "strict" is true,
+    an incomplete last line (e.g., in a file copied while the acquisition
+    was still running) is skipped instead.
+    '''
+
+    import pandas
+
+    rawdata = pandas.read_csv(input_file, delim_whitespace=True,
+                              skiprows=skiprows, names=TEXT_FILE_COLUMNS)
+    if len(rawdata.columns) != len(TEXT_FILE_COLUMNS):
+        raise ValueError('the input file has {0} columns instead of {1}'
+                         .format(len(rawdata.columns),
+                                 len(TEXT_FILE_COLUMNS)))
+
+    incomplete = rawdata.isnull().values.any(axis=1)
+    if not strict and len(incomplete) and incomplete[-1]:
+        LOGGER.warning('skipping the incomplete last line of the input file')
+        rawdata = rawdata.iloc[:-1]
+        incomplete = incomplete[:-1]
+
+    if incomplete.any():
+        raise ValueError('some lines of the input file have less than {0} columns'
+                         .format(len(TEXT_FILE_COLUMNS)))
+
+    result = np.zeros(rawdata.shape[0], dtype=TIME_SERIES_DATA_TYPE)
+    for key in TEXT_FILE_COLUMNS:
+        result[key] = np.array(rawdata[key])
+
+    return result
+
 
 def convert_text_file_to_h5(input_file, output_file):
     '''Convert a text file into a HDF5 file
@@ -27,50 +404,35 @@ def convert_text_file_to_h5(input_file, output_file):
     object).
     '''
 
-    column_names = ('pctime', 'phb', 'record',
-                    'dem_Q1_ADU', 'dem_U1_ADU', 'dem_U2_ADU', 'dem_Q2_ADU',
-                    'pwr_Q1_ADU', 'pwr_U1_ADU', 'pwr_U2_ADU', 'pwr_Q2_ADU',
-                    'rfpower_dB', 'freq_Hz')
+    import h5py
 
     LOGGER.debug('going to load the text file')
-    rawdata = pandas.read_csv(input_file, delim_whitespace=True,
-                              skiprows=1, names=column_names)
-    if len(rawdata.columns) != len(column_names):
-        raise ValueError('the input file has {0} columns instead of {1}'
-                         .format(len(rawdata.columns),
-                                 len(column_names)))
+    with span('parse_text') as cur_span:
+        samples = read_text_samples(input_file)
+        samples['time_s'] = np.arange(len(samples)) / SAMPLING_FREQUENCY
+        cur_span.bytes_out = samples.nbytes
     LOGGER.debug('file read successfully')
 
-    data_type = np.dtype([
-        ('time_s', np.float32),
-        ('pctime', np.float32),
-        ('phb', np.int8),
-        ('record', np.int8),
-        ('dem_Q1_ADU', np.float32),
-        ('dem_U1_ADU', np.float32),
-        ('dem_U2_ADU', np.float32),
-        ('dem_Q2_ADU', np.float32),
-        ('pwr_Q1_ADU', np.float32),
-        ('pwr_U1_ADU', np.float32),
-        ('pwr_U2_ADU', np.float32),
-        ('pwr_Q2_ADU', np.float32),
-        ('rfpower_dB', np.float32),
-        ('freq_Hz', np.float32)
-    ])
-
     LOGGER.debug('going to create the HDF5 file')
     with h5py.File(output_file, 'w') as h5_file:
-        data = h5_file.create_dataset(
-            'time_series', (rawdata.shape[0],),
-            dtype=data_type, compression='gzip', shuffle=True)
+        with span('write_time_series', bytes_in=samples.nbytes):
+            h5_file.create_dataset('time_series', data=samples,
+                                   compression='gzip', shuffle=True)
+            write_samples_hash(h5_file)
+        LOGGER.debug('columns have been written in HDF5 file')
 
-        LOGGER.debug('file created, writing columns')
-        data['time_s'] = np.arange(len(rawdata['pctime'])) / SAMPLING_FREQUENCY
+        with span('derived_streams'):
+            write_derived_streams(h5_file)
+        LOGGER.debug('derived streams have been written in HDF5 file')
 
-        for key in column_names:
-            data[key] = np.array(rawdata[key])
+        with span('event_index'):
+            num_of_events = write_event_index(h5_file, DEM_COLUMNS + PWR_COLUMNS)
+        LOGGER.debug('%d glitches/jumps have been written in HDF5 file', num_of_events)
 
-        LOGGER.debug('columns have been written in HDF5 file')
+        with span('segment_index'):
+            num_of_segments = write_segment_index(h5_file)
+        LOGGER.debug('%d phb/record segments have been written in HDF5 file',
+                     num_of_segments)
 
 
 def read_worksheet_table(wks):
@@ -175,10 +537,14 @@ def column_to_numpy_array(values):
 def convert_excel_file_to_h5(input_file, h5_file, dataset_name):
     'Convert an Excel file into a HDF5 dataset'
 
+    import xlrd
+
     # Read data and metadata from the Excel file
-    with xlrd.open_workbook(file_contents=input_file.read()) as workbook:
+    with span('read_excel') as cur_span, \
+         xlrd.open_workbook(file_contents=input_file.read()) as workbook:
         settings = read_worksheet_settings(workbook)
         datatable = read_worksheet_table(workbook)
+        cur_span.bytes_out = sum(x.nbytes for x in (datatable or {}).values())
 
         # The new Keithley has the nasty habit to save Excel files with no data,
         # and these file share the *same filename* as the files containing
@@ -335,6 +701,8 @@ def convert_zip_file_to_h5(input_file, output_file_path):
         'V2_PS2/tests/data/Ir_vs_Vr': 'PSB2/IRVR', 'Ir_vs_Vr_V2_PS2': 'PSB2/IRVR',
     }
 
+    import h5py
+
     with h5py.File(output_file_path, 'w') as h5_file:
         with ZipFile(input_file) as zip_file:
             for info in zip_file.infolist():
@@ -351,9 +719,12 @@ def convert_zip_file_to_h5(input_file, output_file_path):
                 if not dataset_name:
                     continue
 
-                with zip_file.open(info) as xls_file:
+                with span('excel_file', bytes_in=info.file_size), \
+                     zip_file.open(info) as xls_file:
                     convert_excel_file_to_h5(xls_file, h5_file, dataset_name)
 
+        write_samples_hash(h5_file)
+
 
 def convert_data_file_to_h5(data_file_name, data_file, output_file):
     '''Convert a data file into a HDF5 file
@@ -361,10 +732,16 @@ def convert_data_file_to_h5(data_file_name, data_file, output_file):
     The parameter "data_file_name" is used only to infer the type of the file
     from its extension: it does not need to match a real file.
     '''
+    import h5py
+
     basename = os.path.basename(data_file_name)
     _, file_ext = os.path.splitext(basename)
 
-    with BytesIO(data_file.read()) as input_file:
+    with span('read_upload') as cur_span:
+        data = data_file.read()
+        cur_span.bytes_out = len(data)
+
+    with BytesIO(data) as input_file:
         file_ext = file_ext.lower()
         if file_ext == '.txt':
             LOGGER.debug('file "%s" is a text file', data_file_name)
@@ -380,6 +757,19 @@ def convert_data_file_to_h5(data_file_name, data_file, output_file):
             if type(output_file) is str:
                 with open(output_file, "wb") as dest_file:
                     copyfileobj(input_file, dest_file)
+
+                # Files produced by older versions of the converter do not
+                # contain the derived streams and the indexes of glitches and
+                # phb/record segments
+                with h5py.File(output_file, 'r+') as h5_file:
+                    # The file might have been modified outside the database
+                    write_samples_hash(h5_file)
+                    if 'time_series' in h5_file and DERIVED_GROUP not in h5_file:
+                        write_derived_streams(h5_file)
+                    if 'time_series' in h5_file and EVENT_DATASET not in h5_file:
+                        write_event_index(h5_file, DEM_COLUMNS + PWR_COLUMNS)
+                    if 'time_series' in h5_file and SEGMENT_DATASET not in h5_file:
+                        write_segment_index(h5_file)
             else:
                 # Tread "output_file" as a file-like object
                 copyfileobj(data_file, output_file)
@@ -0,0 +1,240 @@
+# -*- encoding: utf-8 -*-
+
+'''Detection of glitches, ADC saturation and jumps in the time series
+
+This module looks for three kinds of events in the outputs of the detectors:
+
+- spikes: short groups of samples which deviate from the local median by more
+  than a few times the local MAD (median absolute deviation), computed on
+  blocks of consecutive samples;
+- rail hits: groups of samples stuck at the smallest or largest value that
+  the ADC can return (see DEFAULT_ADC_RANGE_ADU), as happens when it
+  saturates;
+- jumps: sudden changes in the mean of the output, found by comparing the
+  averages of two windows before and after each sample.
+
+Jumps are expected in tests where the input changes in steps (e.g., Y-factor
+tests and frequency sweeps): their severity still helps telling them apart
+from glitches.
+
+Events are saved in the dataset EVENT_DATASET of the HDF5 file (see
+"write_event_index"), and the database keeps a copy of them in the
+"GlitchEvent" table. The functions in this module do not access the database.
+'''
+
+from functools import partial
+import logging
+
+import numpy as np
+
+# Increase this whenever a change in the code changes the results
+ALGORITHM_VERSION = '1.1'
+
+# Name of the dataset containing the index of the events in HDF5 files
+EVENT_DATASET = 'events'
+
+EVENT_SPIKE = 'spike'
+EVENT_RAIL = 'rail'
+EVENT_JUMP = 'jump'
+
+EVENT_DATA_TYPE = np.dtype([
+    ('kind', 'S8'),
+    ('channel', 'S16'),
+    ('start', np.int64),
+    ('stop', np.int64),
+    ('severity', np.float32),
+])
+
+# Number of samples in the blocks used to compute the local median and MAD
+DEFAULT_MAD_BLOCK_SAMPLES = 250
+# Samples farther than this from the local median (in units of the local MAD,
+# rescaled to a Gaussian sigma) are outliers
+DEFAULT_SPIKE_THRESHOLD_SIGMA = 8.0
+# Groups of outliers longer than this are not spikes (they are usually part
+# of a jump, which is detected separately)
+DEFAULT_MAX_SPIKE_SAMPLES = 10
+# Smallest and largest values returned by the signed 16-bit ADCs of the
+# acquisition boards
+DEFAULT_ADC_RANGE_ADU = (-32768, 32767)
+# Minimum number of consecutive samples at the limits of the ADC
+DEFAULT_MIN_RAIL_SAMPLES = 3
+# Number of samples in the windows used to look for jumps
+DEFAULT_JUMP_WINDOW_SAMPLES = 25
+# Changes in the mean larger than this (in units of the expected noise on the
+# difference between two windows) are jumps
+DEFAULT_JUMP_THRESHOLD_SIGMA = 10.0
+
+# Conversion factor between the MAD and the sigma of a Gaussian distribution
+MAD_TO_SIGMA = 1.4826
+
+# Get an instance of a logger
+LOGGER = logging.getLogger(__name__)
+
+
+def masked_runs(mask, min_length=1, max_length=None):
+    '''Return the runs of true values in a boolean array
+
+    Return a tuple of arrays (starts, stops), considering only the runs whose
+    length is within the limits.'''
+
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+
+    lengths = stops - starts
+    selected = lengths >= min_length
+    if max_length is not None:
+        selected &= lengths <= max_length
+
+    return starts[selected], stops[selected]
+
+
+def find_spikes(signal,
+                block_samples=DEFAULT_MAD_BLOCK_SAMPLES,
+                threshold_sigma=DEFAULT_SPIKE_THRESHOLD_SIGMA,
+                max_spike_samples=DEFAULT_MAX_SPIKE_SAMPLES):
+    '''Find short groups of outliers using the MAD computed on blocks
+
+    The signal is split in blocks of "block_samples" samples (the last one can
+    be shorter), and the median and MAD of every block are computed at once.
+    Return a tuple of arrays (starts, stops, severities), where the severity
+    is the largest deviation in the group in units of the local sigma.
+    '''
+
+    num_of_samples = len(signal)
+    num_of_blocks = -(-num_of_samples // block_samples)
+    padded = np.full(num_of_blocks * block_samples, np.nan)
+    padded[:num_of_samples] = signal
+    blocks = padded.reshape(num_of_blocks, block_samples)
+
+    median = np.nanmedian(blocks, axis=1, keepdims=True)
+    sigma = MAD_TO_SIGMA * np.nanmedian(np.abs(blocks - median), axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        deviation = (np.abs(blocks - median) / sigma).ravel()[:num_of_samples]
+
+    # Blocks where the signal is constant have no outliers
+    deviation[~np.isfinite(deviation)] = 0.0
+
+    starts, stops = masked_runs(deviation > threshold_sigma,
+                                max_length=max_spike_samples)
+    severities = np.array([deviation[start:stop].max()
+                           for start, stop in zip(starts, stops)])
+    return starts, stops, severities
+
+
+def find_rail_hits(signal,
+                   adc_range=DEFAULT_ADC_RANGE_ADU,
+                   min_rail_samples=DEFAULT_MIN_RAIL_SAMPLES):
+    '''Find the groups of samples stuck at the limits of the ADC
+
+    The parameter "adc_range" is a tuple (min, max) with the smallest and
+    largest values returned by the ADC. Return a tuple of arrays (starts,
+    stops, severities), where the severity is the number of samples in the
+    group.
+    '''
+
+    low, high = adc_range
+    starts, stops = masked_runs((signal <= low) | (signal >= high),
+                                min_length=min_rail_samples)
+    return starts, stops, (stops - starts).astype(np.float64)
+
+
+def find_jumps(signal,
+               window_samples=DEFAULT_JUMP_WINDOW_SAMPLES,
+               threshold_sigma=DEFAULT_JUMP_THRESHOLD_SIGMA):
+    '''Find the samples where the mean of the signal changes suddenly
+
+    The white noise of the signal is estimated from the differences between
+    consecutive samples. Return a tuple of arrays (starts, stops, severities),
+    where the severity is the largest change in units of its expected noise.
+    '''
+
+    num_of_samples = len(signal)
+    if num_of_samples < 2 * window_samples:
+        return np.array([], dtype=int), np.array([], dtype=int), np.array([])
+
+    sigma = MAD_TO_SIGMA * np.median(np.abs(np.diff(signal))) / np.sqrt(2)
+    if sigma == 0.0:
+        return np.array([], dtype=int), np.array([], dtype=int), np.array([])
+
+    cumsum = np.concatenate([[0.0], np.cumsum(signal, dtype=np.float64)])
+    window_mean = (cumsum[window_samples:] - cumsum[:-window_samples]) / window_samples
+
+    # Element i is the change between the windows [i - w, i) and [i, i + w)
+    change = np.zeros(num_of_samples)
+    change[window_samples:num_of_samples - window_samples + 1] = \
+        np.abs(window_mean[window_samples:] - window_mean[:-window_samples]) / \
+        (sigma * np.sqrt(2.0 / window_samples))
+
+    starts, stops = masked_runs(change > threshold_sigma)
+    severities = np.array([change[start:stop].max()
+                           for start, stop in zip(starts, stops)])
+    return starts, stops, severities
+
+
+def detect_events(signal, channel, adc_range=DEFAULT_ADC_RANGE_ADU):
+    '''Run all the detectors on one channel
+
+    The parameter "adc_range" has the same meaning as in "find_rail_hits".
+    Return a NumPy array of type EVENT_DATA_TYPE, sorted by start.'''
+
+    signal = np.asarray(signal, dtype=np.float64)
+    if len(signal) == 0:
+        return np.zeros(0, dtype=EVENT_DATA_TYPE)
+
+    events = []
+    for kind, detector in ((EVENT_SPIKE, find_spikes),
+                           (EVENT_RAIL, partial(find_rail_hits, adc_range=adc_range)),
+                           (EVENT_JUMP, find_jumps)):
+        starts, stops, severities = detector(signal)
+        cur_events = np.zeros(len(starts), dtype=EVENT_DATA_TYPE)
+        cur_events['kind'] = kind
+        cur_events['channel'] = channel
+        cur_events['start'] = starts
+        cur_events['stop'] = stops
+        cur_events['severity'] = severities
+        events.append(cur_events)
+
+    result = np.concatenate(events)
+    return result[np.argsort(result['start'], kind='stable')]
+
+
+def write_event_index(h5_file, columns, adc_range=DEFAULT_ADC_RANGE_ADU):
+    '''Detect events in the columns of "time_series" and save them in the file
+
+    The index is saved in the dataset EVENT_DATASET, replacing any previous
+    version. Columns missing from "time_series" are skipped. The parameter
+    "adc_range" has the same meaning as in "find_rail_hits". Return the
+    number of events.
+    '''
+
+    if EVENT_DATASET in h5_file:
+        del h5_file[EVENT_DATASET]
+
+    dataset = h5_file['time_series']
+    names = dataset.dtype.names or ()
+    events = [detect_events(dataset[x], x, adc_range) for x in columns if x in names]
+    events = np.concatenate(events) if events else np.zeros(0, dtype=EVENT_DATA_TYPE)
+
+    h5_file.create_dataset(EVENT_DATASET, data=events, maxshape=(None,),
+                           chunks=True, compression='gzip')
+    h5_file[EVENT_DATASET].attrs['algorithm_version'] = ALGORITHM_VERSION
+    h5_file[EVENT_DATASET].attrs['adc_range_adu'] = adc_range
+    return len(events)
+
+
+def read_event_index(h5_file):
+    '''Return the events saved by "write_event_index" as a list of dictionaries
+
+    Return None if the file has no index.'''
+
+    if EVENT_DATASET not in h5_file:
+        return None
+
+    return [{
+        'kind': x['kind'].decode('utf-8'),
+        'channel': x['channel'].decode('utf-8'),
+        'start': int(x['start']),
+        'stop': int(x['stop']),
+        'severity': float(x['severity']),
+    } for x in h5_file[EVENT_DATASET][...]]
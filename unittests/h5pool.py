@@ -0,0 +1,209 @@
+# -*- encoding: utf-8 -*-
+
+'''Pool of read-only HDF5 files shared by the views of a process
+
+Opening a HDF5 file requires parsing its metadata, and closing it throws away
+the chunk cache. Views which read windows of the same test over and over
+(e.g., a plot being zoomed) can instead ask this module for a handle:
+
+    with open_h5_file(cur_test.data_file.path) as h5_file:
+        ...
+
+Handles are kept open in a LRU pool, keyed by the path and the modification
+time of the file, so that a file replaced by another process is opened again.
+Code in this process which writes a HDF5 file must call "invalidate" before
+opening it, as HDF5 does not allow opening for writing a file which is
+already open. Handles are opened without the file lock of the HDF5 library
+(see "open_without_locking"), which would otherwise prevent every other
+process from writing the file as long as the handle is in the pool. The
+size of the pool and of the chunk cache of each file are
+set by H5_POOL_SIZE and H5_POOL_RDCC_NBYTES in the settings.
+'''
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+from .metrics import H5_POOL_REQUESTS
+
+# Get an instance of a logger
+LOGGER = logging.getLogger(__name__)
+
+# Protects the environment variable used by "open_without_locking"
+_LOCKING_ENV_LOCK = threading.Lock()
+
+
+def open_without_locking(file_name, mode='r', **kwargs):
+    '''Open a HDF5 file without taking the file lock of the HDF5 library
+
+    A reader holding the lock prevents other processes from opening the
+    file for writing. The keyword arguments are passed to "h5py.File".'''
+
+    import h5py
+
+    try:
+        return h5py.File(file_name, mode, locking=False, **kwargs)
+    except (TypeError, ValueError):
+        # h5py < 3.5, or a HDF5 library older than 1.10.7, does not accept
+        # "locking"; HDF5 reads the same setting from the environment
+        # whenever a file is opened
+        pass
+
+    with _LOCKING_ENV_LOCK:
+        old_value = os.environ.get('HDF5_USE_FILE_LOCKING')
+        os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+        try:
+            return h5py.File(file_name, mode, **kwargs)
+        finally:
+            if old_value is None:
+                del os.environ['HDF5_USE_FILE_LOCKING']
+            else:
+                os.environ['HDF5_USE_FILE_LOCKING'] = old_value
+
+
+class H5FilePool:
+    '''LRU pool of HDF5 files opened in read-only mode
+
+    Handles which are being used are never closed: if all of them are in use,
+    the pool can temporarily grow beyond "max_size".'''
+
+    def __init__(self, max_size, rdcc_nbytes):
+        self.max_size = max_size
+        self.rdcc_nbytes = rdcc_nbytes
+
+        # Keys are (path, mtime), values are lists [handle, number of users]
+        self.handles = OrderedDict()
+        # Handles which have been invalidated while in use
+        self.retired = []
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def acquire(self, file_name):
+        'Return a handle to "file_name"; call "release" when it is no longer needed'
+
+        path = os.path.abspath(file_name)
+        key = (path, os.stat(path).st_mtime_ns)
+        with self.lock:
+            entry = self.handles.get(key)
+            if entry:
+                self.hits += 1
+                H5_POOL_REQUESTS.inc(result='hit')
+                self.handles.move_to_end(key)
+            else:
+                self.misses += 1
+                H5_POOL_REQUESTS.inc(result='miss')
+                # Older versions of the same file are no longer useful
+                self._close_matching(lambda x: x[0] == path)
+                # SWMR mode allows reading files while samples are being
+                # appended to them (see "live.py")
+                entry = [open_without_locking(path, swmr=True,
+                                              rdcc_nbytes=self.rdcc_nbytes), 0]
+                self.handles[key] = entry
+                self._evict()
+
+            entry[1] += 1
+            return entry[0]
+
+    def release(self, handle):
+        'Tell the pool that a handle returned by "acquire" is no longer used'
+
+        with self.lock:
+            for entry in list(self.handles.values()) + self.retired:
+                if entry[0] is handle:
+                    entry[1] -= 1
+                    break
+
+            for entry in [x for x in self.retired if x[1] == 0]:
+                self.retired.remove(entry)
+                entry[0].close()
+
+            self._evict()
+
+    def invalidate(self, file_name=None):
+        '''Close the handles to "file_name" (or to every file, if None)
+
+        Handles which are being used are closed when they are released.'''
+
+        with self.lock:
+            if file_name is None:
+                self._close_matching(lambda x: True)
+            else:
+                path = os.path.abspath(file_name)
+                self._close_matching(lambda x: x[0] == path)
+
+    def stats(self):
+        'Return a dictionary with the hit/miss counters of the pool'
+
+        with self.lock:
+            return OrderedDict([
+                ('size', len(self.handles)),
+                ('max_size', self.max_size),
+                ('hits', self.hits),
+                ('misses', self.misses),
+                ('evictions', self.evictions),
+            ])
+
+    def _close_matching(self, condition):
+        for key in [x for x in self.handles.keys() if condition(x)]:
+            entry = self.handles.pop(key)
+            if entry[1] > 0:
+                LOGGER.debug('HDF5 file "%s" will be closed once released', key[0])
+                self.retired.append(entry)
+            else:
+                entry[0].close()
+
+    def _evict(self):
+        # Close the least recently used handles which are not being used
+        for key in list(self.handles.keys()):
+            if len(self.handles) <= self.max_size:
+                break
+
+            handle, num_of_users = self.handles[key]
+            if num_of_users == 0:
+                del self.handles[key]
+                handle.close()
+                self.evictions += 1
+
+
+# One pool per process: handles must not be shared with forked processes
+_POOL = None
+_POOL_PID = None
+
+
+def get_pool():
+    'Return the pool of HDF5 files of the current process'
+
+    global _POOL, _POOL_PID
+
+    if _POOL is None or _POOL_PID != os.getpid():
+        _POOL = H5FilePool(max_size=settings.H5_POOL_SIZE,
+                           rdcc_nbytes=settings.H5_POOL_RDCC_NBYTES)
+        _POOL_PID = os.getpid()
+
+    return _POOL
+
+
+@contextmanager
+def open_h5_file(file_name):
+    'Context manager returning a read-only handle to "file_name" from the pool'
+
+    pool = get_pool()
+    handle = pool.acquire(file_name)
+    try:
+        yield handle
+    finally:
+        pool.release(handle)
+
+
+def invalidate(file_name=None):
+    'Close the handles in the pool of this process for "file_name" (default: all)'
+
+    if _POOL is not None and _POOL_PID == os.getpid():
+        _POOL.invalidate(file_name)
@@ -0,0 +1,365 @@
+# -*- encoding: utf-8 -*-
+
+'''Access to HDF5 files through Django's storage API
+
+Data files are saved through the storage of the "data_file" field of
+PolarimeterTest (by default, the local filesystem under MEDIA_ROOT). The
+functions in this module accept either the path of a local file or an
+object with the attributes "name" and "storage", like a FieldFile or a
+"StoredFile":
+
+    with open_h5_file(cur_test.data_file) as h5_file:
+        ...
+
+Files in the local filesystem are opened directly, using the pool of
+handles in "h5pool.py". Files in other storages (e.g., an object store
+shared by several nodes) are read in blocks of HDF5_STORAGE_BLOCK_SIZE
+bytes, which are kept in a LRU cache of HDF5_STORAGE_CACHE_BYTES bytes in
+each process; reading a slice of a dataset therefore downloads only the
+blocks containing it and the metadata of the file. A storage can read
+blocks without downloading the whole object by implementing the method
+"read_range(name, offset, size)" (see "S3RangeReadMixin"); otherwise, blocks
+are read by seeking into the file returned by "storage.open".
+
+Blocks are identified by the name of the file and by its version, which is
+the value returned by "storage.file_version(name)" if the storage defines
+it, or the size and the modification time of the file. A file replaced by
+another node is therefore never read from stale blocks.
+
+Files are modified through "writable_h5_file", which downloads files from
+remote storages into a temporary file and uploads it under a new name at the
+end.
+'''
+
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+import io
+import logging
+import os
+from shutil import copyfileobj
+from tempfile import NamedTemporaryFile
+import threading
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from . import h5pool
+from .metrics import STORAGE_BLOCK_REQUESTS
+
+# Get an instance of a logger
+LOGGER = logging.getLogger(__name__)
+
+
+class StoredFile(namedtuple('StoredFile', ['name'])):
+    '''A file in the default storage, identified by its name
+
+    Unlike FieldFile objects, instances can be passed to other processes.'''
+
+    @property
+    def storage(self):
+        return default_storage
+
+
+class S3RangeReadMixin:
+    '''Mixin for the S3 storage of django-storages, reading ranges of objects
+
+    The default implementation of "storage.open" downloads the whole object.
+    To use the mixin, define a new storage class and set DEFAULT_FILE_STORAGE
+    to its full name:
+
+        from storages.backends.s3boto3 import S3Boto3Storage
+
+        class RangeS3Storage(S3RangeReadMixin, S3Boto3Storage):
+            pass
+    '''
+
+    def _object(self, name):
+        return self.bucket.Object(self._normalize_name(self._clean_name(name)))
+
+    def read_range(self, name, offset, size):
+        response = self._object(name).get(
+            Range='bytes={0}-{1}'.format(offset, offset + size - 1))
+        return response['Body'].read()
+
+    def file_version(self, name):
+        return self._object(name).e_tag
+
+
+def local_path(data_file):
+    'Return the path of "data_file" in the local filesystem, or None'
+
+    if isinstance(data_file, str):
+        return data_file
+
+    try:
+        return data_file.storage.path(data_file.name)
+    except NotImplementedError:
+        return None
+
+
+def file_version(data_file):
+    'Return a string which changes whenever the contents of "data_file" change'
+
+    path = local_path(data_file)
+    if path is not None:
+        file_stat = os.stat(path)
+        return '{0}:{1}'.format(file_stat.st_size, file_stat.st_mtime_ns)
+
+    storage = data_file.storage
+    if hasattr(storage, 'file_version'):
+        return str(storage.file_version(data_file.name))
+
+    try:
+        modified_time = storage.get_modified_time(data_file.name).timestamp()
+    except NotImplementedError:
+        modified_time = None
+    return '{0}:{1}'.format(storage.size(data_file.name), modified_time)
+
+
+def file_stat(data_file):
+    'Return a tuple (size, mtime) describing "data_file"'
+
+    path = local_path(data_file)
+    if path is not None:
+        result = os.stat(path)
+        return result.st_size, result.st_mtime
+
+    storage = data_file.storage
+    return (storage.size(data_file.name),
+            storage.get_modified_time(data_file.name).timestamp())
+
+
+def read_range(storage, name, offset, size):
+    'Read "size" bytes starting from "offset" from a file in "storage"'
+
+    if hasattr(storage, 'read_range'):
+        return storage.read_range(name, offset, size)
+
+    with storage.open(name, 'rb') as input_file:
+        input_file.seek(offset)
+        return input_file.read(size)
+
+
+class BlockCache:
+    '''LRU cache of the blocks of files read from remote storages
+
+    Keys are tuples (name, version, index of the block).'''
+
+    def __init__(self, max_bytes, block_size):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+
+        self.blocks = OrderedDict()
+        self.num_of_bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            data = self.blocks.get(key)
+            if data is None:
+                self.misses += 1
+                STORAGE_BLOCK_REQUESTS.inc(result='miss')
+            else:
+                self.hits += 1
+                STORAGE_BLOCK_REQUESTS.inc(result='hit')
+                self.blocks.move_to_end(key)
+
+            return data
+
+    def put(self, key, data):
+        with self.lock:
+            if key in self.blocks or len(data) > self.max_bytes:
+                return
+
+            self.blocks[key] = data
+            self.num_of_bytes += len(data)
+            while self.num_of_bytes > self.max_bytes:
+                _, old_data = self.blocks.popitem(last=False)
+                self.num_of_bytes -= len(old_data)
+
+    def invalidate(self, name=None):
+        'Remove the blocks of the file "name" (or of every file, if None)'
+
+        with self.lock:
+            for key in [x for x in self.blocks.keys() if name is None or x[0] == name]:
+                self.num_of_bytes -= len(self.blocks.pop(key))
+
+    def stats(self):
+        with self.lock:
+            return OrderedDict([
+                ('blocks', len(self.blocks)),
+                ('bytes', self.num_of_bytes),
+                ('max_bytes', self.max_bytes),
+                ('hits', self.hits),
+                ('misses', self.misses),
+            ])
+
+
+# One cache per process, created on first use
+_CACHE = None
+_CACHE_PID = None
+
+
+def get_cache():
+    'Return the cache of blocks of the current process'
+
+    global _CACHE, _CACHE_PID
+
+    if _CACHE is None or _CACHE_PID != os.getpid():
+        _CACHE = BlockCache(max_bytes=settings.HDF5_STORAGE_CACHE_BYTES,
+                            block_size=settings.HDF5_STORAGE_BLOCK_SIZE)
+        _CACHE_PID = os.getpid()
+
+    return _CACHE
+
+
+class StorageFile(io.RawIOBase):
+    '''Read-only file object reading a file in a storage through the block cache
+
+    h5py can open instances of this class like normal files.'''
+
+    def __init__(self, name, storage, cache=None):
+        super(StorageFile, self).__init__()
+        self.name = name
+        self.storage = storage
+        self.cache = cache or get_cache()
+        self.size = storage.size(name)
+        self.version = file_version(self)
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        else:
+            raise ValueError('invalid value for "whence": {0}'.format(whence))
+
+        return self.position
+
+    def read_block(self, index):
+        key = (self.name, self.version, index)
+        data = self.cache.get(key)
+        if data is None:
+            offset = index * self.cache.block_size
+            data = read_range(self.storage, self.name, offset,
+                              min(self.cache.block_size, self.size - offset))
+            self.cache.put(key, data)
+
+        return data
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        count = max(0, min(len(view), self.size - self.position))
+
+        done = 0
+        while done < count:
+            index, start = divmod(self.position + done, self.cache.block_size)
+            block = self.read_block(index)
+            length = min(count - done, len(block) - start)
+            view[done:done + length] = block[start:start + length]
+            done += length
+
+        self.position += count
+        return count
+
+
+@contextmanager
+def open_h5_file(data_file):
+    'Context manager returning a read-only HDF5 handle to "data_file"'
+
+    path = local_path(data_file)
+    if path is not None:
+        with h5pool.open_h5_file(path) as h5_file:
+            yield h5_file
+        return
+
+    import h5py
+
+    with StorageFile(data_file.name, data_file.storage) as input_file, \
+         h5py.File(input_file, 'r') as h5_file:
+        yield h5_file
+
+
+def invalidate(data_file):
+    'Forget the open handles and the cached blocks of "data_file"'
+
+    path = local_path(data_file)
+    if path is not None:
+        h5pool.invalidate(path)
+    else:
+        get_cache().invalidate(data_file.name)
+
+
+@contextmanager
+def local_copy(data_file):
+    '''Context manager returning the path of a local file with the contents of "data_file"
+
+    Files in remote storages are downloaded into a temporary file, which is
+    deleted at the end of the "with" block.'''
+
+    path = local_path(data_file)
+    if path is not None:
+        yield path
+        return
+
+    with NamedTemporaryFile(suffix='.h5', delete=False) as temporary_file, \
+         data_file.storage.open(data_file.name, 'rb') as input_file:
+        copyfileobj(input_file, temporary_file)
+
+    try:
+        yield temporary_file.name
+    finally:
+        os.remove(temporary_file.name)
+
+
+@contextmanager
+def writable_h5_file(data_file):
+    '''Context manager returning the path of "data_file", to be modified
+
+    Files in remote storages are downloaded into a temporary file, which is
+    uploaded under a new name if the "with" block completes without errors.
+    In this case "data_file" must be a FieldFile: it is pointed to the new
+    file, the row of its model is updated, and only then the original file
+    is deleted. Readers therefore always find a complete file.'''
+
+    if local_path(data_file) is None and getattr(data_file, 'instance', None) is None:
+        raise TypeError('"{0}" is not bound to a model, unable to rename it'
+                        .format(data_file.name))
+
+    invalidate(data_file)
+    with local_copy(data_file) as path:
+        yield path
+
+        if local_path(data_file) is None:
+            storage = data_file.storage
+            old_name = data_file.name
+            with open(path, 'rb') as input_file:
+                # The name is already taken, so the storage picks a new one
+                new_name = storage.save(old_name, File(input_file))
+
+            instance = data_file.instance
+            data_file.name = new_name
+            if instance.pk is not None:
+                type(instance)._default_manager.filter(pk=instance.pk).update(
+                    **{data_file.field.attname: new_name})
+
+            invalidate(StoredFile(old_name))
+            storage.delete(old_name)
+            LOGGER.debug('file "%s" uploaded again to the storage as "%s"',
+                         old_name, new_name)
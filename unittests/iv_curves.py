@@ -0,0 +1,295 @@
+# -*- encoding: utf-8 -*-
+
+'''Analysis of the I-V curves acquired with Keithley machines
+
+The converter of ZIP files (see "file_conversions.py") saves each set of
+Keithley measurements as a 2D dataset, with one column per block: e.g., an
+Id/Vd dataset contains one curve for each value of the gate voltage, which
+is recorded in the "fixed_*" attributes of the dataset. This module fits all
+the blocks of a dataset at once:
+
+- HEMT Id/Vd curves (IDVD): output conductance in saturation and drain current
+  at the largest drain voltage;
+- HEMT Id/Vg curves (IDVG): transconductance and pinch-off voltage;
+- forward curves of diodes (IFVF, both detectors and phase switches):
+  ideality factor and saturation current of the Shockley equation;
+- reverse curves of phase switches (IRVR): leakage current and reverse
+  resistance.
+
+Currents are taken in absolute value, as the two Keithley machines used in
+the tests follow different sign conventions.
+
+The functions in this module do not access the database, so that they can
+be run in a pool of processes (see "batch.py").
+'''
+
+from collections import OrderedDict
+from datetime import date
+import logging
+
+import h5py
+import numpy as np
+
+from .spectra import to_json_float
+
+# Increase this whenever a change in the code changes the results
+ALGORITHM_VERSION = '1.0'
+
+# Thermal voltage kT/q at room temperature, in V
+THERMAL_VOLTAGE_V = 0.025852
+
+# Fraction of the drain voltage range where the HEMT is assumed to be saturated
+SATURATION_FRACTION = 0.5
+
+# Forward currents below this fraction of the maximum are not used to fit the
+# Shockley equation, as they are dominated by noise
+MIN_FORWARD_CURRENT_FRACTION = 0.01
+
+# Names of the columns containing the current and the voltage of each curve
+CURVE_COLUMNS = OrderedDict([
+    ('IDVD', ('DrainI', 'DrainV')),
+    ('IDVG', ('DrainI', 'GateV')),
+    ('IFVF', (('BaseI', 'AnodeI'), ('BaseV', 'AnodeV'))),
+    ('IRVR', (('BaseI', 'AnodeI'), ('BaseV', 'AnodeV'))),
+])
+
+# Get an instance of a logger
+LOGGER = logging.getLogger(__name__)
+
+
+def masked_linear_fit(x, y, mask):
+    '''Fit y = a + b x on each column of the 2D arrays "x" and "y"
+
+    Only the elements where "mask" is true are used. Return a tuple (a, b)
+    of arrays with one element per column; columns with less than two
+    usable points produce NaN.'''
+
+    weights = mask.astype(np.float64)
+    x = np.where(mask, x, 0.0)
+    y = np.where(mask, y, 0.0)
+
+    num = weights.sum(axis=0)
+    sum_x = x.sum(axis=0)
+    sum_y = y.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        det = num * (x * x).sum(axis=0) - sum_x ** 2
+        slope = (num * (x * y).sum(axis=0) - sum_x * sum_y) / det
+        intercept = (sum_y - slope * sum_x) / num
+
+    slope[num < 2] = np.nan
+    intercept[num < 2] = np.nan
+    return intercept, slope
+
+
+def fit_idvd(current, voltage):
+    'Return the output conductance (S) and the maximum drain current (A) of each block'
+
+    max_voltage = np.nanmax(voltage, axis=0)
+    saturated = np.isfinite(current) & \
+        (voltage >= SATURATION_FRACTION * max_voltage[np.newaxis, :])
+    _, conductance = masked_linear_fit(voltage, current, saturated)
+
+    # Current at the largest drain voltage
+    last_idx = np.nanargmax(voltage, axis=0)
+    drain_current = current[last_idx, np.arange(current.shape[1])]
+
+    return OrderedDict([
+        ('output_conductance_S', conductance),
+        ('drain_current_A', drain_current),
+    ])
+
+
+def fit_idvg(current, voltage):
+    '''Return the transconductance (S) and the pinch-off voltage (V) of each block
+
+    The transconductance is the maximum of dI/dV. The pinch-off voltage is
+    the voltage where the tangent at that point crosses I = 0.'''
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        derivative = np.gradient(current, axis=0) / np.gradient(voltage, axis=0)
+    derivative[~np.isfinite(derivative)] = -np.inf
+
+    max_idx = np.argmax(derivative, axis=0)
+    columns = np.arange(current.shape[1])
+    transconductance = derivative[max_idx, columns]
+    transconductance[~np.isfinite(transconductance)] = np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pinch_off = voltage[max_idx, columns] - \
+            current[max_idx, columns] / transconductance
+
+    return OrderedDict([
+        ('transconductance_S', transconductance),
+        ('pinch_off_V', pinch_off),
+    ])
+
+
+def fit_ifvf(current, voltage):
+    '''Fit the Shockley equation I = I_s exp(V / (n V_t)) to each block
+
+    Return the ideality factor n, the saturation current I_s (A), and the
+    forward voltage (V) at the largest current.'''
+
+    max_current = np.nanmax(current, axis=0)
+    usable = np.isfinite(current) & \
+        (current > MIN_FORWARD_CURRENT_FRACTION * max_current[np.newaxis, :])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_current = np.log(current)
+    intercept, slope = masked_linear_fit(voltage, log_current, usable)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ideality = 1.0 / (slope * THERMAL_VOLTAGE_V)
+    last_idx = np.nanargmax(current, axis=0)
+
+    return OrderedDict([
+        ('ideality_factor', ideality),
+        ('saturation_current_A', np.exp(intercept)),
+        ('forward_voltage_V', voltage[last_idx, np.arange(current.shape[1])]),
+    ])
+
+
+def fit_irvr(current, voltage):
+    'Return the leakage current (A) and the reverse resistance (ohm) of each block'
+
+    _, slope = masked_linear_fit(voltage, current, np.isfinite(current))
+    first_idx = np.nanargmax(np.abs(voltage), axis=0)
+
+    with np.errstate(divide='ignore'):
+        resistance = 1.0 / np.abs(slope)
+
+    return OrderedDict([
+        ('leakage_current_A', current[first_idx, np.arange(current.shape[1])]),
+        ('reverse_resistance_ohm', resistance),
+    ])
+
+
+CURVE_FIT_FUNCTIONS = {
+    'IDVD': fit_idvd,
+    'IDVG': fit_idvg,
+    'IFVF': fit_ifvf,
+    'IRVR': fit_irvr,
+}
+
+
+def summarize_idvd(blocks):
+    # The drain current is most relevant for the block with the largest
+    # current, while the output conductance is similar for all the blocks
+    return OrderedDict([
+        ('output_conductance_S', np.nanmedian(blocks['output_conductance_S'])),
+        ('drain_current_A', np.nanmax(blocks['drain_current_A'])),
+    ])
+
+
+def summarize_idvg(blocks):
+    # Use the block where the HEMT has the largest gain
+    best = np.nanargmax(blocks['transconductance_S'])
+    return OrderedDict([(key, value[best]) for key, value in blocks.items()])
+
+
+def summarize_by_median(blocks):
+    return OrderedDict([(key, np.nanmedian(value)) for key, value in blocks.items()])
+
+
+CURVE_SUMMARY_FUNCTIONS = {
+    'IDVD': summarize_idvd,
+    'IDVG': summarize_idvg,
+    'IFVF': summarize_by_median,
+    'IRVR': summarize_by_median,
+}
+
+
+def find_column(names, candidates):
+    'Return the first name in "candidates" (a string or a tuple) which is in "names"'
+
+    if isinstance(candidates, str):
+        candidates = (candidates,)
+
+    for cur_name in candidates:
+        if cur_name in names:
+            return cur_name
+
+    return None
+
+
+def analyse_iv_dataset(dataset, curve):
+    '''Fit all the blocks of a I-V dataset
+
+    Return a JSON record containing the parameters of each block and their
+    summary, or None if the dataset does not contain the expected columns.
+    '''
+
+    current_candidates, voltage_candidates = CURVE_COLUMNS[curve]
+    names = dataset.dtype.names or ()
+    current_column = find_column(names, current_candidates)
+    voltage_column = find_column(names, voltage_candidates)
+    if not current_column or not voltage_column or dataset.ndim != 2:
+        return None
+
+    data = dataset[...]
+    current = np.abs(data[current_column].astype(np.float64))
+    voltage = data[voltage_column].astype(np.float64)
+
+    # Blocks made only of NaNs cannot be fitted
+    valid = np.any(np.isfinite(current) & np.isfinite(voltage), axis=0)
+    if not np.any(valid):
+        return None
+    current, voltage = current[:, valid], voltage[:, valid]
+
+    with np.errstate(invalid='ignore'):
+        blocks = CURVE_FIT_FUNCTIONS[curve](current, voltage)
+
+    fixed_column = dataset.attrs.get('fixed_value')
+    if isinstance(fixed_column, bytes):
+        fixed_column = fixed_column.decode('utf-8')
+
+    result = OrderedDict([
+        ('current_column', current_column),
+        ('voltage_column', voltage_column),
+        ('fixed_column', fixed_column),
+        ('num_of_blocks', int(current.shape[1])),
+    ])
+    if fixed_column in names:
+        fixed_values = data[fixed_column][:, valid].astype(np.float64)
+        result['fixed_values'] = [to_json_float(x) for x in np.nanmean(fixed_values, axis=0)]
+
+    with np.errstate(invalid='ignore'):
+        summary = CURVE_SUMMARY_FUNCTIONS[curve](blocks)
+    for key, value in summary.items():
+        result[key] = to_json_float(value)
+
+    result['blocks'] = OrderedDict([
+        (key, [to_json_float(x) for x in value]) for key, value in blocks.items()])
+    return result
+
+
+def compute_iv_analysis(h5_file_name):
+    '''Analyse every I-V dataset in a HDF5 file
+
+    Datasets are named "COMPONENT/CURVE" (e.g. "HA1/IDVG"). Return a list of
+    JSON records, each containing the keys "component" and "curve", or None
+    if the file does not contain I-V curves.
+    '''
+
+    result = []
+    with h5py.File(h5_file_name, 'r') as h5_file:
+        for component in sorted(h5_file.keys()):
+            group = h5_file[component]
+            if not isinstance(group, h5py.Group):
+                continue
+
+            for curve in CURVE_COLUMNS.keys():
+                if curve not in group:
+                    continue
+
+                record = analyse_iv_dataset(group[curve], curve)
+                if record is None:
+                    LOGGER.debug('unable to analyse dataset %s/%s in "%s"',
+                                 component, curve, h5_file_name)
+                    continue
+
+                record['component'] = component
+                record['curve'] = curve
+                record['code_version'] = ALGORITHM_VERSION
+                record['analysis_date'] = date.today().strftime('%Y-%m-%d')
+                result.append(record)
+
+    return result or None
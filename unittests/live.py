@@ -0,0 +1,203 @@
+# -*- encoding: utf-8 -*-
+
+'''Append samples to the HDF5 file of a test while the acquisition is running
+
+The HDF5 files of tests acquired "live" are created with the latest version
+of the file format, and all their datasets are resizable. Every time a new
+block of samples is received, the file is opened in single-writer/multiple-
+reader (SWMR) mode, so that processes reading the file (e.g., the views
+showing the test) always see consistent data, and the following objects are
+updated incrementally:
+
+- "time_series", which is extended with the new samples;
+- the I, Q, U streams in DERIVED_GROUP (only the last incomplete blocks of
+  the decimated streams are computed again);
+- the index of phb/record segments;
+- the dataset STATISTICS_DATASET, containing running sums from which mean,
+  standard deviation, minimum and maximum of each DEM/PWR output are computed.
+
+Readers must open live files without the file lock of the HDF5 library, as
+the pool in "h5pool.py" does: a reader holding the lock would make every
+append done by another process fail as long as it keeps the file open.
+
+The index of glitches and the hash of the samples need the whole time
+series, and they are built when the acquisition is marked as complete (see
+"finish_live_file").
+'''
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import logging
+
+import fcntl
+import numpy as np
+
+from .file_conversions import (
+    DEM_COLUMNS,
+    PWR_COLUMNS,
+    SAMPLING_FREQUENCY,
+    TIME_SERIES_DATA_TYPE,
+    extend_derived_streams,
+    extend_segment_index,
+    write_derived_streams,
+    write_samples_hash,
+    write_segment_index,
+)
+from .glitches import write_event_index
+
+# Name of the dataset containing the running statistics of the outputs
+STATISTICS_DATASET = 'statistics'
+STATISTICS_DATA_TYPE = np.dtype([
+    ('column', 'S16'),
+    ('count', np.int64),
+    ('sum', np.float64),
+    ('sum2', np.float64),
+    ('min', np.float64),
+    ('max', np.float64),
+])
+
+# Number of samples in each chunk of the time series
+LIVE_CHUNK_SAMPLES = 4096
+
+# Get an instance of a logger
+LOGGER = logging.getLogger(__name__)
+
+
+@contextmanager
+def locked_file(file_name):
+    'Context manager which prevents two processes from writing "file_name" at once'
+
+    with open(file_name + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def is_live_file(h5_file):
+    'Return True if "h5_file" has been created by "create_live_file"'
+    return bool(h5_file.attrs.get('live', False))
+
+
+def create_live_file(file_name, pwr_offsets=None):
+    '''Create an empty HDF5 file where samples can be appended
+
+    The parameter "pwr_offsets" has the same meaning as in
+    "write_derived_streams".'''
+
+    import h5py
+
+    with h5py.File(file_name, 'w', libver='latest') as h5_file:
+        h5_file.attrs['live'] = True
+        h5_file.create_dataset('time_series', (0,), maxshape=(None,),
+                               dtype=TIME_SERIES_DATA_TYPE,
+                               chunks=(LIVE_CHUNK_SAMPLES,),
+                               compression='gzip', shuffle=True)
+
+        write_derived_streams(h5_file, pwr_offsets)
+        write_segment_index(h5_file)
+
+        statistics = np.zeros(len(DEM_COLUMNS + PWR_COLUMNS), dtype=STATISTICS_DATA_TYPE)
+        statistics['column'] = DEM_COLUMNS + PWR_COLUMNS
+        statistics['min'] = np.inf
+        statistics['max'] = -np.inf
+        h5_file.create_dataset(STATISTICS_DATASET, data=statistics)
+
+
+def update_statistics(h5_file, samples):
+    'Add the values in "samples" to the running statistics'
+
+    dataset = h5_file[STATISTICS_DATASET]
+    statistics = dataset[...]
+    for idx, name in enumerate(statistics['column']):
+        values = samples[name.decode('utf-8')].astype(np.float64)
+        statistics['count'][idx] += len(values)
+        statistics['sum'][idx] += values.sum()
+        statistics['sum2'][idx] += np.sum(values ** 2)
+        statistics['min'][idx] = min(statistics['min'][idx], values.min())
+        statistics['max'][idx] = max(statistics['max'][idx], values.max())
+
+    dataset[...] = statistics
+
+
+def read_statistics(h5_file):
+    '''Return the running statistics of a live file as a dictionary
+
+    Return None if the file has no statistics.'''
+
+    if STATISTICS_DATASET not in h5_file:
+        return None
+
+    result = OrderedDict()
+    for row in h5_file[STATISTICS_DATASET][...]:
+        count = int(row['count'])
+        if count:
+            mean = row['sum'] / count
+            std = np.sqrt(max(row['sum2'] / count - mean ** 2, 0.0))
+            values = (count, float(mean), float(std), float(row['min']), float(row['max']))
+        else:
+            values = (0, None, None, None, None)
+
+        result[row['column'].decode('utf-8')] = OrderedDict(
+            zip(('count', 'mean', 'std', 'min', 'max'), values))
+
+    return result
+
+
+def append_samples(file_name, samples):
+    '''Append a block of samples to a file created by "create_live_file"
+
+    The parameter "samples" must be a NumPy array of type
+    TIME_SERIES_DATA_TYPE; its column "time_s" is computed from the position
+    of the samples. Return the number of samples in the file. Raise
+    ValueError if the file was not created by "create_live_file".
+    '''
+
+    import h5py
+
+    with locked_file(file_name):
+        with h5py.File(file_name, 'r+', libver='latest') as h5_file:
+            if not is_live_file(h5_file):
+                raise ValueError('file "{0}" does not accept new samples'
+                                 .format(file_name))
+
+            # From now on, readers using SWMR see the file in a consistent state
+            h5_file.swmr_mode = True
+
+            time_series = h5_file['time_series']
+            start = time_series.shape[0]
+            stop = start + len(samples)
+            if not len(samples):
+                return start
+
+            samples = np.array(samples, dtype=TIME_SERIES_DATA_TYPE)
+            samples['time_s'] = np.arange(start, stop) / SAMPLING_FREQUENCY
+
+            time_series.resize((stop,))
+            time_series[start:stop] = samples
+            time_series.flush()
+
+            extend_derived_streams(h5_file, start)
+            extend_segment_index(h5_file, start)
+            update_statistics(h5_file, samples)
+            h5_file.flush()
+
+            LOGGER.debug('%d samples appended to "%s", which now contains %d samples',
+                         len(samples), file_name, stop)
+            return stop
+
+
+def finish_live_file(file_name):
+    '''Mark the acquisition saved in a live file as complete
+
+    The index of glitches and the hash of the samples are built, and no
+    more samples can be appended. Return the number of glitches found.'''
+
+    import h5py
+
+    with locked_file(file_name):
+        with h5py.File(file_name, 'r+', libver='latest') as h5_file:
+            h5_file.attrs['live'] = False
+            write_samples_hash(h5_file)
+            return write_event_index(h5_file, DEM_COLUMNS + PWR_COLUMNS)
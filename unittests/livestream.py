@@ -0,0 +1,262 @@
+# -*- encoding: utf-8 -*-
+
+'''Stream the samples of a test to browsers while it is being acquired
+
+The view "TestLiveStream" sends new samples of the PWR outputs as
+server-sent events (SSE). Samples are decimated by averaging blocks of
+consecutive samples, and each event contains only the blocks which the
+client has not received yet; its "id" is the index of the next block, so
+that a browser reconnecting with the header "Last-Event-ID" resumes from
+where it stopped.
+
+All the clients of this process watching the same test share one
+"LiveStreamReader": only one of them at a time polls the HDF5 file, and it
+reads just the samples appended since the last poll. The others wait for
+the new blocks to be available. Readers are forgotten as soon as no client
+uses them; a new reader starts from the first block needed by its first
+client, and it reads older blocks only if another client asks for them.
+'''
+
+from base64 import b64encode
+from collections import OrderedDict
+from functools import partial
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from .file_conversions import PWR_COLUMNS
+from .h5pool import open_h5_file
+from .live import is_live_file
+from .timing import count_hdf5_bytes
+
+# Columns sent to the clients
+STREAM_COLUMNS = ('time_s',) + tuple(PWR_COLUMNS)
+STREAM_DATA_TYPE = np.dtype([(x, np.float64) for x in STREAM_COLUMNS])
+
+# Get an instance of a logger
+LOGGER = logging.getLogger(__name__)
+
+
+def decimate_samples(samples, decimation):
+    '''Average blocks of "decimation" consecutive samples
+
+    The last block can be shorter. Return a NumPy array of type
+    STREAM_DATA_TYPE.'''
+
+    block_starts = np.arange(0, len(samples), decimation)
+    block_lengths = np.diff(np.append(block_starts, len(samples)))
+    result = np.empty(len(block_starts), dtype=STREAM_DATA_TYPE)
+    if len(samples):
+        for column in STREAM_COLUMNS:
+            result[column] = np.add.reduceat(samples[column].astype(np.float64),
+                                             block_starts) / block_lengths
+
+    return result
+
+
+class LiveStreamReader:
+    '''Read the decimated PWR outputs of a growing HDF5 file
+
+    The last "max_blocks" decimated samples are kept in memory, starting
+    from the block "first_block". While the acquisition is running, only
+    complete blocks are read; once it is finished, the last (shorter) block
+    is read too, and the reader is marked as finished.'''
+
+    def __init__(self, file_name, decimation, poll_interval=1.0, max_blocks=10000,
+                 first_block=0):
+        self.file_name = file_name
+        self.decimation = decimation
+        self.poll_interval = poll_interval
+        self.max_blocks = max_blocks
+
+        # Index of the first block in "self.blocks"
+        self.first_block = first_block
+        self.blocks = np.zeros(0, dtype=STREAM_DATA_TYPE)
+        self.finished = False
+
+        self.condition = threading.Condition()
+        self.polling = False
+        self.last_poll = 0.0
+        self.num_of_polls = 0
+
+    @property
+    def num_of_blocks(self):
+        'Number of blocks read so far'
+        return self.first_block + len(self.blocks)
+
+    def _read_blocks(self, first_sample, last_sample=None):
+        '''Read the blocks of samples in [first_sample, last_sample)
+
+        If "last_sample" is None, read up to the end of the file. Return a
+        tuple (blocks, finished).'''
+
+        with open_h5_file(self.file_name) as h5_file:
+            finished = not is_live_file(h5_file)
+            time_series = h5_file['time_series']
+            num_of_samples = time_series.shape[0]
+            if not finished:
+                num_of_samples -= num_of_samples % self.decimation
+            if last_sample is not None:
+                num_of_samples = min(num_of_samples, last_sample)
+
+            if num_of_samples <= first_sample:
+                return np.zeros(0, dtype=STREAM_DATA_TYPE), finished
+
+            samples = time_series[(slice(first_sample, num_of_samples),) + STREAM_COLUMNS]
+            count_hdf5_bytes(read=samples.nbytes)
+
+        return decimate_samples(samples, self.decimation), finished
+
+    def _poll(self, function):
+        '''Call "function" while the other threads wait, and return its result
+
+        This thread reads the file on behalf of all the clients; the others
+        can still get the blocks already read. The condition must be held.'''
+
+        self.polling = True
+        self.condition.release()
+        try:
+            return function()
+        finally:
+            self.condition.acquire()
+            self.polling = False
+            self.condition.notify_all()
+
+    def _trim_blocks(self):
+        # Keep only the last "max_blocks" blocks in memory
+        if len(self.blocks) > self.max_blocks:
+            self.first_block += len(self.blocks) - self.max_blocks
+            self.blocks = self.blocks[-self.max_blocks:]
+
+    def _add_blocks(self, new_blocks, finished):
+        self.blocks = np.concatenate([self.blocks, new_blocks])
+        self._trim_blocks()
+
+        self.finished = finished
+        self.last_poll = time.time()
+        self.num_of_polls += 1
+
+    def wait(self, first, timeout):
+        '''Return the blocks starting from index "first"
+
+        If no such block is available, wait until one is read from the file
+        or "timeout" seconds have passed. Return a tuple (index of the first
+        block, blocks); the index is larger than "first" if the blocks
+        before it are no longer in memory.'''
+
+        deadline = time.time() + timeout
+        older_blocks_read = False
+        with self.condition:
+            while True:
+                now = time.time()
+
+                # A client which started later than the others (or which
+                # reconnected) might need blocks older than those in memory
+                start = max(first, self.num_of_blocks - self.max_blocks)
+                if start < self.first_block and not older_blocks_read:
+                    if not self.polling:
+                        stop = self.first_block
+                        old_blocks, _ = self._poll(partial(
+                            self._read_blocks, start * self.decimation,
+                            stop * self.decimation))
+                        self.blocks = np.concatenate([old_blocks, self.blocks])
+                        self.first_block = stop - len(old_blocks)
+                        self._trim_blocks()
+                        older_blocks_read = True
+                        continue
+                elif self.num_of_blocks > first or self.finished:
+                    break
+
+                if now >= deadline:
+                    break
+
+                next_poll = self.last_poll + self.poll_interval
+                if self.polling or now < next_poll:
+                    self.condition.wait(min(deadline, max(next_poll, now + 0.01)) - now)
+                    continue
+
+                first_sample = self.num_of_blocks * self.decimation
+                new_blocks, finished = self._poll(partial(self._read_blocks, first_sample))
+                self._add_blocks(new_blocks, finished)
+
+            first = max(first, self.first_block)
+            return first, self.blocks[first - self.first_block:][:self.max_blocks]
+
+
+# Readers shared by the clients of this process, indexed by (path, decimation)
+_READERS = weakref.WeakValueDictionary()
+_READERS_LOCK = threading.Lock()
+
+
+def get_reader(file_name, decimation, poll_interval=1.0, first=0):
+    '''Return the reader shared by all the clients streaming "file_name"
+
+    If no client is using a reader, a new one is created, which starts from
+    the block "first".'''
+
+    key = (os.path.abspath(file_name), decimation)
+    with _READERS_LOCK:
+        reader = _READERS.get(key)
+        if reader is None:
+            reader = LiveStreamReader(key[0], decimation, poll_interval,
+                                      first_block=first)
+            _READERS[key] = reader
+
+        return reader
+
+
+def format_event(event, data, event_id=None):
+    'Format a server-sent event'
+
+    lines = []
+    if event_id is not None:
+        lines.append('id: {0}'.format(event_id))
+    lines.append('event: {0}'.format(event))
+    lines.append('data: {0}'.format(json.dumps(data, separators=(',', ':'))))
+    return '\n'.join(lines) + '\n\n'
+
+
+def encode_blocks(first, blocks, encoding='json'):
+    '''Convert decimated samples into the payload of a "samples" event
+
+    If "encoding" is "base64", each column is sent as the Base64 encoding of
+    its little-endian 32-bit floating point values (the time as 64-bit
+    values), which is about three times smaller than JSON.'''
+
+    result = OrderedDict([('first', first), ('encoding', encoding)])
+    for column in STREAM_COLUMNS:
+        if encoding == 'base64':
+            data_type = '<f8' if column == 'time_s' else '<f4'
+            result[column] = b64encode(blocks[column].astype(data_type).tobytes()).decode('ascii')
+        else:
+            result[column] = [round(float(x), 6) for x in blocks[column]]
+
+    return result
+
+
+def stream_events(reader, first, encoding='json', max_duration=60.0, keepalive=15.0):
+    '''Yield the server-sent events for a client which has received "first" blocks
+
+    The stream ends when the acquisition is complete (with an "end" event)
+    or after "max_duration" seconds; in the latter case, browsers reconnect
+    automatically. A comment is sent every "keepalive" seconds without new
+    samples, so that proxies do not close the connection.'''
+
+    deadline = time.time() + max_duration
+    yield 'retry: {0}\n\n'.format(int(reader.poll_interval * 1000))
+    while time.time() < deadline:
+        first, blocks = reader.wait(first, timeout=min(keepalive, deadline - time.time()))
+        if len(blocks):
+            first += len(blocks)
+            yield format_event('samples', encode_blocks(first - len(blocks), blocks, encoding),
+                               event_id=first)
+        elif reader.finished:
+            yield format_event('end', {'num_of_blocks': first})
+            return
+        else:
+            yield ': keepalive\n\n'
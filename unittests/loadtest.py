@@ -0,0 +1,401 @@
+# -*- encoding: utf-8 -*-
+
+'''Load tests of the web pages and of the REST API
+
+A traffic profile is a dictionary which can be saved in JSON:
+
+    {
+        "description": "Reviewers browsing the list of tests",
+        "clients": 20,
+        "duration_s": 60,
+        "warmup_s": 5,
+        "think_time_s": 0.5,
+        "test_query": {"cryogenic": "true"},
+        "requests": [
+            {"name": "test_list", "path": "/unittests/", "weight": 1},
+            {"name": "test_json", "path": "/unittests/tests/{test_id}/json/", "weight": 3}
+        ]
+    }
+
+Each of the "clients" runs in its own thread and keeps sending requests
+until "duration_s" seconds have passed, waiting a random time (exponentially
+distributed with mean "think_time_s") between them. Every request is chosen
+at random from "requests", with probability proportional to its weight; the
+placeholder "{test_id}" in the path is replaced by the ID of a random test
+among those returned by the REST API (see "discover_test_ids"), filtered by
+the parameters in "test_query". The random generators are seeded, so that
+a scenario can be reproduced. Requests completed during the first
+"warmup_s" seconds are not included in the report.
+
+A request fails if the connection fails or the status code is not 2xx. The
+report (see "summarize_samples") contains the throughput, the percentiles of
+the latency and the error rate of each kind of request and of the total.
+'''
+
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import http.client
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+from tempfile import TemporaryFile
+import time
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+
+# Get an instance of a logger
+LOGGER = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 99)
+
+# Profiles which can be used without writing a JSON file
+PROFILES = OrderedDict([
+    ('dashboard', {
+        'description': 'Reviewers browsing the web pages',
+        'clients': 20,
+        'duration_s': 60,
+        'warmup_s': 5,
+        'think_time_s': 1.0,
+        'requests': [
+            {'name': 'test_list', 'path': '/unittests/', 'weight': 2},
+            {'name': 'test_details', 'path': '/unittests/tests/{test_id}/', 'weight': 3},
+            {'name': 'test_details_json', 'path': '/unittests/tests/{test_id}/json/',
+             'weight': 3},
+            {'name': 'tnoise_list', 'path': '/unittests/tnoise/', 'weight': 1},
+            {'name': 'bandpass_list', 'path': '/unittests/bandpass/', 'weight': 1},
+            {'name': 'spectrum_list', 'path': '/unittests/spectrum/', 'weight': 1},
+        ],
+    }),
+    ('api', {
+        'description': 'Scripts and plots querying the REST API',
+        'clients': 50,
+        'duration_s': 60,
+        'warmup_s': 5,
+        'think_time_s': 0.1,
+        'requests': [
+            {'name': 'api_tests', 'path': '/unittests/api/tests/?limit=100', 'weight': 2},
+            {'name': 'api_tnoise', 'path': '/unittests/api/tnoise/', 'weight': 1},
+            {'name': 'api_bandpass', 'path': '/unittests/api/bandpass/', 'weight': 1},
+            {'name': 'api_spectrum', 'path': '/unittests/api/spectrum/', 'weight': 1},
+            {'name': 'api_time_series',
+             'path': '/unittests/api/tests/{test_id}/time_series/?columns=pwr_Q1_ADU&to_s=60',
+             'weight': 2},
+            {'name': 'api_derived', 'path': '/unittests/api/tests/{test_id}/derived/',
+             'weight': 2},
+            {'name': 'api_segments', 'path': '/unittests/api/tests/{test_id}/segments/',
+             'weight': 1},
+        ],
+    }),
+    ('downloads', {
+        'description': 'Users downloading data files and plots',
+        'clients': 5,
+        'duration_s': 60,
+        'warmup_s': 0,
+        'think_time_s': 2.0,
+        'requests': [
+            {'name': 'download', 'path': '/unittests/tests/{test_id}/download/', 'weight': 1},
+            {'name': 'plot', 'path': '/unittests/tests/{test_id}/plot/', 'weight': 1},
+        ],
+    }),
+])
+
+# Outcome of one request; "start" is in seconds since the beginning of the test
+Sample = namedtuple('Sample', ['name', 'start', 'latency', 'status', 'num_of_bytes', 'error'])
+
+
+def validate_profile(profile):
+    '''Check that a profile is well formed, filling missing keys with defaults
+
+    Return a new dictionary; raise ValueError if the profile is invalid.'''
+
+    result = OrderedDict([
+        ('description', ''),
+        ('clients', 10),
+        ('duration_s', 30.0),
+        ('warmup_s', 0.0),
+        ('think_time_s', 0.0),
+        ('test_query', {}),
+        ('requests', []),
+    ])
+    unknown_keys = set(profile.keys()) - set(result.keys())
+    if unknown_keys:
+        raise ValueError('unknown key(s) in profile: {0}'.format(', '.join(sorted(unknown_keys))))
+    result.update(profile)
+
+    if int(result['clients']) < 1:
+        raise ValueError('the number of clients must be positive')
+    if float(result['duration_s']) <= float(result['warmup_s']):
+        raise ValueError('the duration must be longer than the warm-up time')
+    if not result['requests']:
+        raise ValueError('the profile does not contain any request')
+
+    for cur_request in result['requests']:
+        if 'name' not in cur_request or 'path' not in cur_request:
+            raise ValueError('every request must have a name and a path')
+        if not cur_request['path'].startswith('/'):
+            raise ValueError('path "{0}" does not start with "/"'.format(cur_request['path']))
+        if cur_request.get('weight', 1) <= 0:
+            raise ValueError('the weight of request "{0}" is not positive'
+                             .format(cur_request['name']))
+
+    return result
+
+
+def load_profiles(file_name=None):
+    '''Return the dictionary of the available profiles
+
+    The profiles in PROFILES are extended (or replaced) by those in the JSON
+    file "file_name", which must contain an object mapping names to profiles.'''
+
+    profiles = OrderedDict(PROFILES)
+    if file_name:
+        with open(file_name, 'rt') as input_file:
+            profiles.update(json.load(input_file, object_pairs_hook=OrderedDict))
+
+    return OrderedDict([(name, validate_profile(profile))
+                        for name, profile in profiles.items()])
+
+
+class Connection:
+    'HTTP connection to the server, which is kept alive between requests'
+
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        self.connection_class = (http.client.HTTPSConnection if parts.scheme == 'https'
+                                 else http.client.HTTPConnection)
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.connection = None
+
+    def get(self, path):
+        'Send a GET request and return a tuple (status, body)'
+
+        if self.connection is None:
+            self.connection = self.connection_class(self.netloc, timeout=self.timeout)
+
+        try:
+            self.connection.request('GET', self.prefix + path)
+            response = self.connection.getresponse()
+            body = response.read()
+        except Exception:
+            # The connection is in an unknown state: open a new one next time
+            self.close()
+            raise
+
+        if response.will_close:
+            self.close()
+
+        return response.status, body
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def discover_test_ids(base_url, query=None, max_tests=1000, timeout=30.0):
+    '''Return the IDs of the tests matching "query", using the REST API
+
+    "query" is a dictionary of parameters of the "api/tests" endpoint.'''
+
+    params = OrderedDict(query or {})
+    params['fields'] = 'id'
+    params['limit'] = max_tests
+    connection = Connection(base_url, timeout)
+    try:
+        status, body = connection.get('/unittests/api/tests/?' + urlencode(params))
+    finally:
+        connection.close()
+
+    if status != 200:
+        raise ValueError('unable to list the tests (status {0})'.format(status))
+
+    return [x['id'] for x in json.loads(body.decode('utf-8'))['tests']]
+
+
+def run_client(base_url, profile, test_ids, client_idx, seed, start_time, timeout):
+    '''Send requests for one client until the end of the test
+
+    Return the list of "Sample" objects.'''
+
+    generator = random.Random(seed * 1000003 + client_idx)
+    requests = profile['requests']
+    weights = [x.get('weight', 1) for x in requests]
+    end_time = start_time + profile['duration_s']
+    connection = Connection(base_url, timeout)
+
+    samples = []
+    try:
+        while True:
+            cur_request = generator.choices(requests, weights)[0]
+            path = cur_request['path']
+            if '{test_id}' in path:
+                if not test_ids:
+                    raise ValueError('request "{0}" needs a test, but none was found'
+                                     .format(cur_request['name']))
+                path = path.format(test_id=generator.choice(test_ids))
+
+            request_start = time.perf_counter()
+            if request_start >= end_time:
+                break
+
+            try:
+                status, body = connection.get(path)
+                error = None if 200 <= status < 300 else 'HTTP {0}'.format(status)
+                num_of_bytes = len(body)
+            except (OSError, http.client.HTTPException) as exc:
+                status, num_of_bytes, error = None, 0, type(exc).__name__
+
+            samples.append(Sample(cur_request['name'], request_start - start_time,
+                                  time.perf_counter() - request_start, status,
+                                  num_of_bytes, error))
+
+            if profile['think_time_s'] > 0:
+                time.sleep(min(generator.expovariate(1.0 / profile['think_time_s']),
+                               max(0.0, end_time - time.perf_counter())))
+    finally:
+        connection.close()
+
+    return samples
+
+
+def summarize_samples(samples, elapsed_s):
+    '''Compute throughput, latency percentiles and error rate of a list of samples
+
+    Return a dictionary with the statistics of all the samples ("total") and
+    of each name of request ("requests").'''
+
+    def summarize(group):
+        latency_ms = np.array([x.latency * 1e3 for x in group])
+        num_of_errors = sum(1 for x in group if x.error)
+        statuses = OrderedDict()
+        for cur_sample in sorted(group, key=lambda x: str(x.status)):
+            key = str(cur_sample.status) if cur_sample.status else cur_sample.error
+            statuses[key] = statuses.get(key, 0) + 1
+
+        result = OrderedDict([
+            ('count', len(group)),
+            ('errors', num_of_errors),
+            ('error_rate', num_of_errors / len(group) if group else 0.0),
+            ('throughput_rps', len(group) / elapsed_s if elapsed_s > 0 else 0.0),
+            ('bytes', sum(x.num_of_bytes for x in group)),
+            ('statuses', statuses),
+        ])
+        for cur_percentile in PERCENTILES:
+            result['latency_p{0}_ms'.format(cur_percentile)] = \
+                float(np.percentile(latency_ms, cur_percentile)) if group else None
+        result['latency_max_ms'] = float(latency_ms.max()) if group else None
+        return result
+
+    groups = OrderedDict()
+    for cur_sample in samples:
+        groups.setdefault(cur_sample.name, []).append(cur_sample)
+
+    return OrderedDict([
+        ('total', summarize(samples)),
+        ('requests', OrderedDict([(name, summarize(group))
+                                  for name, group in sorted(groups.items())])),
+    ])
+
+
+def run_load_test(base_url, profile, seed=1, timeout=60.0):
+    '''Run a load test against the server at "base_url" using "profile"
+
+    Return a dictionary containing the profile, the seed, the number of
+    tests used to fill "{test_id}", and the statistics computed by
+    "summarize_samples" on the requests completed after the warm-up.'''
+
+    profile = validate_profile(profile)
+    if any('{test_id}' in x['path'] for x in profile['requests']):
+        test_ids = discover_test_ids(base_url, profile['test_query'], timeout=timeout)
+    else:
+        test_ids = []
+
+    LOGGER.info('starting load test on %s with %d clients for %.1f s',
+                base_url, profile['clients'], profile['duration_s'])
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=profile['clients']) as executor:
+        futures = [executor.submit(run_client, base_url, profile, test_ids,
+                                   client_idx, seed, start_time, timeout)
+                   for client_idx in range(profile['clients'])]
+        samples = [x for cur_future in futures for x in cur_future.result()]
+    elapsed_s = time.perf_counter() - start_time
+
+    warmup_s = profile['warmup_s']
+    measured = [x for x in samples if x.start >= warmup_s]
+    result = OrderedDict([
+        ('base_url', base_url),
+        ('profile', profile),
+        ('seed', seed),
+        ('num_of_tests', len(test_ids)),
+        ('elapsed_s', elapsed_s),
+    ])
+    result.update(summarize_samples(measured, elapsed_s - warmup_s))
+    return result
+
+
+def wait_for_server(process, host, port, timeout):
+    '''Wait until "process" accepts TCP connections on the port
+
+    Return False if the process terminates or if the timeout expires.'''
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            with socket.create_connection((host, port), timeout=1.0):
+                return True
+        except OSError:
+            time.sleep(0.2)
+
+    return False
+
+
+# Script running the development server, which accepts requests for the host
+# passed as first argument whatever ALLOWED_HOSTS says
+SERVER_SCRIPT = '''
+import os
+import sys
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'stdb2.settings')
+
+from django.conf import settings
+from django.core.management import execute_from_command_line
+
+settings.ALLOWED_HOSTS = [sys.argv[1]]
+execute_from_command_line(['manage.py'] + sys.argv[2:])
+'''
+
+
+@contextmanager
+def local_server(port, host='127.0.0.1', startup_timeout=60.0):
+    '''Run the development server of this project in a separate process
+
+    The server uses the database configured in the settings, and it is
+    stopped when the "with" block ends. It yields the base URL.'''
+
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # The server logs every request: a pipe would fill up and block it
+    error_file = TemporaryFile()
+    process = subprocess.Popen(
+        [sys.executable, '-c', SERVER_SCRIPT, host, 'runserver', '--noreload',
+         '{0}:{1}'.format(host, port)],
+        cwd=base_dir, stdout=subprocess.DEVNULL, stderr=error_file)
+    try:
+        if not wait_for_server(process, host, port, startup_timeout):
+            if process.poll() is not None:
+                error_file.seek(0)
+                raise RuntimeError('the server did not start: {0}'.format(
+                    error_file.read().decode('utf-8', 'replace').strip()))
+            raise RuntimeError('the server did not start within {0} s'.format(startup_timeout))
+        yield 'http://{0}:{1}'.format(host, port)
+    finally:
+        process.terminate()
+        process.wait()
+        error_file.close()
@@ -0,0 +1,35 @@
+# -*- encoding: utf-8 -*-
+
+'''Fill the typed columns of analysis results saved before they existed
+'''
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from unittests.models import ANALYSIS_MODELS
+
+
+class Command(BaseCommand):
+    help = 'Copy scalar values from the JSON records of analyses into typed columns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only-missing', action='store_true',
+                            help='Skip analyses whose columns have already been filled')
+
+    def handle(self, *args, **options):
+        for model in ANALYSIS_MODELS:
+            queryset = model.objects.all()
+            if options['only_missing']:
+                # If every column is NULL, the object was never updated
+                queryset = queryset.filter(**{name + '__isnull': True
+                                              for name in model.scalar_column_names()})
+
+            num_of_objects = 0
+            with transaction.atomic():
+                for obj in queryset.only('pk', 'analysis_results').iterator():
+                    model.objects.filter(pk=obj.pk).update(
+                        **obj.get_scalar_values())
+                    num_of_objects += 1
+
+            self.stdout.write('{0}: {1} object(s) updated'.format(
+                model._meta.verbose_name, num_of_objects))
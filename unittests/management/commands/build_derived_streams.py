@@ -0,0 +1,50 @@
+# -*- encoding: utf-8 -*-
+
+'''Compute the I, Q, U streams and the index of phb/record segments of data
+files uploaded before they were saved at ingest
+'''
+
+import h5py
+
+from django.core.management.base import BaseCommand
+
+from unittests.file_conversions import (
+    DERIVED_GROUP,
+    SEGMENT_DATASET,
+    write_segment_index,
+)
+from unittests.h5storage import writable_h5_file
+from unittests.models import PolarimeterTest
+
+
+class Command(BaseCommand):
+    help = 'Save the derived I, Q, U streams and the index of segments into the HDF5 files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('test_ids', nargs='*', type=int,
+                            help='IDs of the tests to process (default: all)')
+        parser.add_argument('--force', action='store_true',
+                            help='Compute the streams again even if they already exist')
+
+    def handle(self, *args, **options):
+        tests = PolarimeterTest.objects.exclude(data_file='')
+        if options['test_ids']:
+            tests = tests.filter(pk__in=options['test_ids'])
+
+        num_of_tests = 0
+        for cur_test in tests.order_by('pk'):
+            with writable_h5_file(cur_test.data_file) as file_name, \
+                 h5py.File(file_name, 'r+') as h5_file:
+                if 'time_series' not in h5_file:
+                    continue
+
+                if options['force'] or SEGMENT_DATASET not in h5_file:
+                    write_segment_index(h5_file)
+
+                if DERIVED_GROUP in h5_file and not options['force']:
+                    continue
+
+            cur_test.update_derived_streams()
+            num_of_tests += 1
+
+        self.stdout.write('{0} file(s) updated'.format(num_of_tests))
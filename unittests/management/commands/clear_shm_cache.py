@@ -0,0 +1,22 @@
+# -*- encoding: utf-8 -*-
+
+'''Remove the time series kept in shared memory by the worker processes
+'''
+
+from django.core.management.base import BaseCommand, CommandError
+
+from unittests.shmcache import get_cache
+
+
+class Command(BaseCommand):
+    help = 'Remove every segment of the shared memory cache of time series'
+
+    def handle(self, *args, **options):
+        cache = get_cache()
+        if cache is None:
+            raise CommandError('the shared memory cache is disabled '
+                               '(set SHM_CACHE_BYTES) or not supported')
+
+        num_of_entries = cache.stats()['entries']
+        cache.clear()
+        self.stdout.write('{0} column(s) removed from the cache'.format(num_of_entries))
@@ -0,0 +1,39 @@
+# -*- encoding: utf-8 -*-
+
+'''Estimate the bandpasses of many tests and save them in the database
+'''
+
+from functools import partial
+
+from unittests.bandpass import (
+    ALGORITHM_VERSION,
+    DEFAULT_SETTLING_SAMPLES,
+    compute_bandpass_analysis,
+)
+from unittests.batch import BatchAnalysisCommand
+from unittests.models import BandpassAnalysis
+
+
+class Command(BatchAnalysisCommand):
+    help = 'Estimate central frequency and bandwidth of bandpass tests'
+
+    analysis_model = BandpassAnalysis
+    algorithm_version = ALGORITHM_VERSION
+    parameter_names = ('settling_samples',)
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--test-type', default='bandpass',
+                            help='Analyse tests whose type contains this text '
+                            '(default: "bandpass")')
+        parser.add_argument('--settling-samples', type=int,
+                            default=DEFAULT_SETTLING_SAMPLES,
+                            help='Number of samples to discard after each frequency change')
+
+    def get_tests(self, options):
+        tests = super(Command, self).get_tests(options)
+        return tests.filter(test_type__description__icontains=options['test_type'])
+
+    def get_worker(self, options):
+        return partial(compute_bandpass_analysis,
+                       settling_samples=options['settling_samples'])
@@ -0,0 +1,34 @@
+# -*- encoding: utf-8 -*-
+
+'''Fit the I-V curves of many tests and save the results in the database
+'''
+
+from django.db import transaction
+
+from unittests.batch import BatchAnalysisCommand
+from unittests.iv_curves import ALGORITHM_VERSION, compute_iv_analysis
+from unittests.models import IVCurveAnalysis
+
+
+class Command(BatchAnalysisCommand):
+    help = 'Fit the HEMT, detector, and phase-switch I-V curves acquired with Keithley'
+
+    analysis_model = IVCurveAnalysis
+    algorithm_version = ALGORITHM_VERSION
+
+    def get_worker(self, options):
+        return compute_iv_analysis
+
+    def save_analysis(self, test, results, author):
+        # Each dataset produces one object, which replaces the old one
+        with transaction.atomic():
+            IVCurveAnalysis.objects.filter(test=test).delete()
+            analyses = [IVCurveAnalysis(test=test,
+                                        component=x['component'],
+                                        curve=x['curve'],
+                                        analysis_results=x,
+                                        author=author) for x in results]
+            for cur_analysis in analyses:
+                cur_analysis.save()
+
+        return analyses
@@ -0,0 +1,40 @@
+# -*- encoding: utf-8 -*-
+
+'''Compute the noise spectra of many tests and save them in the database
+'''
+
+from functools import partial
+
+from unittests.batch import BatchAnalysisCommand
+from unittests.models import SpectralAnalysis
+from unittests.spectra import (
+    ALGORITHM_VERSION,
+    DEFAULT_CHUNK_SAMPLES,
+    DEFAULT_SEGMENT_LENGTH,
+    DEFAULT_WHITE_NOISE_MIN_FREQ_HZ,
+    compute_spectral_analysis,
+)
+
+
+class Command(BatchAnalysisCommand):
+    help = 'Estimate the PSD and the 1/f knee of tests, saving them as spectral analyses'
+
+    analysis_model = SpectralAnalysis
+    algorithm_version = ALGORITHM_VERSION
+    parameter_names = ('segment_length', 'white_noise_min_freq')
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--segment-length', type=int, default=DEFAULT_SEGMENT_LENGTH,
+                            help='Number of samples in each Welch segment')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SAMPLES,
+                            help='Number of samples read from the HDF5 file at a time')
+        parser.add_argument('--white-noise-min-freq', type=float,
+                            default=DEFAULT_WHITE_NOISE_MIN_FREQ_HZ,
+                            help='Frequency (Hz) above which the spectrum is white')
+
+    def get_worker(self, options):
+        return partial(compute_spectral_analysis,
+                       segment_length=options['segment_length'],
+                       chunk_samples=options['chunk_size'],
+                       white_noise_min_freq_hz=options['white_noise_min_freq'])
@@ -0,0 +1,80 @@
+# -*- encoding: utf-8 -*-
+
+'''Estimate the noise temperature of cryogenic tests and save it in the database
+'''
+
+from functools import partial
+
+from django.conf import settings
+from django.db.models import Prefetch
+
+from unittests.batch import BatchAnalysisCommand, CachedFunction
+from unittests.h5storage import StoredFile
+from unittests.models import NoiseTemperatureAnalysis, Temperatures
+from unittests.tnoise import (
+    ALGORITHM_VERSION,
+    DEFAULT_MIN_PLATEAU_SAMPLES,
+    DEFAULT_THRESHOLD_SIGMA,
+    DEFAULT_WINDOW_SAMPLES,
+    compute_tnoise_analysis,
+)
+
+# Functions computing the temperature of the load from a "Temperatures" object
+LOAD_TEMPERATURES = {
+    'a': lambda x: 0.5 * (x.t_load_a_1 + x.t_load_a_2),
+    'b': lambda x: 0.5 * (x.t_load_b_1 + x.t_load_b_2),
+    'mean': lambda x: 0.25 * (x.t_load_a_1 + x.t_load_a_2 +
+                              x.t_load_b_1 + x.t_load_b_2),
+}
+
+
+class Command(BatchAnalysisCommand):
+    help = 'Estimate gain and noise temperature of cryogenic tests (Y-factor)'
+
+    analysis_model = NoiseTemperatureAnalysis
+    algorithm_version = ALGORITHM_VERSION
+    parameter_names = ('load', 'window', 'min_plateau', 'threshold')
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--load', choices=sorted(LOAD_TEMPERATURES.keys()),
+                            default='mean',
+                            help='Which load temperature to use (default: mean of A and B)')
+        parser.add_argument('--window', type=int, default=DEFAULT_WINDOW_SAMPLES,
+                            help='Number of samples used to detect changes in the output')
+        parser.add_argument('--min-plateau', type=int, default=DEFAULT_MIN_PLATEAU_SAMPLES,
+                            help='Minimum number of samples in a plateau')
+        parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD_SIGMA,
+                            help='Threshold (in sigma) used to detect changes in the output')
+        parser.add_argument('--no-cache', action='store_true',
+                            help='Do not use the cache of results in ANALYSIS_CACHE_DIR')
+
+    def get_tests(self, options):
+        self.load_temperature = LOAD_TEMPERATURES[options['load']]
+
+        tests = super(Command, self).get_tests(options)
+        return tests.filter(cryogenic=True, temperatures__isnull=False).distinct() \
+            .prefetch_related(Prefetch('temperatures_set',
+                                       queryset=Temperatures.objects.order_by('pk')))
+
+    def get_worker(self, options):
+        parameters = {
+            'window_samples': options['window'],
+            'min_plateau_samples': options['min_plateau'],
+            'threshold_sigma': options['threshold'],
+        }
+        if options['no_cache']:
+            return partial(compute_tnoise_analysis, **parameters)
+
+        return CachedFunction(settings.ANALYSIS_CACHE_DIR,
+                              compute_tnoise_analysis, **parameters)
+
+    def get_worker_arguments(self, test):
+        return (StoredFile(test.data_file.name),
+                [self.load_temperature(x) for x in test.temperatures_set.all()])
+
+    def get_housekeeping(self, test):
+        result = super(Command, self).get_housekeeping(test)
+        result['temperatures'] = [(x.t_load_a_1, x.t_load_a_2, x.t_load_b_1, x.t_load_b_2)
+                                  for x in test.temperatures_set.all()]
+        return result
@@ -0,0 +1,47 @@
+# -*- encoding: utf-8 -*-
+
+'''Build the index of glitches and jumps of data files already in the database
+'''
+
+import h5py
+
+from django.core.management.base import BaseCommand
+
+from unittests.file_conversions import DEM_COLUMNS, PWR_COLUMNS
+from unittests.glitches import EVENT_DATASET, write_event_index
+from unittests.h5storage import writable_h5_file
+from unittests.models import PolarimeterTest
+
+
+class Command(BaseCommand):
+    help = 'Look for glitches, saturations and jumps in the time series of the tests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('test_ids', nargs='*', type=int,
+                            help='IDs of the tests to process (default: all)')
+        parser.add_argument('--force', action='store_true',
+                            help='Run the detection again even if the index already exists')
+
+    def handle(self, *args, **options):
+        tests = PolarimeterTest.objects.exclude(data_file='')
+        if options['test_ids']:
+            tests = tests.filter(pk__in=options['test_ids'])
+
+        num_of_tests = 0
+        num_of_events = 0
+        for cur_test in tests.order_by('pk'):
+            with writable_h5_file(cur_test.data_file) as file_name, \
+                 h5py.File(file_name, 'r+') as h5_file:
+                if 'time_series' not in h5_file:
+                    continue
+
+                if EVENT_DATASET in h5_file and not options['force']:
+                    continue
+
+                write_event_index(h5_file, DEM_COLUMNS + PWR_COLUMNS)
+
+            num_of_events += cur_test.update_glitch_events()
+            num_of_tests += 1
+
+        self.stdout.write('{0} event(s) found in {1} file(s)'.format(
+            num_of_events, num_of_tests))
@@ -0,0 +1,91 @@
+# -*- encoding: utf-8 -*-
+
+'''Write synthetic data files or fill the database with synthetic tests
+'''
+
+from django.core.management.base import BaseCommand, CommandError
+
+from unittests.synthetic import (BANDS, TEST_KINDS, SyntheticTest,
+                                 populate_database, write_keithley_zip)
+
+
+class Command(BaseCommand):
+    help = '''Produce realistic synthetic inputs for scale and load tests:
+    text files like those of the acquisition software ("text"), ZIP files of
+    Keithley measurements ("zip"), or tests in the database ("database")'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', choices=('text', 'zip', 'database'),
+                            help='What to produce')
+        parser.add_argument('--output', metavar='FILE',
+                            help='Name of the file to write (for "text" and "zip")')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Seed of the random generator (default: %(default)s)')
+
+        group = parser.add_argument_group('text files')
+        group.add_argument('--duration', type=float, default=3600.0,
+                           help='Duration of the test in seconds (default: %(default)s)')
+        group.add_argument('--kind', choices=sorted(TEST_KINDS.keys()), default='noise',
+                           help='Kind of test (default: %(default)s)')
+        group.add_argument('--band', choices=sorted(BANDS.keys()), default='Q',
+                           help='Band of the polarimeter (default: %(default)s)')
+        group.add_argument('--white-noise', type=float, default=15.0,
+                           help='White noise of the outputs in ADU (default: %(default)s)')
+        group.add_argument('--knee-frequency', type=float, default=0.05,
+                           help='Knee frequency of the 1/f noise in Hz (default: %(default)s)')
+        group.add_argument('--phase-switch-period', type=float, default=60.0,
+                           help='''Seconds between changes in the state of the phase
+                           switches, 0 to keep them fixed (default: %(default)s)''')
+        group.add_argument('--steps', type=int, default=8,
+                           help='Number of steps in sweeps (default: %(default)s)')
+        group.add_argument('--glitch-rate', type=float, default=0.0,
+                           help='Number of glitches per second (default: %(default)s)')
+
+        group = parser.add_argument_group('Keithley files')
+        group.add_argument('--blocks', type=int, default=5,
+                           help='Number of curves in each Excel file (default: %(default)s)')
+        group.add_argument('--points', type=int, default=100,
+                           help='Number of points in each curve (default: %(default)s)')
+
+        group = parser.add_argument_group('database')
+        group.add_argument('--tests', type=int, default=1000,
+                           help='Number of tests to create (default: %(default)s)')
+        group.add_argument('--tests-per-polarimeter', type=int, default=20,
+                           help='Number of tests for each polarimeter (default: %(default)s)')
+        group.add_argument('--data-duration', type=float, default=0.0,
+                           help='''Duration in seconds of the data files shared by the
+                           tests, 0 to create tests without data (default: %(default)s)''')
+        group.add_argument('--analysis-fraction', type=float, default=0.5,
+                           help='Fraction of the tests having an analysis (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        target = options['target']
+        if target in ('text', 'zip') and not options['output']:
+            raise CommandError('--output is required to write a {0} file'.format(target))
+
+        if target == 'text':
+            synthetic_test = SyntheticTest(
+                options['duration'], kind=options['kind'], band=options['band'],
+                seed=options['seed'], white_noise_adu=options['white_noise'],
+                knee_frequency_hz=options['knee_frequency'],
+                phase_switch_period_s=options['phase_switch_period'],
+                num_of_steps=options['steps'], glitch_rate_hz=options['glitch_rate'])
+            synthetic_test.write_text_file(options['output'])
+            self.stdout.write('{0} samples written to "{1}"'.format(
+                synthetic_test.num_of_samples, options['output']))
+        elif target == 'zip':
+            if not 1 <= options['blocks'] <= 64 or not 1 <= options['points'] <= 65535:
+                raise CommandError('Excel files can contain at most 64 blocks '
+                                   'of 65535 points')
+
+            write_keithley_zip(options['output'], num_of_blocks=options['blocks'],
+                               points_per_curve=options['points'], seed=options['seed'])
+            self.stdout.write('Keithley files written to "{0}"'.format(options['output']))
+        else:
+            test_ids = populate_database(
+                options['tests'],
+                tests_per_polarimeter=options['tests_per_polarimeter'],
+                data_duration_s=options['data_duration'],
+                analysis_fraction=options['analysis_fraction'],
+                seed=options['seed'])
+            self.stdout.write('{0} tests created'.format(len(test_ids)))
@@ -0,0 +1,91 @@
+# -*- encoding: utf-8 -*-
+
+'''Summarize the time and memory spent converting the most recent uploads
+'''
+
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand
+import numpy as np
+
+from unittests.models import IngestRecord
+from unittests.tracing import flatten_spans
+
+PERCENTILES = (50, 90, 99)
+
+
+def summarize_records(records):
+    '''Compute the percentiles of the stages in a list of "IngestRecord"
+
+    Return a dictionary associating the path of each stage (e.g.,
+    "save/conversion/parse_text") with a dictionary containing the number of
+    records including it and the percentiles of wall time, CPU time, MB/s of
+    input and traced memory peak.'''
+
+    stages = OrderedDict()
+    for cur_record in records:
+        for path, cur_span in flatten_spans(cur_record.trace):
+            stages.setdefault(path, []).append(cur_span)
+
+    result = OrderedDict()
+    for path, spans in stages.items():
+        wall_time = np.array([x['wall_time_s'] for x in spans])
+        cpu_time = np.array([x['cpu_time_s'] for x in spans])
+        throughput = np.array([x['bytes_in'] / 1e6 / x['wall_time_s']
+                               for x in spans if x['bytes_in'] and x['wall_time_s'] > 0])
+        peak_memory = np.array([x['peak_traced_bytes'] for x in spans
+                                if x['peak_traced_bytes'] is not None])
+
+        summary = OrderedDict([('count', len(spans))])
+        for name, values in (('wall_time_s', wall_time),
+                             ('cpu_time_s', cpu_time),
+                             ('input_mb_per_s', throughput),
+                             ('peak_traced_mb', peak_memory / 1e6)):
+            summary[name] = OrderedDict(
+                ('p{0}'.format(x), float(np.percentile(values, x)) if len(values) else None)
+                for x in PERCENTILES)
+
+        result[path] = summary
+
+    return result
+
+
+def format_number(value):
+    return '-' if value is None else '{0:.3g}'.format(value)
+
+
+class Command(BaseCommand):
+    help = 'Show percentiles of the time and memory used by each stage of recent uploads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--last', type=int, default=100,
+                            help='Number of uploads to consider (default: %(default)s)')
+        parser.add_argument('--format', dest='file_format',
+                            help='Only consider uploads with this extension (e.g., "txt")')
+
+    def handle(self, *args, **options):
+        records = IngestRecord.objects.order_by('-date', '-pk')
+        if options['file_format']:
+            records = records.filter(file_format=options['file_format'].lower())
+        records = list(records[:options['last']])
+
+        if not records:
+            self.stdout.write('no uploads found')
+            return
+
+        self.stdout.write('{0} upload(s), {1:.1f} MB in total\n'.format(
+            len(records), sum(x.file_size for x in records) / 1e6))
+
+        columns = ('wall_time_s', 'cpu_time_s', 'input_mb_per_s', 'peak_traced_mb')
+        header = '{0:40s} {1:>5s}'.format('Stage', 'N') + ''.join(
+            ' {0:>26s}'.format('{0} (p{1})'.format(
+                x, '/'.join(str(y) for y in PERCENTILES))) for x in columns)
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+
+        for path, summary in summarize_records(records).items():
+            line = '{0:40s} {1:5d}'.format(path, summary['count'])
+            for cur_column in columns:
+                line += ' {0:>26s}'.format('/'.join(
+                    format_number(x) for x in summary[cur_column].values()))
+            self.stdout.write(line)
@@ -0,0 +1,91 @@
+# -*- encoding: utf-8 -*-
+
+'''Run a load test against a server, using one of the traffic profiles
+'''
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from unittests.loadtest import PERCENTILES, load_profiles, local_server, run_load_test
+
+
+class Command(BaseCommand):
+    help = '''Send many concurrent requests to the web pages and to the REST API,
+    and report throughput, latency percentiles and error rates. Without --url,
+    the development server is measured, whose numbers do not reflect a
+    production deployment with uWSGI'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile', nargs='?', default='dashboard',
+                            help='Name of the traffic profile (default: %(default)s)')
+        parser.add_argument('--profile-file', metavar='FILE',
+                            help='JSON file containing additional profiles')
+        parser.add_argument('--list', action='store_true',
+                            help='List the available profiles and exit')
+        parser.add_argument('--url',
+                            help='''Base URL of the server to test; if not given,
+                            a development server ("runserver") is started on --port''')
+        parser.add_argument('--port', type=int, default=8765,
+                            help='Port of the local server (default: %(default)s)')
+        parser.add_argument('--clients', type=int,
+                            help='Override the number of clients in the profile')
+        parser.add_argument('--duration', type=float,
+                            help='Override the duration (in seconds) of the profile')
+        parser.add_argument('--warmup', type=float,
+                            help='''Override the time (in seconds) at the beginning
+                            of the test whose requests are not included in the report''')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Seed of the random generators (default: %(default)s)')
+        parser.add_argument('--output', metavar='FILE',
+                            help='Save the results in this JSON file')
+
+    def handle(self, *args, **options):
+        try:
+            profiles = load_profiles(options['profile_file'])
+        except (OSError, ValueError) as exc:
+            raise CommandError('invalid profiles: {0}'.format(exc))
+
+        if options['list']:
+            for name, profile in profiles.items():
+                self.stdout.write('{0:16s} {1}'.format(name, profile['description']))
+            return
+
+        if options['profile'] not in profiles:
+            raise CommandError('unknown profile "{0}", available profiles are: {1}'
+                               .format(options['profile'], ', '.join(profiles.keys())))
+
+        profile = dict(profiles[options['profile']])
+        if options['clients'] is not None:
+            profile['clients'] = options['clients']
+        if options['duration'] is not None:
+            profile['duration_s'] = options['duration']
+        if options['warmup'] is not None:
+            profile['warmup_s'] = options['warmup']
+
+        try:
+            if options['url']:
+                results = run_load_test(options['url'], profile, seed=options['seed'])
+            else:
+                with local_server(options['port']) as base_url:
+                    results = run_load_test(base_url, profile, seed=options['seed'])
+        except (OSError, RuntimeError, ValueError) as exc:
+            raise CommandError(str(exc))
+
+        columns = ['p{0} (ms)'.format(x) for x in PERCENTILES] + ['max (ms)']
+        self.stdout.write('{0:20s} {1:>8s} {2:>8s} {3:>10s}'.format(
+            'Request', 'Count', 'Errors', 'Req/s') +
+                          ''.join(' {0:>10s}'.format(x) for x in columns))
+        rows = list(results['requests'].items()) + [('TOTAL', results['total'])]
+        for name, stats in rows:
+            latencies = [stats['latency_p{0}_ms'.format(x)] for x in PERCENTILES]
+            latencies.append(stats['latency_max_ms'])
+            self.stdout.write('{0:20s} {1:8d} {2:7.1f}% {3:10.1f}'.format(
+                name, stats['count'], 100.0 * stats['error_rate'], stats['throughput_rps']) +
+                              ''.join(' {0:10.1f}'.format(x if x is not None else float('nan'))
+                                      for x in latencies))
+
+        if options['output']:
+            with open(options['output'], 'wt') as output_file:
+                json.dump(results, output_file, indent=2)
+            self.stdout.write('results saved in "{0}"'.format(options['output']))
@@ -0,0 +1,102 @@
+# -*- encoding: utf-8 -*-
+
+'''Compute again the analyses whose inputs have changed
+'''
+
+from collections import OrderedDict
+import json
+
+from django.core.management import load_command_class
+from django.core.management.base import BaseCommand, CommandError
+
+from unittests.batch import ANALYSIS_COMMANDS, find_stale_tests, get_author
+
+
+def parse_parameters(values):
+    'Convert a list of "NAME=VALUE" strings into a dictionary'
+
+    result = OrderedDict()
+    for cur_value in values:
+        name, sep, value = cur_value.partition('=')
+        if not sep or not name:
+            raise CommandError('invalid parameter "{0}", use NAME=VALUE'.format(cur_value))
+        result[name.replace('-', '_')] = value
+
+    return result
+
+
+class Command(BaseCommand):
+    help = '''Run again the analysis engines on the tests whose data file,
+    housekeeping data, algorithm or parameters have changed since the last run'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--author', required=True,
+                            help='User name of the author of the new analyses')
+        parser.add_argument('--engine', action='append', choices=ANALYSIS_COMMANDS,
+                            help='Only consider this engine (can be repeated)')
+        parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                            help='''Analyse the tests with this value of a parameter
+                            of the engines, e.g. "settling_samples=100" (can be
+                            repeated). Tests whose last run used another value
+                            are stale; otherwise, every test is analysed again
+                            with the parameters of its last run''')
+        parser.add_argument('--jobs', type=int, default=None,
+                            help='Number of processes to use (default: one per CPU)')
+        parser.add_argument('--include-missing', action='store_true',
+                            help='Analyse tests never processed by the engines, too')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only print the list of stale tests')
+
+    def handle(self, *args, **options):
+        author = get_author(options['author'])
+        parameters = parse_parameters(options['param'])
+
+        engine_names = options['engine'] or ANALYSIS_COMMANDS
+        commands = OrderedDict((x, load_command_class('unittests', x))
+                               for x in engine_names)
+        unknown_names = set(parameters.keys()).difference(
+            *[x.parameter_names for x in commands.values()])
+        if unknown_names:
+            raise CommandError('unknown parameter(s): {0}'.format(
+                ', '.join(sorted(unknown_names))))
+
+        num_of_analyses = 0
+        for engine_name, command in commands.items():
+            command.stdout = self.stdout
+            command.stderr = self.stderr
+
+            # Parameters not passed by the user have their default value,
+            # which is used only for tests never analysed
+            engine_args = ['--author', options['author']]
+            for name, value in parameters.items():
+                if name in command.parameter_names:
+                    engine_args += ['--' + name.replace('_', '-'), value]
+            engine_options = vars(command.create_parser('manage.py', engine_name)
+                                  .parse_args(engine_args))
+            engine_options['jobs'] = options['jobs']
+
+            stale_tests = find_stale_tests(
+                command, engine_options,
+                include_missing=options['include_missing'],
+                parameters={x: engine_options[x] for x in command.parameter_names
+                            if x in parameters})
+            self.stdout.write('{0}: {1} stale test(s)'.format(engine_name, len(stale_tests)))
+            for test, reasons, _ in stale_tests:
+                self.stdout.write('  test {0} ({1}): {2}'.format(
+                    test.pk, test, ', '.join(reasons)))
+
+            if not stale_tests or options['dry_run']:
+                continue
+
+            # Tests analysed with the same parameters are processed together
+            groups = OrderedDict()
+            for test, _, run_parameters in stale_tests:
+                key = json.dumps(run_parameters, sort_keys=True)
+                groups.setdefault(key, (run_parameters, []))[1].append(test)
+
+            for run_parameters, tests in groups.values():
+                num_of_analyses += command.run_analysis(
+                    tests, dict(engine_options, **run_parameters), author)
+
+        if not options['dry_run']:
+            self.stdout.write('{0} analyses saved'.format(num_of_analyses))
@@ -0,0 +1,109 @@
+# -*- encoding: utf-8 -*-
+
+'''Run the benchmarks of the converters, readers and views
+
+The benchmarks run on a test database and a temporary MEDIA_ROOT, so the
+real database and data files are never touched.
+'''
+
+import json
+from tempfile import TemporaryDirectory
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (override_settings, setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+
+from unittests.benchmarks import (BENCHMARKS, DEFAULT_DATA_SCALES,
+                                  DEFAULT_DATABASE_SCALES, compare_results,
+                                  run_benchmarks)
+
+
+def scale_list(value):
+    'Parse a comma-separated list of positive integers, like "10000,100000"'
+    try:
+        result = [int(x) for x in value.split(',') if x.strip()]
+    except ValueError:
+        raise CommandError('invalid list of scales "{0}"'.format(value))
+
+    if not result or min(result) <= 0:
+        raise CommandError('invalid list of scales "{0}"'.format(value))
+
+    return result
+
+
+class Command(BaseCommand):
+    help = '''Measure time and memory used by the converters, the HDF5 readers
+    and the most used views, and save the results in a JSON file'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', action='append', choices=list(BENCHMARKS.keys()),
+                            help='Only run this benchmark (can be repeated)')
+        parser.add_argument('--samples', default=','.join(str(x) for x in DEFAULT_DATA_SCALES),
+                            help='''Comma-separated list of the number of samples
+                            in the time series (default: %(default)s)''')
+        parser.add_argument('--tests', default=','.join(str(x) for x in DEFAULT_DATABASE_SCALES),
+                            help='''Comma-separated list of the number of tests
+                            in the database (default: %(default)s)''')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Number of timed runs of each case (default: %(default)s)')
+        parser.add_argument('--output', metavar='FILE',
+                            help='Save the results in this JSON file')
+        parser.add_argument('--compare', metavar='FILE',
+                            help='Compare the results with those saved in this JSON file')
+        parser.add_argument('--load', metavar='FILE',
+                            help='''Do not run the benchmarks, but load the results
+                            from this JSON file (useful with --compare)''')
+        parser.add_argument('--threshold', type=float, default=0.1,
+                            help='''Relative change in the median time reported
+                            as a regression or improvement (default: %(default)s)''')
+
+    def run(self, options):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            with TemporaryDirectory() as work_dir, \
+                 override_settings(MEDIA_ROOT=work_dir):
+                return run_benchmarks(work_dir,
+                                      data_scales=scale_list(options['samples']),
+                                      database_scales=scale_list(options['tests']),
+                                      names=options['only'],
+                                      repeat=options['repeat'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+
+        if options['load']:
+            with open(options['load'], 'rt') as input_file:
+                results = json.load(input_file)
+        else:
+            results = self.run(options)
+
+        self.stdout.write('{0:32s} {1:>14s} {2:>12s} {3:>12s} {4:>12s}'.format(
+            'Benchmark', 'Scale', 'Median (s)', 'Stdev (s)', 'Peak (MB)'))
+        for cur_result in results['results']:
+            self.stdout.write('{0:32s} {1:>14s} {2:12.4f} {3:12.4f} {4:12.1f}'.format(
+                cur_result['name'],
+                '{0} {1}'.format(cur_result['scale'], cur_result['scale_unit']),
+                cur_result['wall_time_s']['median'],
+                cur_result['wall_time_s']['stdev'],
+                cur_result['peak_traced_bytes'] / 1e6))
+
+        if options['output']:
+            with open(options['output'], 'wt') as output_file:
+                json.dump(results, output_file, indent=2)
+            self.stdout.write('results saved in "{0}"'.format(options['output']))
+
+        if options['compare']:
+            with open(options['compare'], 'rt') as input_file:
+                baseline = json.load(input_file)
+
+            self.stdout.write('\nComparison with commit {0}:'.format(
+                baseline['environment'].get('git_commit') or 'unknown'))
+            for name, scale, old_time, new_time, ratio, flag in \
+                    compare_results(baseline, results, options['threshold']):
+                self.stdout.write('{0:32s} {1:>14d} {2:12.4f} {3:12.4f} {4:8.2f}x {5}'
+                                  .format(name, scale, old_time, new_time, ratio, flag))
@@ -0,0 +1,475 @@
+# -*- encoding: utf-8 -*-
+
+'''Metrics of the server in the Prometheus text format
+
+The metrics are declared at the bottom of this module (counters, gauges and
+histograms, with optional labels). Every process saves its values in a
+memory-mapped file in METRICS_DIR, named after its PID; the view
+"metrics_view" reads all the files and adds them together, so that the
+numbers are correct even when many worker processes (or management commands)
+update them. Gauges only include the values of processes which are still
+running.
+
+When a process exits, or when "collect" finds the file of a process which is
+no longer running, its counters and histograms are added to the file
+"metrics_archive.db" and its own file is removed. This keeps the number of
+files bounded, and a new process reusing the PID of a dead one starts from
+zero. Counters survive restarts of the server: empty METRICS_DIR to reset
+them. If METRICS_DIR is empty (the default), metrics are not recorded at all.
+'''
+
+import atexit
+from collections import OrderedDict
+from contextlib import contextmanager
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+
+# Size of the files created by each process; they grow when needed
+INITIAL_FILE_SIZE = 64 * 1024
+
+# File collecting the counters and histograms of processes which have exited
+ARCHIVE_FILE_NAME = 'metrics_archive.db'
+
+# File locked while the files of dead processes are merged into the archive
+LOCK_FILE_NAME = 'metrics.lock'
+
+# Default buckets of histograms measuring durations, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Get an instance of a logger
+LOGGER = logging.getLogger(__name__)
+
+
+class MmapValues:
+    '''Floating-point values indexed by strings, saved in a memory-mapped file
+
+    Only one process writes the file. The first 8 bytes contain the number of
+    bytes used; each entry is made by the length of the key (4 bytes), the
+    key encoded in UTF-8 and padded to a multiple of 8 bytes, and the value
+    (8 bytes). An entry is complete before the number of bytes used is
+    updated, so that other processes can read the file at any time.'''
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.lock = threading.Lock()
+        self.positions = {}
+
+        with open(file_name, 'a+b') as new_file:
+            if os.path.getsize(file_name) < INITIAL_FILE_SIZE:
+                new_file.truncate(INITIAL_FILE_SIZE)
+
+        self.file = open(file_name, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.used = max(8, struct.unpack_from('Q', self.map, 0)[0])
+        for key, value, position in read_entries(self.map):
+            self.positions[key] = position
+
+    def _add_entry(self, key):
+        encoded_key = key.encode('utf-8')
+        padding = 8 - (4 + len(encoded_key)) % 8
+        entry = struct.pack('I{0}s{1}x'.format(len(encoded_key), padding),
+                            len(encoded_key), encoded_key) + struct.pack('d', 0.0)
+
+        if self.used + len(entry) > len(self.map):
+            new_size = 2 * len(self.map)
+            while self.used + len(entry) > new_size:
+                new_size *= 2
+            self.map.close()
+            self.file.truncate(new_size)
+            self.map = mmap.mmap(self.file.fileno(), 0)
+
+        self.map[self.used:self.used + len(entry)] = entry
+        position = self.used + len(entry) - 8
+        self.used += len(entry)
+        struct.pack_into('Q', self.map, 0, self.used)
+
+        self.positions[key] = position
+        return position
+
+    def add(self, key, amount):
+        'Add "amount" to the value associated with "key"'
+
+        with self.lock:
+            position = self.positions.get(key)
+            if position is None:
+                position = self._add_entry(key)
+
+            value = struct.unpack_from('d', self.map, position)[0]
+            struct.pack_into('d', self.map, position, value + amount)
+
+    def set(self, key, value):
+        'Associate "value" with "key"'
+
+        with self.lock:
+            position = self.positions.get(key)
+            if position is None:
+                position = self._add_entry(key)
+
+            struct.pack_into('d', self.map, position, value)
+
+    def close(self):
+        with self.lock:
+            self.map.close()
+            self.file.close()
+
+
+def read_entries(buffer):
+    'Yield the tuples (key, value, position of the value) saved by "MmapValues"'
+
+    used = struct.unpack_from('Q', buffer, 0)[0]
+    position = 8
+    while position < used:
+        key_length = struct.unpack_from('I', buffer, position)[0]
+        key = bytes(buffer[position + 4:position + 4 + key_length]).decode('utf-8')
+        position += 4 + key_length
+        position += 8 - position % 8
+        yield key, struct.unpack_from('d', buffer, position)[0], position
+        position += 8
+
+
+# Values of the current process, created on first use
+_VALUES = None
+_VALUES_KEY = None
+_VALUES_LOCK = threading.Lock()
+
+
+def process_file_name(metrics_dir, pid):
+    return os.path.join(metrics_dir, 'metrics_{0}.db'.format(pid))
+
+
+@contextmanager
+def archive_lock(metrics_dir):
+    'Lock the archive of "metrics_dir" against other processes'
+
+    with open(os.path.join(metrics_dir, LOCK_FILE_NAME), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def archive_file(metrics_dir, file_name):
+    '''Add the counters and histograms in "file_name" to the archive and remove it
+
+    Gauges are dropped. The caller must hold "archive_lock".'''
+
+    if not os.path.exists(file_name):
+        return
+
+    with open(file_name, 'rb') as input_file:
+        buffer = input_file.read()
+
+    gauge_names = set(x.name for x in REGISTRY.values() if x.metric_type == 'gauge')
+    archive = MmapValues(os.path.join(metrics_dir, ARCHIVE_FILE_NAME))
+    try:
+        for key, value, _ in read_entries(buffer):
+            if json.loads(key)[0] not in gauge_names:
+                archive.add(key, value)
+    finally:
+        archive.close()
+
+    os.remove(file_name)
+
+
+def get_values():
+    'Return the store of the current process, or None if metrics are disabled'
+
+    global _VALUES, _VALUES_KEY
+
+    if not settings.METRICS_DIR:
+        return None
+
+    with _VALUES_LOCK:
+        key = (os.getpid(), settings.METRICS_DIR)
+        if _VALUES is None or _VALUES_KEY != key:
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            file_name = process_file_name(settings.METRICS_DIR, os.getpid())
+            # A file with our PID was left by a dead process: do not inherit
+            # its values
+            with archive_lock(settings.METRICS_DIR):
+                archive_file(settings.METRICS_DIR, file_name)
+
+            _VALUES = MmapValues(file_name)
+            _VALUES_KEY = key
+
+        return _VALUES
+
+
+@atexit.register
+def archive_values():
+    'Move the values of the current process to the archive'
+
+    global _VALUES, _VALUES_KEY
+
+    with _VALUES_LOCK:
+        if _VALUES is None or _VALUES_KEY[0] != os.getpid():
+            return
+
+        metrics_dir = _VALUES_KEY[1]
+        _VALUES.close()
+        if os.path.isdir(metrics_dir):
+            with archive_lock(metrics_dir):
+                archive_file(metrics_dir, _VALUES.file_name)
+
+        _VALUES = None
+        _VALUES_KEY = None
+
+
+def sample_key(name, labels):
+    'Return the key used to save a sample in the store'
+    return json.dumps([name, sorted(labels.items())], separators=(',', ':'))
+
+
+# All the metrics declared in this module, indexed by name
+REGISTRY = OrderedDict()
+
+
+class Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY[name] = self
+
+    def _labels(self, labels):
+        if set(labels.keys()) != set(self.labelnames):
+            raise ValueError('metric "{0}" requires labels {1}, got {2}'
+                             .format(self.name, self.labelnames, tuple(labels.keys())))
+        return {key: str(value) for key, value in labels.items()}
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def inc(self, amount=1.0, **labels):
+        values = get_values()
+        if values:
+            values.add(sample_key(self.name + '_total', self._labels(labels)), amount)
+
+
+class Gauge(Metric):
+    '''Value which can go up and down
+
+    The values of all the running processes are added together.'''
+
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        values = get_values()
+        if values:
+            values.set(sample_key(self.name, self._labels(labels)), value)
+
+    def inc(self, amount=1.0, **labels):
+        values = get_values()
+        if values:
+            values.add(sample_key(self.name, self._labels(labels)), amount)
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        values = get_values()
+        if not values:
+            return
+
+        labels = self._labels(labels)
+        # Buckets are saved as they are, and made cumulative when exposed
+        bucket = next(x for x in self.buckets if value <= x)
+        values.add(sample_key(self.name + '_bucket', dict(labels, le=format_value(bucket))), 1.0)
+        values.add(sample_key(self.name + '_sum', labels), value)
+        values.add(sample_key(self.name + '_count', labels), 1.0)
+
+    @contextmanager
+    def time(self, **labels):
+        'Context manager which observes the time spent in the "with" block'
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+def format_value(value):
+    'Format a number as required by the Prometheus text format'
+
+    if value == float('inf'):
+        return '+Inf'
+    if value == int(value) and abs(value) < 1e15:
+        return '{0:.1f}'.format(value)
+    return repr(float(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+
+    escaped = ['{0}="{1}"'.format(key, value.replace('\\', '\\\\')
+                                  .replace('"', '\\"').replace('\n', '\\n'))
+               for key, value in labels]
+    return '{' + ','.join(escaped) + '}'
+
+
+def process_is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect(metrics_dir):
+    '''Add together the samples saved by all the processes
+
+    Return a dictionary associating the keys used by the store with values.'''
+
+    result = {}
+    with archive_lock(metrics_dir):
+        for file_name in sorted(os.listdir(metrics_dir)):
+            if not (file_name.startswith('metrics_') and file_name.endswith('.db')) or \
+               file_name == ARCHIVE_FILE_NAME:
+                continue
+
+            pid = int(file_name[len('metrics_'):-len('.db')])
+            if not process_is_running(pid):
+                archive_file(metrics_dir, os.path.join(metrics_dir, file_name))
+
+        for file_name in sorted(os.listdir(metrics_dir)):
+            if not (file_name.startswith('metrics_') and file_name.endswith('.db')):
+                continue
+
+            with open(os.path.join(metrics_dir, file_name), 'rb') as input_file:
+                buffer = input_file.read()
+
+            for key, value, _ in read_entries(buffer):
+                result[key] = result.get(key, 0.0) + value
+
+    return result
+
+
+def expose(samples):
+    'Format the samples returned by "collect" in the Prometheus text format'
+
+    # Group the samples by metric
+    by_name = {}
+    for key, value in samples.items():
+        name, labels = json.loads(key)
+        by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for metric in REGISTRY.values():
+        lines.append('# HELP {0} {1}'.format(metric.name, metric.documentation))
+        lines.append('# TYPE {0} {1}'.format(metric.name, metric.metric_type))
+
+        if metric.metric_type == 'histogram':
+            # Group the buckets of each combination of labels, and make them
+            # cumulative
+            series = OrderedDict()
+            for labels, value in sorted(by_name.get(metric.name + '_bucket', [])):
+                other_labels = tuple((k, v) for k, v in labels if k != 'le')
+                upper_limit = float(dict(labels)['le'].replace('+Inf', 'inf'))
+                series.setdefault(other_labels, {})[upper_limit] = value
+
+            for other_labels, counts in series.items():
+                cumulative = 0.0
+                for upper_limit in metric.buckets:
+                    cumulative += counts.get(upper_limit, 0.0)
+                    labels = other_labels + (('le', format_value(upper_limit)),)
+                    lines.append('{0}_bucket{1} {2}'.format(metric.name, format_labels(labels),
+                                                            format_value(cumulative)))
+
+                for suffix in ('_sum', '_count'):
+                    value = dict((tuple(tuple(x) for x in labels), value)
+                                 for labels, value in by_name.get(metric.name + suffix, []))
+                    lines.append('{0}{1}{2} {3}'.format(
+                        metric.name, suffix, format_labels(other_labels),
+                        format_value(value.get(other_labels, 0.0))))
+        else:
+            sample_name = metric.name + ('_total' if metric.metric_type == 'counter' else '')
+            for labels, value in sorted(by_name.get(sample_name, [])):
+                lines.append('{0}{1} {2}'.format(sample_name,
+                                                 format_labels([tuple(x) for x in labels]),
+                                                 format_value(value)))
+
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    'Return the metrics of all the processes in the Prometheus text format'
+
+    if not settings.METRICS_DIR or not os.path.isdir(settings.METRICS_DIR):
+        samples = {}
+    else:
+        samples = collect(settings.METRICS_DIR)
+
+    return HttpResponse(expose(samples), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class MetricsMiddleware:
+    'Record the latency of every request in a histogram, labelled by view name'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        REQUEST_DURATION.observe(time.perf_counter() - start,
+                                 view=view, method=request.method)
+        RESPONSES.inc(view=view, status=response.status_code)
+        return response
+
+
+REQUEST_DURATION = Histogram(
+    'stdb2_request_duration_seconds', 'Time spent by Django to answer requests',
+    labelnames=('view', 'method'))
+RESPONSES = Counter(
+    'stdb2_responses', 'Number of responses sent, by view and status code',
+    labelnames=('view', 'status'))
+CONVERSION_DURATION = Histogram(
+    'stdb2_conversion_duration_seconds', 'Time spent converting uploaded files into HDF5',
+    labelnames=('format',))
+CONVERSION_BYTES = Counter(
+    'stdb2_conversion_input_bytes', 'Size of the uploaded files converted into HDF5',
+    labelnames=('format',))
+CONVERSION_THROUGHPUT = Histogram(
+    'stdb2_conversion_throughput_mb_per_second',
+    'Speed of the conversion of uploaded files into HDF5, in MB of input per second',
+    labelnames=('format',), buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0))
+PLOT_DURATION = Histogram(
+    'stdb2_pwr_plot_duration_seconds', 'Time spent rendering the plots of the PWR outputs')
+H5_POOL_REQUESTS = Counter(
+    'stdb2_h5_pool_requests', 'Requests of HDF5 handles to the pool, by result (hit or miss)',
+    labelnames=('result',))
+STORAGE_BLOCK_REQUESTS = Counter(
+    'stdb2_storage_block_requests',
+    'Requests of blocks of HDF5 files in remote storages to the cache, by result (hit or miss)',
+    labelnames=('result',))
+PENDING_JOBS = Gauge(
+    'stdb2_pending_jobs', 'Number of analysis jobs submitted to worker processes and not completed',
+    labelnames=('job',))
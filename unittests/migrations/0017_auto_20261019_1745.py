@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 17:45
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('unittests', '0016_auto_20171215_1135'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='polarimetertest',
+            index=models.Index(fields=['polarimeter_number', 'acquisition_date', 'id'], name='poltest_pol_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='polarimetertest',
+            index=models.Index(fields=['test_type', 'polarimeter_number', 'acquisition_date'], name='poltest_type_pol_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='polarimetertest',
+            index=models.Index(fields=['band', 'polarimeter_number', 'acquisition_date'], name='poltest_band_pol_date_idx'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 17:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+OPERATORS_TABLE = 'unittests_polarimetertest_operators'
+OPERATORS_INDEX = 'poltest_operators_test_idx'
+
+
+def add_operators_index(apps, schema_editor):
+    '''Index the table linking tests and operators, if no index is there
+
+    Databases created with SQLite lack the indexes on the columns of this
+    table, so looking for the operators of a test requires a full scan.
+    '''
+
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(
+            cursor, OPERATORS_TABLE)
+
+    for constraint in constraints.values():
+        if constraint['index'] and constraint['columns'] and \
+                constraint['columns'][0] == 'polarimetertest_id':
+            return
+
+    schema_editor.execute('CREATE INDEX {0} ON {1} ({2}, {3})'.format(
+        schema_editor.quote_name(OPERATORS_INDEX),
+        schema_editor.quote_name(OPERATORS_TABLE),
+        schema_editor.quote_name('polarimetertest_id'),
+        schema_editor.quote_name('operator_id'),
+    ))
+
+
+def remove_operators_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(
+            cursor, OPERATORS_TABLE)
+
+    if OPERATORS_INDEX in constraints:
+        schema_editor.execute(schema_editor.sql_delete_index % {
+            'table': schema_editor.quote_name(OPERATORS_TABLE),
+            'name': schema_editor.quote_name(OPERATORS_INDEX),
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('unittests', '0017_auto_20261019_1745'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='polarimetertest',
+            index=models.Index(fields=['acquisition_date'], name='poltest_acq_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='polarimetertest',
+            index=models.Index(fields=['creation_date'], name='poltest_creation_date_idx'),
+        ),
+        migrations.RunPython(add_operators_index, remove_operators_index),
+    ]
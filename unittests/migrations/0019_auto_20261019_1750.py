@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 17:50
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('unittests', '0018_auto_20261019_1747'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bandpassanalysis',
+            name='analysis_date',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='bandpassanalysis',
+            name='bandwidth_err_ghz',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='bandpassanalysis',
+            name='bandwidth_ghz',
+            field=models.FloatField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='bandpassanalysis',
+            name='central_nu_err_ghz',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='bandpassanalysis',
+            name='central_nu_ghz',
+            field=models.FloatField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='noisetemperatureanalysis',
+            name='analysis_date',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='noisetemperatureanalysis',
+            name='gain_q1_adu_k',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='noisetemperatureanalysis',
+            name='gain_q2_adu_k',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='noisetemperatureanalysis',
+            name='gain_u1_adu_k',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='noisetemperatureanalysis',
+            name='gain_u2_adu_k',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='noisetemperatureanalysis',
+            name='tnoise_err_k',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='noisetemperatureanalysis',
+            name='tnoise_k',
+            field=models.FloatField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='spectralanalysis',
+            name='analysis_date',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='spectralanalysis',
+            name='f_knee_q_hz',
+            field=models.FloatField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='spectralanalysis',
+            name='f_knee_u_hz',
+            field=models.FloatField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='spectralanalysis',
+            name='slope_i',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='spectralanalysis',
+            name='slope_q',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='spectralanalysis',
+            name='slope_u',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='spectralanalysis',
+            name='test_duration_hr',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='spectralanalysis',
+            name='wn_level_q_k2_hz',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='spectralanalysis',
+            name='wn_level_u_k2_hz',
+            field=models.FloatField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 17:53
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('unittests', '0019_auto_20261019_1750'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bandpassanalysis',
+            name='arrays_file',
+            field=models.FileField(blank=True, editable=False, upload_to='analysis_arrays/'),
+        ),
+        migrations.AddField(
+            model_name='noisetemperatureanalysis',
+            name='arrays_file',
+            field=models.FileField(blank=True, editable=False, upload_to='analysis_arrays/'),
+        ),
+        migrations.AddField(
+            model_name='spectralanalysis',
+            name='arrays_file',
+            field=models.FileField(blank=True, editable=False, upload_to='analysis_arrays/'),
+        ),
+    ]
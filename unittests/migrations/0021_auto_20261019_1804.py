@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 18:04
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+import unittests.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('unittests', '0020_auto_20261019_1753'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IVCurveAnalysis',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('component', models.CharField(max_length=8)),
+                ('curve', models.CharField(choices=[('IDVD', 'HEMT, drain current vs drain voltage'), ('IDVG', 'HEMT, drain current vs gate voltage'), ('IFVF', 'Diode, forward current vs forward voltage'), ('IRVR', 'Diode, reverse current vs reverse voltage')], max_length=4)),
+                ('analysis_results', jsonfield.fields.JSONField(blank=True)),
+                ('transconductance_s', models.FloatField(editable=False, null=True)),
+                ('pinch_off_v', models.FloatField(editable=False, null=True)),
+                ('output_conductance_s', models.FloatField(editable=False, null=True)),
+                ('drain_current_a', models.FloatField(editable=False, null=True)),
+                ('ideality_factor', models.FloatField(editable=False, null=True)),
+                ('saturation_current_a', models.FloatField(editable=False, null=True)),
+                ('forward_voltage_v', models.FloatField(editable=False, null=True)),
+                ('leakage_current_a', models.FloatField(editable=False, null=True)),
+                ('reverse_resistance_ohm', models.FloatField(editable=False, null=True)),
+                ('analysis_date', models.DateField(editable=False, null=True)),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='iv_curves_owned', to=settings.AUTH_USER_MODEL)),
+                ('test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='unittests.PolarimeterTest')),
+            ],
+            options={
+                'verbose_name': 'fit of I-V curves',
+            },
+            bases=(unittests.models.AnalysisScalarsMixin, models.Model),
+        ),
+        migrations.AddIndex(
+            model_name='ivcurveanalysis',
+            index=models.Index(fields=['component', 'curve'], name='ivcurve_comp_curve_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ivcurveanalysis',
+            unique_together=set([('test', 'component', 'curve')]),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 18:06
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('unittests', '0021_auto_20261019_1804'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('engine', models.CharField(max_length=64)),
+                ('algorithm_version', models.CharField(max_length=32)),
+                ('parameters', jsonfield.fields.JSONField(blank=True)),
+                ('data_file_hash', models.CharField(max_length=64)),
+                ('data_file_size', models.BigIntegerField()),
+                ('data_file_mtime', models.FloatField()),
+                ('housekeeping_hash', models.CharField(max_length=64)),
+                ('analysis_ids', jsonfield.fields.JSONField(blank=True)),
+                ('run_date', models.DateTimeField(auto_now=True)),
+                ('test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='unittests.PolarimeterTest')),
+            ],
+            options={
+                'verbose_name': 'run of an analysis engine',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='analysisrun',
+            unique_together=set([('test', 'engine')]),
+        ),
+    ]
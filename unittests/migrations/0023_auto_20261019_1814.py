@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 18:14
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('unittests', '0022_auto_20261019_1806'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GlitchEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('spike', 'Spike'), ('rail', 'ADC saturation'), ('jump', 'Jump')], max_length=8)),
+                ('channel', models.CharField(max_length=16)),
+                ('start_sample', models.BigIntegerField()),
+                ('stop_sample', models.BigIntegerField()),
+                ('severity', models.FloatField()),
+                ('test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='glitch_events', to='unittests.PolarimeterTest')),
+            ],
+            options={
+                'verbose_name': 'glitch in the time series',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='glitchevent',
+            index=models.Index(fields=['kind', 'severity'], name='glitch_kind_severity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='glitchevent',
+            index=models.Index(fields=['channel', 'kind'], name='glitch_channel_kind_idx'),
+        ),
+    ]
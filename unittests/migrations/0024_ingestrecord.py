@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 18:36
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('unittests', '0023_auto_20261019_1814'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestRecord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('file_name', models.CharField(max_length=1024)),
+                ('file_format', models.CharField(max_length=16)),
+                ('file_size', models.BigIntegerField()),
+                ('wall_time_s', models.FloatField()),
+                ('peak_traced_bytes', models.BigIntegerField(blank=True, null=True)),
+                ('peak_rss_bytes', models.BigIntegerField(blank=True, null=True)),
+                ('trace', jsonfield.fields.JSONField(blank=True)),
+                ('test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingest_records', to='unittests.PolarimeterTest')),
+            ],
+            options={
+                'verbose_name': 'ingestion of a data file',
+            },
+        ),
+    ]
@@ -18,27 +18,56 @@ housekeeping temperatures, and so on is available and ready to be put in the
 database.
 '''
 
+from collections import OrderedDict
 from io import BytesIO
 import logging
 import os
+import sys
 from tempfile import NamedTemporaryFile
+import threading
+import time
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
 from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.core.files import File
 from django.core.files.base import ContentFile
-import h5py
-import matplotlib as mpl
+from django.utils.dateparse import parse_date
+import numpy as np
 
 from jsonfield import JSONField
 
-from .file_conversions import convert_data_file_to_h5
+from .file_conversions import (
+    convert_data_file_to_h5,
+    write_derived_streams,
+)
+from . import h5pool
+from . import h5storage
+from .live import (
+    append_samples,
+    create_live_file,
+    finish_live_file,
+    is_live_file,
+)
+from .glitches import (
+    EVENT_JUMP,
+    EVENT_RAIL,
+    EVENT_SPIKE,
+    read_event_index,
+)
 from .validators import validate_report_file_ext
+from .metrics import (
+    CONVERSION_BYTES,
+    CONVERSION_DURATION,
+    CONVERSION_THROUGHPUT,
+    PLOT_DURATION,
+)
+from .timing import count_hdf5_bytes
+from .tracing import span, trace
 
-mpl.use('Agg')
-import matplotlib.pylab as plt
 
 # Get an instance of a logger
 LOGGER = logging.getLogger(__name__)
@@ -83,6 +112,28 @@ PHSW_STATES = (
 def create_pwr_plot(hdf5_file_name, dpi=80):
     'Plot PWR data from an HDF5 file into an image'
 
+    with PLOT_DURATION.time():
+        return _create_pwr_plot(hdf5_file_name, dpi)
+
+
+def import_pyplot():
+    '''Return the module "matplotlib.pylab", using a backend that needs no display
+
+    Matplotlib takes a long time to import, so it is only loaded when the
+    first plot is made.'''
+
+    import matplotlib
+    if 'matplotlib.pyplot' not in sys.modules:
+        matplotlib.use('Agg')
+
+    import matplotlib.pylab as plt
+    return plt
+
+
+def _create_pwr_plot(hdf5_file_name, dpi):
+    import h5py
+
+    plt = import_pyplot()
     plt.figure(figsize=(512 / dpi, 384 / dpi), dpi=dpi)
     with h5py.File(hdf5_file_name, 'r') as h5_file:
         if not 'time_series' in h5_file:
@@ -118,6 +169,9 @@ def update_hdf5_test_file_attrs(file_name, poltest):
     else:
         abs_url = poltest.get_absolute_url()
 
+    import h5py
+
+    h5pool.invalidate(file_name)
     with h5py.File(file_name, 'r+') as h5_file:
         for key, value in [('url', abs_url),
                            ('polarimeter', poltest.polarimeter_name),
@@ -133,6 +187,51 @@ def get_polarimeter_name(num):
     return 'STRIP{0:02d}'.format(num)
 
 
+# Names of the URLs associated with each test, and of the keyword used to pass
+# the primary key of the test to "reverse"
+TEST_URL_NAMES = OrderedDict([
+    ('absolute_url', ('unittests:test_details', 'test_id')),
+    ('download_url', ('unittests:test_download', 'test_id')),
+    ('json_url', ('unittests:test_details_json', 'test_id')),
+])
+
+# Keys returned by "PolarimeterTest.to_dict"
+TEST_SUMMARY_FIELDS = (
+    'id',
+    'polarimeter_number',
+    'polarimeter_name',
+    'band',
+    'cryogenic',
+    'phsw_state',
+    'test_type',
+    'description',
+    'acquisition_date',
+    'creation_date',
+) + tuple(TEST_URL_NAMES.keys())
+
+
+class TestUrlBuilder:
+    '''Build the URLs of many tests with just one call to "reverse" per URL
+
+    Calling "reverse" is expensive, and the REST API might need the URLs of
+    thousands of tests. This class resolves each URL once, using a placeholder
+    for the primary key, and then builds the URL of every test by joining
+    strings.
+    '''
+
+    PLACEHOLDER = 987654321
+
+    def __init__(self):
+        self.templates = {}
+        for key, (url_name, pk_kwarg) in TEST_URL_NAMES.items():
+            url = reverse(url_name, kwargs={pk_kwarg: self.PLACEHOLDER})
+            self.templates[key] = url.split(str(self.PLACEHOLDER), 1)
+
+    def url(self, key, pk):
+        prefix, suffix = self.templates[key]
+        return '{0}{1}{2}'.format(prefix, pk, suffix)
+
+
 class PolarimeterTest(models.Model):
     'A dedicated test done on one polarimeter'
 
@@ -188,70 +287,323 @@ class PolarimeterTest(models.Model):
     def get_delete_url(self):
         return reverse('unittests:test_delete', kwargs={'pk': self.pk})
 
+    def get_base_file_name(self):
+        'Return the name (without extension) of the data and plot files of the test'
+
+        # Remove weird characters from the description of the test type
+        test_type = ''.join(filter(str.isalpha,
+                                   self.test_type.description))
+        return ('{polname}_{date}_{testtype}'
+                .format(polname=self.polarimeter_name,
+                        date=self.acquisition_date.strftime('%Y-%m-%d'),
+                        testtype=test_type))
+
     def save(self, *args, **kwargs):
         if self.data_file:
-            # Remove weird characters from the description of the test type
-            test_type = ''.join(filter(str.isalpha,
-                                       self.test_type.description))
-            base_file_name = ('{polname}_{date}_{testtype}'
-                              .format(polname=self.polarimeter_name,
-                                      date=self.acquisition_date.strftime(
-                                          '%Y-%m-%d'),
-                                      testtype=test_type))
+            # Views must not keep reading the file being replaced
+            if self.pk:
+                old_file = (PolarimeterTest.objects.filter(pk=self.pk)
+                            .values_list('data_file', flat=True).first())
+                if old_file:
+                    h5storage.invalidate(h5storage.StoredFile(old_file))
+
+            base_file_name = self.get_base_file_name()
             hdf5_file_name = base_file_name + '.h5'
             LOGGER.debug('going to create a temporary HDF5 file in "%s"',
                          hdf5_file_name)
-            with NamedTemporaryFile(suffix='.h5', delete=False) as temporary_file:
+            # Files which have just been uploaded are not committed yet;
+            # otherwise, the HDF5 file in the storage is converted again
+            new_upload = not self.data_file._committed
+            input_name = os.path.basename(self.data_file.name)
+            input_format = os.path.splitext(input_name)[1].lstrip('.').lower()
+            input_size = self.data_file.size
+            with trace('save', bytes_in=input_size,
+                       trace_memory=settings.INGEST_TRACE_MEMORY) as root_span:
+                temporary_file = NamedTemporaryFile(suffix='.h5', delete=False)
                 tmp_file_name = temporary_file.name
-                convert_data_file_to_h5(
-                    self.data_file.name, self.data_file, temporary_file.name)
-                image_file = create_pwr_plot(temporary_file.name)
+                try:
+                    with temporary_file:
+                        start = time.perf_counter()
+                        with span('conversion', bytes_in=input_size) as cur_span:
+                            convert_data_file_to_h5(
+                                self.data_file.name, self.data_file, temporary_file.name)
+                            cur_span.bytes_out = os.path.getsize(tmp_file_name)
+                        elapsed = time.perf_counter() - start
+                        CONVERSION_DURATION.observe(elapsed, format=input_format)
+                        CONVERSION_BYTES.inc(input_size, format=input_format)
+                        if elapsed > 0:
+                            CONVERSION_THROUGHPUT.observe(input_size / 1e6 / elapsed,
+                                                          format=input_format)
+
+                        with span('pwr_plot'):
+                            image_file = create_pwr_plot(temporary_file.name)
+
+                    # A new row must not be left without its data file
+                    new_row = self.pk is None
+                    try:
+                        with transaction.atomic():
+                            self._store_data_file(tmp_file_name, base_file_name,
+                                                  image_file, *args, **kwargs)
+                    except Exception:
+                        if new_row:
+                            self.pk = None
+                        raise
+                finally:
+                    os.remove(tmp_file_name)
+
+                count_hdf5_bytes(written=self.data_file.size)
+                LOGGER.debug(
+                    'HDF5 file "%s" imported in the database and removed, new file is "%s"',
+                    hdf5_file_name, self.data_file.name)
+
+                with span('glitch_events'):
+                    self.update_glitch_events()
+
+                root_span.bytes_out = self.data_file.size
+
+            if new_upload:
+                IngestRecord.objects.create(
+                    test=self,
+                    file_name=input_name,
+                    file_format=input_format,
+                    file_size=input_size,
+                    wall_time_s=root_span.wall_time,
+                    peak_traced_bytes=root_span.peak_traced_bytes,
+                    peak_rss_bytes=root_span.peak_rss_bytes,
+                    trace=root_span.to_dict())
+        else:
+            super(PolarimeterTest, self).save(*args, **kwargs)
 
-            LOGGER.debug('importing HDF5 file "%s" into the database',
-                         hdf5_file_name)
-            with open(tmp_file_name, 'rb') as temporary_file:
-                self.data_file = File(temporary_file, hdf5_file_name)
+    def _store_data_file(self, tmp_file_name, base_file_name, image_file,
+                         *args, **kwargs):
+        '''Complete the converted file "tmp_file_name" and save it with the row
 
-                if image_file:
-                    self.pwr_plot.save(base_file_name + '.png',
-                                       image_file, save=False)
+        The metadata saved in the file include the URL of the test, which
+        needs the primary key: new rows are saved before the file, which is
+        then uploaded to the storage only once.'''
 
-                super(PolarimeterTest, self).save(*args, **kwargs)
+        if self.pk is None:
+            self.data_file = ''
+            super(PolarimeterTest, self).save(*args, **kwargs)
+            args, kwargs = (), {'update_fields': ['data_file', 'pwr_plot']}
 
-            os.remove(tmp_file_name)
-            LOGGER.debug(
-                'HDF5 file "%s" imported in the database and removed, new file is "%s"',
-                hdf5_file_name, self.data_file.name)
+        with span('hdf5_attrs'):
+            update_hdf5_test_file_attrs(tmp_file_name, self)
+
+        # The converter does not know the ADC offsets of the test
+        if self.adcoffset_set.exists():
+            import h5py
+
+            with span('derived_streams'), \
+                 h5py.File(tmp_file_name, 'r+') as h5_file:
+                write_derived_streams(h5_file, self.get_pwr_offsets())
+
+        LOGGER.debug('importing HDF5 file "%s" into the database',
+                     base_file_name + '.h5')
+        with span('store_files') as cur_span, \
+             open(tmp_file_name, 'rb') as temporary_file:
+            self.data_file = File(temporary_file, base_file_name + '.h5')
+
+            if image_file:
+                self.pwr_plot.save(base_file_name + '.png',
+                                   image_file, save=False)
 
-            update_hdf5_test_file_attrs(os.path.join(
-                settings.MEDIA_ROOT, self.data_file.name), self)
-            LOGGER.debug('metadata for file "%s" have been updated',
-                         self.data_file.name)
-        else:
             super(PolarimeterTest, self).save(*args, **kwargs)
+            cur_span.bytes_out = self.data_file.size
+
+    def get_pwr_offsets(self):
+        'Return the last set of ADC offsets of the test as a list, or None'
+
+        offset = self.adcoffset_set.order_by('pk').last()
+        if not offset:
+            return None
+
+        return [offset.q1_adu, offset.u1_adu, offset.u2_adu, offset.q2_adu]
+
+    def update_derived_streams(self):
+        '''Compute again the I, Q, U streams in the data file
+
+        This must be called whenever the ADC offsets of the test change.'''
+
+        if not self.data_file:
+            return
+
+        if not self.data_file.storage.exists(self.data_file.name):
+            LOGGER.warning('unable to update derived streams, file "%s" does not exist',
+                           self.data_file.name)
+            return
+
+        import h5py
+
+        with h5storage.writable_h5_file(self.data_file) as file_name, \
+             h5py.File(file_name, 'r+') as h5_file:
+            if 'time_series' in h5_file:
+                write_derived_streams(h5_file, self.get_pwr_offsets())
+                LOGGER.debug('derived streams in "%s" have been updated',
+                             self.data_file.name)
+
+    def is_live(self):
+        'Return True if samples are still being appended to the data file'
+
+        if not self.data_file or not self.data_file.storage.exists(self.data_file.name):
+            return False
+
+        try:
+            with h5storage.open_h5_file(self.data_file) as h5_file:
+                return is_live_file(h5_file)
+        except OSError:
+            LOGGER.warning('unable to open "%s" as a HDF5 file', self.data_file.name)
+            return False
+
+    def append_live_samples(self, samples):
+        '''Append a block of samples to the data file of a test being acquired
+
+        If the test has no data file, an empty one is created (see
+        "live.create_live_file"). Raise ValueError if the data file was not
+        created for a live acquisition. Return the number of samples in the
+        file.'''
+
+        if not self.data_file:
+            storage = self.data_file.storage
+            name = storage.get_available_name(self.data_file.field.generate_filename(
+                self, self.get_base_file_name() + '.h5'))
+            os.makedirs(os.path.dirname(storage.path(name)), exist_ok=True)
+            create_live_file(storage.path(name), self.get_pwr_offsets())
+
+            # Calling "save" would convert the file again
+            PolarimeterTest.objects.filter(pk=self.pk).update(data_file=name)
+            self.data_file = name
+            LOGGER.info('live data file "%s" created for test %d', name, self.pk)
 
-    def to_dict(self):
-        'Create a dictionary containing a summary of the test (useful for the REST API)'
+        file_name = self.data_file.path
+        h5pool.invalidate(file_name)
+        count_hdf5_bytes(written=samples.nbytes)
+        return append_samples(file_name, samples)
 
-        return {
+    def finish_live_acquisition(self):
+        '''Mark the acquisition of a live test as complete
+
+        The metadata, the index of glitches and the plot of the PWR outputs
+        are saved as if the whole file had been uploaded at once. Return the
+        number of glitches found.'''
+
+        file_name = self.data_file.path
+        h5pool.invalidate(file_name)
+        finish_live_file(file_name)
+        update_hdf5_test_file_attrs(file_name, self)
+
+        image_file = create_pwr_plot(file_name)
+        if image_file:
+            self.pwr_plot.save(self.get_base_file_name() + '.png',
+                               image_file, save=False)
+            PolarimeterTest.objects.filter(pk=self.pk).update(pwr_plot=self.pwr_plot.name)
+
+        return self.update_glitch_events()
+
+    def update_glitch_events(self):
+        '''Copy the index of glitches and jumps in the data file into the database
+
+        The events already in the database for this test are removed. Return
+        the number of events, or None if the file has no index.'''
+
+        if not self.data_file:
+            return None
+
+        with h5storage.open_h5_file(self.data_file) as h5_file:
+            events = read_event_index(h5_file)
+
+        if events is None:
+            return None
+
+        GlitchEvent.objects.filter(test=self).delete()
+        GlitchEvent.objects.bulk_create([
+            GlitchEvent(test=self,
+                        kind=x['kind'],
+                        channel=x['channel'],
+                        start_sample=x['start'],
+                        stop_sample=x['stop'],
+                        severity=x['severity'])
+            for x in events])
+        return len(events)
+
+    def to_dict(self, fields=None, url_builder=None):
+        '''Create a dictionary containing a summary of the test (useful for the REST API)
+
+        If "fields" is not None, only the keys listed in it are returned. When
+        converting many tests, pass the same "TestUrlBuilder" object in
+        "url_builder" to every call, and use "select_related('test_type')" in
+        the query.
+        '''
+
+        if not url_builder:
+            url_builder = TestUrlBuilder()
+
+        result = {
             'id': self.pk,
             'polarimeter_number': self.polarimeter_number,
-            'test_type': self.test_type.pk,
+            'polarimeter_name': self.polarimeter_name,
+            'band': self.band,
+            'cryogenic': self.cryogenic,
+            'phsw_state': self.phsw_state,
+            'test_type': self.test_type_id,
             'description': self.test_description,
-            'absolute_url': self.get_absolute_url(),
-            'download_url': self.get_download_url(),
-            'json_url': self.get_json_url(),
+            'acquisition_date': self.acquisition_date.strftime('%Y-%m-%d'),
+            'creation_date': (self.creation_date.strftime('%Y-%m-%d')
+                              if self.creation_date else None),
         }
+        for key in TEST_URL_NAMES.keys():
+            result[key] = url_builder.url(key, self.pk)
+
+        if fields:
+            result = {key: result[key] for key in fields}
+
+        return result
 
     class Meta:
         verbose_name = 'test of a polarimetric unit'
         ordering = ['polarimeter_number', 'acquisition_date']
         get_latest_by = 'acquisition_date'
+        indexes = [
+            # Used by the default ordering and by keyset pagination in the
+            # REST API
+            models.Index(fields=['polarimeter_number', 'acquisition_date', 'id'],
+                         name='poltest_pol_date_idx'),
+            models.Index(fields=['test_type', 'polarimeter_number', 'acquisition_date'],
+                         name='poltest_type_pol_date_idx'),
+            models.Index(fields=['band', 'polarimeter_number', 'acquisition_date'],
+                         name='poltest_band_pol_date_idx'),
+            # Used by date ranges not restricted to a polarimeter, and by
+            # the count of tests added in the last days
+            models.Index(fields=['acquisition_date'], name='poltest_acq_date_idx'),
+            models.Index(fields=['creation_date'], name='poltest_creation_date_idx'),
+        ]
+
+
+class AdcOffsetQuerySet(models.QuerySet):
+    '''Query set updating the derived streams of the tests whose offsets change
+
+    Saving and deleting offsets is handled by the signal receivers below,
+    but "update" does not send any signal.'''
+
+    def update(self, **kwargs):
+        test_ids = set(self.values_list('test_id', flat=True))
+        result = super(AdcOffsetQuerySet, self).update(**kwargs)
+
+        if 'test' in kwargs:
+            test_ids.add(kwargs['test'].pk)
+        if 'test_id' in kwargs:
+            test_ids.add(kwargs['test_id'])
+        for cur_test in PolarimeterTest.objects.filter(pk__in=test_ids):
+            cur_test.update_derived_streams()
+
+        return result
 
 
 class AdcOffset(models.Model):
     'Offset configuration used for the four ADCs'
 
+    objects = AdcOffsetQuerySet.as_manager()
+
     test = models.ForeignKey(to=PolarimeterTest, on_delete=models.CASCADE)
     q1_adu = models.IntegerField(verbose_name='PWR0 (Q1) offset [ADU]')
     u1_adu = models.IntegerField(verbose_name='PWR1 (U1) offset [ADU]')
@@ -273,6 +625,41 @@ class AdcOffset(models.Model):
         verbose_name = 'values of the four ADC offsets'
 
 
+# Primary keys of the tests being deleted by each thread: their ADC offsets
+# are deleted too, but their data files must not be written again
+_DELETED_TESTS = threading.local()
+
+
+def get_deleted_tests():
+    if not hasattr(_DELETED_TESTS, 'ids'):
+        _DELETED_TESTS.ids = set()
+    return _DELETED_TESTS.ids
+
+
+@receiver(pre_delete, sender=PolarimeterTest)
+def mark_deleted_test(sender, instance, **kwargs):
+    get_deleted_tests().add(instance.pk)
+
+
+@receiver(post_delete, sender=PolarimeterTest)
+def unmark_deleted_test(sender, instance, **kwargs):
+    get_deleted_tests().discard(instance.pk)
+
+
+@receiver(post_save, sender=AdcOffset)
+@receiver(post_delete, sender=AdcOffset)
+def update_offset_derived_streams(sender, instance, raw=False, **kwargs):
+    '''Compute again the derived streams of a test whose ADC offsets have changed
+
+    Receivers are called also when offsets are deleted through query sets
+    (e.g., by the bulk actions of the admin site).'''
+
+    if raw or instance.test_id in get_deleted_tests():
+        return
+
+    instance.test.update_derived_streams()
+
+
 def dict_to_adc_offset_list(data):
     offsets = data['adc_offsets']
     if type(offsets) is dict:
@@ -451,14 +838,245 @@ def dict_to_temperature_set_list(data):
     ) for x in temperatures]
 
 
-class NoiseTemperatureAnalysis(models.Model):
+def scalar_to_float(value):
+    'Convert a value taken from a JSON record into a float, or None'
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def scalar_to_date(value):
+    'Convert a YYYY-MM-DD string taken from a JSON record into a date, or None'
+    try:
+        return parse_date(str(value)[:10])
+    except ValueError:
+        return None
+
+
+class AnalysisScalarsMixin:
+    '''Copy well-known scalar values from "analysis_results" into typed columns
+
+    The JSON record in "analysis_results" cannot be used in SQL queries. Each
+    model using this mixin lists in "scalar_keys" the values that are worth
+    querying, as tuples (column name, path within the JSON record,
+    conversion function). Columns are updated every time the object is saved.
+    '''
+
+    scalar_keys = ()
+
+    @classmethod
+    def scalar_column_names(cls):
+        return [x[0] for x in cls.scalar_keys]
+
+    def get_scalar_values(self):
+        'Return a dictionary with the values of the columns in "scalar_keys"'
+
+        result = {}
+        for column_name, path, conversion in self.scalar_keys:
+            value = self.analysis_results
+            for key in path:
+                if not isinstance(value, dict):
+                    value = None
+                    break
+                value = value.get(key)
+
+            result[column_name] = conversion(value)
+
+        return result
+
+    def update_scalar_columns(self):
+        for column_name, value in self.get_scalar_values().items():
+            setattr(self, column_name, value)
+
+    def save(self, *args, **kwargs):
+        self.update_scalar_columns()
+        super().save(*args, **kwargs)
+
+
+# Key used in JSON records to mark a reference to an array stored in a file
+ARRAY_REFERENCE_KEY = 'stored_array'
+
+
+def is_list_of_numbers(value):
+    'Tell if "value" is a list of numbers, or a list of lists of numbers'
+
+    if not isinstance(value, list) or not value:
+        return False
+
+    if isinstance(value[0], list):
+        return all([is_list_of_numbers(x) and len(x) == len(value[0])
+                    for x in value])
+
+    return all([isinstance(x, (int, float)) and not isinstance(x, bool)
+                for x in value])
+
+
+def extract_large_arrays(value, min_length, arrays, path=''):
+    '''Replace lists of at least "min_length" numbers with references
+
+    The function walks through the JSON record "value" and returns a copy of
+    it where every long list of numbers is replaced by a reference. The
+    arrays are saved in the dictionary "arrays", using their path within the
+    record as key.
+    '''
+
+    if isinstance(value, dict):
+        return OrderedDict([
+            (key, extract_large_arrays(item, min_length, arrays,
+                                       '/'.join([path, key]) if path else key))
+            for key, item in value.items()])
+
+    if isinstance(value, list):
+        if len(value) >= min_length and is_list_of_numbers(value):
+            name = path if path else 'root'
+            # Lists of integers keep their type
+            arrays[name] = np.array(value)
+            if arrays[name].dtype.kind not in 'iuf':
+                arrays[name] = arrays[name].astype(np.float64)
+            return {ARRAY_REFERENCE_KEY: name, 'shape': list(arrays[name].shape)}
+
+        return [extract_large_arrays(item, min_length, arrays,
+                                     '{0}/{1}'.format(path, idx))
+                for idx, item in enumerate(value)]
+
+    return value
+
+
+def collect_array_references(value):
+    'Return the set of the names of the arrays referenced by a JSON record'
+
+    if isinstance(value, dict):
+        if ARRAY_REFERENCE_KEY in value:
+            return set([value[ARRAY_REFERENCE_KEY]])
+
+        return set().union(*[collect_array_references(x) for x in value.values()])
+
+    if isinstance(value, list):
+        return set().union(*[collect_array_references(x) for x in value])
+
+    return set()
+
+
+def resolve_array_references(value, arrays):
+    'Replace references in a JSON record with the arrays they point to'
+
+    if isinstance(value, dict):
+        if ARRAY_REFERENCE_KEY in value:
+            return arrays[value[ARRAY_REFERENCE_KEY]].tolist()
+
+        return OrderedDict([(key, resolve_array_references(item, arrays))
+                            for key, item in value.items()])
+
+    if isinstance(value, list):
+        return [resolve_array_references(x, arrays) for x in value]
+
+    return value
+
+
+def delete_unreferenced_arrays_file(model, storage, file_name, exclude_pk=None):
+    '''Delete the NPZ file "file_name" if no object of "model" uses it
+
+    Other analyses can share the same file (e.g., synthetic ones, see
+    "synthetic.py"). The object with primary key "exclude_pk" is not
+    considered.'''
+
+    if model.objects.filter(arrays_file=file_name).exclude(pk=exclude_pk).exists():
+        return
+
+    storage.delete(file_name)
+    LOGGER.debug('file "%s" is no longer used, it has been deleted', file_name)
+
+
+class AnalysisArraysMixin:
+    '''Keep long arrays of numbers in "analysis_results" in a separate NPZ file
+
+    Bandpasses and spectra can contain thousands of numbers, which would be
+    decoded every time the object is loaded from the database. When the
+    object is saved, every list longer than ANALYSIS_ARRAY_MIN_LENGTH is moved
+    into the file "arrays_file" and replaced by a reference; the function
+    "get_full_results" puts the arrays back.
+    '''
+
+    def load_arrays(self):
+        'Return a dictionary-like object with the arrays saved in "arrays_file"'
+
+        if not self.arrays_file:
+            return {}
+
+        with self.arrays_file.storage.open(self.arrays_file.name, 'rb') as npz_file:
+            # NpzFile objects read arrays lazily, but the file is going to be
+            # closed: load everything now, it is what the caller wants anyway
+            with np.load(BytesIO(npz_file.read())) as arrays:
+                return {name: arrays[name] for name in arrays.files}
+
+    def get_full_results(self):
+        'Return "analysis_results", with references replaced by arrays'
+
+        if not collect_array_references(self.analysis_results):
+            return self.analysis_results
+
+        return resolve_array_references(self.analysis_results, self.load_arrays())
+
+    def store_large_arrays(self):
+        new_arrays = {}
+        results = extract_large_arrays(self.analysis_results,
+                                       settings.ANALYSIS_ARRAY_MIN_LENGTH,
+                                       new_arrays)
+        if not new_arrays:
+            return
+
+        # Keep the arrays saved in the old file that are still referenced
+        referenced_names = collect_array_references(results)
+        arrays = {name: value for name, value in self.load_arrays().items()
+                  if name in referenced_names and name not in new_arrays}
+        arrays.update(new_arrays)
+
+        old_file_name = self.arrays_file.name if self.arrays_file else None
+        buffer = BytesIO()
+        np.savez_compressed(buffer, **arrays)
+        self.arrays_file.save('{0}_{1}.npz'.format(self._meta.model_name, self.test_id),
+                              ContentFile(buffer.getvalue()), save=False)
+        if old_file_name:
+            delete_unreferenced_arrays_file(type(self), self.arrays_file.storage,
+                                            old_file_name, exclude_pk=self.pk)
+
+        self.analysis_results = results
+        LOGGER.debug('%d array(s) of %s moved into "%s"',
+                     len(new_arrays), self, self.arrays_file.name)
+
+    def save(self, *args, **kwargs):
+        self.store_large_arrays()
+        super().save(*args, **kwargs)
+
+
+class NoiseTemperatureAnalysis(AnalysisArraysMixin, AnalysisScalarsMixin, models.Model):
     'Result of a noise temperature analysis'
 
     test = models.ForeignKey(to=PolarimeterTest, on_delete=models.CASCADE)
     analysis_results = JSONField(blank=True)
+
+    scalar_keys = (
+        ('tnoise_k', ('tnoise', 'mean'), scalar_to_float),
+        ('tnoise_err_k', ('tnoise', 'std'), scalar_to_float),
+        ('gain_q1_adu_k', ('gain_q1', 'mean'), scalar_to_float),
+        ('gain_u1_adu_k', ('gain_u1', 'mean'), scalar_to_float),
+        ('gain_u2_adu_k', ('gain_u2', 'mean'), scalar_to_float),
+        ('gain_q2_adu_k', ('gain_q2', 'mean'), scalar_to_float),
+        ('analysis_date', ('analysis_date',), scalar_to_date),
+    )
+    tnoise_k = models.FloatField(null=True, editable=False, db_index=True)
+    tnoise_err_k = models.FloatField(null=True, editable=False)
+    gain_q1_adu_k = models.FloatField(null=True, editable=False)
+    gain_u1_adu_k = models.FloatField(null=True, editable=False)
+    gain_u2_adu_k = models.FloatField(null=True, editable=False)
+    gain_q2_adu_k = models.FloatField(null=True, editable=False)
+    analysis_date = models.DateField(null=True, editable=False)
     report_file = models.FileField(
         verbose_name='Report', upload_to='reports/',
         validators=[validate_report_file_ext], blank=True)
+    arrays_file = models.FileField(
+        upload_to='analysis_arrays/', blank=True, editable=False)
 
     author = models.ForeignKey(
         settings.AUTH_USER_MODEL, related_name='tnoise_owned')
@@ -473,15 +1091,38 @@ class NoiseTemperatureAnalysis(models.Model):
         verbose_name = 'noise temperature and gain estimates'
 
 
-class SpectralAnalysis(models.Model):
+class SpectralAnalysis(AnalysisArraysMixin, AnalysisScalarsMixin, models.Model):
     'Results of the analysis of a long-acquisition test'
 
     test = models.ForeignKey(to=PolarimeterTest, on_delete=models.CASCADE)
 
     analysis_results = JSONField(blank=True)
+
+    scalar_keys = (
+        ('test_duration_hr', ('test_duration_hr',), scalar_to_float),
+        ('slope_i', ('I', 'slope'), scalar_to_float),
+        ('slope_q', ('Q', 'slope'), scalar_to_float),
+        ('f_knee_q_hz', ('Q', 'f_knee_hz'), scalar_to_float),
+        ('wn_level_q_k2_hz', ('Q', 'WN_level_K2_hz'), scalar_to_float),
+        ('slope_u', ('U', 'slope'), scalar_to_float),
+        ('f_knee_u_hz', ('U', 'f_knee_hz'), scalar_to_float),
+        ('wn_level_u_k2_hz', ('U', 'WN_level_K2_hz'), scalar_to_float),
+        ('analysis_date', ('analysis_date',), scalar_to_date),
+    )
+    test_duration_hr = models.FloatField(null=True, editable=False)
+    slope_i = models.FloatField(null=True, editable=False)
+    slope_q = models.FloatField(null=True, editable=False)
+    f_knee_q_hz = models.FloatField(null=True, editable=False, db_index=True)
+    wn_level_q_k2_hz = models.FloatField(null=True, editable=False)
+    slope_u = models.FloatField(null=True, editable=False)
+    f_knee_u_hz = models.FloatField(null=True, editable=False, db_index=True)
+    wn_level_u_k2_hz = models.FloatField(null=True, editable=False)
+    analysis_date = models.DateField(null=True, editable=False)
     report_file = models.FileField(
         verbose_name='Report', upload_to='reports/',
         validators=[validate_report_file_ext], blank=True)
+    arrays_file = models.FileField(
+        upload_to='analysis_arrays/', blank=True, editable=False)
 
     author = models.ForeignKey(
         settings.AUTH_USER_MODEL, related_name='spectral_owned')
@@ -496,15 +1137,31 @@ class SpectralAnalysis(models.Model):
         verbose_name = 'noise analysis for tests done in stable conditions'
 
 
-class BandpassAnalysis(models.Model):
+class BandpassAnalysis(AnalysisArraysMixin, AnalysisScalarsMixin, models.Model):
     'Results of the analysis of a bandpass test'
 
     test = models.ForeignKey(to=PolarimeterTest, on_delete=models.CASCADE)
 
     analysis_results = JSONField(blank=True)
+
+    scalar_keys = (
+        ('central_nu_ghz', ('central_nu_ghz',), scalar_to_float),
+        ('central_nu_err_ghz', ('central_nu_err',), scalar_to_float),
+        ('bandwidth_ghz', ('bandwidth_ghz',), scalar_to_float),
+        ('bandwidth_err_ghz', ('bandwidth_err',), scalar_to_float),
+        ('analysis_date', ('analysis_date',), scalar_to_date),
+    )
+    central_nu_ghz = models.FloatField(
+        null=True, editable=False, db_index=True)
+    central_nu_err_ghz = models.FloatField(null=True, editable=False)
+    bandwidth_ghz = models.FloatField(null=True, editable=False, db_index=True)
+    bandwidth_err_ghz = models.FloatField(null=True, editable=False)
+    analysis_date = models.DateField(null=True, editable=False)
     report_file = models.FileField(
         verbose_name='Report', upload_to='reports/',
         validators=[validate_report_file_ext], blank=True)
+    arrays_file = models.FileField(
+        upload_to='analysis_arrays/', blank=True, editable=False)
 
     author = models.ForeignKey(
         settings.AUTH_USER_MODEL, related_name='bandpass_owned')
@@ -517,3 +1174,181 @@ class BandpassAnalysis(models.Model):
 
     class Meta:
         verbose_name = 'noise analysis for tests done in stable conditions'
+
+
+IV_CURVE_CHOICES = (
+    ('IDVD', 'HEMT, drain current vs drain voltage'),
+    ('IDVG', 'HEMT, drain current vs gate voltage'),
+    ('IFVF', 'Diode, forward current vs forward voltage'),
+    ('IRVR', 'Diode, reverse current vs reverse voltage'),
+)
+
+
+class IVCurveAnalysis(AnalysisScalarsMixin, models.Model):
+    '''Parameters fitted to the I-V curves of one component of a polarimeter
+
+    There is one object for each dataset (e.g. "HA1/IDVG") in the HDF5 file
+    of the test. Only the columns which apply to the kind of curve are set.
+    '''
+
+    test = models.ForeignKey(to=PolarimeterTest, on_delete=models.CASCADE)
+    component = models.CharField(max_length=8)
+    curve = models.CharField(max_length=4, choices=IV_CURVE_CHOICES)
+
+    analysis_results = JSONField(blank=True)
+
+    scalar_keys = (
+        ('transconductance_s', ('transconductance_S',), scalar_to_float),
+        ('pinch_off_v', ('pinch_off_V',), scalar_to_float),
+        ('output_conductance_s', ('output_conductance_S',), scalar_to_float),
+        ('drain_current_a', ('drain_current_A',), scalar_to_float),
+        ('ideality_factor', ('ideality_factor',), scalar_to_float),
+        ('saturation_current_a', ('saturation_current_A',), scalar_to_float),
+        ('forward_voltage_v', ('forward_voltage_V',), scalar_to_float),
+        ('leakage_current_a', ('leakage_current_A',), scalar_to_float),
+        ('reverse_resistance_ohm', ('reverse_resistance_ohm',), scalar_to_float),
+        ('analysis_date', ('analysis_date',), scalar_to_date),
+    )
+    transconductance_s = models.FloatField(null=True, editable=False)
+    pinch_off_v = models.FloatField(null=True, editable=False)
+    output_conductance_s = models.FloatField(null=True, editable=False)
+    drain_current_a = models.FloatField(null=True, editable=False)
+    ideality_factor = models.FloatField(null=True, editable=False)
+    saturation_current_a = models.FloatField(null=True, editable=False)
+    forward_voltage_v = models.FloatField(null=True, editable=False)
+    leakage_current_a = models.FloatField(null=True, editable=False)
+    reverse_resistance_ohm = models.FloatField(null=True, editable=False)
+    analysis_date = models.DateField(null=True, editable=False)
+
+    author = models.ForeignKey(
+        settings.AUTH_USER_MODEL, related_name='iv_curves_owned')
+
+    def __str__(self):
+        return '{0}/{1} for {2}'.format(self.component, self.curve, self.test)
+
+    class Meta:
+        verbose_name = 'fit of I-V curves'
+        unique_together = ('test', 'component', 'curve')
+        indexes = [
+            models.Index(fields=['component', 'curve'], name='ivcurve_comp_curve_idx'),
+        ]
+
+
+class AnalysisRun(models.Model):
+    '''Inputs used by the server to compute the analyses of a test
+
+    Every time an analysis engine (a management command like
+    "compute_spectra") processes a test, it records here the hash of the
+    samples in the data file, the hash of the housekeeping rows it used (e.g.
+    the temperatures), the version of the algorithm, and its parameters. If any
+    of them changes, the analyses listed in "analysis_ids" are stale, and the
+    command "recompute" will compute them again.
+    '''
+
+    test = models.ForeignKey(to=PolarimeterTest, on_delete=models.CASCADE)
+    engine = models.CharField(max_length=64)
+    algorithm_version = models.CharField(max_length=32)
+    parameters = JSONField(blank=True)
+
+    data_file_hash = models.CharField(max_length=64)
+    # Used to avoid computing the hash again if the file was not touched
+    data_file_size = models.BigIntegerField()
+    data_file_mtime = models.FloatField()
+    housekeeping_hash = models.CharField(max_length=64)
+
+    # Primary keys of the objects created by the engine
+    analysis_ids = JSONField(blank=True)
+    run_date = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{0} on {1}'.format(self.engine, self.test)
+
+    class Meta:
+        verbose_name = 'run of an analysis engine'
+        unique_together = ('test', 'engine')
+
+
+GLITCH_KIND_CHOICES = (
+    (EVENT_SPIKE, 'Spike'),
+    (EVENT_RAIL, 'ADC saturation'),
+    (EVENT_JUMP, 'Jump'),
+)
+
+
+class GlitchEvent(models.Model):
+    '''Glitch, saturation or jump found in the time series of a test
+
+    Events are detected when the data file is converted (see "glitches.py"),
+    and they are saved both in the HDF5 file and in this table, so that they
+    can be searched across many tests. Samples are counted from the beginning
+    of the time series, and "stop_sample" is not included in the event.
+    '''
+
+    test = models.ForeignKey(to=PolarimeterTest, on_delete=models.CASCADE,
+                             related_name='glitch_events')
+    kind = models.CharField(max_length=8, choices=GLITCH_KIND_CHOICES)
+    channel = models.CharField(max_length=16)
+    start_sample = models.BigIntegerField()
+    stop_sample = models.BigIntegerField()
+    severity = models.FloatField()
+
+    def __str__(self):
+        return '{0} in {1} ({2}-{3}) for {4}'.format(
+            self.kind, self.channel, self.start_sample, self.stop_sample, self.test)
+
+    class Meta:
+        verbose_name = 'glitch in the time series'
+        indexes = [
+            models.Index(fields=['kind', 'severity'], name='glitch_kind_severity_idx'),
+            models.Index(fields=['channel', 'kind'], name='glitch_channel_kind_idx'),
+        ]
+
+
+class IngestRecord(models.Model):
+    '''Timing and memory usage of the conversion of a data file
+
+    A record is saved every time "PolarimeterTest.save" converts a data file
+    which has just been uploaded.
+    The field "trace" contains the nested stages of the conversion (see
+    "tracing.py"), each with its wall-clock and CPU time, bytes read and
+    written, and memory peaks. The command "ingest_report" summarizes them.
+    '''
+
+    test = models.ForeignKey(to=PolarimeterTest, on_delete=models.CASCADE,
+                             related_name='ingest_records')
+    date = models.DateTimeField(auto_now_add=True, db_index=True)
+    file_name = models.CharField(max_length=1024)
+    file_format = models.CharField(max_length=16)
+    file_size = models.BigIntegerField()
+    wall_time_s = models.FloatField()
+    peak_traced_bytes = models.BigIntegerField(null=True, blank=True)
+    peak_rss_bytes = models.BigIntegerField(null=True, blank=True)
+    trace = JSONField(blank=True)
+
+    def __str__(self):
+        return 'ingestion of "{0}" for {1}'.format(self.file_name, self.test)
+
+    class Meta:
+        verbose_name = 'ingestion of a data file'
+
+
+# Models whose scalar results are stored in typed columns
+ANALYSIS_MODELS = (
+    NoiseTemperatureAnalysis,
+    SpectralAnalysis,
+    BandpassAnalysis,
+    IVCurveAnalysis,
+)
+
+
+def delete_arrays_file(sender, instance, **kwargs):
+    'Delete the NPZ file of an analysis which has been deleted, if unused'
+
+    if instance.arrays_file:
+        delete_unreferenced_arrays_file(sender, instance.arrays_file.storage,
+                                        instance.arrays_file.name)
+
+
+for cur_model in ANALYSIS_MODELS:
+    if issubclass(cur_model, AnalysisArraysMixin):
+        post_delete.connect(delete_arrays_file, sender=cur_model)
@@ -0,0 +1,22 @@
+# -*- encoding: utf-8 -*-
+
+'''Renderers used by the REST API of the "unittest" application
+'''
+
+from rest_framework.renderers import BaseRenderer
+
+
+class NpzRenderer(BaseRenderer):
+    '''Send binary data saved using NumPy's "savez"
+
+    Views using this renderer must pass the bytes of the NPZ file to the
+    response when this renderer has been selected.
+    '''
+
+    media_type = 'application/x-npz'
+    format = 'npz'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
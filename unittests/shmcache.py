@@ -0,0 +1,307 @@
+# -*- encoding: utf-8 -*-
+
+'''Cache of decompressed time series shared by the worker processes
+
+When many WSGI workers serve the same test, each of them would decompress the
+same columns of "time_series". If SHM_CACHE_BYTES is larger than zero in the
+settings, the columns read through "read_time_series_columns" are instead
+copied into POSIX shared memory segments, and every worker gets read-only
+NumPy views of them without copying data.
+
+The segments are listed in a small index, which is itself a shared memory
+segment containing a NumPy structured array; a lock file serializes the
+changes to it. Entries are keyed by the path and modification time of the
+file and by the name of the column, so that a modified file is never read
+from the cache. When the total size of the segments would exceed
+SHM_CACHE_BYTES, the least recently used ones are removed.
+
+The cache requires Python 3.8 or newer ("multiprocessing.shared_memory") and
+a POSIX system; otherwise the columns are always read from the file.
+'''
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+from django.conf import settings
+import numpy as np
+
+from .h5storage import file_version, local_path, open_h5_file
+from .timing import count_hdf5_bytes
+
+try:
+    import fcntl
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    fcntl = None
+    resource_tracker = None
+    shared_memory = None
+
+# Maximum number of columns in the cache
+MAX_ENTRIES = 256
+
+INDEX_DATA_TYPE = np.dtype([
+    ('key', 'S40'),
+    ('segment', 'S40'),
+    ('dtype', 'S8'),
+    ('length', np.int64),
+    ('nbytes', np.int64),
+    ('last_access', np.float64),
+])
+
+# Get an instance of a logger
+LOGGER = logging.getLogger(__name__)
+
+
+def untrack(segment):
+    '''Prevent the resource tracker from removing a segment when the process ends
+
+    Segments are shared by all the workers, and they must survive the one
+    which created them; they are removed by the cache itself.'''
+
+    try:
+        resource_tracker.unregister(segment._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+class SharedColumnCache:
+    '''LRU cache of NumPy arrays kept in shared memory segments
+
+    All the instances created with the same "prefix" (even in different
+    processes) share the same segments.'''
+
+    def __init__(self, max_bytes, prefix='stdb2'):
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self.lock_file_name = os.path.join(tempfile.gettempdir(),
+                                           '{0}_shm.lock'.format(prefix))
+
+        # Segments attached by this process, indexed by name
+        self.attached = {}
+
+        with self.locked():
+            try:
+                self.index_segment = shared_memory.SharedMemory(
+                    name='{0}_index'.format(prefix), create=True,
+                    size=MAX_ENTRIES * INDEX_DATA_TYPE.itemsize)
+            except FileExistsError:
+                self.index_segment = shared_memory.SharedMemory(
+                    name='{0}_index'.format(prefix))
+            untrack(self.index_segment)
+
+        self.index = np.ndarray((MAX_ENTRIES,), dtype=INDEX_DATA_TYPE,
+                                buffer=self.index_segment.buf)
+
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def locked(self):
+        'Context manager which gives exclusive access to the index'
+
+        with open(self.lock_file_name, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _find(self, key):
+        matches = np.flatnonzero(self.index['key'] == key.encode('utf-8'))
+        return matches[0] if len(matches) else None
+
+    def _view(self, entry):
+        name = entry['segment'].decode('utf-8')
+        segment = self.attached.get(name)
+        if segment is None:
+            segment = shared_memory.SharedMemory(name=name)
+            untrack(segment)
+            self.attached[name] = segment
+
+        result = np.ndarray((int(entry['length']),),
+                            dtype=np.dtype(entry['dtype'].decode('utf-8')),
+                            buffer=segment.buf)
+        result.flags.writeable = False
+        return result
+
+    def _remove(self, idx):
+        name = self.index[idx]['segment'].decode('utf-8')
+        self.index[idx] = np.zeros(1, dtype=INDEX_DATA_TYPE)[0]
+        try:
+            # Processes which attached the segment can still use it
+            segment = shared_memory.SharedMemory(name=name)
+            segment.close()
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _detach_removed(self):
+        'Close the segments of this process which are no longer in the index'
+
+        names = set(x.decode('utf-8') for x in self.index['segment'] if x)
+        for name in [x for x in self.attached.keys() if x not in names]:
+            try:
+                self.attached[name].close()
+                del self.attached[name]
+            except BufferError:
+                # Some array still points to the segment
+                pass
+
+    def get(self, key):
+        'Return a read-only view of the array associated with "key", or None'
+
+        with self.locked():
+            idx = self._find(key)
+            if idx is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.index['last_access'][idx] = time.time()
+            return self._view(self.index[idx])
+
+    def put(self, key, array):
+        '''Copy "array" into shared memory and return a read-only view of it
+
+        If the array does not fit in the cache, it is returned unchanged.'''
+
+        array = np.ascontiguousarray(array)
+        if array.nbytes == 0 or array.nbytes > self.max_bytes or \
+           len(array.dtype.str) > INDEX_DATA_TYPE['dtype'].itemsize:
+            return array
+
+        with self.locked():
+            self._detach_removed()
+
+            idx = self._find(key)
+            if idx is not None:
+                # Another process has just saved the same array
+                return self._view(self.index[idx])
+
+            used = self.index['nbytes'] > 0
+            while used.any() and (self.index['nbytes'].sum() + array.nbytes > self.max_bytes
+                                  or used.all()):
+                oldest = np.flatnonzero(used)[np.argmin(self.index['last_access'][used])]
+                self._remove(oldest)
+                used = self.index['nbytes'] > 0
+
+            name = '{0}_{1}'.format(self.prefix, key[:24])
+            try:
+                segment = shared_memory.SharedMemory(name=name, create=True,
+                                                     size=array.nbytes)
+            except FileExistsError:
+                # Left behind by a process which crashed while saving it
+                stale_segment = shared_memory.SharedMemory(name=name)
+                stale_segment.close()
+                stale_segment.unlink()
+                segment = shared_memory.SharedMemory(name=name, create=True,
+                                                     size=array.nbytes)
+            untrack(segment)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[:] = array
+            self.attached[name] = segment
+
+            idx = np.flatnonzero(~used)[0]
+            self.index[idx] = (key, name, array.dtype.str, len(array),
+                               array.nbytes, time.time())
+            return self._view(self.index[idx])
+
+    def clear(self):
+        'Remove all the segments in the cache'
+
+        with self.locked():
+            for idx in np.flatnonzero(self.index['nbytes'] > 0):
+                self._remove(idx)
+
+            self._detach_removed()
+
+    def stats(self):
+        'Return a dictionary describing the content of the cache'
+
+        used = self.index['nbytes'] > 0
+        return OrderedDict([
+            ('entries', int(np.count_nonzero(used))),
+            ('bytes', int(self.index['nbytes'][used].sum())),
+            ('max_bytes', self.max_bytes),
+            ('hits', self.hits),
+            ('misses', self.misses),
+        ])
+
+
+# One instance per process, created on first use
+_CACHE = None
+_CACHE_PID = None
+
+
+def get_cache():
+    'Return the cache of this process, or None if it is disabled or unsupported'
+
+    global _CACHE, _CACHE_PID
+
+    if settings.SHM_CACHE_BYTES <= 0 or shared_memory is None:
+        return None
+
+    if _CACHE is None or _CACHE_PID != os.getpid():
+        _CACHE = SharedColumnCache(settings.SHM_CACHE_BYTES,
+                                   prefix=settings.SHM_CACHE_PREFIX)
+        _CACHE_PID = os.getpid()
+
+    return _CACHE
+
+
+def file_key(data_file):
+    'Return a string identifying the current contents of "data_file"'
+
+    path = local_path(data_file)
+    name = os.path.abspath(path) if path is not None else data_file.name
+    return '{0}:{1}'.format(name, file_version(data_file))
+
+
+def column_key(key_of_file, column):
+    'Return the key identifying a column of "time_series" in the cache'
+
+    text = '{0}:{1}'.format(key_of_file, column)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def read_time_series_columns(data_file, columns, start=0, stop=None):
+    '''Return the samples in [start, stop) of the columns of "time_series"
+
+    The parameter "data_file" is a path or a file in a storage (see
+    "h5storage.py"). The result is a dictionary associating the name of each
+    column with a NumPy array. If the shared memory cache is enabled, whole
+    columns are read and saved in the cache, and arrays are read-only views
+    of it; otherwise, only the requested samples are read.'''
+
+    window = slice(start, stop)
+    cache = get_cache()
+    key_of_file = file_key(data_file) if cache else None
+    result = OrderedDict()
+    missing = []
+    for cur_column in columns:
+        array = cache.get(column_key(key_of_file, cur_column)) if cache else None
+        if array is None:
+            missing.append(cur_column)
+        else:
+            result[cur_column] = array[window]
+
+    if missing:
+        with open_h5_file(data_file) as h5_file:
+            # Read all the columns at once, so that chunks are decompressed
+            # only once
+            rows = slice(None) if cache else window
+            data = h5_file['time_series'][(rows,) + tuple(missing)]
+            count_hdf5_bytes(read=data.nbytes)
+
+            for cur_column in missing:
+                # h5py returns a plain array if only one column is requested
+                array = data[cur_column] if len(missing) > 1 else data
+                if cache:
+                    array = cache.put(column_key(key_of_file, cur_column), array)[window]
+                result[cur_column] = array
+
+    return OrderedDict([(x, result[x]) for x in columns])
@@ -0,0 +1,267 @@
+# -*- encoding: utf-8 -*-
+
+'''Estimation of the noise spectra of long acquisitions
+
+This module computes the power spectral density of the DEM/PWR outputs and
+of the Stokes parameters using Welch's method, and fits a 1/f model to it.
+The time series is read in chunks, so that the memory used does not depend
+on the length of the acquisition.
+
+The functions in this module do not access the database, so that they can
+be run in a pool of processes (see "batch.py").
+'''
+
+from datetime import date
+import logging
+import math
+
+import h5py
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from .file_conversions import (
+    DEM_COLUMNS,
+    PWR_COLUMNS,
+    SAMPLING_FREQUENCY,
+    STOKES_COMBINATIONS,
+    stokes_weight_matrix,
+)
+
+# Increase this whenever a change in the code changes the results
+ALGORITHM_VERSION = '1.0'
+
+DEFAULT_SEGMENT_LENGTH = 2 ** 14
+DEFAULT_CHUNK_SAMPLES = 2 ** 18
+DEFAULT_WHITE_NOISE_MIN_FREQ_HZ = 1.0
+DEFAULT_NUM_OF_LOG_BINS = 64
+
+# Get an instance of a logger
+LOGGER = logging.getLogger(__name__)
+
+
+def choose_segment_length(num_of_samples, segment_length):
+    '''Return the length of the segments used to compute the spectrum
+
+    Short acquisitions use shorter segments, so that at least two of them are
+    averaged. Return None if the time series is too short.'''
+
+    max_length = 2 ** int(math.log2(max(num_of_samples // 2, 1)))
+    result = min(segment_length, max_length)
+    if result < 16:
+        return None
+
+    return result
+
+
+def iterate_chunks(dataset, columns, chunk_samples):
+    'Yield 2D arrays (one row per column) containing consecutive samples'
+
+    weights = stokes_weight_matrix(list(columns))
+    for start in range(0, dataset.shape[0], chunk_samples):
+        stop = min(start + chunk_samples, dataset.shape[0])
+        chunk = dataset[(slice(start, stop),) + tuple(columns)]
+        channels = np.stack([chunk[x].astype(np.float64) for x in columns])
+
+        # Append the Stokes parameters to the detector outputs
+        yield np.vstack([channels, weights @ channels])
+
+
+def welch_psd(chunks, segment_length, sampling_frequency):
+    '''Compute the averaged power spectra of a set of time streams
+
+    The parameter "chunks" must be an iterable over 2D arrays with shape
+    (number of streams, samples). Segments overlap by 50% and are multiplied
+    by a Hann window; the mean of each segment is removed. Return a tuple
+    containing the frequencies, the one-sided PSD (one row per stream), and
+    the number of segments that have been averaged.
+    '''
+
+    hop = segment_length // 2
+    window = np.hanning(segment_length)
+    scale = 1.0 / (sampling_frequency * np.sum(window ** 2))
+
+    psd_sum = None
+    num_of_segments = 0
+    leftover = None
+    for chunk in chunks:
+        if leftover is not None:
+            chunk = np.hstack([leftover, chunk])
+
+        cur_segments = (chunk.shape[1] - segment_length) // hop + 1
+        if cur_segments <= 0:
+            leftover = chunk
+            continue
+
+        # Build a (streams, segments, samples) view without copying data
+        segments = as_strided(
+            chunk,
+            shape=(chunk.shape[0], cur_segments, segment_length),
+            strides=(chunk.strides[0], hop * chunk.strides[1], chunk.strides[1]),
+            writeable=False)
+        segments = (segments - segments.mean(axis=2, keepdims=True)) * window
+        power = np.abs(np.fft.rfft(segments, axis=2)) ** 2
+
+        if psd_sum is None:
+            psd_sum = power.sum(axis=1)
+        else:
+            psd_sum += power.sum(axis=1)
+
+        num_of_segments += cur_segments
+        leftover = chunk[:, cur_segments * hop:].copy()
+
+    if not num_of_segments:
+        return None, None, 0
+
+    psd = psd_sum * scale / num_of_segments
+    # One-sided spectrum: double everything but the DC and Nyquist terms
+    psd[:, 1:] *= 2.0
+    if segment_length % 2 == 0:
+        psd[:, -1] /= 2.0
+
+    freq = np.fft.rfftfreq(segment_length, d=1.0 / sampling_frequency)
+    return freq, psd, num_of_segments
+
+
+def log_bin_matrix(freq, num_of_bins):
+    '''Return a matrix which averages a spectrum in logarithmic bins
+
+    Multiplying a spectrum by the transpose of this matrix produces the
+    average of the spectrum in each bin. The DC term is ignored. Empty bins
+    are removed.'''
+
+    edges = np.logspace(np.log10(freq[1]), np.log10(freq[-1]), num_of_bins + 1)
+    bin_idx = np.clip(np.digitize(freq, edges) - 1, 0, num_of_bins - 1)
+    matrix = np.zeros((num_of_bins, len(freq)))
+    matrix[bin_idx[1:], np.arange(1, len(freq))] = 1.0
+
+    counts = matrix.sum(axis=1)
+    matrix = matrix[counts > 0]
+    return matrix / counts[counts > 0][:, np.newaxis]
+
+
+def fit_one_over_f(freq, psd,
+                   white_noise_min_freq_hz=DEFAULT_WHITE_NOISE_MIN_FREQ_HZ,
+                   num_of_log_bins=DEFAULT_NUM_OF_LOG_BINS):
+    '''Fit the model P(f) = WN * (1 + (f_knee / f)^alpha) to many spectra
+
+    The white noise level WN is the median of the spectrum above
+    "white_noise_min_freq_hz" (or above half the Nyquist frequency, if this
+    is lower). The slope alpha and the knee frequency are estimated through
+    a linear fit of log(P/WN - 1) versus log(f) on the log-binned spectrum
+    below that frequency. All the spectra in the rows of "psd" are fitted at
+    once. Return a dictionary of arrays with one element per row; quantities
+    which cannot be estimated are NaN.
+    '''
+
+    white_noise_min_freq_hz = min(white_noise_min_freq_hz, freq[-1] / 2)
+    white_mask = freq >= white_noise_min_freq_hz
+    white_level = np.median(psd[:, white_mask], axis=1)
+    delta_white_level = np.std(psd[:, white_mask], axis=1) / \
+        np.sqrt(np.count_nonzero(white_mask))
+
+    bin_matrix = log_bin_matrix(freq, num_of_log_bins)
+    binned_freq = bin_matrix @ freq
+    binned_psd = psd @ bin_matrix.T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        excess = binned_psd / white_level[:, np.newaxis] - 1.0
+        usable = (excess > 0.0) & (binned_freq < white_noise_min_freq_hz)
+        x = np.log(binned_freq)[np.newaxis, :] * np.ones_like(excess)
+        y = np.where(usable, np.log(excess), 0.0)
+
+        # Least-squares fit of y = a + b x on the usable bins of each row
+        weights = usable.astype(np.float64)
+        num = weights.sum(axis=1)
+        sum_x = (weights * x).sum(axis=1)
+        sum_y = (weights * y).sum(axis=1)
+        sum_xx = (weights * x * x).sum(axis=1)
+        sum_xy = (weights * x * y).sum(axis=1)
+        det = num * sum_xx - sum_x ** 2
+        slope = (num * sum_xy - sum_x * sum_y) / det
+        intercept = (sum_y - slope * sum_x) / num
+
+        residuals = weights * (y - intercept[:, np.newaxis] - slope[:, np.newaxis] * x)
+        sigma2 = (residuals ** 2).sum(axis=1) / (num - 2)
+        var_slope = sigma2 * num / det
+        var_intercept = sigma2 * sum_xx / det
+        covariance = -sigma2 * sum_x / det
+
+        alpha = -slope
+        f_knee = np.exp(-intercept / slope)
+        # Propagate the errors on a and b into log(f_knee) = -a / b
+        var_log_f_knee = var_intercept / slope ** 2 + \
+            intercept ** 2 * var_slope / slope ** 4 - \
+            2 * intercept * covariance / slope ** 3
+        delta_f_knee = f_knee * np.sqrt(var_log_f_knee)
+
+    invalid = (num < 3) | (alpha <= 0.0)
+    for cur_array in (alpha, f_knee, delta_f_knee, var_slope):
+        cur_array[invalid] = np.nan
+
+    return {
+        'slope': alpha,
+        'delta_slope': np.sqrt(var_slope),
+        'f_knee_hz': f_knee,
+        'delta_f_knee_hz': delta_f_knee,
+        'WN_level_ADU2_hz': white_level,
+        'delta_WN_level_ADU2_hz': delta_white_level,
+    }
+
+
+def to_json_float(value):
+    'Convert a NumPy number into a float, turning NaNs into None'
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+def compute_spectral_analysis(h5_file_name,
+                              segment_length=DEFAULT_SEGMENT_LENGTH,
+                              chunk_samples=DEFAULT_CHUNK_SAMPLES,
+                              white_noise_min_freq_hz=DEFAULT_WHITE_NOISE_MIN_FREQ_HZ):
+    '''Compute the noise spectra of a test and fit them
+
+    Return a JSON record suitable for the "analysis_results" field of a
+    "SpectralAnalysis" object, or None if the file does not contain a time
+    series long enough.
+    '''
+
+    columns = DEM_COLUMNS + PWR_COLUMNS
+    stream_names = list(columns) + list(STOKES_COMBINATIONS.keys())
+
+    with h5py.File(h5_file_name, 'r') as h5_file:
+        if 'time_series' not in h5_file:
+            return None
+
+        dataset = h5_file['time_series']
+        num_of_samples = dataset.shape[0]
+        cur_segment_length = choose_segment_length(num_of_samples, segment_length)
+        if not cur_segment_length:
+            LOGGER.debug('"%s" is too short (%d samples) to compute a spectrum',
+                         h5_file_name, num_of_samples)
+            return None
+
+        # Chunks must contain at least one segment
+        chunk_samples = max(chunk_samples, cur_segment_length)
+        freq, psd, num_of_segments = welch_psd(
+            iterate_chunks(dataset, columns, chunk_samples),
+            cur_segment_length, SAMPLING_FREQUENCY)
+
+    fit = fit_one_over_f(freq, psd, white_noise_min_freq_hz)
+
+    result = {
+        'estimation_method': 'Welch periodogram, 1/f fit on log-binned spectrum',
+        'code_version': ALGORITHM_VERSION,
+        'analysis_date': date.today().strftime('%Y-%m-%d'),
+        'sampling_frequency_hz': SAMPLING_FREQUENCY,
+        'test_duration_hr': num_of_samples / SAMPLING_FREQUENCY / 3600.0,
+        'segment_length': cur_segment_length,
+        'num_of_segments': num_of_segments,
+        'frequency_hz': freq.tolist(),
+    }
+    for stream_idx, stream_name in enumerate(stream_names):
+        stream_result = {key: to_json_float(value[stream_idx])
+                         for key, value in fit.items()}
+        stream_result['psd_ADU2_hz'] = psd[stream_idx].tolist()
+        result[stream_name] = stream_result
+
+    return result
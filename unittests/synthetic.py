@@ -0,0 +1,607 @@
+# -*- encoding: utf-8 -*-
+
+'''Synthetic data files and databases for scale and load tests
+
+This module produces inputs which look like the real ones, in any size:
+
+- text files in the format of the acquisition software used in Bicocca
+  ("SyntheticTest"), with white and 1/f noise, phase-switch patterns,
+  glitches, and either frequency sweeps (bandpass tests) or steps in the
+  temperature of the load (Y-factor tests);
+- ZIP files containing Excel files saved by the Keithley machine
+  ("write_keithley_zip"), with I-V curves of HEMTs, detectors and phase
+  switches;
+- databases filled with tests, housekeeping data and analyses
+  ("populate_database").
+
+The results of the analyses stored by "populate_database" are produced by
+running the analysis engines on synthetic files once per kind of test: every
+test gets a copy of the result, with the scalar values varied randomly.
+All the functions take a "seed", so that their output is reproducible.
+'''
+
+from copy import deepcopy
+from datetime import date, timedelta
+from io import BytesIO
+import logging
+import os
+from tempfile import TemporaryDirectory
+from zipfile import ZIP_DEFLATED, ZipFile
+
+import numpy as np
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .bandpass import compute_bandpass_analysis
+from .file_conversions import (DEM_COLUMNS, PWR_COLUMNS, SAMPLING_FREQUENCY,
+                               TEXT_FILE_COLUMNS, convert_text_file_to_h5)
+from .models import (AdcOffset, BandpassAnalysis, Biases, DetectorOutput,
+                     NoiseTemperatureAnalysis, Operator, PolarimeterTest,
+                     SpectralAnalysis, Temperatures, TestType, create_pwr_plot,
+                     extract_large_arrays)
+from .spectra import compute_spectral_analysis
+from .tnoise import compute_tnoise_analysis
+
+# Get an instance of a logger
+LOGGER = logging.getLogger(__name__)
+
+# Kinds of synthetic tests, and the description of their "TestType"
+TEST_KINDS = {
+    'noise': 'Long acquisition (synthetic)',
+    'bandpass': 'Bandpass (synthetic)',
+    'tnoise': 'Y-factor (synthetic)',
+}
+
+# Name of the user owning the objects created by "populate_database"
+SYNTHETIC_USER_NAME = 'synthetic'
+
+# First line of the text files saved by the acquisition software
+TEXT_FILE_HEADER = '\t'.join(['PCTIME', 'PHB', 'RECORD',
+                              'DEM0', 'DEM1', 'DEM2', 'DEM3',
+                              'PWR0', 'PWR1', 'PWR2', 'PWR3',
+                              'RF POWER', 'FREQUENCY'])
+
+# Number of samples generated at once: the 1/f noise of consecutive blocks
+# is not correlated, which is negligible for blocks this long (~12 hours)
+BLOCK_SAMPLES = 2 ** 20
+
+# Gain of the four detectors (ADU/K) and noise temperature (K)
+DETECTOR_GAINS = np.array([90.0, 110.0, 105.0, 95.0])
+NOISE_TEMPERATURE_K = 30.0
+# Temperature of the load when it is not being changed (K)
+LOAD_TEMPERATURE_K = 20.0
+# Offsets of the DEM outputs, whose sign is flipped by the phase switches
+DEM_OFFSETS = np.array([400.0, -250.0, 300.0, -350.0])
+
+# The four states of the phase switches (the PHB column contains the index
+# in this tuple) and the sign of the DEM outputs (Q1, U1, U2, Q2) in each
+PHASE_SWITCH_STATES = ('0101', '0110', '1010', '1001')
+PHASE_SWITCH_SIGNS = np.array([
+    [1, 1, 1, 1],
+    [1, -1, -1, 1],
+    [-1, 1, 1, -1],
+    [-1, -1, -1, -1],
+])
+
+# Bands of the polarimeters: central frequency and width of the sweep (Hz)
+BANDS = {
+    'Q': (43e9, 8e9),
+    'W': (95e9, 18e9),
+}
+
+# Power of the RF source during bandpass tests (dB)
+RF_POWER_DB = -10.0
+
+
+def one_over_f_noise(generator, num_of_samples, sigma, knee_frequency_hz, slope):
+    '''Return a realization of noise with a 1/f^slope spectrum and a white floor
+
+    The noise has standard deviation "sigma" at frequencies much higher than
+    "knee_frequency_hz".'''
+
+    white = generator.normal(scale=sigma, size=num_of_samples)
+    if knee_frequency_hz <= 0.0 or num_of_samples < 2:
+        return white
+
+    spectrum = np.fft.rfft(white)
+    freq = np.fft.rfftfreq(num_of_samples, d=1.0 / SAMPLING_FREQUENCY)
+    freq[0] = freq[1]
+    spectrum *= np.sqrt(1.0 + (knee_frequency_hz / freq) ** slope)
+    return np.fft.irfft(spectrum, n=num_of_samples)
+
+
+class SyntheticTest:
+    '''A test acquired with the Bicocca acquisition software, with synthetic data
+
+    The PWR outputs are the product of the gain of each detector and the sum
+    of the load and noise temperatures, with white noise of amplitude
+    "white_noise_adu" plus 1/f noise common to the four detectors (gain
+    fluctuations) with knee frequency "knee_frequency_hz". The DEM outputs
+    have a constant offset whose sign depends on the state of the phase
+    switches, which cycle among PHASE_SWITCH_STATES every
+    "phase_switch_period_s" seconds (if it is zero, they stay in the first
+    state). The RECORD flag is set during the first half of each phase
+    switch period. Glitches (spikes of 50 sigma in one detector) occur at the
+    rate "glitch_rate_hz".
+
+    The parameter "kind" is one of the keys of TEST_KINDS:
+
+    - "noise": nothing else changes;
+    - "bandpass": the frequency of the RF source is swept in "num_of_steps"
+      steps across the band, and the PWR outputs follow a Gaussian bandpass;
+    - "tnoise": the temperature of the load is changed in "num_of_steps"
+      steps (see "load_temperatures").
+    '''
+
+    def __init__(self, duration_s, kind='noise', band='Q', seed=1,
+                 white_noise_adu=15.0, knee_frequency_hz=0.05, slope=1.0,
+                 phase_switch_period_s=60.0, num_of_steps=8, glitch_rate_hz=0.0,
+                 start_pctime=700):
+        if kind not in TEST_KINDS:
+            raise ValueError('unknown kind of test "{0}"'.format(kind))
+        if band not in BANDS:
+            raise ValueError('unknown band "{0}"'.format(band))
+
+        self.num_of_samples = int(duration_s * SAMPLING_FREQUENCY)
+        self.kind = kind
+        self.band = band
+        self.seed = seed
+        self.white_noise_adu = white_noise_adu
+        self.knee_frequency_hz = knee_frequency_hz
+        self.slope = slope
+        self.phase_switch_period_s = phase_switch_period_s
+        self.num_of_steps = num_of_steps
+        self.glitch_rate_hz = glitch_rate_hz
+        self.start_pctime = start_pctime
+
+    @property
+    def phsw_state(self):
+        'Value of the field "phsw_state" of a "PolarimeterTest" with this data'
+
+        if self.phase_switch_period_s > 0:
+            return 'switching'
+
+        return PHASE_SWITCH_STATES[0]
+
+    def load_temperatures(self):
+        'Return the list of temperatures of the load (K), one per step'
+
+        if self.kind != 'tnoise':
+            return [LOAD_TEMPERATURE_K]
+
+        return list(np.linspace(LOAD_TEMPERATURE_K, 4 * LOAD_TEMPERATURE_K,
+                                self.num_of_steps))
+
+    def frequencies(self):
+        'Return the frequencies of the steps of the sweep (Hz)'
+
+        central_freq, width = BANDS[self.band]
+        return np.linspace(central_freq - width, central_freq + width, self.num_of_steps)
+
+    def step_index(self, sample_idx):
+        'Return the step of the sweep for each sample index'
+
+        step_samples = max(1, self.num_of_samples // self.num_of_steps)
+        return np.minimum(sample_idx // step_samples, self.num_of_steps - 1)
+
+    def blocks(self, block_samples=BLOCK_SAMPLES):
+        '''Yield the samples of the test, in arrays of at most "block_samples"
+
+        Each array has one field for each name in TEXT_FILE_COLUMNS.'''
+
+        generator = np.random.RandomState(self.seed)
+        data_type = np.dtype([(x, np.float64) for x in TEXT_FILE_COLUMNS])
+
+        for start in range(0, self.num_of_samples, block_samples):
+            num = min(block_samples, self.num_of_samples - start)
+            sample_idx = np.arange(start, start + num)
+            block = np.zeros(num, dtype=data_type)
+
+            block['pctime'] = self.start_pctime + sample_idx // int(SAMPLING_FREQUENCY)
+            if self.phase_switch_period_s > 0:
+                period_samples = int(self.phase_switch_period_s * SAMPLING_FREQUENCY)
+                block['phb'] = (sample_idx // period_samples) % len(PHASE_SWITCH_STATES)
+                block['record'] = (sample_idx % period_samples) < period_samples // 2
+
+            # Temperature seen by the detectors
+            if self.kind == 'tnoise':
+                temperature = np.array(self.load_temperatures())[self.step_index(sample_idx)]
+            else:
+                temperature = np.full(num, LOAD_TEMPERATURE_K)
+            temperature = temperature + NOISE_TEMPERATURE_K
+
+            if self.kind == 'bandpass':
+                central_freq, width = BANDS[self.band]
+                freq = self.frequencies()[self.step_index(sample_idx)]
+                response = np.exp(-0.5 * ((freq - central_freq) / (0.4 * width)) ** 2)
+                # The source adds up to 100 K to the temperature of the load
+                temperature = temperature + 100.0 * response
+                block['rfpower_dB'] = RF_POWER_DB
+                block['freq_Hz'] = freq
+            else:
+                block['rfpower_dB'] = -40.0
+                block['freq_Hz'] = -1.0
+
+            gain_fluctuation = one_over_f_noise(
+                generator, num, 1e-3, self.knee_frequency_hz, self.slope)
+            signs = PHASE_SWITCH_SIGNS[block['phb'].astype(int)]
+            for idx, (dem, pwr) in enumerate(zip(DEM_COLUMNS, PWR_COLUMNS)):
+                block[pwr] = (DETECTOR_GAINS[idx] * temperature * (1.0 + gain_fluctuation) +
+                              generator.normal(scale=self.white_noise_adu, size=num))
+                block[dem] = (DEM_OFFSETS[idx] * signs[:, idx] +
+                              generator.normal(scale=self.white_noise_adu, size=num))
+
+            num_of_glitches = generator.poisson(self.glitch_rate_hz * num / SAMPLING_FREQUENCY)
+            for _ in range(num_of_glitches):
+                column = PWR_COLUMNS[generator.randint(len(PWR_COLUMNS))]
+                block[column][generator.randint(num)] += 50.0 * self.white_noise_adu
+
+            yield block
+
+    def write_text_file(self, file_name):
+        'Save the samples in a text file with the format of the acquisition software'
+
+        # Every column is an integer, apart from the frequency
+        formats = ['%d'] * (len(TEXT_FILE_COLUMNS) - 1) + ['%.6f']
+        with open(file_name, 'wt') as output_file:
+            output_file.write(TEXT_FILE_HEADER + '\n')
+            for block in self.blocks():
+                columns = np.column_stack([block[x] for x in TEXT_FILE_COLUMNS])
+                columns[:, :-1] = np.round(columns[:, :-1])
+                np.savetxt(output_file, columns, fmt=formats, delimiter='\t')
+
+
+################################################################################
+# Keithley files
+
+# Curves saved by the Keithley machine: name of the Excel file (as saved by
+# the new machine, see "convert_zip_file_to_h5"), name of the columns, kind
+# of curve
+KEITHLEY_FILES = (
+    [('Id_vs_Vd_H{0}#1@1.xls'.format(x), ('DrainI', 'DrainV', 'GateI', 'GateV'), 'IDVD')
+     for x in range(6)] +
+    [('Id_vs_Vg_H{0}#1@1.xls'.format(x), ('DrainI', 'DrainV', 'GateI', 'GateV'), 'IDVG')
+     for x in range(6)] +
+    [('If_vs_Vf_Det{0}#1@1.xls'.format(x), ('AnodeI', 'AnodeV'), 'IFVF')
+     for x in range(1, 5)] +
+    [('If_vs_Vfd_{0}#1@1.xls'.format(x), ('AnodeI', 'AnodeV'), 'IFVF')
+     for x in ('V1_PS1', 'V2_PS1', 'V1_PS2', 'V2_PS2')] +
+    [('Ir_vs_Vr_{0}#1@1.xls'.format(x), ('AnodeI', 'AnodeV'), 'IRVR')
+     for x in ('V1_PS1', 'V2_PS1', 'V1_PS2', 'V2_PS2')]
+)
+
+
+def keithley_curves(kind, num_of_blocks, points_per_curve, generator):
+    '''Return the columns of a set of I-V curves
+
+    The result is a dictionary associating the base name of each column
+    (e.g., "DrainI") with a 2D array of shape (points_per_curve,
+    num_of_blocks). HEMTs follow a square-law model, diodes the Shockley
+    equation.'''
+
+    block = np.arange(num_of_blocks)[np.newaxis, :]
+    point = np.linspace(0.0, 1.0, points_per_curve)[:, np.newaxis]
+    ones = np.ones((points_per_curve, num_of_blocks))
+    noise_scale = 1e-3
+
+    if kind in ('IDVD', 'IDVG'):
+        threshold_v = -0.6
+        if kind == 'IDVD':
+            # One curve for each gate voltage
+            drain_v = 1.5 * point * ones
+            gate_v = (-0.5 + 0.1 * block) * ones
+        else:
+            # One curve for each drain voltage
+            gate_v = (-1.0 + 1.4 * point) * ones
+            drain_v = (0.2 + 0.2 * block) * ones
+
+        drain_i = (0.05 * np.maximum(gate_v - threshold_v, 0.0) ** 2 *
+                   np.tanh(drain_v / 0.3) * (1.0 + 0.05 * drain_v))
+        drain_i *= 1.0 + generator.normal(scale=noise_scale, size=drain_i.shape)
+        gate_i = 1e-6 * (1.0 + generator.normal(scale=0.1, size=drain_i.shape))
+        return {'DrainI': drain_i, 'DrainV': drain_v, 'GateI': gate_i, 'GateV': gate_v}
+
+    if kind == 'IFVF':
+        anode_v = (0.2 + 0.8 * point) * ones
+        ideality = 1.5 + 0.05 * block
+        anode_i = 1e-9 * np.expm1(anode_v / (ideality * 0.025852))
+        anode_i = np.minimum(anode_i, 1e-2)
+    else:
+        anode_v = -5.0 * point * ones
+        anode_i = -1e-9 - anode_v / (1e8 * (1.0 + 0.1 * block))
+
+    anode_i = anode_i * (1.0 + generator.normal(scale=noise_scale, size=anode_i.shape))
+    return {'AnodeI': anode_i, 'AnodeV': anode_v}
+
+
+def write_keithley_excel_file(output_file, test_name, columns, curves):
+    '''Save a set of curves in an Excel file with the layout used by Keithley
+
+    The first worksheet contains the data table, with columns named like
+    "DrainI(1)", "DrainV(1)", ..., "DrainI(2)", ...; the worksheet "Settings"
+    contains the name of the test.'''
+
+    # Only needed to produce synthetic data, so it is not a hard dependency
+    import xlwt
+
+    workbook = xlwt.Workbook()
+    data_sheet = workbook.add_sheet('Run1')
+    num_of_points, num_of_blocks = curves[columns[0]].shape
+    col_idx = 0
+    for block_idx in range(num_of_blocks):
+        for name in columns:
+            data_sheet.write(0, col_idx, '{0}({1})'.format(name, block_idx + 1))
+            for row_idx, value in enumerate(curves[name][:, block_idx]):
+                data_sheet.write(row_idx + 1, col_idx, float(value))
+            col_idx += 1
+
+    workbook.add_sheet('Calc')
+    settings_sheet = workbook.add_sheet('Settings')
+    for row_idx, (key, value) in enumerate([('Test Name', test_name),
+                                            ('Mode', 'Sweeping'),
+                                            ('Speed', 'Normal')]):
+        settings_sheet.write(row_idx + 1, 0, key)
+        settings_sheet.write(row_idx + 1, 1, value)
+
+    workbook.save(output_file)
+
+
+def write_keithley_zip(file_name, num_of_blocks=5, points_per_curve=100, seed=1):
+    '''Write a ZIP file with the Excel files of a set of Keithley tests
+
+    Every file in KEITHLEY_FILES is saved, with "num_of_blocks" curves of
+    "points_per_curve" points each. The writer of Excel files limits
+    "num_of_blocks" to 64 for HEMTs and 128 for diodes, and "points_per_curve"
+    to 65535.'''
+
+    generator = np.random.RandomState(seed)
+    with ZipFile(file_name, 'w', compression=ZIP_DEFLATED) as zip_file:
+        for xls_name, columns, kind in KEITHLEY_FILES:
+            curves = keithley_curves(kind, num_of_blocks, points_per_curve, generator)
+            with zip_file.open('synthetic/' + xls_name, 'w') as xls_file:
+                write_keithley_excel_file(xls_file, os.path.splitext(xls_name)[0],
+                                          columns, curves)
+
+
+################################################################################
+# Database
+
+
+def jitter_results(results, scalar_keys, generator, sigma=0.05):
+    '''Return a copy of "analysis_results" with the scalars varied randomly
+
+    The values at the paths listed in "scalar_keys" (see
+    "AnalysisScalarsMixin") are multiplied by a random factor 1 + N(0, sigma).'''
+
+    results = deepcopy(results)
+    for _, path, _ in scalar_keys:
+        parent = results
+        for key in path[:-1]:
+            parent = parent.get(key) if isinstance(parent, dict) else None
+        if not isinstance(parent, dict):
+            continue
+
+        value = parent.get(path[-1])
+        if isinstance(value, float):
+            parent[path[-1]] = value * (1.0 + generator.normal(scale=sigma))
+
+    return results
+
+
+def analysis_templates(work_dir, seed=1, max_attempts=5):
+    '''Run the analysis engines on one synthetic file of each kind
+
+    Return a dictionary associating each kind of test in TEST_KINDS with a
+    tuple (analysis model, JSON record). As the engines can fail on unlucky
+    realizations of the noise (e.g., when a spurious plateau is found in a
+    Y-factor test), up to "max_attempts" seeds are tried; if all of them
+    fail, the record is None. The files are written in "work_dir".'''
+
+    templates = {}
+    for kind, duration_s, model, function in (
+            ('noise', 3600.0, SpectralAnalysis, compute_spectral_analysis),
+            ('bandpass', 600.0, BandpassAnalysis, compute_bandpass_analysis),
+            ('tnoise', 480.0, NoiseTemperatureAnalysis, compute_tnoise_analysis)):
+        results = None
+        for cur_seed in range(seed, seed + max_attempts):
+            synthetic_test = SyntheticTest(duration_s, kind=kind, seed=cur_seed)
+            text_file_name = os.path.join(work_dir, kind + '.txt')
+            h5_file_name = os.path.join(work_dir, kind + '.h5')
+            synthetic_test.write_text_file(text_file_name)
+            with open(text_file_name, 'rb') as input_file:
+                convert_text_file_to_h5(input_file, h5_file_name)
+
+            try:
+                if kind == 'tnoise':
+                    results = function(h5_file_name, synthetic_test.load_temperatures())
+                else:
+                    results = function(h5_file_name)
+                break
+            except ValueError as exc:
+                LOGGER.debug('unable to analyse the synthetic %s test with seed %d: %s',
+                             kind, cur_seed, exc)
+
+        if results is None:
+            LOGGER.warning('no %s analysis could be computed on synthetic data', kind)
+        templates[kind] = (model, results)
+
+    return templates
+
+
+def store_template_arrays(model, results):
+    '''Move the long arrays of a JSON record into a NPZ file, like "save" does
+
+    Return a tuple (JSON record with references, name of the NPZ file in the
+    storage); the name is empty if the record has no long arrays.'''
+
+    arrays = {}
+    results = extract_large_arrays(results, settings.ANALYSIS_ARRAY_MIN_LENGTH, arrays)
+    if not arrays:
+        return results, ''
+
+    buffer = BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    file_name = default_storage.save(
+        'analysis_arrays/synthetic_{0}.npz'.format(model._meta.model_name),
+        ContentFile(buffer.getvalue()))
+    return results, file_name
+
+
+def save_data_files(work_dir, duration_s, seed=1):
+    '''Save one HDF5 file for each kind of test in the storage of the data files
+
+    Return a dictionary associating each kind with a tuple containing the
+    names of the file and of its plot, to be used as the values of
+    "PolarimeterTest.data_file" and "PolarimeterTest.pwr_plot".'''
+
+    file_names = {}
+    for kind in TEST_KINDS:
+        text_file_name = os.path.join(work_dir, 'data_{0}.txt'.format(kind))
+        SyntheticTest(duration_s, kind=kind, seed=seed).write_text_file(text_file_name)
+
+        name = default_storage.get_available_name(
+            'unit_test_data/synthetic_{0}.h5'.format(kind))
+        path = default_storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(text_file_name, 'rb') as input_file:
+            convert_text_file_to_h5(input_file, path)
+
+        image_file = create_pwr_plot(path)
+        plot_name = default_storage.save('plots/synthetic_{0}.png'.format(kind),
+                                         image_file) if image_file else ''
+        file_names[kind] = (name, plot_name)
+
+    return file_names
+
+
+def populate_database(num_of_tests, tests_per_polarimeter=20, data_duration_s=0.0,
+                      analysis_fraction=0.5, seed=1, batch_size=500):
+    '''Fill the database with synthetic tests, housekeeping data and analyses
+
+    The tests are distributed among polarimeters (the first
+    "tests_per_polarimeter" tests go to STRIP01, and so on) and kinds (noise,
+    bandpass and Y-factor tests, in turn). Each test has ADC offsets,
+    detector outputs, HEMT biases, and the temperatures of the cryochamber
+    (one set for each step of Y-factor tests); a fraction
+    "analysis_fraction" of the tests has the analysis matching its kind.
+
+    If "data_duration_s" is positive, one data file of that duration is
+    created for each kind and shared by all the tests of that kind;
+    otherwise, the tests have no data file. Objects are owned by the user
+    SYNTHETIC_USER_NAME, which is created if needed. Return the list of the
+    IDs of the new tests.'''
+
+    generator = np.random.RandomState(seed)
+    user_model = get_user_model()
+    try:
+        user = user_model.objects.get(username=SYNTHETIC_USER_NAME)
+    except user_model.DoesNotExist:
+        user = user_model.objects.create_user(
+            SYNTHETIC_USER_NAME, SYNTHETIC_USER_NAME + '@example.com')
+
+    test_types = {kind: TestType.objects.get_or_create(description=description)[0]
+                  for kind, description in TEST_KINDS.items()}
+    operators = [Operator.objects.get_or_create(name='Synthetic operator {0}'.format(x))[0]
+                 for x in range(5)]
+
+    kinds = sorted(TEST_KINDS.keys())
+    with TemporaryDirectory() as work_dir:
+        templates = analysis_templates(work_dir, seed)
+        if data_duration_s > 0:
+            data_files = save_data_files(work_dir, data_duration_s, seed)
+        else:
+            data_files = {x: ('', '') for x in kinds}
+
+    first_day = date(year=2017, month=10, day=1)
+    tests = []
+    for idx in range(num_of_tests):
+        kind = kinds[idx % len(kinds)]
+        pol_num = 1 + idx // tests_per_polarimeter
+        tests.append(PolarimeterTest(
+            polarimeter_number=pol_num,
+            cryogenic=(kind == 'tnoise' or idx % 2 == 0),
+            acquisition_date=first_day + timedelta(days=idx % tests_per_polarimeter),
+            band='Q' if pol_num % 2 == 1 else 'W',
+            phsw_state='switching',
+            test_type=test_types[kind],
+            data_file=data_files[kind][0],
+            pwr_plot=data_files[kind][1],
+            short_description='Synthetic {0} test'.format(kind),
+            author=user,
+        ))
+
+    # Retrieve the new IDs, as "bulk_create" does not set them on every backend
+    last_id = PolarimeterTest.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    PolarimeterTest.objects.bulk_create(tests, batch_size=batch_size)
+    test_ids = list(PolarimeterTest.objects.filter(pk__gt=last_id)
+                    .order_by('pk').values_list('pk', flat=True))
+    test_kinds = [kinds[idx % len(kinds)] for idx in range(len(test_ids))]
+
+    PolarimeterTest.operators.through.objects.bulk_create([
+        PolarimeterTest.operators.through(
+            polarimetertest_id=test_id,
+            operator_id=operators[test_id % len(operators)].pk)
+        for test_id in test_ids], batch_size=batch_size)
+
+    def adu_values(nominal, spread):
+        return {name: int(value) for name, value in
+                zip(('q1_adu', 'u1_adu', 'u2_adu', 'q2_adu'),
+                    generator.normal(nominal, spread, size=4))}
+
+    AdcOffset.objects.bulk_create([
+        AdcOffset(test_id=test_id, **adu_values(300, 20)) for test_id in test_ids],
+        batch_size=batch_size)
+    DetectorOutput.objects.bulk_create([
+        DetectorOutput(test_id=test_id, **adu_values(4500, 300)) for test_id in test_ids],
+        batch_size=batch_size)
+
+    bias_fields = [x.name for x in Biases._meta.get_fields()
+                   if x.name.startswith(('drain_', 'gate_'))]
+    nominal_biases = {'drain_voltage': 1.0, 'drain_current': 10.0, 'gate_voltage': -200.0}
+    Biases.objects.bulk_create([
+        Biases(test_id=test_id, **{
+            name: float(nominal_biases[name.rsplit('_', 2)[0]] *
+                        (1.0 + generator.normal(scale=0.05)))
+            for name in bias_fields})
+        for test_id in test_ids], batch_size=batch_size)
+
+    temperatures = []
+    load_temperatures = {kind: SyntheticTest(1.0, kind=kind).load_temperatures()
+                         for kind in kinds}
+    for test_id, kind in zip(test_ids, test_kinds):
+        for load_temp in load_temperatures[kind]:
+            temperatures.append(Temperatures(
+                test_id=test_id,
+                t_load_a_1=load_temp, t_load_a_2=load_temp,
+                t_load_b_1=load_temp, t_load_b_2=load_temp,
+                t_cross_guide_1=20.0, t_cross_guide_2=20.0,
+                t_polarimeter_1=20.0, t_polarimeter_2=20.0))
+    Temperatures.objects.bulk_create(temperatures, batch_size=batch_size)
+
+    # Long arrays are saved once, in a NPZ file shared by all the copies
+    shared_arrays = {kind: store_template_arrays(model, results)
+                     for kind, (model, results) in templates.items() if results}
+
+    analyses = {}
+    for test_id, kind in zip(test_ids, test_kinds):
+        if kind not in shared_arrays or generator.uniform() >= analysis_fraction:
+            continue
+
+        model = templates[kind][0]
+        results, arrays_file_name = shared_arrays[kind]
+        analysis = model(test_id=test_id, author=user, arrays_file=arrays_file_name,
+                         analysis_results=jitter_results(results, model.scalar_keys,
+                                                         generator))
+        # "bulk_create" does not call "save", which fills the scalar columns
+        analysis.update_scalar_columns()
+        analyses.setdefault(model, []).append(analysis)
+
+    for model, objects in analyses.items():
+        model.objects.bulk_create(objects, batch_size=batch_size)
+
+    LOGGER.info('%d synthetic tests created, with %d analyses', len(test_ids),
+                sum(len(x) for x in analyses.values()))
+    return test_ids
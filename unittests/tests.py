@@ -1,16 +1,54 @@
-from datetime import date, datetime
+import base64
+import hashlib
+from datetime import date, datetime, timedelta
+import multiprocessing
+from io import BytesIO, StringIO
+import json
 import os.path
+import sqlite3
+import subprocess
+import sys
 from tempfile import TemporaryDirectory
+from unittest import skipUnless
+from unittest import skipIf
+from unittest.mock import patch
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files import File
+from django.core.files.storage import Storage, default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
 from django.utils.timezone import make_aware
-from django.test import TestCase
+from django.test import (
+    LiveServerTestCase,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
 import h5py
 import numpy as np
 
-from .file_conversions import convert_data_file_to_h5
+from .file_conversions import (
+    DEM_COLUMNS,
+    DERIVED_GROUP,
+    PWR_COLUMNS,
+    SAMPLING_FREQUENCY,
+    TEXT_FILE_COLUMNS,
+    TIME_SERIES_DATA_TYPE,
+    compute_state_segments,
+    convert_data_file_to_h5,
+    convert_text_file_to_h5,
+    convert_zip_file_to_h5,
+    iterate_segments,
+    read_derived_streams,
+    read_text_samples,
+    write_derived_streams,
+    write_segment_index,
+)
 
 from .models import (
     TestType,
@@ -23,7 +61,30 @@ from .models import (
     NoiseTemperatureAnalysis,
     SpectralAnalysis,
     BandpassAnalysis,
+    IVCurveAnalysis,
+    AnalysisRun,
+    GlitchEvent,
+    IngestRecord,
+    update_hdf5_test_file_attrs,
 )
+from .bandpass import average_by_frequency, compute_bandpass_analysis
+from .batch import CachedFunction, cached_call, file_sha256, hashed_call
+from . import benchmarks
+from . import dbrouting
+from . import h5pool
+from . import h5storage
+from .glitches import detect_events, write_event_index
+from .iv_curves import fit_idvg, fit_ifvf
+from . import live
+from . import loadtest
+from . import metrics
+from . import livestream
+from . import shmcache
+from . import synthetic
+from . import tracing
+from .spectra import fit_one_over_f, welch_psd
+from .tnoise import find_plateaus
+from live_upload import LineBuffer
 
 
 class FileConvMixin(TestCase):
@@ -86,8 +147,35 @@ class TestTextFileConversion(FileConvMixin):
 
     def testGroups(self):
         'Check that the number of groups under / is what we expect'
-        self.assertEqual(len(self.h5_file.items()), 1)
+        self.assertEqual(len(self.h5_file.items()), 4)
         self.assertTrue('time_series' in self.h5_file)
+        self.assertTrue('derived' in self.h5_file)
+        self.assertTrue('events' in self.h5_file)
+        self.assertTrue('segments' in self.h5_file)
+
+    def testTruncatedLastLine(self):
+        'Check that an incomplete last line is skipped, unless asked otherwise'
+
+        with open(os.path.join(self.test_file_path, 'datafile.txt'), 'rb') as input_file:
+            lines = input_file.read().splitlines(keepends=True)
+        truncated = b''.join(lines[:-1]) + b' '.join(lines[-1].split()[:5])
+
+        samples = read_text_samples(BytesIO(truncated))
+        self.assertEqual(len(samples), len(lines) - 2)
+        self.assertEqual(samples[-1]['pctime'], float(lines[-2].split()[0]))
+        with self.assertRaises(ValueError):
+            read_text_samples(BytesIO(truncated), strict=True)
+
+        # Incomplete lines elsewhere are errors
+        with self.assertRaises(ValueError):
+            read_text_samples(BytesIO(b''.join(lines[:2]) + b'1 2 3\n' + b''.join(lines[2:])))
+
+    def testSegments(self):
+        'Check that the index of phb/record segments covers the whole file'
+        segments = self.h5_file['segments'][...]
+        self.assertEqual(segments['start'][0], 0)
+        self.assertEqual(segments['stop'][-1], self.h5_file['time_series'].shape[0])
+        self.assertTrue(np.all(segments['start'][1:] == segments['stop'][:-1]))
 
     def testDatasets(self):
         'Check the contents of the dataset'
@@ -312,3 +400,2380 @@ class TestDatabaseAccess(TestCase):
         response = self.client.get('/unittests/')
         self.assertTemplateUsed(
             response, 'unittests/polarimetertest_list.html')
+
+
+def populate_tests_without_data(num_of_polarimeters=3, tests_per_polarimeter=3):
+    'Create a few tests which have no data file associated with them'
+
+    SiteUser = get_user_model()
+    user = SiteUser.objects.create_user(
+        'janedoe', 'janedoe@myself.com', 'iseedeadpeople')
+
+    test_types = [TestType(description='Bandpass'), TestType(description='Y-factor')]
+    for cur_type in test_types:
+        cur_type.save()
+
+    for pol_num in range(1, num_of_polarimeters + 1):
+        for test_idx in range(tests_per_polarimeter):
+            PolarimeterTest(
+                polarimeter_number=pol_num,
+                cryogenic=(test_idx % 2 == 0),
+                acquisition_date=date(year=2017, month=11, day=test_idx + 1),
+                band='Q' if pol_num % 2 == 1 else 'W',
+                test_type=test_types[test_idx % 2],
+                author=user,
+            ).save()
+
+
+class TestQueryApi(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        populate_tests_without_data()
+
+    def query(self, **params):
+        response = self.client.get('/unittests/api/tests/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def testFilters(self):
+        data = self.query(polarimeter='1,3')
+        self.assertEqual(len(data['tests']), 6)
+        self.assertEqual(set([x['polarimeter_number'] for x in data['tests']]),
+                         set([1, 3]))
+
+        data = self.query(band='W', cryogenic='true')
+        self.assertEqual([(x['polarimeter_number'], x['acquisition_date'])
+                          for x in data['tests']],
+                         [(2, '2017-11-01'), (2, '2017-11-03')])
+
+        data = self.query(acquired_from='2017-11-02', acquired_to='2017-11-02')
+        self.assertEqual(len(data['tests']), 3)
+
+    def testPagination(self):
+        everything = self.query()['tests']
+        self.assertEqual(len(everything), 9)
+
+        pages = []
+        data = self.query(limit=4)
+        pages.extend(data['tests'])
+        while data['next_cursor']:
+            data = self.query(limit=4, after=data['next_cursor'])
+            pages.extend(data['tests'])
+
+        self.assertEqual([x['id'] for x in pages],
+                         [x['id'] for x in everything])
+
+    def testFields(self):
+        data = self.query(fields='id,json_url', limit=1)
+        test = data['tests'][0]
+        self.assertEqual(set(test.keys()), set(['id', 'json_url']))
+        self.assertEqual(test['json_url'],
+                         PolarimeterTest.objects.get(pk=test['id']).get_json_url())
+
+    def testInvalidParameters(self):
+        for params in [{'fields': 'nonexistent'},
+                       {'polarimeter': 'abc'},
+                       {'acquired_from': '2017/11/01'},
+                       {'after': 'xyz'},
+                       {'limit': '5,6'},
+                       {'limit': 0}]:
+            response = self.client.get('/unittests/api/tests/', params)
+            self.assertEqual(response.status_code, 400)
+
+
+# Tables which grow with the number of tests in the database
+HOT_TABLES = (
+    'unittests_polarimetertest',
+    'unittests_polarimetertest_operators',
+    'unittests_adcoffset',
+    'unittests_detectoroutput',
+    'unittests_biases',
+    'unittests_temperatures',
+    'unittests_noisetemperatureanalysis',
+    'unittests_bandpassanalysis',
+    'unittests_spectralanalysis',
+)
+
+
+def populate_database_at_scale(num_of_polarimeters=55, tests_per_polarimeter=40):
+    '''Fill the database with as many rows as expected at the end of the campaign
+
+    The tests do not have real data files: they all point to "placeholder.h5",
+    which must be created by the caller under MEDIA_ROOT.
+    '''
+
+    SiteUser = get_user_model()
+    user = SiteUser.objects.create_user(
+        'bigdoe', 'bigdoe@myself.com', 'iseedeadpeople')
+
+    TestType.objects.bulk_create(
+        [TestType(description='Type {0}'.format(x)) for x in range(10)])
+    test_types = list(TestType.objects.all())
+    operators = [Operator(name='Operator {0}'.format(x)) for x in range(5)]
+    Operator.objects.bulk_create(operators)
+    operators = list(Operator.objects.all())
+
+    first_day = date(year=2017, month=10, day=1)
+    PolarimeterTest.objects.bulk_create([
+        PolarimeterTest(
+            polarimeter_number=pol_num,
+            cryogenic=(test_idx % 2 == 0),
+            acquisition_date=first_day + timedelta(days=test_idx),
+            band='Q' if pol_num % 2 == 1 else 'W',
+            test_type=test_types[test_idx % len(test_types)],
+            data_file='placeholder.h5',
+            author=user,
+        )
+        for pol_num in range(1, num_of_polarimeters + 1)
+        for test_idx in range(tests_per_polarimeter)
+    ])
+    test_ids = list(PolarimeterTest.objects.values_list('id', flat=True))
+
+    PolarimeterTest.operators.through.objects.bulk_create([
+        PolarimeterTest.operators.through(
+            polarimetertest_id=test_id,
+            operator_id=operators[test_id % len(operators)].pk)
+        for test_id in test_ids
+    ])
+
+    AdcOffset.objects.bulk_create([
+        AdcOffset(test_id=test_id, q1_adu=1, u1_adu=2, u2_adu=3, q2_adu=4)
+        for test_id in test_ids])
+    DetectorOutput.objects.bulk_create([
+        DetectorOutput(test_id=test_id, q1_adu=1, u1_adu=2, u2_adu=3, q2_adu=4)
+        for test_id in test_ids])
+    Temperatures.objects.bulk_create([
+        Temperatures(test_id=test_id,
+                     t_load_a_1=20.0 + temp_idx, t_load_a_2=20.0 + temp_idx,
+                     t_load_b_1=20.0, t_load_b_2=20.0,
+                     t_cross_guide_1=20.0, t_cross_guide_2=20.0,
+                     t_polarimeter_1=20.0, t_polarimeter_2=20.0)
+        for test_id in test_ids
+        for temp_idx in range(3)])
+
+    for model in (NoiseTemperatureAnalysis, BandpassAnalysis, SpectralAnalysis):
+        model.objects.bulk_create([
+            model(test_id=test_id, analysis_results={}, author=user)
+            for test_id in test_ids[::4]])
+
+
+def find_sequential_scans(sql, tables, listed_tables=()):
+    '''Return the tables in "tables" that a query would scan sequentially
+
+    Tables in "listed_tables" are read in full by the query (e.g., in pages
+    listing every test), so they can be scanned, but only following an
+    index. Any other table must be accessed through SEARCH steps. This only
+    works with SQLite.'''
+
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        plan = [row[-1] for row in cursor.fetchall()]
+
+    result = []
+    for step in plan:
+        # SQLite writes "SCAN TABLE name" (older versions) or "SCAN name";
+        # full scans of an index are reported as "SCAN name USING [COVERING]
+        # INDEX", and they read every row like sequential scans
+        words = step.split()
+        if not words or words[0] != 'SCAN':
+            continue
+
+        table_name = words[2] if words[1] == 'TABLE' else words[1]
+        if table_name in listed_tables and 'USING' in words:
+            continue
+
+        if table_name in tables:
+            result.append((table_name, step))
+
+    return result
+
+
+@skipUnless(connection.vendor == 'sqlite', 'query plans are checked using SQLite')
+class TestQueryPlans(TestCase):
+    '''Check that no view scans the largest tables sequentially
+
+    Every SELECT run by a view is passed to EXPLAIN QUERY PLAN once the
+    database has been filled with a realistic number of rows.
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temporary_dir = TemporaryDirectory()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.temporary_dir.name)
+        cls.media_settings.enable()
+        with open(os.path.join(cls.temporary_dir.name, 'placeholder.h5'), 'wb'):
+            pass
+
+        super(TestQueryPlans, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestQueryPlans, cls).tearDownClass()
+        cls.media_settings.disable()
+        cls.temporary_dir.cleanup()
+
+    # Pages which list every row of some tables
+    LISTED_TABLES = {
+        '/unittests/': ['unittests_polarimetertest'],
+        '/unittests/tnoise/': ['unittests_polarimetertest'],
+        '/unittests/bandpass/': ['unittests_polarimetertest'],
+        '/unittests/spectrum/': ['unittests_polarimetertest'],
+        '/unittests/api/tnoise/': ['unittests_noisetemperatureanalysis'],
+        '/unittests/api/bandpass/': ['unittests_bandpassanalysis'],
+        '/unittests/api/spectrum/': ['unittests_spectralanalysis'],
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        populate_database_at_scale()
+
+    def assertNoSequentialScans(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+
+        for query in context.captured_queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+
+            scans = find_sequential_scans(query['sql'], HOT_TABLES,
+                                          self.LISTED_TABLES.get(url, ()))
+            self.assertEqual(scans, [], 'URL {0}, query "{1}"'.format(
+                url, query['sql']))
+
+        return context
+
+    def testScanDetection(self):
+        # Walking a whole index to sort the rows is not a search, even if it
+        # avoids reading the table
+        sql = str(PolarimeterTest.objects.filter(cryogenic=True)
+                  .order_by('polarimeter_number', 'acquisition_date')
+                  .values('polarimeter_number').query)
+        self.assertEqual(len(find_sequential_scans(sql, HOT_TABLES)), 1)
+        self.assertEqual(find_sequential_scans(sql, HOT_TABLES,
+                                               ['unittests_polarimetertest']), [])
+
+    def testTestViews(self):
+        test = PolarimeterTest.objects.filter(polarimeter_number=7)[3]
+        for url in ['/unittests/',
+                    test.get_absolute_url(),
+                    test.get_json_url(),
+                    '/unittests/STRIP07/']:
+            self.assertNoSequentialScans(url)
+
+    def testAnalysisViews(self):
+        for kind in ('tnoise', 'bandpass', 'spectrum'):
+            self.assertNoSequentialScans('/unittests/{0}/'.format(kind))
+            self.assertNoSequentialScans('/unittests/api/{0}/'.format(kind))
+
+    def testRestApi(self):
+        test_type = TestType.objects.all()[2]
+        for url in ['/unittests/api/tests/STRIP12/',
+                    '/unittests/api/tests/types/{0}'.format(test_type.pk),
+                    '/unittests/api/tests/users/',
+                    '/unittests/api/tests/countbydate/',
+                    '/unittests/api/tests/?polarimeter=12&cryogenic=true',
+                    '/unittests/api/tests/?type={0}'.format(test_type.pk),
+                    '/unittests/api/tests/?acquired_from=2017-10-05&acquired_to=2017-10-06',
+                    '/unittests/api/tests/?band=W&limit=10']:
+            self.assertNoSequentialScans(url)
+
+    def testNumberOfQueries(self):
+        'Check that list pages do not run one query per test'
+
+        for url in ['/unittests/',
+                    '/unittests/tnoise/',
+                    '/unittests/bandpass/',
+                    '/unittests/spectrum/',
+                    '/unittests/api/tnoise/',
+                    '/unittests/api/tests/countbydate/']:
+            context = self.assertNoSequentialScans(url)
+            self.assertLess(len(context.captured_queries), 10, url)
+
+
+class TestAnalysisColumns(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        populate_tests_without_data()
+        user = get_user_model().objects.get(username='janedoe')
+        for test in PolarimeterTest.objects.all():
+            BandpassAnalysis(
+                test=test,
+                analysis_results={
+                    'central_nu_ghz': 40.0 + test.polarimeter_number,
+                    'central_nu_err': 0.1,
+                    'bandwidth_ghz': 7.0 + test.pk * 0.1,
+                    'bandwidth_err': 0.2,
+                    'analysis_date': '2017-12-15',
+                },
+                author=user,
+            ).save()
+
+    def testColumnsAreFilledOnSave(self):
+        analysis = BandpassAnalysis.objects.filter(
+            test__polarimeter_number=2).first()
+        self.assertAlmostEqual(analysis.central_nu_ghz, 42.0)
+        self.assertAlmostEqual(analysis.bandwidth_err_ghz, 0.2)
+        self.assertEqual(analysis.analysis_date, date(2017, 12, 15))
+
+    def testMissingKeys(self):
+        analysis = BandpassAnalysis(analysis_results={'bandwidth_ghz': 'n/a'})
+        self.assertEqual(analysis.get_scalar_values()['bandwidth_ghz'], None)
+        self.assertEqual(analysis.get_scalar_values()['central_nu_ghz'], None)
+
+        analysis = BandpassAnalysis(analysis_results=None)
+        self.assertEqual(analysis.get_scalar_values()['analysis_date'], None)
+
+    def testBackfill(self):
+        BandpassAnalysis.objects.update(central_nu_ghz=None, central_nu_err_ghz=None,
+                                        bandwidth_ghz=None, bandwidth_err_ghz=None,
+                                        analysis_date=None)
+        call_command('backfill_analysis_columns', only_missing=True,
+                     stdout=open(os.devnull, 'w'))
+        self.assertEqual(
+            BandpassAnalysis.objects.filter(bandwidth_ghz__isnull=True).count(), 0)
+
+    def testAllDataFilters(self):
+        response = self.client.get('/unittests/api/bandpass/',
+                                   {'min_central_nu_ghz': 41.5,
+                                    'sort': '-bandwidth_ghz'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['polarimeters'], ['STRIP02', 'STRIP03'])
+        for pol_results in data['results']:
+            bandwidths = [x['bandwidth_ghz'] for x in pol_results]
+            self.assertEqual(bandwidths, sorted(bandwidths, reverse=True))
+
+        response = self.client.get('/unittests/api/bandpass/', {'sort': 'foo'})
+        self.assertEqual(response.status_code, 400)
+
+    def testListPage(self):
+        response = self.client.get('/unittests/bandpass/',
+                                   {'max_bandwidth_ghz': 7.35})
+        self.assertEqual(len(response.context['bandpass_analysis_tests']), 3)
+
+        for value in ('abc', 'nan', 'inf', '-Infinity'):
+            response = self.client.get('/unittests/bandpass/',
+                                       {'max_bandwidth_ghz': value})
+            self.assertEqual(response.status_code, 400)
+
+
+@override_settings(ANALYSIS_ARRAY_MIN_LENGTH=10)
+class TestAnalysisArrays(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temporary_dir = TemporaryDirectory()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.temporary_dir.name)
+        cls.media_settings.enable()
+        super(TestAnalysisArrays, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestAnalysisArrays, cls).tearDownClass()
+        cls.media_settings.disable()
+        cls.temporary_dir.cleanup()
+
+    def setUp(self):
+        populate_tests_without_data(num_of_polarimeters=1, tests_per_polarimeter=1)
+        self.results = {
+            'bandwidth_ghz': 7.5,
+            'frequency_ghz': [38.0 + 0.1 * x for x in range(100)],
+            'response': {
+                'PWR0': [float(x) for x in range(100)],
+                'counts': list(range(100)),
+                'labels': ['a'] * 100,
+                'short': [1.0, 2.0],
+            },
+        }
+        self.analysis = BandpassAnalysis(
+            test=PolarimeterTest.objects.first(),
+            analysis_results=self.results,
+            author=get_user_model().objects.get(username='janedoe'))
+        self.analysis.save()
+
+    def testArraysAreMoved(self):
+        analysis = BandpassAnalysis.objects.get(pk=self.analysis.pk)
+        self.assertTrue(analysis.arrays_file)
+        stored = analysis.analysis_results
+        self.assertEqual(stored['frequency_ghz']['shape'], [100])
+        self.assertEqual(stored['response']['labels'], ['a'] * 100)
+        self.assertEqual(stored['response']['short'], [1.0, 2.0])
+        self.assertAlmostEqual(analysis.bandwidth_ghz, 7.5)
+
+        self.assertEqual(analysis.get_full_results(), self.results)
+
+        # Integers are not converted into floating-point numbers
+        arrays = analysis.load_arrays()
+        self.assertEqual(arrays['response/counts'].dtype.kind, 'i')
+        self.assertEqual(arrays['response/PWR0'].dtype, np.float64)
+
+    def testDeletedAnalysis(self):
+        file_name = self.analysis.arrays_file.name
+        storage = self.analysis.arrays_file.storage
+
+        # A file shared by two analyses is kept until both are deleted
+        other = BandpassAnalysis.objects.get(pk=self.analysis.pk)
+        other.pk = None
+        other.save()
+        self.assertEqual(other.arrays_file.name, file_name)
+
+        self.analysis.delete()
+        self.assertTrue(storage.exists(file_name))
+        BandpassAnalysis.objects.all().delete()
+        self.assertFalse(storage.exists(file_name))
+
+    def testUpdateKeepsOldArrays(self):
+        analysis = BandpassAnalysis.objects.get(pk=self.analysis.pk)
+        old_file_name = analysis.arrays_file.name
+        analysis.analysis_results['response']['PWR1'] = [2.0] * 50
+        analysis.save()
+
+        analysis = BandpassAnalysis.objects.get(pk=self.analysis.pk)
+        self.assertNotEqual(analysis.arrays_file.name, old_file_name)
+        self.assertFalse(analysis.arrays_file.storage.exists(old_file_name))
+        full_results = analysis.get_full_results()
+        self.assertEqual(full_results['response']['PWR1'], [2.0] * 50)
+        self.assertEqual(full_results['frequency_ghz'], self.results['frequency_ghz'])
+
+    def testDetailEndpoint(self):
+        url = '/unittests/api/bandpass/{0}'.format(self.analysis.pk)
+        self.assertEqual(self.client.get(url).json(), self.results)
+
+        data = self.client.get(url, {'arrays': 'ref'}).json()
+        self.assertEqual(data['response']['PWR0']['stored_array'], 'response/PWR0')
+
+        response = self.client.get(url, HTTP_ACCEPT='application/x-npz')
+        self.assertEqual(response['Content-Type'], 'application/x-npz')
+        with np.load(BytesIO(response.content)) as arrays:
+            self.assertEqual(arrays['response/PWR0'].tolist(),
+                             self.results['response']['PWR0'])
+
+    def testListEndpoint(self):
+        data = self.client.get('/unittests/api/bandpass/').json()
+        self.assertEqual(data['results'][0][0]['response']['PWR0']['stored_array'],
+                         'response/PWR0')
+
+        data = self.client.get('/unittests/api/bandpass/', {'arrays': 'full'}).json()
+        self.assertEqual(data['results'][0][0], self.results)
+
+    def testTestExport(self):
+        test = PolarimeterTest.objects.first()
+        data = self.client.get(test.get_json_url()).json()
+        self.assertEqual(len(data['analyses']['bandpass']), 1)
+        bandpass = data['analyses']['bandpass'][0]
+        self.assertEqual(bandpass['analysis_id'], self.analysis.pk)
+        self.assertEqual(bandpass['response']['PWR0'], self.results['response']['PWR0'])
+        self.assertEqual(bandpass['frequency_ghz'], self.results['frequency_ghz'])
+
+
+def write_noise_time_series(file_name, num_of_samples, sigma=1.0, seed=1):
+    'Save a HDF5 file containing white noise in every DEM/PWR column'
+
+    columns = DEM_COLUMNS + PWR_COLUMNS
+    data_type = np.dtype([('time_s', np.float32)] +
+                         [(x, np.float32) for x in columns])
+    data = np.zeros(num_of_samples, dtype=data_type)
+    data['time_s'] = np.arange(num_of_samples) / SAMPLING_FREQUENCY
+
+    generator = np.random.RandomState(seed)
+    for cur_column in columns:
+        data[cur_column] = 1000.0 + generator.normal(scale=sigma, size=num_of_samples)
+
+    with h5py.File(file_name, 'w') as h5_file:
+        h5_file.create_dataset('time_series', data=data, chunks=True)
+
+
+class TestSpectralAnalysis(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temporary_dir = TemporaryDirectory()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.temporary_dir.name)
+        cls.media_settings.enable()
+        super(TestSpectralAnalysis, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestSpectralAnalysis, cls).tearDownClass()
+        cls.media_settings.disable()
+        cls.temporary_dir.cleanup()
+
+    def testWelchChunking(self):
+        streams = np.random.RandomState(2).normal(size=(2, 10000))
+        freq, psd, num = welch_psd([streams], 256, SAMPLING_FREQUENCY)
+        chunks = [streams[:, x:x + 999] for x in range(0, 10000, 999)]
+        _, chunked_psd, chunked_num = welch_psd(chunks, 256, SAMPLING_FREQUENCY)
+
+        self.assertEqual(num, chunked_num)
+        self.assertTrue(np.allclose(psd, chunked_psd))
+        self.assertAlmostEqual(freq[-1], SAMPLING_FREQUENCY / 2)
+        # White noise with unit variance has a one-sided PSD of 2 / fs
+        self.assertAlmostEqual(np.median(psd[0, 1:]) * SAMPLING_FREQUENCY / 2,
+                               1.0, delta=0.1)
+
+    def testOneOverFFit(self):
+        freq = np.fft.rfftfreq(4096, d=1.0 / SAMPLING_FREQUENCY)
+        model = np.empty((2, len(freq)))
+        model[:, 0] = 0.0
+        model[0, 1:] = 3.0 * (1 + (0.05 / freq[1:]) ** 1.5)
+        model[1, 1:] = 0.5 * (1 + (0.2 / freq[1:]) ** 1.0)
+
+        fit = fit_one_over_f(freq, model)
+        self.assertTrue(np.allclose(fit['slope'], [1.5, 1.0], rtol=0.05))
+        self.assertTrue(np.allclose(fit['f_knee_hz'], [0.05, 0.2], rtol=0.1))
+        self.assertTrue(np.allclose(fit['WN_level_ADU2_hz'], [3.0, 0.5], rtol=0.05))
+
+    def testCommand(self):
+        populate_tests_without_data(num_of_polarimeters=1, tests_per_polarimeter=2)
+        PolarimeterTest.objects.filter(pk=PolarimeterTest.objects.first().pk) \
+            .update(data_file='spectra.h5')
+        test = PolarimeterTest.objects.exclude(data_file='').get()
+        write_noise_time_series(test.data_file.path, 20000)
+
+        call_command('compute_spectra', '--author', 'janedoe', '--jobs', '1',
+                     '--segment-length', '1024', '--chunk-size', '3000',
+                     stdout=open(os.devnull, 'w'))
+        self.assertEqual(SpectralAnalysis.objects.count(), 1)
+
+        analysis = SpectralAnalysis.objects.get()
+        self.assertEqual(analysis.test_id, test.pk)
+        self.assertAlmostEqual(analysis.test_duration_hr,
+                               20000 / SAMPLING_FREQUENCY / 3600.0)
+
+        results = analysis.get_full_results()
+        self.assertEqual(results['segment_length'], 1024)
+        self.assertEqual(len(results['Q']['psd_ADU2_hz']), 513)
+        # Q = (Q1 - Q2) / 2 has half the variance of each detector
+        self.assertAlmostEqual(results['Q']['WN_level_ADU2_hz'] * SAMPLING_FREQUENCY,
+                               1.0, delta=0.1)
+
+        call_command('compute_spectra', '--author', 'janedoe', '--jobs', '1',
+                     '--skip-existing', stdout=open(os.devnull, 'w'))
+        self.assertEqual(SpectralAnalysis.objects.count(), 1)
+
+
+def write_sweep_time_series(file_name, min_band_ghz=38.0, max_band_ghz=48.0,
+                            samples_per_step=10):
+    'Save a HDF5 file containing a frequency sweep through a top-hat band'
+
+    freq_ghz = np.repeat(np.arange(30.0, 56.0, 0.1), samples_per_step)
+    rfpower_db = -10.0 + 3.0 * np.sin(freq_ghz)
+    in_band = (freq_ghz >= min_band_ghz) & (freq_ghz <= max_band_ghz)
+
+    columns = ('freq_Hz', 'rfpower_dB') + PWR_COLUMNS
+    data = np.zeros(len(freq_ghz), dtype=[(x, np.float32) for x in columns])
+    data['freq_Hz'] = freq_ghz * 1e9
+    data['rfpower_dB'] = rfpower_db
+    # Samples after a frequency change have not settled yet
+    settled = np.arange(len(freq_ghz)) % samples_per_step >= 2
+    for idx, name in enumerate(PWR_COLUMNS):
+        data[name] = 100.0 * idx + 1e3 * (10.0 ** (rfpower_db / 10.0)) * in_band * settled
+
+    with h5py.File(file_name, 'w') as h5_file:
+        h5_file.create_dataset('time_series', data=data)
+
+
+class TestBandpassAnalysis(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temporary_dir = TemporaryDirectory()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.temporary_dir.name)
+        cls.media_settings.enable()
+        super(TestBandpassAnalysis, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestBandpassAnalysis, cls).tearDownClass()
+        cls.media_settings.disable()
+        cls.temporary_dir.cleanup()
+
+    def testAverageByFrequency(self):
+        freq = np.array([0, 0, 1, 1, 1, 2, 2, 2, 1, 1, 1])
+        channels = np.array([[5, 5, 9, 1, 1, 9, 2, 2, 9, 3, 3]])
+        step_freq, averages = average_by_frequency(freq, channels, settling_samples=1)
+        self.assertEqual(step_freq.tolist(), [1, 2])
+        self.assertEqual(averages.tolist(), [[2.0, 2.0]])
+
+    def testCommand(self):
+        populate_tests_without_data(num_of_polarimeters=2, tests_per_polarimeter=2)
+        for cur_test in PolarimeterTest.objects.all():
+            file_name = 'sweep_{0}.h5'.format(cur_test.pk)
+            PolarimeterTest.objects.filter(pk=cur_test.pk).update(data_file=file_name)
+            write_sweep_time_series(os.path.join(self.temporary_dir.name, file_name))
+
+        call_command('compute_bandpasses', '--author', 'janedoe', '--jobs', '1',
+                     stdout=open(os.devnull, 'w'))
+
+        # Only the two tests of type "Bandpass" must have been analysed
+        self.assertEqual(BandpassAnalysis.objects.count(), 2)
+        for analysis in BandpassAnalysis.objects.select_related('test__test_type'):
+            self.assertEqual(analysis.test.test_type.description, 'Bandpass')
+            self.assertAlmostEqual(analysis.central_nu_ghz, 43.0, delta=0.1)
+            self.assertAlmostEqual(analysis.bandwidth_ghz, 10.0, delta=0.2)
+            self.assertAlmostEqual(analysis.bandwidth_err_ghz, 0.0)
+
+            results = analysis.get_full_results()
+            self.assertEqual(len(results['frequency_ghz']), 260)
+            self.assertAlmostEqual(max(results['pwr_Q1_ADU']['response']), 1.0)
+
+
+def write_yfactor_time_series(file_name, load_temperatures, tnoise=30.0,
+                              samples_per_step=600, ramp_samples=50, seed=3):
+    'Save a HDF5 file with the outputs of a Y-factor test'
+
+    generator = np.random.RandomState(seed)
+    temperature = [np.full(samples_per_step, load_temperatures[0])]
+    for prev_temp, cur_temp in zip(load_temperatures[:-1], load_temperatures[1:]):
+        temperature.append(np.linspace(prev_temp, cur_temp, ramp_samples))
+        temperature.append(np.full(samples_per_step, cur_temp))
+    temperature = np.concatenate(temperature)
+
+    data = np.zeros(len(temperature), dtype=[(x, np.float32) for x in PWR_COLUMNS])
+    for idx, name in enumerate(PWR_COLUMNS):
+        gain = 10.0 * (idx + 1)
+        data[name] = gain * (temperature + tnoise) + \
+            generator.normal(scale=5.0, size=len(temperature))
+
+    with h5py.File(file_name, 'w') as h5_file:
+        h5_file.create_dataset('time_series', data=data)
+
+
+NUM_OF_CACHED_CALLS = 0
+
+
+def count_cached_calls(file_name, value):
+    global NUM_OF_CACHED_CALLS
+    NUM_OF_CACHED_CALLS += 1
+    return {'value': value}
+
+
+class TestNoiseTemperatureAnalysis(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temporary_dir = TemporaryDirectory()
+        cls.media_settings = override_settings(
+            MEDIA_ROOT=os.path.join(cls.temporary_dir.name, 'media'),
+            ANALYSIS_CACHE_DIR=os.path.join(cls.temporary_dir.name, 'cache'))
+        cls.media_settings.enable()
+        os.mkdir(os.path.join(cls.temporary_dir.name, 'media'))
+        super(TestNoiseTemperatureAnalysis, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestNoiseTemperatureAnalysis, cls).tearDownClass()
+        cls.media_settings.disable()
+        cls.temporary_dir.cleanup()
+
+    def testFindPlateaus(self):
+        signal = np.concatenate([np.zeros(500), np.linspace(0, 10, 20),
+                                 np.full(400, 10.0)])
+        signal += np.random.RandomState(4).normal(scale=0.1, size=len(signal))
+        plateaus = find_plateaus(signal, window_samples=10, min_plateau_samples=100)
+        self.assertEqual(len(plateaus), 2)
+        self.assertLessEqual(plateaus[0][1], 505)
+        self.assertGreaterEqual(plateaus[1][0], 515)
+
+    def testCachedCall(self):
+        file_name = os.path.join(self.temporary_dir.name, 'cached.h5')
+        with open(file_name, 'wb') as output_file:
+            output_file.write(b'1234')
+
+        cache_dir = os.path.join(self.temporary_dir.name, 'test_cache')
+        num_of_calls = NUM_OF_CACHED_CALLS
+        for _ in range(2):
+            self.assertEqual(cached_call(cache_dir, count_cached_calls, file_name, 1),
+                             {'value': 1})
+        self.assertEqual(NUM_OF_CACHED_CALLS, num_of_calls + 1)
+
+        # Different parameters or contents must not use the cache
+        cached_call(cache_dir, count_cached_calls, file_name, 2)
+        with open(file_name, 'wb') as output_file:
+            output_file.write(b'5678')
+        cached_call(cache_dir, count_cached_calls, file_name, 1)
+        self.assertEqual(NUM_OF_CACHED_CALLS, num_of_calls + 3)
+
+        # The hash computed by "hashed_call" is used for the key
+        with patch('unittests.batch.file_sha256', wraps=file_sha256) as hash_function:
+            for _ in range(2):
+                result, file_info = hashed_call(
+                    CachedFunction(cache_dir, count_cached_calls), file_name, 3)
+                self.assertEqual(result, {'value': 3})
+        self.assertEqual(hash_function.call_count, 2)
+        self.assertEqual(NUM_OF_CACHED_CALLS, num_of_calls + 4)
+
+    def testCommand(self):
+        populate_tests_without_data(num_of_polarimeters=1, tests_per_polarimeter=3)
+        load_temperatures = [20.0, 40.0, 60.0, 80.0]
+        for cur_test in PolarimeterTest.objects.all():
+            file_name = 'yfactor_{0}.h5'.format(cur_test.pk)
+            PolarimeterTest.objects.filter(pk=cur_test.pk).update(data_file=file_name)
+            write_yfactor_time_series(
+                os.path.join(settings.MEDIA_ROOT, file_name), load_temperatures)
+
+            for cur_temp in load_temperatures:
+                Temperatures(test=cur_test,
+                             t_load_a_1=cur_temp, t_load_a_2=cur_temp,
+                             t_load_b_1=cur_temp, t_load_b_2=cur_temp,
+                             t_cross_guide_1=0.0, t_cross_guide_2=0.0,
+                             t_polarimeter_1=0.0, t_polarimeter_2=0.0).save()
+
+        call_command('compute_tnoise', '--author', 'janedoe', '--jobs', '1',
+                     stdout=open(os.devnull, 'w'))
+
+        # Only cryogenic tests (the first and the third) must have been analysed
+        self.assertEqual(NoiseTemperatureAnalysis.objects.count(), 2)
+        for analysis in NoiseTemperatureAnalysis.objects.select_related('test'):
+            self.assertTrue(analysis.test.cryogenic)
+            self.assertAlmostEqual(analysis.tnoise_k, 30.0, delta=0.5)
+            self.assertAlmostEqual(analysis.gain_q1_adu_k, 10.0, delta=0.05)
+            self.assertAlmostEqual(analysis.gain_q2_adu_k, 40.0, delta=0.2)
+            self.assertEqual(len(analysis.analysis_results['plateaus']), 4)
+
+        self.assertTrue(os.listdir(settings.ANALYSIS_CACHE_DIR))
+
+
+class TestIVCurveAnalysis(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temporary_dir = TemporaryDirectory()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.temporary_dir.name)
+        cls.media_settings.enable()
+        super(TestIVCurveAnalysis, cls).setUpClass()
+
+        input_file_name = os.path.join(os.path.dirname(__file__), '..',
+                                       'testdata', 'datafile.zip')
+        with open(input_file_name, 'rb') as input_file:
+            convert_data_file_to_h5(input_file_name, input_file,
+                                    os.path.join(cls.temporary_dir.name, 'iv.h5'))
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestIVCurveAnalysis, cls).tearDownClass()
+        cls.media_settings.disable()
+        cls.temporary_dir.cleanup()
+
+    def testFits(self):
+        voltage = np.linspace(-1.0, 1.0, 41)[:, np.newaxis] * np.ones((1, 2))
+        gm = np.array([0.02, 0.05])
+        current = np.clip(gm * (voltage + 0.3), 0.0, None)
+        result = fit_idvg(current, voltage)
+        self.assertTrue(np.allclose(result['transconductance_S'], gm))
+        self.assertTrue(np.allclose(result['pinch_off_V'], -0.3))
+
+        voltage = np.linspace(0.5, 0.9, 30)[:, np.newaxis]
+        current = 1e-13 * np.exp(voltage / (1.5 * 0.025852))
+        result = fit_ifvf(current, voltage)
+        self.assertAlmostEqual(result['ideality_factor'][0], 1.5)
+        self.assertAlmostEqual(result['saturation_current_A'][0] / 1e-13, 1.0)
+
+    def testCommandAndComparison(self):
+        populate_tests_without_data(num_of_polarimeters=2, tests_per_polarimeter=1)
+        PolarimeterTest.objects.update(data_file='iv.h5')
+
+        call_command('compute_iv_curves', '--author', 'janedoe', '--jobs', '1',
+                     stdout=open(os.devnull, 'w'))
+        # 6 HEMTs with 2 curves, 4 phase switches with 2 curves, 4 detectors
+        self.assertEqual(IVCurveAnalysis.objects.count(), 2 * (12 + 8 + 4))
+
+        analysis = IVCurveAnalysis.objects.filter(component='HA1', curve='IDVG').first()
+        self.assertIsNotNone(analysis.transconductance_s)
+        self.assertIsNone(analysis.ideality_factor)
+        self.assertEqual(len(analysis.analysis_results['blocks']['pinch_off_V']), 25)
+
+        # Running the command again must replace the old results
+        call_command('compute_iv_curves', '--author', 'janedoe', '--jobs', '1',
+                     stdout=open(os.devnull, 'w'))
+        self.assertEqual(IVCurveAnalysis.objects.count(), 2 * (12 + 8 + 4))
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/unittests/api/iv_curves/',
+                                       {'component': 'HA1,HB1', 'curve': 'IDVG'})
+        data = response.json()
+        self.assertEqual(len(data['results']), 4)
+        self.assertEqual([x['polarimeter_number'] for x in data['results']],
+                         [1, 2, 1, 2])
+        self.assertEqual(len(data['summary']), 2)
+        self.assertEqual(data['summary'][0]['num_of_polarimeters'], 2)
+        self.assertAlmostEqual(data['summary'][0]['transconductance_s_mean'],
+                               analysis.transconductance_s)
+
+        response = self.client.get('/unittests/api/iv_curves/',
+                                   {'curve': 'IFVF', 'min_ideality_factor': '1.0'})
+        self.assertEqual(len(response.json()['results']), 2 * 4)
+
+
+class TestRecompute(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temporary_dir = TemporaryDirectory()
+        cls.media_settings = override_settings(
+            MEDIA_ROOT=cls.temporary_dir.name,
+            ANALYSIS_CACHE_DIR=os.path.join(cls.temporary_dir.name, 'cache'))
+        cls.media_settings.enable()
+        super(TestRecompute, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestRecompute, cls).tearDownClass()
+        cls.media_settings.disable()
+        cls.temporary_dir.cleanup()
+
+    def setUp(self):
+        populate_tests_without_data(num_of_polarimeters=2, tests_per_polarimeter=1)
+        for cur_test in PolarimeterTest.objects.all():
+            file_name = 'test_{0}.h5'.format(cur_test.pk)
+            PolarimeterTest.objects.filter(pk=cur_test.pk).update(data_file=file_name)
+            write_sweep_time_series(os.path.join(self.temporary_dir.name, file_name))
+
+        call_command('compute_bandpasses', '--author', 'janedoe', '--jobs', '1',
+                     stdout=open(os.devnull, 'w'))
+
+    def recompute(self, *args):
+        output = StringIO()
+        call_command('recompute', '--author', 'janedoe', '--jobs', '1',
+                     '--engine', 'compute_bandpasses', *args, stdout=output)
+        return output.getvalue()
+
+    def testRunsAreRecorded(self):
+        self.assertEqual(AnalysisRun.objects.count(), 2)
+        for cur_run in AnalysisRun.objects.all():
+            self.assertEqual(cur_run.engine, 'compute_bandpasses')
+            self.assertEqual(len(cur_run.data_file_hash), 64)
+            self.assertEqual(cur_run.analysis_ids,
+                             list(BandpassAnalysis.objects.filter(test=cur_run.test)
+                                  .values_list('pk', flat=True)))
+
+        self.assertIn('0 stale test(s)', self.recompute())
+
+    def testChangedDataFile(self):
+        test = PolarimeterTest.objects.first()
+        old_analysis = BandpassAnalysis.objects.get(test=test)
+
+        # Touching a file without changing it must not trigger a new analysis
+        os.utime(test.data_file.path, (0, 0))
+        self.assertIn('0 stale test(s)', self.recompute())
+
+        write_sweep_time_series(test.data_file.path, min_band_ghz=40.0)
+        output = self.recompute()
+        self.assertIn('1 stale test(s)', output)
+        self.assertIn('data file changed', output)
+
+        self.assertEqual(BandpassAnalysis.objects.count(), 2)
+        self.assertFalse(BandpassAnalysis.objects.filter(pk=old_analysis.pk).exists())
+        self.assertAlmostEqual(BandpassAnalysis.objects.get(test=test).central_nu_ghz,
+                               44.0, delta=0.1)
+        self.assertIn('0 stale test(s)', self.recompute())
+
+    def testRewrittenDataFile(self):
+        test = PolarimeterTest.objects.first()
+
+        # Indexes and attributes do not change the samples
+        with h5py.File(test.data_file.path, 'r+') as h5_file:
+            write_event_index(h5_file, PWR_COLUMNS)
+            h5_file.attrs['polarimeter'] = 'STRIP99'
+        with patch('unittests.batch.local_copy') as local_copy:
+            self.assertIn('0 stale test(s)', self.recompute('--dry-run'))
+        local_copy.assert_not_called()
+
+        # Unlike the ADC offsets, which define the derived streams
+        AdcOffset.objects.bulk_create([
+            AdcOffset(test=test, q1_adu=1, u1_adu=2, u2_adu=3, q2_adu=4)])
+        output = self.recompute()
+        self.assertIn('1 stale test(s)', output)
+        self.assertIn('housekeeping data changed', output)
+
+    def testNonDefaultParameters(self):
+        call_command('compute_bandpasses', '--author', 'janedoe', '--jobs', '1',
+                     '--settling-samples', '7', stdout=open(os.devnull, 'w'))
+        self.assertIn('0 stale test(s)', self.recompute())
+
+        # Tests are analysed again with the parameters of their last run
+        test = PolarimeterTest.objects.first()
+        write_sweep_time_series(test.data_file.path, min_band_ghz=40.0)
+        output = self.recompute()
+        self.assertIn('1 stale test(s)', output)
+        self.assertNotIn('parameters changed', output)
+        self.assertEqual([x.parameters for x in AnalysisRun.objects.all()],
+                         [{'settling_samples': 7}] * 2)
+
+        # Unless the user asks for other values
+        self.assertIn('0 stale test(s)', self.recompute('--param', 'settling_samples=7'))
+        output = self.recompute('--param', 'settling-samples=8')
+        self.assertIn('2 stale test(s)', output)
+        self.assertIn('parameters changed', output)
+        self.assertEqual([x.parameters for x in AnalysisRun.objects.all()],
+                         [{'settling_samples': 8}] * 2)
+
+        with self.assertRaises(CommandError):
+            self.recompute('--param', 'segment_length=10')
+
+    def testChangedAlgorithm(self):
+        with patch('unittests.management.commands.compute_bandpasses.'
+                   'Command.algorithm_version', '999'):
+            self.assertIn('2 stale test(s)', self.recompute('--dry-run'))
+            self.assertEqual(AnalysisRun.objects.filter(algorithm_version='999').count(), 0)
+
+            self.recompute()
+            self.assertEqual(AnalysisRun.objects.filter(algorithm_version='999').count(), 2)
+
+    def testChangedHousekeeping(self):
+        test = PolarimeterTest.objects.first()
+        PolarimeterTest.objects.filter(pk=test.pk).update(
+            cryogenic=True, data_file='yfactor.h5')
+        load_temperatures = [20.0, 40.0, 60.0]
+        write_yfactor_time_series(os.path.join(self.temporary_dir.name, 'yfactor.h5'),
+                                  load_temperatures)
+        for cur_temp in load_temperatures:
+            Temperatures(test=test,
+                         t_load_a_1=cur_temp, t_load_a_2=cur_temp,
+                         t_load_b_1=cur_temp, t_load_b_2=cur_temp,
+                         t_cross_guide_1=0.0, t_cross_guide_2=0.0,
+                         t_polarimeter_1=0.0, t_polarimeter_2=0.0).save()
+
+        output = StringIO()
+        call_command('recompute', '--author', 'janedoe', '--jobs', '1',
+                     '--engine', 'compute_tnoise', '--include-missing', stdout=output)
+        self.assertIn('never analysed', output.getvalue())
+        old_tnoise = NoiseTemperatureAnalysis.objects.get(test=test).tnoise_k
+
+        temperature = Temperatures.objects.filter(test=test).last()
+        temperature.t_load_a_1 = temperature.t_load_a_2 = 70.0
+        temperature.t_load_b_1 = temperature.t_load_b_2 = 70.0
+        temperature.save()
+
+        output = StringIO()
+        call_command('recompute', '--author', 'janedoe', '--jobs', '1',
+                     '--engine', 'compute_tnoise', stdout=output)
+        self.assertIn('housekeeping data changed', output.getvalue())
+        self.assertEqual(NoiseTemperatureAnalysis.objects.count(), 1)
+        self.assertNotAlmostEqual(
+            NoiseTemperatureAnalysis.objects.get(test=test).tnoise_k, old_tnoise)
+
+
+class TestDerivedStreams(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temporary_dir = TemporaryDirectory()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.temporary_dir.name)
+        cls.media_settings.enable()
+        super(TestDerivedStreams, cls).setUpClass()
+
+    def tearDown(self):
+        # The views keep the files open
+        h5pool.invalidate()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestDerivedStreams, cls).tearDownClass()
+        cls.media_settings.disable()
+        cls.temporary_dir.cleanup()
+
+    def setUp(self):
+        populate_tests_without_data(num_of_polarimeters=1, tests_per_polarimeter=1)
+        self.test = PolarimeterTest.objects.get()
+        PolarimeterTest.objects.filter(pk=self.test.pk).update(data_file='derived.h5')
+        self.test.refresh_from_db()
+
+        write_noise_time_series(self.test.data_file.path, 2500)
+        with h5py.File(self.test.data_file.path, 'r+') as h5_file:
+            write_derived_streams(h5_file, chunk_samples=1000)
+
+    def read_time_series(self):
+        with h5py.File(self.test.data_file.path, 'r') as h5_file:
+            return h5_file['time_series'][...]
+
+    def testDecimation(self):
+        data = self.read_time_series()
+        expected_i = np.mean([data[x].astype(np.float64) for x in PWR_COLUMNS], axis=0)
+        expected_q = 0.5 * (data['dem_Q1_ADU'].astype(np.float64) -
+                            data['dem_Q2_ADU'].astype(np.float64))
+
+        with h5py.File(self.test.data_file.path, 'r') as h5_file:
+            full = read_derived_streams(h5_file, 1)
+            self.assertEqual(len(full), 2500)
+            self.assertTrue(np.allclose(full['I'], expected_i))
+            self.assertTrue(np.allclose(full['Q'], expected_q, atol=1e-4))
+
+            decimated = read_derived_streams(h5_file, 1000)
+            self.assertEqual(len(decimated), 3)
+            self.assertAlmostEqual(float(decimated['I'][1]),
+                                   np.mean(expected_i[1000:2000]), places=3)
+            # The last block is shorter than the others
+            self.assertAlmostEqual(float(decimated['I'][2]),
+                                   np.mean(expected_i[2000:]), places=3)
+            self.assertIsNone(read_derived_streams(h5_file, 7))
+
+    def testAdcOffsets(self):
+        offset = AdcOffset(test=self.test, q1_adu=100, u1_adu=200, u2_adu=300, q2_adu=400)
+        offset.save()
+
+        expected_i = np.mean([self.read_time_series()[x].astype(np.float64)
+                              for x in PWR_COLUMNS], axis=0) - 250.0
+        with h5py.File(self.test.data_file.path, 'r') as h5_file:
+            self.assertTrue(np.allclose(read_derived_streams(h5_file, 1)['I'],
+                                        expected_i))
+            self.assertEqual(h5_file['derived'].attrs['pwr_offsets_adu'].tolist(),
+                             [100, 200, 300, 400])
+
+        offset.delete()
+        with h5py.File(self.test.data_file.path, 'r') as h5_file:
+            self.assertTrue(np.allclose(read_derived_streams(h5_file, 1)['I'],
+                                        expected_i + 250.0))
+
+    def testBulkChanges(self):
+        def read_offsets():
+            with h5py.File(self.test.data_file.path, 'r') as h5_file:
+                return h5_file['derived'].attrs['pwr_offsets_adu'].tolist()
+
+        AdcOffset(test=self.test, q1_adu=100, u1_adu=200, u2_adu=300, q2_adu=400).save()
+
+        # Query sets (used e.g. by the admin site) update the streams too
+        AdcOffset.objects.filter(test=self.test).update(q1_adu=500)
+        self.assertEqual(read_offsets(), [500, 200, 300, 400])
+        AdcOffset.objects.filter(test=self.test).delete()
+        self.assertEqual(read_offsets(), [0, 0, 0, 0])
+
+        # The file of a test being deleted is not written again
+        AdcOffset(test=self.test, q1_adu=1, u1_adu=2, u2_adu=3, q2_adu=4).save()
+        with patch('unittests.models.PolarimeterTest.update_derived_streams') as update:
+            self.test.delete()
+        update.assert_not_called()
+        self.assertEqual(AdcOffset.objects.count(), 0)
+
+    def testApi(self):
+        url = '/unittests/api/tests/{0}/derived/'.format(self.test.pk)
+
+        data = self.client.get(url).json()
+        self.assertEqual(data['decimation'], 1)
+        self.assertEqual(len(data['I']), 2500)
+        self.assertEqual(sorted(data.keys()),
+                         sorted(['test_id', 'decimation', 'sampling_frequency_hz',
+                                 'pwr_offsets_adu', 'time_s', 'I', 'Q', 'U']))
+
+        # The finest decimation producing no more than 30 samples is 100
+        data = self.client.get(url, {'max_samples': 30, 'fields': 'Q'}).json()
+        self.assertEqual(data['decimation'], 100)
+        self.assertEqual(len(data['Q']), 25)
+        self.assertNotIn('I', data)
+
+        data = self.client.get(url, {'decimation': 10,
+                                     'from_s': 100 / SAMPLING_FREQUENCY,
+                                     'to_s': 200 / SAMPLING_FREQUENCY}).json()
+        self.assertEqual(len(data['U']), 10)
+
+        response = self.client.get(url, {'decimation': 10}, HTTP_ACCEPT='application/x-npz')
+        self.assertEqual(response['Content-Type'], 'application/x-npz')
+        with np.load(BytesIO(response.content)) as arrays:
+            self.assertEqual(len(arrays['I']), 250)
+
+        self.assertEqual(self.client.get(url, {'decimation': 7}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'decimation': '10,100'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'max_samples': -1}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'fields': 'V'}).status_code, 400)
+
+        h5pool.invalidate(self.test.data_file.path)
+        with h5py.File(self.test.data_file.path, 'r+') as h5_file:
+            del h5_file['derived']
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class TestGlitchDetection(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temporary_dir = TemporaryDirectory()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.temporary_dir.name)
+        cls.media_settings.enable()
+        super(TestGlitchDetection, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestGlitchDetection, cls).tearDownClass()
+        cls.media_settings.disable()
+        cls.temporary_dir.cleanup()
+
+    def testDetectors(self):
+        signal = 1000.0 + np.random.RandomState(3).normal(size=10000)
+        signal[2000] += 40.0
+        signal[5000:] += 20.0
+        signal[8000:8005] = 32767.0
+
+        events = detect_events(signal, 'pwr_Q1_ADU')
+        self.assertTrue(np.all(events['channel'] == b'pwr_Q1_ADU'))
+        found = {(x['kind'].decode('utf-8'), x['start']) for x in events}
+        self.assertIn(('spike', 2000), found)
+        self.assertIn(('rail', 8000), found)
+
+        jumps = events[events['kind'] == b'jump']
+        self.assertTrue(np.any((jumps['start'] <= 5000) & (jumps['stop'] > 5000)))
+        # The only other jumps are at the edges of the saturated samples
+        near_step = (jumps['stop'] > 4900) & (jumps['start'] < 5100)
+        near_rail = (jumps['stop'] > 7900) & (jumps['start'] < 8100)
+        self.assertTrue(np.all(near_step | near_rail))
+
+        # White noise must not produce any event
+        self.assertEqual(len(detect_events(signal[:1900], 'pwr_Q1_ADU')), 0)
+
+    def testQuantizedSignal(self):
+        # The extreme values of a quantized signal repeat often, but they
+        # are far from the limits of the ADC
+        signal = np.clip(np.round(np.random.RandomState(5).normal(size=10000)), -2.0, 2.0)
+        at_max = signal == signal.max()
+        self.assertTrue(np.any(at_max[:-2] & at_max[1:-1] & at_max[2:]))
+        self.assertNotIn(b'rail', detect_events(signal, 'pwr_Q1_ADU')['kind'])
+
+        signal[100:103] = -32768.0
+        events = detect_events(signal, 'pwr_Q1_ADU')
+        self.assertEqual([(x['start'], x['stop']) for x in events if x['kind'] == b'rail'],
+                         [(100, 103)])
+        events = detect_events(signal, 'pwr_Q1_ADU', adc_range=(-2 ** 19, 2 ** 19 - 1))
+        self.assertNotIn(b'rail', events['kind'])
+
+    def testCommandAndApi(self):
+        populate_tests_without_data(num_of_polarimeters=2, tests_per_polarimeter=1)
+        for idx, cur_test in enumerate(PolarimeterTest.objects.order_by('pk')):
+            file_name = 'glitches_{0}.h5'.format(cur_test.pk)
+            PolarimeterTest.objects.filter(pk=cur_test.pk).update(data_file=file_name)
+            write_noise_time_series(os.path.join(self.temporary_dir.name, file_name),
+                                    5000, seed=idx + 1)
+            with h5py.File(os.path.join(self.temporary_dir.name, file_name), 'r+') as h5_file:
+                data = h5_file['time_series']['pwr_U1_ADU']
+                data[1000 * (idx + 1)] += 30.0 * (idx + 1)
+                h5_file['time_series']['pwr_U1_ADU'] = data
+
+        call_command('detect_glitches', stdout=open(os.devnull, 'w'))
+        self.assertEqual(GlitchEvent.objects.count(), 2)
+        # Running the command again does not duplicate the events
+        call_command('detect_glitches', '--force', stdout=open(os.devnull, 'w'))
+        self.assertEqual(GlitchEvent.objects.count(), 2)
+
+        first_test, second_test = PolarimeterTest.objects.order_by('pk')
+        event = GlitchEvent.objects.get(test=second_test)
+        self.assertEqual((event.kind, event.channel, event.start_sample, event.stop_sample),
+                         ('spike', 'pwr_U1_ADU', 2000, 2001))
+
+        data = self.client.get('/unittests/api/glitches/', {'kind': 'spike'}).json()
+        self.assertEqual([x['test_id'] for x in data['events']],
+                         [second_test.pk, first_test.pk])
+        self.assertAlmostEqual(data['events'][0]['start_time_s'],
+                               2000 / SAMPLING_FREQUENCY)
+
+        data = self.client.get('/unittests/api/glitches/', {
+            'polarimeter': first_test.polarimeter_number,
+            'channel': 'pwr_U1_ADU',
+        }).json()
+        self.assertEqual(len(data['events']), 1)
+        self.assertEqual(data['events'][0]['polarimeter_name'], first_test.polarimeter_name)
+
+        data = self.client.get('/unittests/api/glitches/', {
+            'min_severity': event.severity + 1.0}).json()
+        self.assertEqual(len(data['events']), 0)
+
+        response = self.client.get('/unittests/api/glitches/', {'kind': 'foo'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/unittests/api/glitches/', {'limit': '5,6'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestStateSegments(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temporary_dir = TemporaryDirectory()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.temporary_dir.name)
+        cls.media_settings.enable()
+        super(TestStateSegments, cls).setUpClass()
+
+    def tearDown(self):
+        # The views keep the files open
+        h5pool.invalidate()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestStateSegments, cls).tearDownClass()
+        cls.media_settings.disable()
+        cls.temporary_dir.cleanup()
+
+    def setUp(self):
+        populate_tests_without_data(num_of_polarimeters=1, tests_per_polarimeter=1)
+        self.test = PolarimeterTest.objects.get()
+        PolarimeterTest.objects.filter(pk=self.test.pk).update(data_file='segments.h5')
+        self.test.refresh_from_db()
+
+        # Four phase switch states, each recorded for half of its duration
+        self.phb = np.repeat([0, 1, 2, 3], 100).astype(np.int8)
+        self.record = np.tile(np.repeat([0, 1], 50), 4).astype(np.int8)
+        data = np.zeros(400, dtype=[('time_s', np.float32), ('phb', np.int8),
+                                    ('record', np.int8), ('pwr_Q1_ADU', np.float32)])
+        data['time_s'] = np.arange(400) / SAMPLING_FREQUENCY
+        data['phb'] = self.phb
+        data['record'] = self.record
+        data['pwr_Q1_ADU'] = np.arange(400)
+
+        with h5py.File(self.test.data_file.path, 'w') as h5_file:
+            h5_file.create_dataset('time_series', data=data)
+            self.assertEqual(write_segment_index(h5_file), 8)
+
+    def testIndex(self):
+        segments = compute_state_segments(self.phb, self.record)
+        self.assertEqual(segments['start'].tolist(), list(range(0, 400, 50)))
+        self.assertEqual(segments['stop'].tolist(), list(range(50, 401, 50)))
+        self.assertEqual(segments['phb'].tolist(), [0, 0, 1, 1, 2, 2, 3, 3])
+        self.assertEqual(segments['record'].tolist(), [0, 1] * 4)
+
+        self.assertEqual(len(compute_state_segments(self.phb[:0], self.record[:0])), 0)
+
+    def testReader(self):
+        with h5py.File(self.test.data_file.path, 'r') as h5_file:
+            recorded = list(iterate_segments(h5_file, record=1,
+                                             columns=['pwr_Q1_ADU']))
+            self.assertEqual(len(recorded), 4)
+            for segment, samples in recorded:
+                self.assertEqual(samples.tolist(),
+                                 list(range(segment['start'], segment['stop'])))
+
+            segment, samples = next(iterate_segments(h5_file, phb=2, record=0))
+            self.assertEqual(segment['start'], 200)
+            self.assertTrue(np.all(samples['phb'] == 2))
+
+    def testApi(self):
+        url = '/unittests/api/tests/{0}/segments/'.format(self.test.pk)
+        data = self.client.get(url, {'record': 1}).json()
+        self.assertEqual([x['start'] for x in data['segments']], [50, 150, 250, 350])
+        self.assertAlmostEqual(data['segments'][1]['start_time_s'],
+                               150 / SAMPLING_FREQUENCY)
+
+        data = self.client.get(url, {'phb': 3}).json()
+        self.assertEqual(len(data['segments']), 2)
+        self.assertEqual(self.client.get(url, {'phb': '1,2'}).status_code, 400)
+
+        h5pool.invalidate(self.test.data_file.path)
+        with h5py.File(self.test.data_file.path, 'r+') as h5_file:
+            del h5_file['segments']
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+def write_attribute_in_other_process(file_name):
+    'Set an attribute of "file_name" from a new process and return its exit code'
+
+    script = ('import sys, h5py\n'
+              'with h5py.File(sys.argv[1], "r+") as h5_file:\n'
+              '    h5_file.attrs["written"] = True\n')
+    return subprocess.call([sys.executable, '-c', script, file_name],
+                           stderr=subprocess.DEVNULL)
+
+
+class TestH5FilePool(TestCase):
+    def setUp(self):
+        self.temporary_dir = TemporaryDirectory()
+        self.file_names = []
+        for idx in range(3):
+            file_name = os.path.join(self.temporary_dir.name, 'pool_{0}.h5'.format(idx))
+            write_noise_time_series(file_name, 100, seed=idx + 1)
+            self.file_names.append(file_name)
+
+        h5pool.invalidate()
+        self.pool = h5pool.H5FilePool(max_size=2, rdcc_nbytes=2**20)
+
+    def tearDown(self):
+        self.pool.invalidate()
+        h5pool.invalidate()
+        self.temporary_dir.cleanup()
+
+    def read_first_sample(self, file_name):
+        handle = self.pool.acquire(file_name)
+        try:
+            return handle['time_series'][0]['pwr_Q1_ADU']
+        finally:
+            self.pool.release(handle)
+
+    def testHitsAndEvictions(self):
+        for cur_file in self.file_names[:2] * 3:
+            self.read_first_sample(cur_file)
+        self.assertEqual(self.pool.stats()['hits'], 4)
+        self.assertEqual(self.pool.stats()['misses'], 2)
+
+        # The first file is the least recently used one
+        self.read_first_sample(self.file_names[2])
+        self.assertEqual(self.pool.stats()['evictions'], 1)
+        self.assertEqual(self.pool.stats()['size'], 2)
+        self.read_first_sample(self.file_names[0])
+        self.assertEqual(self.pool.stats()['misses'], 4)
+
+    def testReplacedFile(self):
+        old_value = self.read_first_sample(self.file_names[0])
+
+        self.pool.invalidate(self.file_names[0])
+        self.assertEqual(self.pool.stats()['size'], 0)
+        write_noise_time_series(self.file_names[0], 100, seed=10)
+        # Make sure that the modification time changes
+        os.utime(self.file_names[0], ns=(0, 10**9))
+
+        self.assertNotEqual(self.read_first_sample(self.file_names[0]), old_value)
+        self.assertEqual(self.pool.stats()['misses'], 2)
+
+    def testHandlesInUse(self):
+        handle = self.pool.acquire(self.file_names[0])
+        self.pool.invalidate()
+        # The handle must stay open until it is released
+        self.assertEqual(handle['time_series'].shape, (100,))
+        self.pool.release(handle)
+        self.assertFalse(handle)
+
+    def testWriteFromOtherProcess(self):
+        # Handles in the pool must not prevent other workers from writing
+        handle = self.pool.acquire(self.file_names[0])
+        try:
+            self.assertEqual(write_attribute_in_other_process(self.file_names[0]), 0)
+        finally:
+            self.pool.release(handle)
+
+        self.pool.invalidate()
+        with h5py.File(self.file_names[0], 'r') as h5_file:
+            self.assertTrue(h5_file.attrs['written'])
+
+    def testViews(self):
+        populate_tests_without_data(num_of_polarimeters=1, tests_per_polarimeter=1)
+        test = PolarimeterTest.objects.get()
+        PolarimeterTest.objects.filter(pk=test.pk).update(data_file='pool_0.h5')
+        with h5py.File(self.file_names[0], 'r+') as h5_file:
+            write_derived_streams(h5_file)
+
+        # Counters are shared by all the tests run in this process
+        old_stats = h5pool.get_pool().stats()
+        url = '/unittests/api/tests/{0}/derived/'.format(test.pk)
+        with override_settings(MEDIA_ROOT=self.temporary_dir.name):
+            for idx in range(3):
+                response = self.client.get(url, {'from_s': idx, 'to_s': idx + 1})
+                self.assertEqual(response.status_code, 200)
+
+        new_stats = h5pool.get_pool().stats()
+        self.assertEqual(new_stats['misses'] - old_stats['misses'], 1)
+        self.assertEqual(new_stats['hits'] - old_stats['hits'], 2)
+
+
+class TestTimeSeriesApi(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temporary_dir = TemporaryDirectory()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.temporary_dir.name)
+        cls.media_settings.enable()
+        super(TestTimeSeriesApi, cls).setUpClass()
+
+    def tearDown(self):
+        h5pool.invalidate()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestTimeSeriesApi, cls).tearDownClass()
+        cls.media_settings.disable()
+        cls.temporary_dir.cleanup()
+
+    def setUp(self):
+        populate_tests_without_data(num_of_polarimeters=1, tests_per_polarimeter=1)
+        self.test = PolarimeterTest.objects.get()
+        PolarimeterTest.objects.filter(pk=self.test.pk).update(data_file='window.h5')
+        self.test.refresh_from_db()
+        write_noise_time_series(self.test.data_file.path, 1000)
+        with h5py.File(self.test.data_file.path, 'r') as h5_file:
+            self.data = h5_file['time_series'][...]
+
+    def testWindow(self):
+        url = '/unittests/api/tests/{0}/time_series/'.format(self.test.pk)
+        data = self.client.get(url, {'columns': 'pwr_Q1_ADU',
+                                     'from_s': 10 / SAMPLING_FREQUENCY,
+                                     'to_s': 20 / SAMPLING_FREQUENCY}).json()
+        self.assertEqual(sorted(data.keys()), ['pwr_Q1_ADU', 'test_id', 'time_s'])
+        self.assertEqual(data['pwr_Q1_ADU'], self.data['pwr_Q1_ADU'][10:20].tolist())
+
+        response = self.client.get(url, HTTP_ACCEPT='application/x-npz')
+        with np.load(BytesIO(response.content)) as arrays:
+            self.assertEqual(len(arrays['dem_Q1_ADU']), 1000)
+
+        self.assertEqual(self.client.get(url, {'columns': 'foo'}).status_code, 400)
+
+    def testPartialRead(self):
+        url = '/unittests/api/tests/{0}/time_series/'.format(self.test.pk)
+        with patch('unittests.shmcache.count_hdf5_bytes') as count_bytes:
+            data = self.client.get(url, {'columns': 'pwr_Q1_ADU',
+                                         'from_s': 990 / SAMPLING_FREQUENCY,
+                                         'to_s': 2000 / SAMPLING_FREQUENCY}).json()
+        self.assertEqual(data['time_s'], self.data['time_s'][990:].tolist())
+        # Only the samples in the window have been read
+        count_bytes.assert_called_once_with(read=10 * 2 * 4)
+
+    def testJsonLimit(self):
+        url = '/unittests/api/tests/{0}/time_series/'.format(self.test.pk)
+        with patch('unittests.views.TestTimeSeries.max_json_samples', 100):
+            self.assertEqual(self.client.get(url).status_code, 400)
+            response = self.client.get(url, {'to_s': 100 / SAMPLING_FREQUENCY})
+            self.assertEqual(len(response.json()['time_s']), 100)
+
+            response = self.client.get(url, HTTP_ACCEPT='application/x-npz')
+            self.assertEqual(response.status_code, 200)
+
+
+@skipIf(shmcache.shared_memory is None, 'multiprocessing.shared_memory is not available')
+class TestSharedColumnCache(TestCase):
+    def setUp(self):
+        self.temporary_dir = TemporaryDirectory()
+        self.cache = shmcache.SharedColumnCache(
+            max_bytes=10000, prefix='stdb2test{0}'.format(os.getpid()))
+        self.cache.clear()
+
+    def tearDown(self):
+        self.cache.clear()
+        h5pool.invalidate()
+        self.temporary_dir.cleanup()
+
+    def testLeastRecentlyUsed(self):
+        for key in ('a', 'b'):
+            self.cache.put(key * 40, np.ones(500))
+        self.cache.get('a' * 40)
+        self.cache.put('c' * 40, np.ones(500))
+
+        self.assertEqual(self.cache.stats()['bytes'], 8000)
+        self.assertIsNone(self.cache.get('b' * 40))
+        view = self.cache.get('a' * 40)
+        self.assertFalse(view.flags.writeable)
+        self.assertEqual(view.sum(), 500)
+
+        # Arrays larger than the cache are returned unchanged
+        array = np.ones(2000)
+        self.assertIs(self.cache.put('d' * 40, array), array)
+
+    def testSharedBetweenInstances(self):
+        file_name = os.path.join(self.temporary_dir.name, 'shm.h5')
+        write_noise_time_series(file_name, 100)
+
+        with patch('unittests.shmcache.get_cache', return_value=self.cache):
+            first = shmcache.read_time_series_columns(file_name, ['pwr_Q1_ADU', 'time_s'])
+
+        # A second instance (as in another worker) finds the same segment
+        other_cache = shmcache.SharedColumnCache(max_bytes=10000,
+                                                 prefix=self.cache.prefix)
+        with patch('unittests.shmcache.get_cache', return_value=other_cache):
+            second = shmcache.read_time_series_columns(file_name, ['pwr_Q1_ADU'])
+        self.assertEqual(other_cache.stats()['hits'], 1)
+        self.assertTrue(np.all(first['pwr_Q1_ADU'] == second['pwr_Q1_ADU']))
+
+
+def make_live_samples(num_of_samples, seed=1):
+    'Return an array of samples with three phb states and noisy outputs'
+
+    np.random.seed(seed)
+    samples = np.zeros(num_of_samples, dtype=TIME_SERIES_DATA_TYPE)
+    for column in DEM_COLUMNS + PWR_COLUMNS:
+        samples[column] = np.random.randint(-1000, 1000, num_of_samples)
+    samples['phb'] = np.arange(num_of_samples) * 3 // num_of_samples
+    samples['record'] = 1
+    return samples
+
+
+def samples_to_text(samples):
+    'Format samples as the lines written by the acquisition software'
+
+    return ''.join(' '.join(str(x[column]) for column in TEXT_FILE_COLUMNS) + '\n'
+                   for x in samples).encode('utf-8')
+
+
+class TestLiveAcquisition(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temporary_dir = TemporaryDirectory()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.temporary_dir.name)
+        cls.media_settings.enable()
+        super(TestLiveAcquisition, cls).setUpClass()
+
+    def tearDown(self):
+        h5pool.invalidate()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestLiveAcquisition, cls).tearDownClass()
+        cls.media_settings.disable()
+        cls.temporary_dir.cleanup()
+
+    def testIncrementalUpdates(self):
+        samples = make_live_samples(2500)
+        file_name = os.path.join(self.temporary_dir.name, 'incremental.h5')
+        live.create_live_file(file_name, pwr_offsets=[1, 2, 3, 4])
+        for start, stop in ((0, 10), (10, 1234), (1234, 2500)):
+            self.assertEqual(live.append_samples(file_name, samples[start:stop]), stop)
+
+        # Compare the file with one where all the samples are written at once
+        reference = samples.copy()
+        reference['time_s'] = np.arange(len(samples)) / SAMPLING_FREQUENCY
+        with h5py.File(os.path.join(self.temporary_dir.name, 'reference.h5'), 'w') as ref_file, \
+             h5py.File(file_name, 'r', swmr=True) as h5_file:
+            ref_file.create_dataset('time_series', data=reference)
+            write_derived_streams(ref_file, pwr_offsets=[1, 2, 3, 4])
+            write_segment_index(ref_file)
+
+            self.assertTrue(np.all(h5_file['time_series'][...] == reference))
+            for dataset_name in ('derived/stokes_10', 'derived/stokes_1000', 'segments'):
+                for column in ref_file[dataset_name].dtype.names:
+                    self.assertTrue(np.allclose(h5_file[dataset_name][column],
+                                                ref_file[dataset_name][column]))
+
+            statistics = live.read_statistics(h5_file)['pwr_U2_ADU']
+            self.assertEqual(statistics['count'], 2500)
+            values = samples['pwr_U2_ADU'].astype(np.float64)
+            self.assertAlmostEqual(statistics['mean'], values.mean())
+            self.assertAlmostEqual(statistics['std'], values.std())
+            self.assertEqual(statistics['max'], samples['pwr_U2_ADU'].max())
+
+        live.finish_live_file(file_name)
+        with self.assertRaises(ValueError):
+            live.append_samples(file_name, samples[:10])
+
+    def testApi(self):
+        populate_tests_without_data(num_of_polarimeters=1, tests_per_polarimeter=1)
+        test = PolarimeterTest.objects.get()
+        url = '/unittests/api/tests/{0}/live/'.format(test.pk)
+        samples = make_live_samples(600)
+
+        # Anonymous users cannot append samples
+        self.assertEqual(self.client.post(url, samples_to_text(samples),
+                                          content_type='text/plain').status_code, 403)
+
+        self.client.login(username='janedoe', password='iseedeadpeople')
+        for start in (0, 200, 400):
+            response = self.client.post(url, samples_to_text(samples[start:start + 200]),
+                                        content_type='text/plain')
+            self.assertEqual(response.json()['num_of_samples'], start + 200)
+
+            # Readers see the samples while they are being appended
+            data = self.client.get(url).json()
+            self.assertTrue(data['live'])
+            self.assertEqual(data['statistics']['dem_Q1_ADU']['count'], start + 200)
+
+        self.assertEqual(self.client.post(url, b'1 2 3\n', content_type='text/plain')
+                         .status_code, 400)
+
+        response = self.client.post(url + '?final=true', b'', content_type='text/plain')
+        self.assertEqual(response.json()['num_of_samples'], 600)
+        test.refresh_from_db()
+        self.assertTrue(test.pwr_plot)
+        self.assertEqual(test.glitch_events.count(), response.json()['num_of_glitches'])
+        with h5py.File(test.data_file.path, 'r') as h5_file:
+            self.assertEqual(h5_file.attrs['polarimeter'], test.polarimeter_name)
+
+        # No more samples can be appended
+        self.assertEqual(self.client.post(url, samples_to_text(samples[:10]),
+                                          content_type='text/plain').status_code, 409)
+
+    def testLineBuffer(self):
+        buffer = LineBuffer()
+        self.assertEqual(buffer.feed(b'header\n1 2'), b'')
+        self.assertEqual(buffer.feed(b' 3\n4 5'), b'1 2 3\n')
+        self.assertEqual(buffer.feed(b''), b'')
+        self.assertEqual(buffer.pending, b'4 5')
+
+
+class TestLiveStream(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temporary_dir = TemporaryDirectory()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.temporary_dir.name,
+                                               LIVE_STREAM_POLL_SECONDS=0.0)
+        cls.media_settings.enable()
+        super(TestLiveStream, cls).setUpClass()
+
+    def tearDown(self):
+        h5pool.invalidate()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestLiveStream, cls).tearDownClass()
+        cls.media_settings.disable()
+        cls.temporary_dir.cleanup()
+
+    def testSharedReader(self):
+        samples = make_live_samples(45)
+        file_name = os.path.join(self.temporary_dir.name, 'stream.h5')
+        live.create_live_file(file_name)
+        live.append_samples(file_name, samples[:25])
+
+        reader = livestream.get_reader(file_name, decimation=10, poll_interval=60.0)
+        self.assertIs(livestream.get_reader(file_name, decimation=10), reader)
+
+        # Only complete blocks are read while the acquisition is running
+        first, blocks = reader.wait(0, timeout=1.0)
+        self.assertEqual((first, len(blocks)), (0, 2))
+        self.assertAlmostEqual(blocks['pwr_Q1_ADU'][1],
+                               samples['pwr_Q1_ADU'][10:20].astype(np.float64).mean())
+
+        # Another client gets the same blocks without reading the file
+        first, blocks = reader.wait(1, timeout=0.0)
+        self.assertEqual((first, len(blocks)), (1, 1))
+        self.assertEqual(reader.num_of_polls, 1)
+
+        # Only the new samples are read, including the last incomplete block
+        h5pool.invalidate(file_name)
+        live.append_samples(file_name, samples[25:])
+        live.finish_live_file(file_name)
+        reader.poll_interval = 0.0
+        first, blocks = reader.wait(2, timeout=1.0)
+        self.assertEqual((first, len(blocks)), (2, 3))
+        self.assertAlmostEqual(blocks['pwr_Q1_ADU'][2],
+                               samples['pwr_Q1_ADU'][40:].astype(np.float64).mean())
+        self.assertTrue(reader.finished)
+
+    def testReaderInOtherProcess(self):
+        samples = make_live_samples(40)
+        file_name = os.path.join(self.temporary_dir.name, 'other_process.h5')
+        live.create_live_file(file_name)
+        live.append_samples(file_name, samples[:20])
+
+        # The reader keeps the file open in its pool while this process
+        # appends new samples, as two workers of the same site would do
+        script = ('import sys, django\n'
+                  'django.setup()\n'
+                  'from unittests.livestream import LiveStreamReader\n'
+                  'reader = LiveStreamReader(sys.argv[1], 10, poll_interval=0.0)\n'
+                  'for line in sys.stdin:\n'
+                  '    first, blocks = reader.wait(int(line), timeout=5.0)\n'
+                  '    print(first + len(blocks), flush=True)\n')
+        child = subprocess.Popen([sys.executable, '-c', script, file_name],
+                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                 cwd=settings.BASE_DIR, universal_newlines=True)
+        try:
+            child.stdin.write('0\n')
+            child.stdin.flush()
+            self.assertEqual(child.stdout.readline().strip(), '2')
+
+            self.assertEqual(live.append_samples(file_name, samples[20:]), 40)
+            child.stdin.write('2\n')
+            child.stdin.flush()
+            self.assertEqual(child.stdout.readline().strip(), '4')
+        finally:
+            child.stdin.close()
+            child.wait()
+
+    def testReconnection(self):
+        samples = make_live_samples(60)
+        file_name = os.path.join(self.temporary_dir.name, 'reconnect.h5')
+        live.create_live_file(file_name)
+        live.append_samples(file_name, samples)
+        with h5py.File(file_name, 'r') as h5_file:
+            bytes_per_block = h5_file['time_series'][
+                (slice(0, 10),) + livestream.STREAM_COLUMNS].nbytes
+
+        # A new reader does not read the blocks its first client already has
+        reader = livestream.get_reader(file_name, decimation=10, poll_interval=0.0,
+                                       first=4)
+        with patch('unittests.livestream.count_hdf5_bytes') as count_bytes:
+            first, blocks = reader.wait(4, timeout=1.0)
+        self.assertEqual((first, len(blocks)), (4, 2))
+        self.assertAlmostEqual(blocks['pwr_Q1_ADU'][0],
+                               samples['pwr_Q1_ADU'][40:50].astype(np.float64).mean())
+        count_bytes.assert_called_once_with(read=2 * bytes_per_block)
+
+        # Older blocks are read only when a client asks for them
+        with patch('unittests.livestream.count_hdf5_bytes') as count_bytes:
+            first, blocks = reader.wait(1, timeout=1.0)
+        self.assertEqual((first, len(blocks)), (1, 5))
+        self.assertAlmostEqual(blocks['pwr_Q1_ADU'][0],
+                               samples['pwr_Q1_ADU'][10:20].astype(np.float64).mean())
+        count_bytes.assert_called_once_with(read=3 * bytes_per_block)
+        self.assertEqual(reader.first_block, 1)
+
+    def testOlderBlocksLimit(self):
+        file_name = os.path.join(self.temporary_dir.name, 'older_blocks.h5')
+        live.create_live_file(file_name)
+        live.append_samples(file_name, make_live_samples(100))
+
+        reader = livestream.LiveStreamReader(file_name, 10, poll_interval=0.0,
+                                             max_blocks=3, first_block=8)
+        self.assertEqual(reader.wait(8, timeout=1.0)[0], 8)
+
+        # Clients asking for older blocks get at most "max_blocks" of them
+        first, blocks = reader.wait(0, timeout=1.0)
+        self.assertEqual((first, len(blocks)), (7, 3))
+        self.assertEqual((reader.first_block, len(reader.blocks)), (7, 3))
+
+    def testEvents(self):
+        populate_tests_without_data(num_of_polarimeters=1, tests_per_polarimeter=1)
+        test = PolarimeterTest.objects.get()
+        test.append_live_samples(make_live_samples(100))
+        self.assertIn(b'live-plot', self.client.get(test.get_absolute_url()).content)
+
+        test.finish_live_acquisition()
+        url = '/unittests/tests/{0}/stream/'.format(test.pk)
+        response = self.client.get(url, {'decimation': 25})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = b''.join(response.streaming_content).decode('utf-8').split('\n\n')
+        self.assertIn('id: 4\nevent: samples\n', events[1])
+        self.assertEqual(len(json.loads(events[1].split('data: ')[1])['pwr_U1_ADU']), 4)
+        self.assertTrue(events[2].startswith('event: end'))
+
+        # Clients reconnecting get only the blocks they have not received
+        response = self.client.get(url, {'decimation': 25, 'encoding': 'base64'},
+                                   HTTP_LAST_EVENT_ID='3')
+        events = b''.join(response.streaming_content).decode('utf-8').split('\n\n')
+        data = json.loads(events[1].split('data: ')[1])
+        self.assertEqual(data['first'], 3)
+        self.assertEqual(len(base64.b64decode(data['pwr_U1_ADU'])), 4)
+
+        self.assertEqual(self.client.get(url, {'decimation': 0}).status_code, 400)
+
+
+class TestRequestTiming(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temporary_dir = TemporaryDirectory()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.temporary_dir.name)
+        cls.media_settings.enable()
+        super(TestRequestTiming, cls).setUpClass()
+
+    def tearDown(self):
+        h5pool.invalidate()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestRequestTiming, cls).tearDownClass()
+        cls.media_settings.disable()
+        cls.temporary_dir.cleanup()
+
+    def setUp(self):
+        populate_tests_without_data(num_of_polarimeters=1, tests_per_polarimeter=1)
+        self.test = PolarimeterTest.objects.get()
+        PolarimeterTest.objects.filter(pk=self.test.pk).update(data_file='timing.h5')
+        write_noise_time_series(os.path.join(self.temporary_dir.name, 'timing.h5'), 100)
+
+    def testSampledRequests(self):
+        with override_settings(REQUEST_TIMING_SAMPLE_RATE=1.0), \
+             self.assertLogs('unittests.timing', 'INFO') as logs:
+            response = self.client.get('/unittests/')
+            header = response['Server-Timing']
+            self.assertRegex(header, r'db;dur=[0-9.]+;desc="[1-9][0-9]* queries"')
+            self.assertRegex(header, r'render;dur=[0-9.]*[1-9]')
+
+            response = self.client.get('/unittests/api/tests/{0}/time_series/'
+                                       .format(self.test.pk), {'columns': 'pwr_Q1_ADU'})
+            self.assertIn('hdf5;desc="read 800 B, written 0 B"', response['Server-Timing'])
+
+        fields = json.loads(logs.output[-1].split('request timing ')[1])
+        self.assertEqual(fields['hdf5_bytes_read'], 800)
+        self.assertEqual(fields['status'], 200)
+        self.assertFalse(connection.force_debug_cursor)
+
+    def testSamplingOff(self):
+        with override_settings(REQUEST_TIMING_SAMPLE_RATE=0.0):
+            self.assertNotIn('Server-Timing', self.client.get('/unittests/'))
+
+
+def update_metrics_in_child_process():
+    'Update some metrics from a process which exits immediately'
+
+    metrics.CONVERSION_BYTES.inc(2.0, format='txt')
+    metrics.PENDING_JOBS.set(5, job='child')
+    metrics.PLOT_DURATION.observe(0.2)
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        self.temporary_dir = TemporaryDirectory()
+        self.metrics_settings = override_settings(METRICS_DIR=self.temporary_dir.name)
+        self.metrics_settings.enable()
+
+    def tearDown(self):
+        self.metrics_settings.disable()
+        self.temporary_dir.cleanup()
+
+    def get_samples(self):
+        response = self.client.get('/metrics')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        samples = {}
+        for line in response.content.decode('utf-8').splitlines():
+            if not line.startswith('#'):
+                key, value = line.rsplit(' ', 1)
+                samples[key] = float(value)
+        return samples
+
+    def testAggregation(self):
+        metrics.CONVERSION_BYTES.inc(1.0, format='txt')
+        metrics.PENDING_JOBS.set(3, job='parent')
+        metrics.PLOT_DURATION.observe(0.02)
+
+        child = multiprocessing.get_context('fork').Process(target=update_metrics_in_child_process)
+        child.start()
+        child.join()
+
+        samples = self.get_samples()
+        self.assertEqual(samples['stdb2_conversion_input_bytes_total{format="txt"}'], 3.0)
+        # Gauges of processes which are no longer running are ignored
+        self.assertEqual(samples['stdb2_pending_jobs{job="parent"}'], 3.0)
+        self.assertNotIn('stdb2_pending_jobs{job="child"}', samples)
+        # Buckets are cumulative
+        self.assertEqual(samples['stdb2_pwr_plot_duration_seconds_bucket{le="0.025"}'], 1.0)
+        self.assertEqual(samples['stdb2_pwr_plot_duration_seconds_bucket{le="0.25"}'], 2.0)
+        self.assertEqual(samples['stdb2_pwr_plot_duration_seconds_bucket{le="+Inf"}'], 2.0)
+        self.assertAlmostEqual(samples['stdb2_pwr_plot_duration_seconds_sum'], 0.22)
+
+        # The file of the child has been merged into the archive
+        file_names = sorted(os.listdir(self.temporary_dir.name))
+        self.assertEqual(file_names, sorted([metrics.ARCHIVE_FILE_NAME,
+                                             metrics.LOCK_FILE_NAME,
+                                             'metrics_{0}.db'.format(os.getpid())]))
+        # Values are not counted twice once they are archived
+        samples = self.get_samples()
+        self.assertEqual(samples['stdb2_conversion_input_bytes_total{format="txt"}'], 3.0)
+        self.assertAlmostEqual(samples['stdb2_pwr_plot_duration_seconds_sum'], 0.22)
+
+    def testReusedPid(self):
+        # File left by a dead process with the same PID as ours
+        file_name = metrics.process_file_name(self.temporary_dir.name, os.getpid())
+        store = metrics.MmapValues(file_name)
+        store.add(metrics.sample_key('stdb2_conversion_input_bytes_total',
+                                     {'format': 'txt'}), 5.0)
+        store.close()
+
+        metrics.CONVERSION_BYTES.inc(1.0, format='txt')
+        with open(file_name, 'rb') as input_file:
+            values = [value for _, value, _ in metrics.read_entries(input_file.read())]
+        self.assertEqual(values, [1.0])
+
+        samples = self.get_samples()
+        self.assertEqual(samples['stdb2_conversion_input_bytes_total{format="txt"}'], 6.0)
+
+    def testArchiveAtExit(self):
+        metrics.CONVERSION_BYTES.inc(1.0, format='txt')
+        metrics.PENDING_JOBS.set(3, job='parent')
+        metrics.archive_values()
+        self.assertFalse(os.path.exists(
+            metrics.process_file_name(self.temporary_dir.name, os.getpid())))
+
+        metrics.CONVERSION_BYTES.inc(1.0, format='txt')
+        samples = self.get_samples()
+        self.assertEqual(samples['stdb2_conversion_input_bytes_total{format="txt"}'], 2.0)
+        self.assertNotIn('stdb2_pending_jobs{job="parent"}', samples)
+
+    def testStoreGrows(self):
+        store = metrics.MmapValues(os.path.join(self.temporary_dir.name, 'metrics_1.db'))
+        for idx in range(5000):
+            store.add('key{0}'.format(idx), idx)
+        store.set('key0', -1.0)
+
+        # Open the file again, as another process would do
+        with open(store.file_name, 'rb') as input_file:
+            values = {key: value for key, value, _ in metrics.read_entries(input_file.read())}
+        self.assertEqual(len(values), 5000)
+        self.assertEqual(values['key0'], -1.0)
+        self.assertEqual(values['key4999'], 4999.0)
+
+    def testRequestLatency(self):
+        populate_tests_without_data(num_of_polarimeters=1, tests_per_polarimeter=1)
+        self.client.get('/unittests/')
+        self.client.get('/unittests/')
+
+        samples = self.get_samples()
+        self.assertEqual(samples['stdb2_request_duration_seconds_count'
+                                 '{method="GET",view="unittests:test_list"}'], 2.0)
+        self.assertEqual(samples['stdb2_responses_total'
+                                 '{status="200",view="unittests:test_list"}'], 2.0)
+
+
+class TestIngestTracing(TestCase):
+    def testNestedSpans(self):
+        # Without an active trace, spans record nothing
+        with tracing.span('ignored') as cur_span:
+            cur_span.bytes_out = 10
+
+        with tracing.trace('root', bytes_in=100) as root:
+            with tracing.span('allocate', bytes_in=10) as cur_span:
+                array = np.ones(1000000)
+                cur_span.bytes_out = array.nbytes
+                del array
+            with tracing.span('empty'):
+                with tracing.span('nested'):
+                    pass
+
+        trace = root.to_dict()
+        self.assertEqual([x['name'] for x in trace['children']], ['allocate', 'empty'])
+        self.assertEqual(trace['children'][0]['bytes_out'], 8000000)
+        self.assertGreaterEqual(trace['children'][0]['peak_traced_bytes'], 8000000)
+        self.assertGreaterEqual(trace['peak_traced_bytes'], 8000000)
+        self.assertGreaterEqual(trace['wall_time_s'], trace['children'][0]['wall_time_s'])
+        self.assertGreater(trace['peak_rss_bytes'], 0)
+        self.assertEqual([x[0] for x in tracing.flatten_spans(trace)],
+                         ['root', 'root/allocate', 'root/empty', 'root/empty/nested'])
+
+    def testIngestRecords(self):
+        temporary_dir = TemporaryDirectory()
+        with override_settings(MEDIA_ROOT=temporary_dir.name, INGEST_TRACE_MEMORY=True):
+            # The test is saved twice, but the second time no file is uploaded
+            populate_database()
+            h5pool.invalidate()
+        temporary_dir.cleanup()
+
+        records = IngestRecord.objects.order_by('pk')
+        self.assertEqual([x.file_format for x in records], ['txt'])
+        self.assertEqual(records[0].file_name, 'datafile.txt')
+        self.assertGreater(records[0].peak_traced_bytes, 0)
+
+        paths = [x[0] for x in tracing.flatten_spans(records[0].trace)]
+        for path in ('save/conversion/read_upload', 'save/conversion/parse_text',
+                     'save/conversion/write_time_series', 'save/pwr_plot',
+                     'save/hdf5_attrs'):
+            self.assertIn(path, paths)
+
+        output = StringIO()
+        call_command('ingest_report', '--format', 'txt', stdout=output)
+        self.assertIn('1 upload(s)', output.getvalue())
+        self.assertIn('save/conversion/parse_text', output.getvalue())
+
+
+class TestBenchmarks(TestCase):
+    def testRun(self):
+        with TemporaryDirectory() as work_dir, override_settings(MEDIA_ROOT=work_dir):
+            results = benchmarks.run_benchmarks(
+                work_dir, data_scales=[100], database_scales=[8],
+                names=['convert_text', 'read_time_series', 'view_api_tnoise'],
+                repeat=2)
+            h5pool.invalidate()
+
+        self.assertEqual([(x['name'], x['scale'], x['scale_unit']) for x in results['results']],
+                         [('convert_text', 100, 'samples'),
+                          ('read_time_series', 100, 'samples'),
+                          ('view_api_tnoise', 8, 'tests')])
+        for cur_result in results['results']:
+            self.assertEqual(cur_result['repeat'], 2)
+            self.assertGreater(cur_result['wall_time_s']['median'], 0.0)
+            self.assertGreater(cur_result['peak_traced_bytes'], 0)
+
+        # The view benchmarks leave the database empty
+        self.assertFalse(PolarimeterTest.objects.exists())
+        self.assertIn('python', results['environment'])
+        json.dumps(results)
+
+    def testCompare(self):
+        def make_results(times):
+            return {'results': [{'name': name, 'scale': 10, 'wall_time_s': {'median': value}}
+                                for name, value in times.items()]}
+
+        baseline = make_results({'a': 1.0, 'b': 1.0, 'c': 1.0, 'old': 1.0})
+        current = make_results({'a': 1.05, 'b': 1.5, 'c': 0.5, 'new': 1.0})
+        self.assertEqual(
+            [(x[0], x[5]) for x in benchmarks.compare_results(baseline, current, 0.1)],
+            [('a', ''), ('b', 'slower'), ('c', 'faster')])
+
+
+class TestSyntheticData(TestCase):
+    def testTextFile(self):
+        synthetic_test = synthetic.SyntheticTest(120.0, kind='bandpass', band='W',
+                                                 phase_switch_period_s=30.0)
+        with TemporaryDirectory() as work_dir:
+            text_file_name = os.path.join(work_dir, 'test.txt')
+            h5_file_name = os.path.join(work_dir, 'test.h5')
+            synthetic_test.write_text_file(text_file_name)
+            with open(text_file_name, 'rb') as input_file:
+                convert_text_file_to_h5(input_file, h5_file_name)
+
+            with h5py.File(h5_file_name, 'r') as h5_file:
+                data = h5_file['time_series'][:]
+            results = compute_bandpass_analysis(h5_file_name)
+
+        self.assertEqual(len(data), 3000)
+        self.assertEqual(sorted(set(data['phb'])), [0, 1, 2, 3])
+        self.assertEqual(sorted(set(data['record'])), [0, 1])
+        # The sign of the DEM outputs follows the state of the phase switches
+        self.assertGreater(data['dem_Q1_ADU'][data['phb'] == 0].mean(), 0.0)
+        self.assertLess(data['dem_Q1_ADU'][data['phb'] == 3].mean(), 0.0)
+        self.assertEqual(len(set(data['freq_Hz'])), synthetic_test.num_of_steps)
+        self.assertAlmostEqual(results['central_nu_ghz'], 95.0, delta=0.5)
+
+    def testKeithleyZip(self):
+        with TemporaryDirectory() as work_dir:
+            zip_file_name = os.path.join(work_dir, 'test.zip')
+            h5_file_name = os.path.join(work_dir, 'test.h5')
+            synthetic.write_keithley_zip(zip_file_name, num_of_blocks=3, points_per_curve=20)
+            with open(zip_file_name, 'rb') as input_file:
+                convert_zip_file_to_h5(input_file, h5_file_name)
+
+            with h5py.File(h5_file_name, 'r') as h5_file:
+                self.assertEqual(h5_file['HA1/IDVD'].shape, (20, 3))
+                self.assertEqual(h5_file['HA1/IDVD'].attrs['fixed_value'], 'GateV')
+                self.assertEqual(h5_file['Q1/IFVF'].shape, (20, 3))
+                self.assertIn('PSB2/IRVR', h5_file)
+
+    def testPopulate(self):
+        with TemporaryDirectory() as work_dir, override_settings(MEDIA_ROOT=work_dir):
+            test_ids = synthetic.populate_database(30, tests_per_polarimeter=10,
+                                                   analysis_fraction=1.0)
+
+            self.assertEqual(len(test_ids), 30)
+            self.assertEqual(PolarimeterTest.objects.values('polarimeter_number')
+                             .distinct().count(), 3)
+            self.assertEqual(AdcOffset.objects.count(), 30)
+            self.assertEqual(Biases.objects.count(), 30)
+
+            # Y-factor tests have one set of temperatures per step
+            tnoise_test = PolarimeterTest.objects.get(
+                pk=test_ids[sorted(synthetic.TEST_KINDS.keys()).index('tnoise')])
+            self.assertEqual(tnoise_test.temperatures_set.count(), 8)
+
+            self.assertEqual(NoiseTemperatureAnalysis.objects.count(), 10)
+            for analysis in NoiseTemperatureAnalysis.objects.all():
+                self.assertAlmostEqual(analysis.tnoise_k, synthetic.NOISE_TEMPERATURE_K,
+                                       delta=0.3 * synthetic.NOISE_TEMPERATURE_K)
+
+            spectrum = SpectralAnalysis.objects.first()
+            self.assertTrue(spectrum.arrays_file)
+            self.assertIsNotNone(spectrum.test_duration_hr)
+            self.assertTrue(spectrum.get_full_results())
+
+            # Saving an analysis must not delete the arrays shared with the others
+            shared_name = spectrum.arrays_file.name
+            full_results = spectrum.get_full_results()
+            full_results['frequency_hz'] = full_results['frequency_hz'][::-1]
+            spectrum.analysis_results = full_results
+            spectrum.save()
+            self.assertNotEqual(spectrum.arrays_file.name, shared_name)
+            other = SpectralAnalysis.objects.exclude(pk=spectrum.pk).first()
+            self.assertEqual(other.arrays_file.name, shared_name)
+            self.assertTrue(other.get_full_results())
+            h5pool.invalidate()
+
+
+class TestLoadTest(LiveServerTestCase):
+    def testRun(self):
+        with TemporaryDirectory() as work_dir, override_settings(MEDIA_ROOT=work_dir):
+            test_ids = synthetic.populate_database(6, analysis_fraction=0.0)
+            profile = {
+                'clients': 3,
+                'duration_s': 1.0,
+                'requests': [
+                    {'name': 'test_list', 'path': '/unittests/'},
+                    {'name': 'test_json', 'path': '/unittests/tests/{test_id}/json/',
+                     'weight': 2},
+                    {'name': 'api_tests', 'path': '/unittests/api/tests/?limit=5'},
+                    {'name': 'missing', 'path': '/unittests/tests/0/json/'},
+                ],
+            }
+            with self.assertLogs('django.request', 'WARNING'):
+                results = loadtest.run_load_test(self.live_server_url, profile, seed=3)
+            h5pool.invalidate()
+
+        self.assertEqual(results['num_of_tests'], len(test_ids))
+        self.assertEqual(sorted(results['requests'].keys()),
+                         ['api_tests', 'missing', 'test_json', 'test_list'])
+        total = results['total']
+        self.assertEqual(total['count'], sum(x['count'] for x in results['requests'].values()))
+        self.assertGreater(total['throughput_rps'], 0.0)
+        self.assertLessEqual(total['latency_p50_ms'], total['latency_p99_ms'])
+
+        # Only the requests for a missing test fail
+        self.assertEqual(results['requests']['missing']['statuses'],
+                         {'404': results['requests']['missing']['count']})
+        self.assertEqual(total['errors'], results['requests']['missing']['errors'])
+        self.assertEqual(results['requests']['test_json']['errors'], 0)
+        json.dumps(results)
+
+    def testProfiles(self):
+        profiles = loadtest.load_profiles()
+        self.assertIn('api', profiles)
+        self.assertEqual(profiles['dashboard']['test_query'], {})
+
+        with self.assertRaises(ValueError):
+            loadtest.validate_profile({'requests': []})
+        with self.assertRaises(ValueError):
+            loadtest.validate_profile({'requests': [{'name': 'a', 'path': '/', 'weight': 0}]})
+        with self.assertRaises(ValueError):
+            loadtest.validate_profile({'clientz': 3,
+                                       'requests': [{'name': 'a', 'path': '/'}]})
+
+
+class TestLazyImports(SimpleTestCase):
+    # Slow modules which must be imported only when they are used (importing
+    # them in "models.py" made "django.setup()" about twice as slow)
+    LAZY_MODULES = ['h5py', 'matplotlib', 'pandas', 'xlrd']
+
+    SCRIPT = """
+import json, sys
+import django
+django.setup()
+print(json.dumps([x for x in sys.argv[1:] if x in sys.modules]))
+"""
+
+    def testSetup(self):
+        output = subprocess.check_output(
+            [sys.executable, '-c', self.SCRIPT] + self.LAZY_MODULES,
+            cwd=settings.BASE_DIR)
+        self.assertEqual(json.loads(output.decode('utf-8').splitlines()[-1]), [])
+
+
+class StandInBucket:
+    '''In-memory stand-in for a S3 bucket, as seen by boto3
+
+    It records the ranges of the objects which have been read, and the
+    number of objects read as a whole.'''
+
+    def __init__(self):
+        self.objects = {}
+        self.ranges = []
+        self.full_reads = 0
+
+    def Object(self, key):
+        return StandInObject(self, key)
+
+
+class StandInObject:
+    def __init__(self, bucket, key):
+        self.bucket = bucket
+        self.key = key
+
+    @property
+    def e_tag(self):
+        return hashlib.md5(self.bucket.objects[self.key]).hexdigest()
+
+    def get(self, Range):
+        start, stop = [int(x) for x in Range[len('bytes='):].split('-')]
+        self.bucket.ranges.append((start, stop))
+        return {'Body': BytesIO(self.bucket.objects[self.key][start:stop + 1])}
+
+
+class StandInS3Storage(h5storage.S3RangeReadMixin, Storage):
+    'Storage keeping files in a StandInBucket; like S3, it has no local paths'
+
+    bucket = StandInBucket()
+
+    def _clean_name(self, name):
+        return name
+
+    def _normalize_name(self, name):
+        return name
+
+    def _open(self, name, mode='rb'):
+        self.bucket.full_reads += 1
+        return File(BytesIO(self.bucket.objects[name]), name)
+
+    def _save(self, name, content):
+        self.bucket.objects[name] = b''.join(content.chunks())
+        return name
+
+    def delete(self, name):
+        self.bucket.objects.pop(name, None)
+
+    def exists(self, name):
+        return name in self.bucket.objects
+
+    def size(self, name):
+        return len(self.bucket.objects[name])
+
+    def get_modified_time(self, name):
+        return make_aware(datetime(2018, 1, 1))
+
+
+@override_settings(DEFAULT_FILE_STORAGE='unittests.tests.StandInS3Storage')
+class TestRemoteStorage(TestCase):
+    def setUp(self):
+        StandInS3Storage.bucket = StandInBucket()
+        h5storage.get_cache().invalidate()
+
+    def testBlockReads(self):
+        with TemporaryDirectory() as work_dir:
+            file_name = os.path.join(work_dir, 'test.h5')
+            write_noise_time_series(file_name, 100000)
+            with open(file_name, 'rb') as input_file:
+                name = h5storage.StoredFile(default_storage.save('test.h5', input_file))
+            with h5py.File(file_name, 'r') as h5_file:
+                expected = h5_file['time_series'][1000:1010]
+
+        cache = h5storage.BlockCache(max_bytes=2 ** 20, block_size=4096)
+        for _ in range(2):
+            with h5storage.StorageFile(name.name, name.storage, cache) as input_file, \
+                 h5py.File(input_file, 'r') as h5_file:
+                self.assertEqual(h5_file['time_series'][1000:1010].tolist(),
+                                 expected.tolist())
+
+        # Only a few blocks have been downloaded, and only once
+        bucket = StandInS3Storage.bucket
+        self.assertEqual(bucket.full_reads, 0)
+        self.assertLess(sum(y - x + 1 for x, y in bucket.ranges), name.storage.size(name.name) / 4)
+        self.assertTrue(all(x % 4096 == 0 for x, _ in bucket.ranges))
+        self.assertEqual(len(bucket.ranges), cache.misses)
+        self.assertGreater(cache.hits, 0)
+
+        # After another node replaces the file, it is read again
+        with h5storage.local_copy(name) as file_name:
+            with h5py.File(file_name, 'r+') as h5_file:
+                h5_file.attrs['changed'] = True
+            name.storage.delete(name.name)
+            with open(file_name, 'rb') as input_file:
+                self.assertEqual(name.storage.save(name.name, input_file), name.name)
+        with h5storage.StorageFile(name.name, name.storage, cache) as input_file, \
+             h5py.File(input_file, 'r') as h5_file:
+            self.assertTrue(h5_file.attrs['changed'])
+
+    def testPolarimeterTest(self):
+        populate_database()
+        test = PolarimeterTest.objects.get()
+        self.assertIsNone(h5storage.local_path(test.data_file))
+        self.assertIn(test.data_file.name, StandInS3Storage.bucket.objects)
+        self.assertIn(test.pwr_plot.name, StandInS3Storage.bucket.objects)
+
+        with h5storage.local_copy(test.data_file) as file_name, \
+             h5py.File(file_name, 'r') as h5_file:
+            self.assertEqual(h5_file.attrs['polarimeter'], 'STRIP01')
+            expected = h5_file['time_series']['pwr_Q1_ADU'][5:10]
+
+        StandInS3Storage.bucket.full_reads = 0
+        url = '/unittests/api/tests/{0}/time_series/'.format(test.pk)
+        data = self.client.get(url, {'columns': 'pwr_Q1_ADU',
+                                     'from_s': 5 / SAMPLING_FREQUENCY,
+                                     'to_s': 10 / SAMPLING_FREQUENCY}).json()
+        self.assertEqual(data['pwr_Q1_ADU'], expected.tolist())
+        self.assertEqual(StandInS3Storage.bucket.full_reads, 0)
+        self.assertFalse(test.is_live())
+
+    def testWritableFile(self):
+        populate_database()
+        test = PolarimeterTest.objects.get()
+        old_name = test.data_file.name
+        StandInS3Storage.bucket.full_reads = 0
+
+        # The modified file is uploaded under a new name before the old one
+        # is deleted
+        with h5storage.writable_h5_file(test.data_file) as file_name, \
+             h5py.File(file_name, 'r+') as h5_file:
+            h5_file.attrs['changed'] = True
+        self.assertNotEqual(test.data_file.name, old_name)
+        self.assertNotIn(old_name, StandInS3Storage.bucket.objects)
+        self.assertEqual(PolarimeterTest.objects.get().data_file.name, test.data_file.name)
+        with h5storage.open_h5_file(test.data_file) as h5_file:
+            self.assertTrue(h5_file.attrs['changed'])
+        self.assertEqual(StandInS3Storage.bucket.full_reads, 1)
+
+        with self.assertRaises(TypeError):
+            with h5storage.writable_h5_file(h5storage.StoredFile(test.data_file.name)):
+                pass
+
+    def testFailedUpload(self):
+        datafile_path = os.path.join(os.path.dirname(__file__),
+                                     '..', 'testdata', 'datafile.txt')
+        with open(datafile_path, 'rb') as data_file:
+            test = PolarimeterTest(
+                polarimeter_number=1,
+                cryogenic=True,
+                acquisition_date=date(year=2017, month=10, day=1),
+                notes='',
+                data_file=SimpleUploadedFile('datafile.txt', data_file.read()),
+                test_type=TestType.objects.create(description='1/f'),
+                author=get_user_model().objects.create_user('johndoe'))
+
+        with patch('unittests.models.update_hdf5_test_file_attrs',
+                   wraps=update_hdf5_test_file_attrs) as update_attrs, \
+             patch.object(StandInS3Storage, '_save', side_effect=OSError('upload failed')):
+            with self.assertRaises(OSError):
+                test.save()
+
+        # Neither the row nor the temporary file are left behind
+        self.assertIsNone(test.pk)
+        self.assertEqual(PolarimeterTest.objects.count(), 0)
+        self.assertFalse(os.path.exists(update_attrs.call_args[0][0]))
+
+    def testSaveUploadsOnce(self):
+        populate_database()
+        test = PolarimeterTest.objects.get()
+        AdcOffset.objects.create(test=test, q1_adu=1, u1_adu=2, u2_adu=3, q2_adu=4)
+
+        # Saving the data file again writes the metadata and the derived
+        # streams before the only upload
+        StandInS3Storage.bucket.full_reads = 0
+        test = PolarimeterTest.objects.get()
+        with h5storage.local_copy(test.data_file) as file_name, \
+             open(file_name, 'rb') as input_file:
+            test.data_file = File(input_file, 'test.h5')
+            test.save()
+        self.assertEqual(StandInS3Storage.bucket.full_reads, 1)
+
+        with h5storage.local_copy(test.data_file) as file_name, \
+             h5py.File(file_name, 'r') as h5_file:
+            self.assertTrue(h5_file.attrs['url'].endswith(test.get_absolute_url()))
+            self.assertIn(DERIVED_GROUP, h5_file)
+
+
+@override_settings(REPLICA_DATABASES=['replica'])
+class TestReplicaRouting(TransactionTestCase):
+    def setUp(self):
+        populate_tests_without_data(1, 2)
+
+        # Make a copy of the test database, which plays the role of a replica
+        self.work_dir = TemporaryDirectory()
+        self.replica_name = os.path.join(self.work_dir.name, 'replica.sqlite3')
+        connection.ensure_connection()
+        with sqlite3.connect(self.replica_name) as replica:
+            connection.connection.backup(replica)
+
+        connections.databases['replica'] = dict(connections.databases['default'],
+                                                NAME=self.replica_name)
+        dbrouting._DOWN_UNTIL.clear()
+
+        # This row is not in the replica, as if it were lagging behind
+        TestType(description='Only in the primary database').save()
+
+    def tearDown(self):
+        connections['replica'].close()
+        del connections.databases['replica']
+        del connections['replica']
+        self.work_dir.cleanup()
+
+    def get_test_types(self):
+        response = self.client.get('/unittests/api/tests/types/')
+        self.assertEqual(response.status_code, 200)
+        return sorted(x['description'] for x in response.json()['types'])
+
+    def testReadsFromReplica(self):
+        self.assertEqual(self.get_test_types(), ['Bandpass', 'Y-factor'])
+
+        # Pages which are not read-only keep using the primary database
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = self.client.get('/unittests/tnoise/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(replica_queries), 0)
+
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = self.client.get('/unittests/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(len(replica_queries), 0)
+
+    def testStickinessAfterPost(self):
+        response = self.client.post('/unittests/tests/create', {})
+        self.assertIn(dbrouting.PRIMARY_COOKIE_NAME, response.cookies)
+
+        # Users must see what they saved, even if the replica is not up to date
+        self.assertEqual(len(self.get_test_types()), 3)
+
+        with override_settings(REPLICA_STICKY_SECONDS=0):
+            self.client.post('/unittests/tests/create', {})
+        del self.client.cookies[dbrouting.PRIMARY_COOKIE_NAME]
+        self.assertEqual(len(self.get_test_types()), 2)
+
+    def testUnavailableReplica(self):
+        # The replica cannot be reached
+        connections.databases['replica']['NAME'] = os.path.join(
+            self.work_dir.name, 'missing', 'replica.sqlite3')
+        with self.assertLogs('unittests.dbrouting', 'WARNING'):
+            self.assertEqual(len(self.get_test_types()), 3)
+
+        # The replica is not tried again until REPLICA_RETRY_SECONDS have passed
+        self.assertIsNone(dbrouting.choose_replica())
+        with override_settings(REPLICA_RETRY_SECONDS=0):
+            dbrouting.mark_replica_down('replica')
+        connections.databases['replica']['NAME'] = self.replica_name
+        self.assertEqual(dbrouting.choose_replica(), 'replica')
+
+    def testFailingReplica(self):
+        # The replica accepts connections, but it has no tables
+        os.remove(self.replica_name)
+        with self.assertLogs('unittests.dbrouting', 'WARNING') as logs:
+            self.assertEqual(len(self.get_test_types()), 3)
+        self.assertIn('query on replica "replica" failed', logs.output[0])
+        self.assertIsNone(dbrouting.choose_replica())
+
+    def testFailingReplicaWhileRendering(self):
+        # The page of a polarimeter runs its queries within the template
+        os.remove(self.replica_name)
+        with self.assertLogs('unittests.dbrouting', 'WARNING'):
+            response = self.client.get('/unittests/STRIP01/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.resolver_match.view_name, 'unittests:polarimeter_details')
@@ -0,0 +1,161 @@
+# -*- encoding: utf-8 -*-
+
+'''Measure where the time of each request is spent
+
+"RequestTimingMiddleware" measures a random sample of the requests (the
+fraction is set by REQUEST_TIMING_SAMPLE_RATE in the settings). For each of
+them it records:
+
+- the number of SQL queries and the time spent running them;
+- the number of bytes of HDF5 data read and written (the code accessing
+  HDF5 files reports them by calling "count_hdf5_bytes");
+- the time spent rendering templates (measured by the template backend
+  "TimedDjangoTemplates");
+- the total time spent by Django in the request.
+
+The results are added to the response in a "Server-Timing" header (which
+browsers show in their developer tools) and logged as a JSON object
+through the "unittests.timing" logger. Requests which are not sampled only
+pay the cost of a call to "random.random".
+'''
+
+from collections import OrderedDict
+import json
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+# Get an instance of a logger
+LOGGER = logging.getLogger(__name__)
+
+# Metrics of the request being processed by the current thread
+_LOCAL = threading.local()
+
+
+class RequestMetrics:
+    'Counters filled while a sampled request is being processed'
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_queries = 0
+        self.sql_time = 0.0
+        self.hdf5_bytes_read = 0
+        self.hdf5_bytes_written = 0
+        self.render_time = 0.0
+        self.total_time = 0.0
+
+
+def current_metrics():
+    'Return the metrics of the request processed by this thread, or None if not sampled'
+    return getattr(_LOCAL, 'metrics', None)
+
+
+def count_hdf5_bytes(read=0, written=0):
+    'Add the number of bytes read from or written to HDF5 files to the current request'
+
+    metrics = getattr(_LOCAL, 'metrics', None)
+    if metrics is not None:
+        metrics.hdf5_bytes_read += read
+        metrics.hdf5_bytes_written += written
+
+
+class TimedTemplate:
+    'Wrapper around a template of the Django backend which measures "render"'
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        metrics = getattr(_LOCAL, 'metrics', None)
+        if metrics is None:
+            return self.template.render(context, request)
+
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            metrics.render_time += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    'The Django template backend, measuring the time spent in rendering'
+
+    def from_string(self, template_code):
+        return TimedTemplate(super(TimedDjangoTemplates, self).from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super(TimedDjangoTemplates, self).get_template(template_name))
+
+
+def format_server_timing(metrics):
+    'Return the value of the "Server-Timing" header for a request'
+
+    return ', '.join([
+        'db;dur={0:.1f};desc="{1} queries"'.format(metrics.sql_time * 1e3,
+                                                   metrics.sql_queries),
+        'hdf5;desc="read {0} B, written {1} B"'.format(metrics.hdf5_bytes_read,
+                                                       metrics.hdf5_bytes_written),
+        'render;dur={0:.1f}'.format(metrics.render_time * 1e3),
+        'total;dur={0:.1f}'.format(metrics.total_time * 1e3),
+    ])
+
+
+class RequestTimingMiddleware:
+    '''Add a "Server-Timing" header to a sample of the responses and log it
+
+    This should be the first middleware in the list, so that the total time
+    includes the other ones. For streaming responses, the time spent
+    producing the content is not included.'''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sample_rate = settings.REQUEST_TIMING_SAMPLE_RATE
+        if sample_rate <= 0.0 or random.random() >= sample_rate:
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        # Same mechanism used by "django.test.utils.CaptureQueriesContext"
+        query_log_state = []
+        for conn in connections.all():
+            query_log_state.append((conn, conn.force_debug_cursor, len(conn.queries_log)))
+            conn.force_debug_cursor = True
+
+        _LOCAL.metrics = metrics
+        try:
+            response = self.get_response(request)
+        finally:
+            _LOCAL.metrics = None
+            for conn, force_debug_cursor, first_query in query_log_state:
+                conn.force_debug_cursor = force_debug_cursor
+                queries = conn.queries[first_query:]
+                metrics.sql_queries += len(queries)
+                metrics.sql_time += sum(float(x['time']) for x in queries)
+
+            metrics.total_time = time.perf_counter() - metrics.start
+
+        response['Server-Timing'] = format_server_timing(metrics)
+
+        fields = OrderedDict([
+            ('method', request.method),
+            ('path', request.path),
+            ('status', response.status_code),
+            ('total_ms', round(metrics.total_time * 1e3, 3)),
+            ('sql_queries', metrics.sql_queries),
+            ('sql_ms', round(metrics.sql_time * 1e3, 3)),
+            ('render_ms', round(metrics.render_time * 1e3, 3)),
+            ('hdf5_bytes_read', metrics.hdf5_bytes_read),
+            ('hdf5_bytes_written', metrics.hdf5_bytes_written),
+        ])
+        LOGGER.info('request timing %s', json.dumps(fields),
+                    extra={'timing': fields})
+        return response
@@ -0,0 +1,182 @@
+# -*- encoding: utf-8 -*-
+
+'''Estimation of noise temperatures using the Y-factor method
+
+During a Y-factor test the temperature of the loads in front of the
+polarimeter is changed in steps, and the set of temperatures measured at
+each step is saved in the "Temperatures" table. The PWR outputs show one
+plateau per step: this module finds the plateaus in the time series, pairs
+them with the temperatures (in the order in which they were saved), and fits
+the model
+
+    PWR = G * (T_load + T_noise)
+
+to each detector, estimating its gain G and its noise temperature T_noise.
+
+The functions in this module do not access the database, so that they can
+be run in a pool of processes (see "batch.py").
+'''
+
+from datetime import date
+import logging
+
+import h5py
+import numpy as np
+
+from .bandpass import find_runs
+from .file_conversions import PWR_COLUMNS
+from .spectra import to_json_float
+
+# Increase this whenever a change in the code changes the results
+ALGORITHM_VERSION = '1.0'
+
+# Number of samples in the windows used to look for changes in the output
+DEFAULT_WINDOW_SAMPLES = 25
+# Minimum number of samples in a plateau
+DEFAULT_MIN_PLATEAU_SAMPLES = 250
+# A change in the output larger than this (in units of the expected noise on
+# the difference between two windows) marks a transition
+DEFAULT_THRESHOLD_SIGMA = 5.0
+
+# Get an instance of a logger
+LOGGER = logging.getLogger(__name__)
+
+
+def find_plateaus(signal,
+                  window_samples=DEFAULT_WINDOW_SAMPLES,
+                  min_plateau_samples=DEFAULT_MIN_PLATEAU_SAMPLES,
+                  threshold_sigma=DEFAULT_THRESHOLD_SIGMA):
+    '''Find the intervals where a signal is stable
+
+    A sample is stable if the averages of the windows just before and just
+    after it differ by less than "threshold_sigma" times the expected noise
+    on the difference. The white noise of the signal is estimated from the
+    differences between consecutive samples. Return a list of tuples
+    (start, stop) with the indexes of the stable intervals which are at least
+    "min_plateau_samples" long.
+    '''
+
+    num_of_samples = len(signal)
+    if num_of_samples < 2 * window_samples:
+        return []
+
+    sigma = 1.4826 * np.median(np.abs(np.diff(signal))) / np.sqrt(2)
+
+    cumsum = np.concatenate([[0.0], np.cumsum(signal, dtype=np.float64)])
+    window_mean = (cumsum[window_samples:] - cumsum[:-window_samples]) / window_samples
+    # Element i is the difference between the windows [i, i + w) and [i - w, i)
+    step = np.abs(window_mean[window_samples:] - window_mean[:-window_samples])
+
+    stable = np.zeros(num_of_samples, dtype=bool)
+    stable[window_samples:num_of_samples - window_samples + 1] = \
+        step <= threshold_sigma * sigma * np.sqrt(2.0 / window_samples)
+
+    starts, lengths = find_runs(stable)
+    mask = stable[starts] & (lengths >= min_plateau_samples)
+    return [(int(start), int(start + length))
+            for start, length in zip(starts[mask], lengths[mask])]
+
+
+def fit_gain_and_tnoise(load_temperatures, outputs):
+    '''Fit the model PWR = G * (T_load + T_noise) to many detectors at once
+
+    The parameter "load_temperatures" is an array with one temperature per
+    step, while "outputs" is a 2D array with one row per step and one column
+    per detector. Return a tuple of arrays (gain, gain_err, tnoise,
+    tnoise_err) with one element per detector. Errors are NaN if there are
+    only two steps.
+    '''
+
+    num_of_steps = len(load_temperatures)
+    design = np.column_stack([load_temperatures, np.ones(num_of_steps)])
+    coefficients, _, _, _ = np.linalg.lstsq(design, outputs, rcond=None)
+    gain, offset = coefficients
+    tnoise = offset / gain
+
+    if num_of_steps > 2:
+        residuals = outputs - design @ coefficients
+        sigma2 = np.sum(residuals ** 2, axis=0) / (num_of_steps - 2)
+        inverse = np.linalg.inv(design.T @ design)
+        var_gain = sigma2 * inverse[0, 0]
+        var_offset = sigma2 * inverse[1, 1]
+        covariance = sigma2 * inverse[0, 1]
+
+        gain_err = np.sqrt(var_gain)
+        # Propagate the errors on G and G * T_noise into T_noise
+        tnoise_err = np.abs(tnoise) * np.sqrt(
+            var_offset / offset ** 2 + var_gain / gain ** 2 -
+            2 * covariance / (offset * gain))
+    else:
+        gain_err = np.full_like(gain, np.nan)
+        tnoise_err = np.full_like(gain, np.nan)
+
+    return gain, gain_err, tnoise, tnoise_err
+
+
+def compute_tnoise_analysis(h5_file_name, load_temperatures,
+                            window_samples=DEFAULT_WINDOW_SAMPLES,
+                            min_plateau_samples=DEFAULT_MIN_PLATEAU_SAMPLES,
+                            threshold_sigma=DEFAULT_THRESHOLD_SIGMA):
+    '''Estimate gain and noise temperature of the four detectors
+
+    The parameter "load_temperatures" is a list with the temperature of the
+    load (K) at each step of the test. Return a JSON record suitable for the
+    "analysis_results" field of a "NoiseTemperatureAnalysis" object, or None
+    if there are too few temperatures. Raise ValueError if the number of
+    plateaus in the PWR outputs does not match the number of temperatures.
+    '''
+
+    if len(load_temperatures) < 2:
+        return None
+
+    with h5py.File(h5_file_name, 'r') as h5_file:
+        if 'time_series' not in h5_file:
+            return None
+
+        data = h5_file['time_series'][PWR_COLUMNS]
+
+    outputs = np.vstack([data[x].astype(np.float64) for x in PWR_COLUMNS])
+
+    # Look for plateaus in the sum of the outputs, normalized so that each
+    # detector has the same weight
+    scale = 1.4826 * np.median(np.abs(np.diff(outputs, axis=1)), axis=1)
+    scale[scale == 0.0] = 1.0
+    plateaus = find_plateaus((outputs / scale[:, np.newaxis]).sum(axis=0),
+                             window_samples=window_samples,
+                             min_plateau_samples=min_plateau_samples,
+                             threshold_sigma=threshold_sigma)
+    if len(plateaus) != len(load_temperatures):
+        raise ValueError('found {0} plateaus in the outputs, but there are {1} '
+                         'sets of temperatures'.format(len(plateaus),
+                                                       len(load_temperatures)))
+
+    plateau_means = np.array([outputs[:, start:stop].mean(axis=1)
+                              for start, stop in plateaus])
+    gain, gain_err, tnoise, tnoise_err = fit_gain_and_tnoise(
+        np.array(load_temperatures, dtype=np.float64), plateau_means)
+
+    result = {
+        'estimation_method': 'Y-factor, least-squares fit on plateaus',
+        'code_version': ALGORITHM_VERSION,
+        'analysis_date': date.today().strftime('%Y-%m-%d'),
+        'tnoise': {
+            'mean': float(np.mean(tnoise)),
+            'std': float(np.std(tnoise)),
+        },
+        'load_temperatures_K': [float(x) for x in load_temperatures],
+        'plateaus': [list(x) for x in plateaus],
+    }
+    for idx, name in enumerate(PWR_COLUMNS):
+        # E.g., "pwr_Q1_ADU" becomes "q1"
+        detector = name.split('_')[1].lower()
+        result['gain_' + detector] = {
+            'mean': float(gain[idx]),
+            'std': to_json_float(gain_err[idx]),
+        }
+        result['tnoise_' + detector] = {
+            'mean': float(tnoise[idx]),
+            'std': to_json_float(tnoise_err[idx]),
+        }
+        result['pwr_' + detector + '_ADU'] = plateau_means[:, idx].tolist()
+
+    return result
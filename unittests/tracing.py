@@ -0,0 +1,186 @@
+# -*- encoding: utf-8 -*-
+
+'''Nested timing and memory spans for the ingestion of data files
+
+The code which converts and saves data files marks its stages with "span":
+
+    with span('parse_text', bytes_in=size) as cur_span:
+        samples = ...
+        cur_span.bytes_out = samples.nbytes
+
+Spans only record something while a trace is active in the current thread
+(see "trace"); otherwise they cost one attribute lookup. Each span records:
+
+- wall-clock and CPU time;
+- the number of bytes it read and produced, if the code tells them;
+- the peak of the memory allocated by Python and NumPy while the span was
+  running (measured with "tracemalloc", if "trace" was asked to);
+- the high-water mark of the resident memory of the process at the end of
+  the span ("ru_maxrss").
+
+On Python versions older than 3.9, "tracemalloc" cannot reset its peak, so
+the peak of a span includes the allocations made since the trace started.
+This module does not depend on Django, so that "file_conversions.py" can use
+it in standalone programs.
+'''
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+# Traces being recorded by each thread
+_LOCAL = threading.local()
+
+
+class Span:
+    'One stage of a trace; "children" contains the nested stages'
+
+    def __init__(self, name, bytes_in=0):
+        self.name = name
+        self.bytes_in = bytes_in
+        self.bytes_out = 0
+        self.children = []
+
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_traced_bytes = None
+        self.peak_rss_bytes = None
+
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+
+    def finish(self):
+        self.wall_time = time.perf_counter() - self._start_wall
+        self.cpu_time = time.process_time() - self._start_cpu
+
+        # On Linux "ru_maxrss" is in kilobytes, on macOS in bytes
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.peak_rss_bytes = maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+    def to_dict(self):
+        'Return a dictionary which can be saved as JSON'
+
+        return OrderedDict([
+            ('name', self.name),
+            ('wall_time_s', self.wall_time),
+            ('cpu_time_s', self.cpu_time),
+            ('bytes_in', self.bytes_in),
+            ('bytes_out', self.bytes_out),
+            ('peak_traced_bytes', self.peak_traced_bytes),
+            ('peak_rss_bytes', self.peak_rss_bytes),
+            ('children', [x.to_dict() for x in self.children]),
+        ])
+
+
+class _NullSpan:
+    'Span returned when no trace is active: attributes are silently ignored'
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _traced_peak():
+    return tracemalloc.get_traced_memory()[1]
+
+
+def _reset_peak():
+    # Only available since Python 3.9
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+
+
+class Trace:
+    'Stack of the spans of the current thread'
+
+    def __init__(self, root, trace_memory):
+        self.stack = [root]
+        self.trace_memory = trace_memory
+
+    def push(self, new_span):
+        parent = self.stack[-1]
+        parent.children.append(new_span)
+        if self.trace_memory:
+            parent.peak_traced_bytes = max(parent.peak_traced_bytes or 0, _traced_peak())
+            _reset_peak()
+        self.stack.append(new_span)
+
+    def pop(self):
+        cur_span = self.stack.pop()
+        cur_span.finish()
+        if self.trace_memory:
+            cur_span.peak_traced_bytes = max(cur_span.peak_traced_bytes or 0, _traced_peak())
+            parent = self.stack[-1]
+            parent.peak_traced_bytes = max(parent.peak_traced_bytes or 0,
+                                           cur_span.peak_traced_bytes)
+            _reset_peak()
+
+
+@contextmanager
+def span(name, bytes_in=0):
+    '''Context manager which records a stage of the current trace
+
+    It yields the new "Span", so that the code can set "bytes_out"; if no
+    trace is active, it yields an object which ignores assignments.'''
+
+    cur_trace = getattr(_LOCAL, 'trace', None)
+    if cur_trace is None:
+        yield _NULL_SPAN
+        return
+
+    new_span = Span(name, bytes_in)
+    cur_trace.push(new_span)
+    try:
+        yield new_span
+    finally:
+        cur_trace.pop()
+
+
+@contextmanager
+def trace(name, bytes_in=0, trace_memory=True):
+    '''Context manager which records the spans run in the "with" block
+
+    It yields the root "Span". If a trace is already active in this thread,
+    this is the same as "span". If "trace_memory" is true, "tracemalloc" is
+    started (it slows down allocations) and stopped at the end.'''
+
+    if getattr(_LOCAL, 'trace', None) is not None:
+        with span(name, bytes_in) as new_span:
+            yield new_span
+        return
+
+    start_tracemalloc = trace_memory and not tracemalloc.is_tracing()
+    if start_tracemalloc:
+        tracemalloc.start()
+    # Memory is traced only if this trace controls "tracemalloc"
+    trace_memory = start_tracemalloc
+    if trace_memory:
+        _reset_peak()
+
+    root = Span(name, bytes_in)
+    _LOCAL.trace = Trace(root, trace_memory)
+    try:
+        yield root
+    finally:
+        _LOCAL.trace = None
+        root.finish()
+        if trace_memory:
+            root.peak_traced_bytes = max(root.peak_traced_bytes or 0, _traced_peak())
+            tracemalloc.stop()
+
+
+def flatten_spans(span_dict, prefix=''):
+    '''Yield tuples (path, span) for a span saved by "Span.to_dict" and its children
+
+    The path joins the names of the nested spans with "/".'''
+
+    path = prefix + span_dict['name']
+    yield path, span_dict
+    for child in span_dict['children']:
+        yield from flatten_spans(child, path + '/')
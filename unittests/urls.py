@@ -20,6 +20,8 @@ urlpatterns = [
         views.TestPwrPlot.as_view(), name='test_pwr_plot'),
     url(r'^tests/(?P<test_id>\d+)/download/$',
         views.TestDownload.as_view(), name='test_download'),
+    url(r'^tests/(?P<test_id>\d+)/stream/$',
+        views.TestLiveStream.as_view(), name='test_live_stream'),
     url(r'^tests/create$', views.TestCreate.as_view(), name='test_create'),
     url(r'^tests/(?P<pk>\d+)/delete$',
         views.TestDeleteView.as_view(), name='test_delete'),
@@ -109,7 +111,21 @@ urlpatterns = [
         name='api-spectrum-all-data'),
     url(r'^api/spectrum/(?P<pk>\d+)$',
         views.SpectrumData.as_view(), name='api-spectrum-data'),
-
+    url(r'^api/glitches/$', views.GlitchEventQuery.as_view(),
+        name='api-glitches-query'),
+    url(r'^api/iv_curves/$', views.IVCurveComparison.as_view(),
+        name='api-iv-curves-comparison'),
+
+    url(r'^api/tests/$', views.TestQuery.as_view(),
+        name='api-tests-query'),
+    url(r'^api/tests/(?P<test_id>\d+)/time_series/$', views.TestTimeSeries.as_view(),
+        name='api-test-time-series'),
+    url(r'^api/tests/(?P<test_id>\d+)/segments/$', views.TestStateSegments.as_view(),
+        name='api-test-state-segments'),
+    url(r'^api/tests/(?P<test_id>\d+)/derived/$', views.TestDerivedStreams.as_view(),
+        name='api-test-derived-streams'),
+    url(r'^api/tests/(?P<test_id>\d+)/live/$', views.TestLiveAcquisition.as_view(),
+        name='api-test-live'),
     url(r'^api/tests/STRIP(?P<num>\d+)/$', views.TestsByPolarimeter.as_view(),
         name='api-tests-polarimeter'),
 
@@ -4,17 +4,27 @@
 '''
 
 from collections import OrderedDict
-from datetime import timedelta
+from datetime import datetime, timedelta
+from io import BytesIO
 import mimetypes
 import os.path
 
+import numpy as np
 import simplejson as json
 
+from django.conf import settings
 from django.contrib.auth import get_user
-from django.core.urlresolvers import reverse_lazy
+from django.core.urlresolvers import reverse, reverse_lazy
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse, HttpResponseRedirect, Http404
+from django.db.models import Avg, Count, Max, Min, Q
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseRedirect,
+    Http404,
+    StreamingHttpResponse,
+)
 from django.shortcuts import render, get_object_or_404, redirect
 from django.utils.decorators import method_decorator
 from django.utils import timezone
@@ -26,11 +36,17 @@ from django.views.generic import (
     UpdateView,
 )
 
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 from rest_framework.response import Response as RESTResponse
 
 from .models import (
     get_polarimeter_name,
+    TEST_SUMMARY_FIELDS,
+    TestUrlBuilder,
     TestType,
     PolarimeterTest,
     AdcOffset,
@@ -44,7 +60,29 @@ from .models import (
     NoiseTemperatureAnalysis,
     BandpassAnalysis,
     SpectralAnalysis,
+    IVCurveAnalysis,
+    GlitchEvent,
+    GLITCH_KIND_CHOICES,
+)
+
+from .file_conversions import (
+    DEM_COLUMNS,
+    DERIVED_DECIMATIONS,
+    DERIVED_GROUP,
+    PWR_COLUMNS,
+    SAMPLING_FREQUENCY,
+    STOKES_COMBINATIONS,
+    derived_dataset_name,
+    read_derived_streams,
+    read_segment_index,
+    read_text_samples,
 )
+from .h5storage import open_h5_file
+from .live import is_live_file, read_statistics
+from .livestream import get_reader as get_stream_reader, stream_events
+from .renderers import NpzRenderer
+from .shmcache import read_time_series_columns
+from .timing import count_hdf5_bytes
 
 from .forms import (
     TestForm,
@@ -59,26 +97,67 @@ from .forms import (
 )
 
 
+def parse_int_list(value, name):
+    'Convert a comma-separated list of integers passed as a query parameter'
+    try:
+        return [int(x) for x in value.split(',')]
+    except ValueError:
+        raise ValidationError(
+            'invalid value "{0}" for parameter "{1}"'.format(value, name))
+
+
+def parse_int(value, name, min_value=None):
+    '''Convert an integer passed as a query parameter
+
+    Values smaller than "min_value" are rejected.'''
+    try:
+        result = int(value)
+    except ValueError:
+        raise ValidationError(
+            'invalid value "{0}" for parameter "{1}"'.format(value, name))
+
+    if min_value is not None and result < min_value:
+        raise ValidationError(
+            'parameter "{0}" must be at least {1}'.format(name, min_value))
+
+    return result
+
+
+def parse_date(value, name):
+    'Convert a YYYY-MM-DD date passed as a query parameter'
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValidationError(
+            'invalid date "{0}" for parameter "{1}", use YYYY-MM-DD'.format(value, name))
+
+
+def parse_bool(value, name):
+    'Convert a boolean passed as a query parameter'
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    elif value.lower() in ('0', 'false', 'no'):
+        return False
+
+    raise ValidationError(
+        'invalid value "{0}" for parameter "{1}"'.format(value, name))
+
+
 class TestListView(View):
     template = 'unittests/polarimetertest_list.html'
 
     def get(self, request):
         'Produce a list of the tests in the database'
 
-        # Get a list of the polarimeters which have at least one test
-        pol_nums = [x[0] for x in PolarimeterTest.objects.order_by()
-                    .values_list('polarimeter_number').distinct()]
-        if pol_nums:
-            tests = OrderedDict()
-            pol_nums.sort()
-            for cur_pol_num in pol_nums:
-                pol_name = get_polarimeter_name(cur_pol_num)
-                tests[pol_name] = \
-                    PolarimeterTest.objects.filter(
-                        polarimeter_number=cur_pol_num)
+        # Group the tests by polarimeter, using just one query
+        tests = OrderedDict()
+        for cur_test in (PolarimeterTest.objects.select_related('test_type')
+                         .order_by('polarimeter_number', 'acquisition_date')):
+            tests.setdefault(cur_test.polarimeter_name, []).append(cur_test)
 
+        if tests:
             context = {
-                'num_of_tests': len(PolarimeterTest.objects.all()),
+                'num_of_tests': sum([len(x) for x in tests.values()]),
                 'polarimeter_tests': tests,
             }
         else:
@@ -133,6 +212,7 @@ class TestDetails(View):
             'bandpass_analyses': BandpassAnalysis.objects.filter(test=cur_test),
             'spectrum_analyses': SpectralAnalysis.objects.filter(test=cur_test),
             'operators': cur_test.operators.all(),
+            'live': cur_test.is_live(),
         })
 
 
@@ -195,19 +275,19 @@ class TestDetailsJson(View):
 
         tnoise_analyses = []
         for analysis in NoiseTemperatureAnalysis.objects.filter(test=cur_test):
-            d = analysis.analysis_results
+            d = analysis.get_full_results()
             d['analysis_id'] = analysis.id
             tnoise_analyses.append(d)
 
         bandpass_analyses = []
         for analysis in BandpassAnalysis.objects.filter(test=cur_test):
-            d = analysis.analysis_results
+            d = analysis.get_full_results()
             d['analysis_id'] = analysis.id
             bandpass_analyses.append(d)
 
         spectrum_analyses = []
         for analysis in SpectralAnalysis.objects.filter(test=cur_test):
-            d = analysis.analysis_results
+            d = analysis.get_full_results()
             d['analysis_id'] = analysis.id
             spectrum_analyses.append(d)
 
@@ -253,6 +333,7 @@ class TestDownload(View):
         data_file = cur_test.data_file
         data_file.open()
         data = data_file.read()
+        count_hdf5_bytes(read=len(data))
         resp = HttpResponse(data, content_type='application/hdf5')
         resp['Content-Disposition'] = 'attachment; filename="{0}"'.format(
             os.path.basename(data_file.name))
@@ -273,6 +354,49 @@ class TestPwrPlot(View):
         return resp
 
 
+class TestLiveStream(View):
+    def get(self, request, test_id):
+        '''Send the decimated PWR outputs of a test as server-sent events
+
+        Supported parameters in the query string:
+
+        - decimation: number of samples averaged in each point (default: 10)
+        - encoding: "json" (default) or "base64"
+
+        Clients reconnecting with the header "Last-Event-ID" receive only
+        the points after it. The stream keeps this worker busy for up to
+        LIVE_STREAM_MAX_SECONDS seconds. See "livestream.py".
+        '''
+
+        cur_test = get_object_or_404(PolarimeterTest, pk=test_id)
+        if not cur_test.data_file:
+            raise Http404('test {0} has no data file'.format(test_id))
+
+        try:
+            decimation = int(request.GET.get('decimation', 10))
+            first = int(request.META.get('HTTP_LAST_EVENT_ID', 0))
+        except ValueError:
+            return HttpResponseBadRequest('invalid decimation or event ID')
+
+        encoding = request.GET.get('encoding', 'json')
+        if not 1 <= decimation <= max(DERIVED_DECIMATIONS) or \
+           encoding not in ('json', 'base64'):
+            return HttpResponseBadRequest('invalid decimation or encoding')
+
+        first = max(first, 0)
+        reader = get_stream_reader(cur_test.data_file.path, decimation,
+                                   poll_interval=settings.LIVE_STREAM_POLL_SECONDS,
+                                   first=first)
+        resp = StreamingHttpResponse(
+            stream_events(reader, first, encoding,
+                          max_duration=settings.LIVE_STREAM_MAX_SECONDS),
+            content_type='text/event-stream')
+        resp['Cache-Control'] = 'no-cache'
+        # Prevent nginx from buffering the events
+        resp['X-Accel-Buffering'] = 'no'
+        return resp
+
+
 class PolarimeterDetails(TemplateView):
     template_name = 'unittests/polarimeter_details.html'
 
@@ -287,19 +411,23 @@ class PolarimeterDetails(TemplateView):
 
         context['tests'] = \
             PolarimeterTest.objects.filter(
-                polarimeter_number=polarimeter_number).all()
+                polarimeter_number=polarimeter_number).select_related('test_type')
 
+        # The page only shows the typed columns of bandpass analyses
         context['bandpasses'] = \
             BandpassAnalysis.objects.filter(
-                test__polarimeter_number=polarimeter_number).all()
+                test__polarimeter_number=polarimeter_number).select_related(
+                    'test', 'test__test_type').defer('analysis_results')
 
         context['noise_temperatures'] = \
             NoiseTemperatureAnalysis.objects.filter(
-                test__polarimeter_number=polarimeter_number).all()
+                test__polarimeter_number=polarimeter_number).select_related(
+                    'test', 'test__test_type')
 
         context['spectrums'] = \
             SpectralAnalysis.objects.filter(
-                test__polarimeter_number=polarimeter_number).all()
+                test__polarimeter_number=polarimeter_number).select_related(
+                    'test', 'test__test_type')
 
         return context
 
@@ -642,19 +770,105 @@ class TemperatureJsonView(View):
         })
 
 
-class TnoiseListView(View):
-    template = 'unittests/tnoise_list.html'
+def filter_analyses(queryset, model, params):
+    '''Apply the filters in the query string "params" to a set of analyses
+
+    Besides "polarimeter" (a comma-separated list of polarimeter numbers), the
+    filters "min_NAME" and "max_NAME" are accepted for every typed column NAME
+    listed in the "scalar_keys" attribute of the model.
+    '''
+
+    if 'polarimeter' in params:
+        queryset = queryset.filter(test__polarimeter_number__in=parse_int_list(
+            params['polarimeter'], 'polarimeter'))
+
+    for column_name in model.scalar_column_names():
+        is_date = model._meta.get_field(column_name).get_internal_type() == 'DateField'
+        for prefix, lookup in (('min_', 'gte'), ('max_', 'lte')):
+            param_name = prefix + column_name
+            if param_name not in params:
+                continue
+
+            if is_date:
+                value = parse_date(params[param_name], param_name)
+            else:
+                try:
+                    value = float(params[param_name])
+                except ValueError:
+                    value = None
+
+                # NaN and infinities would make the lookup meaningless
+                if value is None or not np.isfinite(value):
+                    raise ValidationError('invalid value "{0}" for parameter "{1}"'
+                                          .format(params[param_name], param_name))
+
+            queryset = queryset.filter(
+                **{'{0}__{1}'.format(column_name, lookup): value})
+
+    return queryset
+
+
+def get_analysis_sort_key(model, params):
+    '''Return the column used to sort analyses, as requested by "sort"
+
+    The name of the column can be preceded by "-" to use descending order.
+    '''
+
+    if 'sort' not in params:
+        return None
+
+    sort_key = params['sort']
+    if sort_key.lstrip('-') not in model.scalar_column_names():
+        raise ValidationError('unable to sort by "{0}", valid columns are {1}'
+                              .format(sort_key, ', '.join(model.scalar_column_names())))
+
+    return sort_key
+
+
+class AnalysisListView(View):
+    '''List analyses of the same kind, using the filters in the query string
+
+    See "filter_analyses" and "get_analysis_sort_key" for the list of
+    parameters.
+    '''
+
+    model = None
+    template = ''
+    context_name = ''
+    # Set this to True if the template only uses the typed columns
+    defer_results = False
 
     def get(self, request):
-        'Show a list of the results of Tnoise tests'
+        try:
+            queryset = filter_analyses(self.model.objects.all(), self.model,
+                                       request.GET)
+            sort_key = get_analysis_sort_key(self.model, request.GET)
+        except ValidationError as exc:
+            return HttpResponseBadRequest(' '.join(exc.detail))
+
+        if sort_key:
+            queryset = queryset.order_by(sort_key, 'test__polarimeter_number')
+        else:
+            queryset = queryset.order_by('test__polarimeter_number')
+
+        queryset = queryset.select_related('test', 'test__test_type')
+        if self.defer_results:
+            queryset = queryset.defer('analysis_results')
 
         context = {
-            'tnoise_tests': NoiseTemperatureAnalysis.objects
-            .order_by('test__polarimeter_number').all(),
+            self.context_name: queryset,
         }
         return render(request, self.template, context)
 
 
+class TnoiseListView(AnalysisListView):
+    'Show a list of the results of Tnoise tests'
+
+    model = NoiseTemperatureAnalysis
+    template = 'unittests/tnoise_list.html'
+    context_name = 'tnoise_tests'
+
+
 class ReportCreateMixin:
     def form_valid(self, form):
         obj = form.save(commit=False)
@@ -712,17 +926,12 @@ class TnoiseReport(DownloadReportMixin, View):
     model_class = NoiseTemperatureAnalysis
 
 
-class SpectralAnalysisListView(View):
-    template = 'unittests/spectral_analysis_list.html'
+class SpectralAnalysisListView(AnalysisListView):
+    'Show a list of the results of a spectral analysis'
 
-    def get(self, request):
-        'Show a list of the results of a spectral analysis'
-
-        context = {
-            'spectral_analysis_tests': SpectralAnalysis.objects
-            .order_by('test__polarimeter_number').all(),
-        }
-        return render(request, self.template, context)
+    model = SpectralAnalysis
+    template = 'unittests/spectral_analysis_list.html'
+    context_name = 'spectral_analysis_tests'
 
 
 @method_decorator(login_required, name='dispatch')
@@ -749,17 +958,13 @@ class SpectralAnalysisReport(DownloadReportMixin, View):
     model_class = SpectralAnalysis
 
 
-class BandpassAnalysisListView(View):
-    template = 'unittests/bandpass_analysis_list.html'
-
-    def get(self, request):
-        'Show a list of the results of a bandpass analysis'
+class BandpassAnalysisListView(AnalysisListView):
+    'Show a list of the results of a bandpass analysis'
 
-        context = {
-            'bandpass_analysis_tests': BandpassAnalysis.objects
-            .order_by('test__polarimeter_number').all(),
-        }
-        return render(request, self.template, context)
+    model = BandpassAnalysis
+    template = 'unittests/bandpass_analysis_list.html'
+    context_name = 'bandpass_analysis_tests'
+    defer_results = True
 
 
 @method_decorator(login_required, name='dispatch')
@@ -789,21 +994,38 @@ class BandpassAnalysisReport(DownloadReportMixin, View):
 # REST classes (used for plots)
 
 class ReportAllDataMixin:
+    '''Return the results of all the analyses, grouped by polarimeter
+
+    Arrays saved outside the database are returned as references, unless
+    the query string contains "arrays=full".
+    '''
+
     model = NoiseTemperatureAnalysis
 
     def get(self, request, format=None):
-        pol_nums = [x[0] for x in self.model.objects.order_by('test__polarimeter_number')
-                    .values_list('test__polarimeter_number').distinct()]
-
+        queryset = filter_analyses(self.model.objects.all(), self.model,
+                                   request.query_params)
+        ordering = ['test__polarimeter_number']
+        sort_key = get_analysis_sort_key(self.model, request.query_params)
+        if sort_key:
+            ordering.append(sort_key)
+
+        full_arrays = request.query_params.get('arrays') == 'full'
+        pol_nums = []
         results = []
-        for cur_pol_num in pol_nums:
-            data = self.model.objects.filter(
-                test__polarimeter_number=cur_pol_num).all()
-            pol_results = []
-            for cur_val in data:
-                pol_results.append(cur_val.analysis_results)
-
-            results.append(pol_results)
+        for cur_analysis in (queryset.order_by(*ordering, 'pk')
+                             .select_related('test')
+                             .only('analysis_results', 'arrays_file',
+                                   'test__polarimeter_number')):
+            cur_pol_num = cur_analysis.test.polarimeter_number
+            if not pol_nums or pol_nums[-1] != cur_pol_num:
+                pol_nums.append(cur_pol_num)
+                results.append([])
+
+            if full_arrays:
+                results[-1].append(cur_analysis.get_full_results())
+            else:
+                results[-1].append(cur_analysis.analysis_results)
 
         return RESTResponse({
             'polarimeters': [get_polarimeter_name(x) for x in pol_nums],
@@ -812,18 +1034,42 @@ class ReportAllDataMixin:
 
 
 class ReportDataMixin:
+    '''Return the results of one analysis
+
+    Arrays saved outside the database are put back in the JSON record, unless
+    the query string contains "arrays=ref". Clients which accept the media
+    type "application/x-npz" receive just the arrays, as a NPZ file.
+    '''
+
     model = None
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NpzRenderer]
 
-    def get(self, request, pk):
+    def get(self, request, pk, format=None):
         analysis = get_object_or_404(self.model, pk=pk)
-        return RESTResponse(analysis.analysis_results)
+
+        if request.accepted_renderer.format == NpzRenderer.format:
+            if analysis.arrays_file:
+                with analysis.arrays_file.storage.open(analysis.arrays_file.name,
+                                                       'rb') as npz_file:
+                    data = npz_file.read()
+            else:
+                buffer = BytesIO()
+                np.savez_compressed(buffer)
+                data = buffer.getvalue()
+
+            return RESTResponse(data)
+
+        if request.query_params.get('arrays') == 'ref':
+            return RESTResponse(analysis.analysis_results)
+
+        return RESTResponse(analysis.get_full_results())
 
 
 class TnoiseAllData(APIView, ReportAllDataMixin):
     model = NoiseTemperatureAnalysis
 
 
-class TnoiseData(APIView, ReportDataMixin):
+class TnoiseData(ReportDataMixin, APIView):
     model = NoiseTemperatureAnalysis
 
 
@@ -831,7 +1077,7 @@ class BandpassAllData(APIView, ReportAllDataMixin):
     model = BandpassAnalysis
 
 
-class BandpassData(APIView, ReportDataMixin):
+class BandpassData(ReportDataMixin, APIView):
     model = BandpassAnalysis
 
 
@@ -839,7 +1085,7 @@ class SpectrumAllData(APIView, ReportAllDataMixin):
     model = SpectralAnalysis
 
 
-class SpectrumData(APIView, ReportDataMixin):
+class SpectrumData(ReportDataMixin, APIView):
     model = SpectralAnalysis
 
 
@@ -861,15 +1107,21 @@ class UsersData(APIView):
 
 class TestTimeTableData(APIView):
     def get(self, request, format=None):
+        today = timezone.now().date()
+        first_day = today - timedelta(days=29)
+
+        # Count the tests with one query instead of one query per day
+        counts = dict(PolarimeterTest.objects.order_by()
+                      .filter(creation_date__gte=first_day)
+                      .values_list('creation_date')
+                      .annotate(Count('id')))
+
         date_values = []
         num_of_tests = []
-
-        today = timezone.now().date()
         for days_ago in range(30):
             start = today - timedelta(days=days_ago)
             date_values.append(start)
-            num_of_tests.append(PolarimeterTest.objects.filter(
-                creation_date=start).count())
+            num_of_tests.append(counts.get(start, 0))
 
         data = {
             'date': date_values,
@@ -891,9 +1143,11 @@ class TestTypes(APIView):
 
 class TestsByPolarimeter(APIView):
     def get(self, request, num):
+        url_builder = TestUrlBuilder()
         tests = []
-        for cur_test in PolarimeterTest.objects.filter(polarimeter_number=num).order_by('polarimeter_number'):
-            tests.append(cur_test.to_dict())
+        for cur_test in (PolarimeterTest.objects.filter(polarimeter_number=num)
+                         .select_related('test_type')):
+            tests.append(cur_test.to_dict(url_builder=url_builder))
 
         return RESTResponse(tests)
 
@@ -901,11 +1155,551 @@ class TestsByPolarimeter(APIView):
 class TestsByType(APIView):
     def get(self, request, pk):
         test_type = get_object_or_404(TestType, pk=pk)
+        url_builder = TestUrlBuilder()
         tests = []
-        for cur_test in PolarimeterTest.objects.filter(test_type=test_type).order_by('polarimeter_number'):
-            tests.append(cur_test.to_dict())
+        for cur_test in (PolarimeterTest.objects.filter(test_type=test_type)
+                         .select_related('test_type')):
+            tests.append(cur_test.to_dict(url_builder=url_builder))
 
         return RESTResponse({'type': {
             'id': test_type.pk,
             'description': test_type.description,
         }, 'tests': tests})
+
+
+def filter_tests(queryset, params):
+    '''Apply the filters in the query string "params" to a set of tests
+
+    See the documentation of "TestQuery" for the list of supported filters.
+    '''
+
+    if 'polarimeter' in params:
+        queryset = queryset.filter(polarimeter_number__in=parse_int_list(
+            params['polarimeter'], 'polarimeter'))
+
+    if 'type' in params:
+        queryset = queryset.filter(
+            test_type__in=parse_int_list(params['type'], 'type'))
+
+    if 'band' in params:
+        queryset = queryset.filter(band=params['band'])
+
+    if 'phsw_state' in params:
+        queryset = queryset.filter(phsw_state=params['phsw_state'])
+
+    if 'cryogenic' in params:
+        queryset = queryset.filter(
+            cryogenic=parse_bool(params['cryogenic'], 'cryogenic'))
+
+    for param_name, lookup in [('acquired_from', 'acquisition_date__gte'),
+                               ('acquired_to', 'acquisition_date__lte'),
+                               ('created_from', 'creation_date__gte'),
+                               ('created_to', 'creation_date__lte')]:
+        if param_name in params:
+            queryset = queryset.filter(
+                **{lookup: parse_date(params[param_name], param_name)})
+
+    return queryset
+
+
+def encode_test_cursor(test):
+    'Return the keyset pagination cursor pointing after "test"'
+    return '{0}_{1}_{2}'.format(test.polarimeter_number,
+                                test.acquisition_date.strftime('%Y-%m-%d'),
+                                test.pk)
+
+
+def decode_test_cursor(cursor):
+    'Parse a cursor produced by "encode_test_cursor"'
+    try:
+        pol_num, date_str, pk = cursor.split('_')
+        return (int(pol_num),
+                datetime.strptime(date_str, '%Y-%m-%d').date(),
+                int(pk))
+    except ValueError:
+        raise ValidationError('invalid cursor "{0}"'.format(cursor))
+
+
+class TestQuery(APIView):
+    '''Return a page of the tests matching a set of filters
+
+    Supported parameters in the query string:
+
+    - polarimeter: comma-separated list of polarimeter numbers
+    - type: comma-separated list of test type IDs
+    - band, phsw_state: exact match
+    - cryogenic: true/false
+    - acquired_from, acquired_to, created_from, created_to: YYYY-MM-DD
+    - fields: comma-separated list of keys to return for each test
+    - limit: maximum number of tests to return
+    - after: cursor returned in the "next_cursor" key of the previous page
+
+    Tests are sorted by polarimeter number, acquisition date and ID. Pages
+    are built using keyset pagination, so that the cost of fetching a page
+    does not depend on its position.
+    '''
+
+    default_page_size = 100
+    max_page_size = 1000
+
+    def get(self, request, format=None):
+        params = request.query_params
+
+        if 'fields' in params:
+            fields = params['fields'].split(',')
+            unknown_fields = [x for x in fields if x not in TEST_SUMMARY_FIELDS]
+            if unknown_fields:
+                raise ValidationError('unknown field(s) {0}, valid fields are {1}'
+                                      .format(', '.join(unknown_fields),
+                                              ', '.join(TEST_SUMMARY_FIELDS)))
+        else:
+            fields = None
+
+        if 'limit' in params:
+            limit = parse_int(params['limit'], 'limit', min_value=1)
+            limit = min(limit, self.max_page_size)
+        else:
+            limit = self.default_page_size
+
+        queryset = filter_tests(
+            PolarimeterTest.objects.select_related('test_type'), params)
+        if 'after' in params:
+            pol_num, acq_date, pk = decode_test_cursor(params['after'])
+            queryset = queryset.filter(
+                Q(polarimeter_number__gt=pol_num) |
+                Q(polarimeter_number=pol_num, acquisition_date__gt=acq_date) |
+                Q(polarimeter_number=pol_num, acquisition_date=acq_date, pk__gt=pk))
+
+        # Fetch one more test than needed, to know if there is a next page
+        page = list(queryset.order_by(
+            'polarimeter_number', 'acquisition_date', 'id')[:limit + 1])
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_test_cursor(page[-1])
+            next_params = params.copy()
+            next_params['after'] = next_cursor
+            next_url = '{0}?{1}'.format(reverse('unittests:api-tests-query'),
+                                        next_params.urlencode())
+        else:
+            next_cursor = None
+            next_url = None
+
+        url_builder = TestUrlBuilder()
+        return RESTResponse({
+            'tests': [x.to_dict(fields=fields, url_builder=url_builder)
+                      for x in page],
+            'next_cursor': next_cursor,
+            'next': next_url,
+        })
+
+
+class IVCurveComparison(APIView):
+    '''Compare the parameters of the I-V curves of many polarimeters
+
+    Only the results stored in the database are used; raw data files are
+    never read. Supported parameters in the query string:
+
+    - component: comma-separated list of components (e.g. "HA1,HB2")
+    - curve: comma-separated list of curve types (e.g. "IDVG")
+    - polarimeter, min_NAME, max_NAME, sort: see "filter_analyses"
+
+    The result contains one row per analysed dataset and, for each pair
+    (component, curve), the number of polarimeters and the mean, minimum and
+    maximum of each parameter.
+    '''
+
+    def get(self, request, format=None):
+        params = request.query_params
+        queryset = filter_analyses(IVCurveAnalysis.objects.all(),
+                                   IVCurveAnalysis, params)
+        for param_name in ('component', 'curve'):
+            if param_name in params:
+                queryset = queryset.filter(**{
+                    param_name + '__in': params[param_name].split(',')})
+
+        columns = [x for x in IVCurveAnalysis.scalar_column_names()
+                   if x != 'analysis_date']
+
+        ordering = ['component', 'curve']
+        sort_key = get_analysis_sort_key(IVCurveAnalysis, params)
+        ordering.append(sort_key or 'test__polarimeter_number')
+
+        results = []
+        for row in queryset.order_by(*ordering, 'pk').values(
+                'pk', 'test_id', 'test__polarimeter_number', 'component', 'curve',
+                'analysis_date', *columns):
+            row['analysis_id'] = row.pop('pk')
+            row['polarimeter_number'] = row.pop('test__polarimeter_number')
+            row['polarimeter_name'] = get_polarimeter_name(row['polarimeter_number'])
+            results.append(row)
+
+        aggregates = {}
+        for cur_column in columns:
+            aggregates[cur_column + '_mean'] = Avg(cur_column)
+            aggregates[cur_column + '_min'] = Min(cur_column)
+            aggregates[cur_column + '_max'] = Max(cur_column)
+        summary = list(queryset.order_by('component', 'curve')
+                       .values('component', 'curve')
+                       .annotate(num_of_polarimeters=Count(
+                           'test__polarimeter_number', distinct=True),
+                           **aggregates))
+
+        return RESTResponse({
+            'columns': columns,
+            'results': results,
+            'summary': summary,
+        })
+
+
+class TestTimeSeries(APIView):
+    '''Return a window of the time series of a test
+
+    Supported parameters in the query string:
+
+    - columns: comma-separated list of columns (default: the DEM/PWR outputs)
+    - from_s, to_s: time range, in seconds from the start of the test
+
+    Clients which accept the media type "application/x-npz" receive the
+    arrays as a NPZ file; JSON responses are limited to "max_json_samples"
+    samples. Columns are read through the shared memory cache (see
+    "shmcache.py"), so that reviewers browsing the same test do not make
+    every worker decompress it again.
+    '''
+
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NpzRenderer]
+    max_json_samples = 100000
+
+    def get(self, request, test_id, format=None):
+        params = request.query_params
+        cur_test = get_object_or_404(PolarimeterTest, pk=test_id)
+        if not cur_test.data_file:
+            raise Http404('test {0} has no data file'.format(test_id))
+
+        with open_h5_file(cur_test.data_file) as h5_file:
+            if 'time_series' not in h5_file:
+                raise Http404('test {0} has no time series'.format(test_id))
+            valid_columns = h5_file['time_series'].dtype.names
+            num_of_samples = h5_file['time_series'].shape[0]
+
+        if 'columns' in params:
+            columns = params['columns'].split(',')
+            unknown_columns = [x for x in columns if x not in valid_columns]
+            if unknown_columns:
+                raise ValidationError('unknown column(s) {0}, valid columns are {1}'
+                                      .format(', '.join(unknown_columns),
+                                              ', '.join(valid_columns)))
+        else:
+            columns = list(DEM_COLUMNS + PWR_COLUMNS)
+
+        time_range = []
+        for param_name in ('from_s', 'to_s'):
+            try:
+                time_range.append(float(params[param_name])
+                                  if param_name in params else None)
+            except ValueError:
+                raise ValidationError('invalid value "{0}" for parameter "{1}"'
+                                      .format(params[param_name], param_name))
+
+        first = 0 if time_range[0] is None else \
+            min(num_of_samples, max(0, int(time_range[0] * SAMPLING_FREQUENCY)))
+        last = num_of_samples if time_range[1] is None else \
+            min(num_of_samples, max(first, int(np.ceil(time_range[1] * SAMPLING_FREQUENCY))))
+
+        use_npz = request.accepted_renderer.format == NpzRenderer.format
+        if not use_npz and last - first > self.max_json_samples:
+            raise ValidationError('the window contains {0} samples, but JSON responses '
+                                  'cannot contain more than {1}: use "from_s" and "to_s", '
+                                  'or ask for "application/x-npz"'
+                                  .format(last - first, self.max_json_samples))
+
+        arrays = read_time_series_columns(cur_test.data_file, ['time_s'] + columns,
+                                          start=first, stop=last)
+
+        if use_npz:
+            buffer = BytesIO()
+            np.savez_compressed(buffer, **arrays)
+            return RESTResponse(buffer.getvalue())
+
+        result = OrderedDict([('test_id', cur_test.pk)])
+        for key, value in arrays.items():
+            result[key] = value.tolist()
+
+        return RESTResponse(result)
+
+
+class TestDerivedStreams(APIView):
+    '''Return the I, Q, U streams computed from the time series of a test
+
+    Supported parameters in the query string:
+
+    - decimation: one of DERIVED_DECIMATIONS (default: the smallest one
+      which returns no more than "max_samples" samples)
+    - max_samples: see above (default: 10000)
+    - from_s, to_s: time range, in seconds from the start of the test
+    - fields: comma-separated list of streams (default: all of them)
+
+    Clients which accept the media type "application/x-npz" receive the
+    arrays as a NPZ file.
+    '''
+
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NpzRenderer]
+    default_max_samples = 10000
+
+    def get(self, request, test_id, format=None):
+        params = request.query_params
+        cur_test = get_object_or_404(PolarimeterTest, pk=test_id)
+
+        fields = list(STOKES_COMBINATIONS.keys())
+        if 'fields' in params:
+            fields = params['fields'].split(',')
+            unknown_fields = [x for x in fields if x not in STOKES_COMBINATIONS]
+            if unknown_fields:
+                raise ValidationError('unknown stream(s) {0}, valid streams are {1}'
+                                      .format(', '.join(unknown_fields),
+                                              ', '.join(STOKES_COMBINATIONS.keys())))
+
+        time_range = []
+        for param_name in ('from_s', 'to_s'):
+            try:
+                time_range.append(float(params[param_name])
+                                  if param_name in params else None)
+            except ValueError:
+                raise ValidationError('invalid value "{0}" for parameter "{1}"'
+                                      .format(params[param_name], param_name))
+
+        if not cur_test.data_file:
+            raise Http404('test {0} has no data file'.format(test_id))
+
+        with open_h5_file(cur_test.data_file) as h5_file:
+            if derived_dataset_name(1) not in h5_file:
+                raise Http404('no derived streams for test {0}'.format(test_id))
+
+            num_of_samples = h5_file[derived_dataset_name(1)].shape[0]
+            first = 0 if time_range[0] is None else \
+                max(0, int(time_range[0] * SAMPLING_FREQUENCY))
+            last = num_of_samples if time_range[1] is None else \
+                min(num_of_samples, int(np.ceil(time_range[1] * SAMPLING_FREQUENCY)))
+
+            if 'decimation' in params:
+                decimation = parse_int(params['decimation'], 'decimation', min_value=1)
+                if decimation not in DERIVED_DECIMATIONS:
+                    raise ValidationError('invalid decimation {0}, valid values are {1}'
+                                          .format(decimation, DERIVED_DECIMATIONS))
+            else:
+                if 'max_samples' in params:
+                    max_samples = parse_int(params['max_samples'], 'max_samples', min_value=1)
+                else:
+                    max_samples = self.default_max_samples
+
+                decimation = DERIVED_DECIMATIONS[-1]
+                for cur_decimation in DERIVED_DECIMATIONS:
+                    if (last - first) // cur_decimation <= max_samples:
+                        decimation = cur_decimation
+                        break
+
+            data = read_derived_streams(h5_file, decimation,
+                                        first // decimation,
+                                        max(first // decimation, -(-last // decimation)))
+            count_hdf5_bytes(read=data.nbytes)
+            pwr_offsets = h5_file[DERIVED_GROUP].attrs.get('pwr_offsets_adu')
+
+        arrays = OrderedDict([('time_s', data['time_s'])])
+        for cur_field in fields:
+            arrays[cur_field] = data[cur_field]
+
+        if request.accepted_renderer.format == NpzRenderer.format:
+            buffer = BytesIO()
+            np.savez_compressed(buffer, **arrays)
+            return RESTResponse(buffer.getvalue())
+
+        result = OrderedDict([
+            ('test_id', cur_test.pk),
+            ('decimation', decimation),
+            ('sampling_frequency_hz', SAMPLING_FREQUENCY / decimation),
+            ('pwr_offsets_adu', None if pwr_offsets is None else pwr_offsets.tolist()),
+        ])
+        for key, value in arrays.items():
+            result[key] = value.tolist()
+
+        return RESTResponse(result)
+
+
+class TestStateSegments(APIView):
+    '''Return the segments of a test where "phb" and "record" are constant
+
+    The parameters "phb" and "record" in the query string select only the
+    segments with those states.'''
+
+    def get(self, request, test_id, format=None):
+        params = request.query_params
+        cur_test = get_object_or_404(PolarimeterTest, pk=test_id)
+
+        states = {}
+        for param_name in ('phb', 'record'):
+            if param_name in params:
+                states[param_name] = parse_int(params[param_name], param_name, min_value=0)
+
+        if not cur_test.data_file:
+            raise Http404('test {0} has no data file'.format(test_id))
+
+        with open_h5_file(cur_test.data_file) as h5_file:
+            segments = read_segment_index(h5_file, **states)
+
+        if segments is None:
+            raise Http404('no index of segments for test {0}'.format(test_id))
+
+        return RESTResponse({
+            'test_id': cur_test.pk,
+            'segments': [OrderedDict([
+                ('start', int(x['start'])),
+                ('stop', int(x['stop'])),
+                ('start_time_s', x['start'] / SAMPLING_FREQUENCY),
+                ('phb', int(x['phb'])),
+                ('record', int(x['record'])),
+            ]) for x in segments],
+        })
+
+
+class TestLiveAcquisition(APIView):
+    '''Append samples to a test while it is being acquired
+
+    GET returns the number of samples in the data file and the running
+    statistics of the outputs. POST appends the samples in the body of the
+    request, which must contain lines in the same format as the text files
+    saved by the acquisition software (without the header). If the test has
+    no data file, an empty one is created. When the parameter "final" in the
+    query string is true, the acquisition is marked as complete and the
+    index of glitches is built. Only authenticated users can append samples.
+    '''
+
+    permission_classes = (IsAuthenticatedOrReadOnly,)
+
+    def get(self, request, test_id, format=None):
+        cur_test = get_object_or_404(PolarimeterTest, pk=test_id)
+        if not cur_test.data_file:
+            raise Http404('test {0} has no data file'.format(test_id))
+
+        with open_h5_file(cur_test.data_file) as h5_file:
+            return RESTResponse(OrderedDict([
+                ('test_id', cur_test.pk),
+                ('live', is_live_file(h5_file)),
+                ('num_of_samples', h5_file['time_series'].shape[0]
+                 if 'time_series' in h5_file else 0),
+                ('statistics', read_statistics(h5_file)),
+            ]))
+
+    def post(self, request, test_id, format=None):
+        cur_test = get_object_or_404(PolarimeterTest, pk=test_id)
+        final = parse_bool(request.query_params.get('final', 'false'), 'final')
+
+        samples = None
+        if request.body.strip():
+            try:
+                # Clients must send complete lines (see "live_upload.py")
+                samples = read_text_samples(BytesIO(request.body), skiprows=0,
+                                            strict=True)
+            except ValueError as exc:
+                raise ValidationError('invalid samples: {0}'.format(exc))
+
+        if samples is None and not cur_test.data_file:
+            raise ValidationError('no samples have been provided')
+
+        try:
+            if samples is not None:
+                num_of_samples = cur_test.append_live_samples(samples)
+            else:
+                with open_h5_file(cur_test.data_file) as h5_file:
+                    if not is_live_file(h5_file):
+                        raise ValueError('test {0} is not being acquired'.format(test_id))
+                    num_of_samples = h5_file['time_series'].shape[0]
+        except ValueError as exc:
+            return RESTResponse({'detail': str(exc)}, status=status.HTTP_409_CONFLICT)
+
+        result = OrderedDict([
+            ('test_id', cur_test.pk),
+            ('num_of_samples', num_of_samples),
+            ('live', not final),
+        ])
+        if final:
+            result['num_of_glitches'] = cur_test.finish_live_acquisition()
+
+        return RESTResponse(result)
+
+
+class GlitchEventQuery(APIView):
+    '''Return the glitches, saturations and jumps found in many tests
+
+    Besides the filters on tests accepted by "TestQuery" (polarimeter, type,
+    band, phsw_state, cryogenic, acquired_from, acquired_to, created_from,
+    created_to), the following parameters are supported:
+
+    - test: comma-separated list of test IDs
+    - kind: comma-separated list of event kinds (spike, rail, jump)
+    - channel: comma-separated list of columns (e.g. pwr_Q1_ADU)
+    - min_severity: only return events at least this severe
+    - limit: maximum number of events to return
+
+    Events are sorted by decreasing severity.
+    '''
+
+    default_page_size = 100
+    max_page_size = 1000
+
+    def get(self, request, format=None):
+        params = request.query_params
+
+        queryset = GlitchEvent.objects.all()
+        if any(x in params for x in ('polarimeter', 'type', 'band', 'phsw_state',
+                                     'cryogenic', 'acquired_from', 'acquired_to',
+                                     'created_from', 'created_to')):
+            queryset = queryset.filter(
+                test__in=filter_tests(PolarimeterTest.objects.all(), params))
+
+        if 'test' in params:
+            queryset = queryset.filter(test__in=parse_int_list(params['test'], 'test'))
+
+        if 'kind' in params:
+            kinds = params['kind'].split(',')
+            valid_kinds = [x[0] for x in GLITCH_KIND_CHOICES]
+            unknown_kinds = [x for x in kinds if x not in valid_kinds]
+            if unknown_kinds:
+                raise ValidationError('unknown kind(s) {0}, valid kinds are {1}'
+                                      .format(', '.join(unknown_kinds),
+                                              ', '.join(valid_kinds)))
+            queryset = queryset.filter(kind__in=kinds)
+
+        if 'channel' in params:
+            queryset = queryset.filter(channel__in=params['channel'].split(','))
+
+        if 'min_severity' in params:
+            try:
+                queryset = queryset.filter(severity__gte=float(params['min_severity']))
+            except ValueError:
+                raise ValidationError('invalid value "{0}" for parameter "min_severity"'
+                                      .format(params['min_severity']))
+
+        if 'limit' in params:
+            limit = parse_int(params['limit'], 'limit', min_value=1)
+            limit = min(limit, self.max_page_size)
+        else:
+            limit = self.default_page_size
+
+        events = []
+        for cur_event in (queryset.order_by('-severity', 'pk')
+                          .values('pk', 'test_id', 'test__polarimeter_number',
+                                  'kind', 'channel', 'start_sample', 'stop_sample',
+                                  'severity')[:limit]):
+            events.append(OrderedDict([
+                ('event_id', cur_event['pk']),
+                ('test_id', cur_event['test_id']),
+                ('polarimeter_name',
+                 get_polarimeter_name(cur_event['test__polarimeter_number'])),
+                ('kind', cur_event['kind']),
+                ('channel', cur_event['channel']),
+                ('start_sample', cur_event['start_sample']),
+                ('stop_sample', cur_event['stop_sample']),
+                ('start_time_s', cur_event['start_sample'] / SAMPLING_FREQUENCY),
+                ('severity', cur_event['severity']),
+            ]))
+
+        return RESTResponse({'events': events})